@@ -0,0 +1,5 @@
+"""Benchmarks for dye.
+
+deploy_bench.py times fablib's deploy, rollback and database dumps against
+a stand-in server on this machine.  It needs fabric and cookiecutter.
+"""
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+"""Time fablib's deploy, rollback and database dumps against a stand-in
+server on this machine.
+
+Usage:
+    deploy_bench.py [options]
+    deploy_bench.py --compare <old> <new>
+    deploy_bench.py -h | --help
+
+Options:
+    -o, --output FILE        Write the results to FILE as JSON
+                             [default: deploy_bench.json]
+    -w, --work-dir DIR       Render the project and keep the stand-in server in
+                             DIR, rather than in a temporary directory that is
+                             removed afterwards
+    -r, --repeat N           Run the scenarios N times, each time against an
+                             empty server [default: 1]
+    -s, --scenarios NAMES    The scenarios to record, separated by commas
+                             [default: full_deploy,noop_redeploy,rollback,dump_restore]
+    --backend BACKEND        "local" to run the server's commands in a local
+                             shell, or "ssh" to have fabric use the sshd on
+                             --host [default: local]
+    --host HOST              The host for the ssh backend [default: localhost]
+    --port PORT              The ssh port for the ssh backend [default: 22]
+    --django-type TYPE       The cookiecutter django_type [default: normal]
+    --compare                Compare the results in two files
+    -v, --verbose            Show the commands as they are run
+    -h, --help               Print this help text
+
+The scenarios are run in this order, and the ones a scenario depends on are
+run (but not recorded) even if they are not asked for:
+
+    full_deploy     the first deploy, which builds the virtualenv
+    noop_redeploy   deploy again with nothing changed
+    rollback        go back to the version before
+    dump_restore    get_remote_dump, then copy the dump back and restore_db
+
+The project is rendered from the cookiecutter template of the dye checkout
+this file is in, with pip_packages.txt changed to install that dye and the
+staging local settings changed to use sqlite, so the stand-in server needs no
+MySQL.  It is committed to a git repository, which fablib deploys from as the
+staging environment, to a server_home in the work directory.
+
+For each scenario we record the wall time, the number of remote and local
+commands and the bytes copied, in total and for each phase of fablib (see
+recorder.py).  Use --compare to compare the results of two commits.
+"""
+import os
+from os import path
+import sys
+import getpass
+import imp
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from dye.bench.recorder import PhaseRecorder, print_comparison
+from dye.bench.results import (median, get_dye_root, save_results,
+                               load_results)
+
+PROJECT_NAME = 'benchproj'
+ENVIRONMENT = 'staging'
+SCENARIOS = ('full_deploy', 'noop_redeploy', 'rollback', 'dump_restore')
+# the fablib functions that are timed as phases
+PHASES = (
+    '_create_dir_if_not_exists',
+    '_migrate_directory_structure',
+    '_set_vcs_root_dir_timestamp',
+    'check_for_local_changes',
+    'create_copy_for_next',
+    'checkout_or_update',
+    'rm_pyc_files',
+    'create_deploy_virtualenv',
+    'link_webserver_conf',
+    'webserver_cmd',
+    'point_current_to_next',
+    '_run_queued_tasks',
+    '_tasks',
+    'touch_wsgi',
+    'delete_old_rollback_versions',
+    '_get_list_of_versions',
+    '_dump_db_in_directory',
+)
+BENCH_LOCAL_SETTINGS = """
+# added by dye/bench/deploy_bench.py - the stand-in server has no MySQL
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': %r,
+    }
+}
+"""
+DYE_REQUIREMENT_RE = re.compile(r'^-e .*#egg=dye\s*$', re.MULTILINE)
+
+
+def render_project(work_dir, django_type):
+    """Render the cookiecutter template into work_dir, and return the
+    directory of the project"""
+    try:
+        from cookiecutter.main import cookiecutter
+    except ImportError:
+        sys.exit("deploy_bench.py needs cookiecutter - pip install cookiecutter")
+    template_dir = get_dye_root()
+    if not path.exists(path.join(template_dir, 'cookiecutter.json')):
+        sys.exit("deploy_bench.py must be run from a checkout of dye")
+    project_dir = path.join(work_dir, PROJECT_NAME)
+    if path.exists(project_dir):
+        shutil.rmtree(project_dir)
+    cookiecutter(template_dir, no_input=True, output_dir=work_dir,
+                 extra_context={'project_name': PROJECT_NAME,
+                                'django_type': django_type})
+    return project_dir
+
+
+def _append_to_file(file_path, text):
+    f = open(file_path, 'a')
+    try:
+        f.write(text)
+    finally:
+        f.close()
+
+
+def adapt_project(project_dir, db_path):
+    """Make the project install this dye, and use sqlite on staging, and
+    commit it to git"""
+    requirements_file = path.join(project_dir, 'deploy', 'pip_packages.txt')
+    requirements = open(requirements_file).read()
+    f = open(requirements_file, 'w')
+    try:
+        f.write(DYE_REQUIREMENT_RE.sub('-e ' + get_dye_root(), requirements))
+    finally:
+        f.close()
+    _append_to_file(
+        path.join(project_dir, 'django', 'website', 'local_settings.py.' + ENVIRONMENT),
+        BENCH_LOCAL_SETTINGS % db_path)
+    git = ['git', '-c', 'user.name=dye bench', '-c', 'user.email=dye-bench@localhost']
+    for args in (['init', '-q'], ['symbolic-ref', 'HEAD', 'refs/heads/master'],
+                 ['add', '-A'], ['commit', '-q', '-m', 'Rendered by deploy_bench.py']):
+        subprocess.check_call(git + args, cwd=project_dir)
+
+
+class DeployBench(object):
+
+    def __init__(self, project_dir, server_home, options):
+        # only imported now, so that --compare and --help work without fabric
+        from dye import fablib
+        from fabric.state import env
+        self.fablib = fablib
+        self.env = env
+        self.project_dir = project_dir
+        self.server_home = server_home
+        self.backend = options['--backend']
+        self.host = options['--host']
+        self.port = options['--port']
+        self.verbose = options['--verbose']
+        self.project_settings = self._load_project_settings()
+        self.recorder = PhaseRecorder()
+        self._last_timestamp = None
+
+    def _load_project_settings(self):
+        settings = imp.load_source(
+            'bench_project_settings',
+            path.join(self.project_dir, 'deploy', 'project_settings.py'))
+        settings.repository = self.project_dir
+        settings.server_home = self.server_home
+        settings.server_project_home = path.join(self.server_home, PROJECT_NAME)
+        settings.host_list = {ENVIRONMENT: ['%s:%s' % (self.host, self.port)]}
+        settings.default_branch = {ENVIRONMENT: 'master'}
+        settings.webserver = None
+        settings.use_sudo = False
+        settings.verbose = self.verbose
+        return settings
+
+    def _setup_env(self):
+        env = self.env
+        env.valid_envs = [ENVIRONMENT]
+        env.environment = ENVIRONMENT
+        env.user = getpass.getuser()
+        env.host = self.host
+        env.port = self.port
+        env.host_string = '%s@%s:%s' % (env.user, self.host, self.port)
+        env.python_bin = sys.executable
+        # fail rather than wait for an answer
+        env.abort_on_prompts = True
+
+    def _setup_paths(self):
+        """As the fabfile does for each fab run, with a new timestamp, so
+        that each deploy gets its own directory"""
+        while self.fablib._create_timestamp_dirname() == self._last_timestamp:
+            time.sleep(0.1)
+        for name in ('next_dir', 'vcs_root_dir_timestamp', 'queued_tasks', 'revision'):
+            self.env.pop(name, None)
+        self.fablib._setup_paths(self.project_settings)
+        self._last_timestamp = self.fablib._create_timestamp_dirname(self.env.timestamp)
+
+    def _clean_server(self):
+        if path.exists(self.server_home):
+            shutil.rmtree(self.server_home)
+        os.makedirs(self.server_home)
+
+    def full_deploy(self):
+        self.fablib.deploy(full_rebuild=True)
+
+    def noop_redeploy(self):
+        self.fablib.deploy(full_rebuild=False)
+
+    def rollback(self):
+        self.fablib.rollback()
+
+    def dump_restore(self):
+        remote_file = path.join(self.server_home, 'bench_dump.sql')
+        local_file = path.join(path.dirname(self.server_home), 'bench_dump.sql')
+        rsync = self.backend == 'ssh'
+        self.fablib.get_remote_dump(filename=remote_file, local_filename=local_file,
+                                    rsync=rsync)
+        if rsync:
+            self.recorder.add_bytes_copied(os.stat(local_file).st_size)
+        self.fablib.put(local_file, remote_file)
+        self.fablib._tasks('restore_db:' + remote_file)
+        self.fablib.sudo_or_run('rm ' + remote_file)
+        os.remove(local_file)
+
+    def run(self, scenarios, repeat):
+        """Returns {scenario: [the summary of each repeat]}"""
+        results = dict((scenario, []) for scenario in scenarios)
+        last = max(SCENARIOS.index(scenario) for scenario in scenarios)
+        uninstall = None
+        if self.backend == 'local':
+            from dye.bench import local_backend
+            uninstall = local_backend.install(self.fablib)
+        self.recorder.watch_commands(self.fablib)
+        self.recorder.watch_commands(self.fablib.files)
+        self.recorder.watch_phases(self.fablib, PHASES)
+        self._setup_env()
+        # fablib compares the local branch with the one on the server
+        old_cwd = os.getcwd()
+        os.chdir(self.project_dir)
+        try:
+            for i in range(repeat):
+                self._clean_server()
+                for scenario in SCENARIOS[:last + 1]:
+                    self._setup_paths()
+                    self.recorder.reset()
+                    print "### Running %s (%d of %d)" % (scenario, i + 1, repeat)
+                    start = time.time()
+                    getattr(self, scenario)()
+                    wall_time = time.time() - start
+                    if scenario in results:
+                        results[scenario].append(self.recorder.get_summary(wall_time))
+        finally:
+            os.chdir(old_cwd)
+            self.recorder.restore()
+            if uninstall is not None:
+                uninstall()
+        return results
+
+
+def print_summary(results):
+    print "%-15s %10s %8s %8s %12s" % ('scenario', 'wall time', 'remote', 'local',
+                                       'bytes')
+    for scenario in SCENARIOS:
+        runs = results['scenarios'].get(scenario)
+        if not runs:
+            continue
+        print "%-15s %9.2fs %8d %8d %12d" % (
+            scenario, median([run['wall_time'] for run in runs]),
+            median([run['remote_commands'] for run in runs]),
+            median([run['local_commands'] for run in runs]),
+            median([run['bytes_copied'] for run in runs]))
+
+
+def main(argv=None):
+    import docopt
+    options = docopt.docopt(__doc__, argv)
+    if options['--compare']:
+        print_comparison(load_results(options['<old>']), load_results(options['<new>']))
+        return 0
+
+    scenarios = [s.strip() for s in options['--scenarios'].split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown or not scenarios:
+        sys.exit("Unknown scenarios: %s - choose from %s" %
+                 (', '.join(unknown), ', '.join(SCENARIOS)))
+    if options['--backend'] not in ('local', 'ssh'):
+        sys.exit("--backend must be local or ssh")
+    repeat = int(options['--repeat'])
+
+    work_dir = options['--work-dir']
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='dye-bench-')
+    else:
+        work_dir = path.abspath(work_dir)
+    try:
+        server_home = path.join(work_dir, 'server')
+        project_dir = render_project(work_dir, options['--django-type'])
+        adapt_project(project_dir, path.join(server_home, 'bench.sqlite'))
+        bench = DeployBench(project_dir, server_home, options)
+        scenario_results = bench.run(scenarios, repeat)
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {'backend': options['--backend'], 'scenarios': scenario_results}
+    save_results(options['--output'], results)
+    print_summary(results)
+    print "### Results written to %s" % options['--output']
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""A local execution backend for fablib, so that deploy_bench.py can deploy
+to a directory on this machine without an ssh server.
+
+install() replaces fablib's run, sudo, put, get and files with the functions
+below, which run the commands in a local shell as the current user.  They
+honour fabric's cd() and settings(warn_only=True), and return results with
+the same attributes as fabric's.
+"""
+from os import path
+import shutil
+import subprocess
+import sys
+
+from fabric.state import env
+from fabric import utils
+
+# what install() replaces in fablib
+REPLACED_NAMES = ('run', 'sudo', 'put', 'get', 'files')
+
+
+class _AttributeString(str):
+    pass
+
+
+def _run_command(command, which):
+    if env.get('cwd'):
+        command = 'cd %s && %s' % (env.cwd, command)
+    if env.get('verbose'):
+        print "[local] %s: %s" % (which, command)
+    popen = subprocess.Popen(['/bin/sh', '-c', command], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    stdout, stderr = popen.communicate()
+    result = _AttributeString(stdout.strip())
+    result.stderr = stderr.strip()
+    result.command = result.real_command = command
+    result.return_code = popen.returncode
+    result.failed = popen.returncode != 0
+    result.succeeded = not result.failed
+    if result.failed and not env.warn_only:
+        utils.abort("%s() received nonzero return code %s while executing!\n\n"
+                    "Requested: %s\n\n%s" % (which, popen.returncode, command, stderr))
+    return result
+
+
+def run(command, *args, **kwargs):
+    return _run_command(command, 'run')
+
+
+def sudo(command, *args, **kwargs):
+    # the stand-in server belongs to us, so there is no need for sudo
+    return _run_command(command, 'sudo')
+
+
+def _remote_path(remote_path):
+    if env.get('cwd') and not path.isabs(remote_path):
+        return path.join(env.cwd, remote_path)
+    return remote_path
+
+
+def put(local_path, remote_path=None, *args, **kwargs):
+    remote_path = _remote_path(remote_path or path.basename(local_path))
+    if path.isdir(remote_path):
+        remote_path = path.join(remote_path, path.basename(local_path))
+    shutil.copy(local_path, remote_path)
+    return [remote_path]
+
+
+def get(remote_path, local_path=None, *args, **kwargs):
+    remote_path = _remote_path(remote_path)
+    if local_path is None:
+        local_path = path.basename(remote_path)
+    if path.isdir(local_path):
+        local_path = path.join(local_path, path.basename(remote_path))
+    shutil.copy(remote_path, local_path)
+    return [local_path]
+
+
+def exists(remote_path, use_sudo=False, verbose=False):
+    """As fabric.contrib.files.exists()"""
+    old_warn_only = env.warn_only
+    env.warn_only = True
+    try:
+        return not run('test -e "$(echo %s)"' % remote_path).failed
+    finally:
+        env.warn_only = old_warn_only
+
+
+def install(fablib):
+    """Make fablib use this backend.  Returns a function that puts fablib
+    back as it was."""
+    originals = dict((name, getattr(fablib, name)) for name in REPLACED_NAMES)
+    fablib.run = run
+    fablib.sudo = sudo
+    fablib.put = put
+    fablib.get = get
+    # fablib only uses files.exists()
+    fablib.files = sys.modules[__name__]
+
+    def uninstall():
+        for name, original in originals.items():
+            setattr(fablib, name, original)
+    return uninstall
@@ -0,0 +1,196 @@
+"""Records where the time goes in a fablib run.
+
+PhaseRecorder wraps functions of fablib so that each call of a phase
+function is timed, and each command (run, sudo, local) and file copy (put,
+get) is counted against the phase that made it.  Phases don't nest - a phase
+called from inside another one is counted as part of the outer one - and
+anything done outside a phase is counted as "other".
+
+The results of a benchmark run are saved as JSON like:
+
+    {"dye_revision": "<git commit>", "backend": "local",
+     "scenarios": {"full_deploy": [{"wall_time": 81.2,
+                                    "remote_commands": 54,
+                                    "local_commands": 4,
+                                    "bytes_copied": 0,
+                                    "phases": {"checkout_or_update": {...}}}]}}
+
+with one entry in each scenario's list per repeat, and compare_results()
+compares two of those files using the median of the repeats.
+"""
+import os
+from os import path
+import time
+
+from .results import median, format_change
+
+REMOTE_COMMAND_FUNCTIONS = ('run', 'sudo')
+LOCAL_COMMAND_FUNCTIONS = ('local',)
+COPY_FUNCTIONS = ('put', 'get')
+OTHER_PHASE = 'other'
+METRICS = ('wall_time', 'remote_commands', 'local_commands', 'bytes_copied')
+
+
+def _get_size(file_path):
+    if isinstance(file_path, basestring) and path.isfile(file_path):
+        return os.stat(file_path).st_size
+    return 0
+
+
+def _get_local_path(name, args, kwargs):
+    # put(local_path, remote_path) and get(remote_path, local_path)
+    position = 0 if name == 'put' else 1
+    if 'local_path' in kwargs:
+        return kwargs['local_path']
+    if len(args) > position:
+        return args[position]
+    return None
+
+
+def _new_phase():
+    return {'wall_time': 0.0, 'calls': 0, 'remote_commands': 0,
+            'local_commands': 0, 'bytes_copied': 0}
+
+
+class PhaseRecorder(object):
+
+    def __init__(self):
+        self._originals = []
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self._current = None
+
+    def _get_phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = _new_phase()
+        return self.phases[name]
+
+    def _patch(self, module, name, wrapper):
+        original = getattr(module, name)
+        self._originals.append((module, name, original))
+        wrapped = wrapper(original)
+        wrapped.__name__ = original.__name__
+        wrapped.__doc__ = original.__doc__
+        setattr(module, name, wrapped)
+
+    def watch_phases(self, module, names):
+        for name in names:
+            self._patch(module, name, self._phase_wrapper(name))
+
+    def watch_commands(self, module):
+        """Count the commands and copies made through module's run, sudo,
+        local, put and get"""
+        for name in REMOTE_COMMAND_FUNCTIONS + LOCAL_COMMAND_FUNCTIONS + COPY_FUNCTIONS:
+            if hasattr(module, name):
+                self._patch(module, name, self._command_wrapper(name))
+
+    def restore(self):
+        """Put back everything we wrapped"""
+        while self._originals:
+            module, name, original = self._originals.pop()
+            setattr(module, name, original)
+
+    def add_bytes_copied(self, count):
+        """For copies made some other way, eg rsync through local()"""
+        self._get_phase(self._current or OTHER_PHASE)['bytes_copied'] += count
+
+    def _phase_wrapper(self, name):
+        def wrapper(fn):
+            def timed(*args, **kwargs):
+                if self._current is not None:
+                    return fn(*args, **kwargs)
+                self._current = name
+                start = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    phase = self._get_phase(name)
+                    phase['wall_time'] += time.time() - start
+                    phase['calls'] += 1
+                    self._current = None
+            return timed
+        return wrapper
+
+    def _command_wrapper(self, name):
+        def wrapper(fn):
+            def counted(*args, **kwargs):
+                phase = self._get_phase(self._current or OTHER_PHASE)
+                if name in REMOTE_COMMAND_FUNCTIONS:
+                    phase['remote_commands'] += 1
+                elif name in LOCAL_COMMAND_FUNCTIONS:
+                    phase['local_commands'] += 1
+                elif name == 'put':
+                    phase['bytes_copied'] += _get_size(_get_local_path(name, args, kwargs))
+                result = fn(*args, **kwargs)
+                if name == 'get':
+                    phase['bytes_copied'] += _get_size(_get_local_path(name, args, kwargs))
+                return result
+            return counted
+        return wrapper
+
+    def get_summary(self, wall_time):
+        """The totals and phases of a scenario that took wall_time.  The time
+        not spent in a phase goes to "other"."""
+        phases = dict((name, dict(phase)) for name, phase in self.phases.items())
+        outside = wall_time - sum(phase['wall_time'] for phase in phases.values())
+        if outside > 0 or OTHER_PHASE in phases:
+            other = phases.setdefault(OTHER_PHASE, _new_phase())
+            other['wall_time'] = max(outside, 0.0)
+        summary = {'wall_time': wall_time, 'phases': phases}
+        for metric in METRICS[1:]:
+            summary[metric] = sum(phase[metric] for phase in phases.values())
+        return summary
+
+
+def _get_medians(runs):
+    """Returns {phase or None for the total: {metric: median}}"""
+    medians = {None: {}}
+    for metric in METRICS:
+        medians[None][metric] = median([run[metric] for run in runs])
+    phase_names = set()
+    for run in runs:
+        phase_names.update(run['phases'])
+    for phase_name in phase_names:
+        phase_runs = [run['phases'][phase_name] for run in runs
+                      if phase_name in run['phases']]
+        medians[phase_name] = dict(
+            (metric, median([phase[metric] for phase in phase_runs]))
+            for metric in METRICS)
+    return medians
+
+
+def compare_results(old, new):
+    """Returns a list of (scenario, phase, metric, old value, new value) for
+    the scenarios in both results, with phase None for the scenario total"""
+    rows = []
+    for scenario in sorted(set(old['scenarios']) & set(new['scenarios'])):
+        old_medians = _get_medians(old['scenarios'][scenario])
+        new_medians = _get_medians(new['scenarios'][scenario])
+        phases = sorted(phase for phase in set(old_medians) | set(new_medians)
+                        if phase is not None)
+        for phase in [None] + phases:
+            for metric in METRICS:
+                old_value = old_medians.get(phase, {}).get(metric)
+                new_value = new_medians.get(phase, {}).get(metric)
+                rows.append((scenario, phase, metric, old_value, new_value))
+    return rows
+
+
+def _format_value(metric, value):
+    if value is None:
+        return '-'
+    if metric == 'wall_time':
+        return '%.2fs' % value
+    return '%d' % value
+
+
+def print_comparison(old, new):
+    print "%-15s %-30s %-16s %12s %12s %8s" % (
+        'scenario', 'phase', 'metric', old.get('dye_revision', 'old')[:12],
+        new.get('dye_revision', 'new')[:12], 'change')
+    for scenario, phase, metric, old_value, new_value in compare_results(old, new):
+        print "%-15s %-30s %-16s %12s %12s %8s" % (
+            scenario, phase or 'TOTAL', metric, _format_value(metric, old_value),
+            _format_value(metric, new_value), format_change(old_value, new_value))
@@ -0,0 +1,116 @@
+"""Statistics, and saving and loading results, for the benchmarks.
+
+The results files are JSON with the dye revision they were run against, so
+that the results of two commits can be compared.
+"""
+import os
+from os import path
+import platform
+import subprocess
+from datetime import datetime
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def percentile(values, percent):
+    """The percentile of values, interpolating between the closest two"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarise(times):
+    return {
+        'times': times,
+        'iterations': len(times),
+        'min': min(times),
+        'median': median(times),
+        'p90': percentile(times, 90),
+        'p99': percentile(times, 99),
+        'max': max(times),
+        'mean': sum(times) / len(times),
+    }
+
+
+def get_dye_root():
+    return path.abspath(path.join(path.dirname(__file__), os.pardir, os.pardir))
+
+
+def get_dye_revision():
+    popen = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=get_dye_root(),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    revision = popen.communicate()[0].strip()
+    return revision if popen.returncode == 0 else 'unknown'
+
+
+def save_results(results_file, results):
+    """Save results along with the dye revision, python version and date"""
+    results = dict(results, dye_revision=get_dye_revision(),
+                   python=platform.python_version(),
+                   date=datetime.now().isoformat())
+    f = open(results_file, 'w')
+    try:
+        json.dump(results, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+
+
+def load_results(results_file):
+    f = open(results_file)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def format_change(old_value, new_value):
+    if not old_value or new_value is None:
+        return ''
+    return '%+.1f%%' % (100.0 * (new_value - old_value) / old_value)
+
+
+def print_timings(timings):
+    """Print the summaries of a {benchmark name: summarise()} dict"""
+    print "%-32s %6s %10s %10s %10s %10s %10s" % (
+        'benchmark', 'runs', 'min', 'median', 'p90', 'p99', 'max')
+    for name in sorted(timings):
+        timing = timings[name]
+        print "%-32s %6d %9.1fms %9.1fms %9.1fms %9.1fms %9.1fms" % (
+            name, timing['iterations'], timing['min'] * 1000,
+            timing['median'] * 1000, timing['p90'] * 1000,
+            timing['p99'] * 1000, timing['max'] * 1000)
+
+
+def print_timings_comparison(old, new):
+    """Compare the medians and 90th percentiles of two sets of timings"""
+    print "%-32s %10s %10s %8s %10s %10s %8s" % (
+        'benchmark', 'old median', 'new median', 'change', 'old p90', 'new p90',
+        'change')
+    for name in sorted(set(old['timings']) | set(new['timings'])):
+        old_timing = old['timings'].get(name, {})
+        new_timing = new['timings'].get(name, {})
+        values = []
+        for key in ('median', 'p90'):
+            old_value = old_timing.get(key)
+            new_value = new_timing.get(key)
+            values += [
+                '-' if old_value is None else '%.1fms' % (old_value * 1000),
+                '-' if new_value is None else '%.1fms' % (new_value * 1000),
+                format_change(old_value, new_value)]
+        print "%-32s %10s %10s %8s %10s %10s %8s" % tuple([name] + values)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+"""Microbenchmarks for the tasks that tasks.py deploy:dev runs, and for the
+database managers.
+
+Usage:
+    tasklib_bench.py [options] [<benchmark>...]
+    tasklib_bench.py --compare <old> <new>
+    tasklib_bench.py --list
+    tasklib_bench.py -h | --help
+
+Options:
+    -o, --output FILE        Write the results to FILE as JSON
+                             [default: tasklib_bench.json]
+    -n, --iterations N       Time each benchmark N times, after one run to warm
+                             up [default: 20]
+    -w, --work-dir DIR       Generate the fixtures in DIR, rather than in a
+                             temporary directory that is removed afterwards
+    --models N               The number of models in the generated app
+                             [default: 20]
+    --tables N               The number of tables in the generated databases
+                             [default: 20]
+    --rows N                 The number of rows in each table [default: 1000]
+    --no-mysql               Skip the MySQLManager benchmarks, rather than
+                             running them against a temporary mysqld
+    --compare                Compare the results in two files
+    --list                   List the benchmarks
+    -h, --help               Print this help text
+
+The benchmarks to run can be given as names or patterns, eg "sqlite_*".  A
+project with a generated app, and SQLite and MySQL databases with generated
+tables, are made for them.  Each benchmark is run in this python, with the
+in-memory state of tasklib reset before each run, so each run costs what it
+would in a new tasks.py process with the same files on disk.  The "_noop"
+benchmarks run a task again when it is up to date, as most runs of
+deploy:dev do.  Those that need Django, mysqld, or the sqlite3 and mysqldump
+commands are skipped when they are not installed.
+
+For each benchmark the minimum, median, 90th and 99th percentile and maximum
+times are reported.  Use --compare to compare the results of two commits.
+"""
+import os
+from os import path
+import sys
+import fnmatch
+import imp
+import shutil
+import subprocess
+import tempfile
+import timeit
+from distutils.spawn import find_executable
+
+from dye import tasklib
+from dye.tasklib import database, scheduler, mysqld
+from dye.bench.results import (summarise, get_dye_root, save_results,
+                               load_results, print_timings,
+                               print_timings_comparison)
+
+PROJECT_SETTINGS = """from os import path
+
+project_name = 'benchproj'
+django_apps = ['benchapp']
+project_type = 'django'
+use_virtualenv = False
+local_deploy_dir = path.dirname(path.abspath(__file__))
+local_vcs_root = path.dirname(local_deploy_dir)
+relative_django_dir = path.join('django', 'website')
+relative_django_settings_dir = relative_django_dir
+relative_ve_dir = path.join(relative_django_dir, '.ve')
+host_list = {'staging': ['localhost']}
+use_temp_mysqld = False
+"""
+SETTINGS = """from os import path
+import private_settings
+
+BASE_DIR = path.dirname(path.abspath(__file__))
+SECRET_KEY = private_settings.SECRET_KEY
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'django.contrib.staticfiles',
+    'benchapp',
+)
+MIDDLEWARE_CLASSES = ()
+STATIC_URL = '/static/'
+STATIC_ROOT = path.join(BASE_DIR, 'static')
+STATICFILES_DIRS = ()
+
+from local_settings import *
+"""
+LOCAL_SETTINGS = """from os import path
+
+DEBUG = True
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path.join(path.dirname(path.abspath(__file__)), 'benchproj.sqlite'),
+    }
+}
+"""
+MANAGE_PY = """#!/usr/bin/env python
+import os
+import sys
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+    from django.core.management import execute_from_command_line
+    execute_from_command_line(sys.argv)
+"""
+MODEL = """
+
+class Model%(number)d(models.Model):
+    name = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+"""
+
+
+def _write_file(file_path, contents):
+    if not path.isdir(path.dirname(file_path)):
+        os.makedirs(path.dirname(file_path))
+    f = open(file_path, 'w')
+    try:
+        f.write(contents)
+    finally:
+        f.close()
+
+
+def make_project(project_dir, models):
+    """Generate a project with an app with the given number of models"""
+    django_dir = path.join(project_dir, 'django', 'website')
+    _write_file(path.join(project_dir, 'deploy', 'project_settings.py'),
+                PROJECT_SETTINGS)
+    _write_file(path.join(django_dir, 'settings.py'), SETTINGS)
+    _write_file(path.join(django_dir, 'local_settings.py.dev'), LOCAL_SETTINGS)
+    _write_file(path.join(django_dir, 'manage.py'), MANAGE_PY)
+    _write_file(path.join(django_dir, 'benchapp', '__init__.py'), '')
+    _write_file(path.join(django_dir, 'benchapp', 'models.py'),
+                'from django.db import models\n' +
+                ''.join(MODEL % {'number': i} for i in range(models)))
+    subprocess.check_call(['git', 'init', '-q'], cwd=project_dir)
+
+
+def _get_fixture_rows(rows):
+    return [(i, 'row %d' % i, i * 7) for i in range(rows)]
+
+
+def _get_fixture_migrations(tables):
+    return [('benchapp', '%04d_migration' % i) for i in range(tables)]
+
+
+def fill_sqlite(db_path, tables, rows):
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    try:
+        for table in range(tables):
+            conn.execute('CREATE TABLE bench_%d (id INTEGER PRIMARY KEY, '
+                         'name TEXT, value INTEGER)' % table)
+            conn.executemany('INSERT INTO bench_%d VALUES (?, ?, ?)' % table,
+                             _get_fixture_rows(rows))
+        conn.execute('CREATE TABLE south_migrationhistory (id INTEGER PRIMARY KEY, '
+                     'app_name TEXT, migration TEXT)')
+        conn.executemany('INSERT INTO south_migrationhistory (app_name, migration) '
+                         'VALUES (?, ?)', _get_fixture_migrations(tables))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def fill_mysql(db, tables, rows):
+    cursor = db.get_root_db_cursor()
+    try:
+        cursor.execute('USE %s' % db.name)
+        for table in range(tables):
+            cursor.execute('CREATE TABLE bench_%d (id INTEGER PRIMARY KEY, '
+                           'name VARCHAR(100), value INTEGER) ENGINE=InnoDB' % table)
+            cursor.executemany('INSERT INTO bench_%d VALUES (%%s, %%s, %%s)' % table,
+                               _get_fixture_rows(rows))
+        cursor.execute('CREATE TABLE south_migrationhistory (id INTEGER PRIMARY KEY '
+                       'AUTO_INCREMENT, app_name VARCHAR(255), migration VARCHAR(255))')
+        cursor.executemany('INSERT INTO south_migrationhistory (app_name, migration) '
+                           'VALUES (%s, %s)', _get_fixture_migrations(tables))
+        cursor.execute('COMMIT')
+    finally:
+        cursor.close()
+
+
+def time_benchmark(setup, run, iterations):
+    """Time run(), after setup() each time, and return the summary of the
+    times.  The first run is a warm up, and isn't counted."""
+    times = []
+    for i in range(iterations + 1):
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        run()
+        if i > 0:
+            times.append(timeit.default_timer() - start)
+    return summarise(times)
+
+
+class TasklibBench(object):
+
+    def __init__(self, work_dir, options):
+        self.work_dir = work_dir
+        self.project_dir = path.join(work_dir, 'benchproj')
+        self.deploy_dir = path.join(self.project_dir, 'deploy')
+        self.models = int(options['--models'])
+        self.tables = int(options['--tables'])
+        self.rows = int(options['--rows'])
+        self.use_mysql = not options['--no-mysql']
+        self.base_env = None
+        self.sqlite_db = None
+        self.mysql_server = None
+        self.mysql_db = None
+
+    def set_up(self):
+        make_project(self.project_dir, self.models)
+        self.clear_env()
+        tasklib._setup_paths(self.load_project_settings(), None)
+        self.base_env = dict(tasklib.env)
+        self.sqlite_db = database.SqliteManager(
+            path.join(self.work_dir, 'fixture.sqlite'), None)
+        fill_sqlite(self.sqlite_db.file_path, self.tables, self.rows)
+        if self.use_mysql and self._can_use_mysql():
+            self.mysql_server = mysqld.TempMysqld()
+            self.mysql_server.start()
+            self.mysql_db = database.MySQLManager(
+                'benchdb', 'benchuser', 'benchpassword', host='127.0.0.1',
+                port=self.mysql_server.port,
+                root_password=self.mysql_server.root_password)
+            self.mysql_db.ensure_user_and_db_exist()
+            fill_mysql(self.mysql_db, self.tables, self.rows)
+
+    def tear_down(self):
+        database.close_db_connections()
+        if self.mysql_server is not None:
+            self.mysql_server.stop()
+
+    def _can_use_mysql(self):
+        if mysqld.find_program('mysqld') is None:
+            return False
+        try:
+            import MySQLdb
+        except ImportError:
+            return False
+        return True
+
+    def _has_django(self):
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.call([sys.executable, '-c', 'import django'],
+                                   stdout=devnull, stderr=devnull) == 0
+        finally:
+            devnull.close()
+
+    def load_project_settings(self):
+        return imp.load_source('bench_project_settings',
+                               path.join(self.deploy_dir, 'project_settings.py'))
+
+    def clear_env(self):
+        database.close_db_connections()
+        tasklib.env.clear()
+        tasklib.env.update({
+            'verbose': False,
+            'quiet': True,
+            'noinput': True,
+            'always_run': False,
+            'deploy_dir': self.deploy_dir,
+            'python_bin': sys.executable,
+        })
+
+    def reset_env(self):
+        """Forget what tasklib has cached in memory, as a new tasks.py would"""
+        database.close_db_connections()
+        tasklib.env.clear()
+        tasklib.env.update(self.base_env)
+
+    def _remove(self, file_path):
+        for old_file in (file_path, file_path + 'c'):
+            if path.lexists(old_file):
+                os.remove(old_file)
+
+    def _run_tasks_py(self, *args):
+        tasks_env = os.environ.copy()
+        tasks_env['DYE_NO_TASKS_SERVER'] = '1'
+        tasks_env['PYTHONPATH'] = get_dye_root()
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.check_call(
+                [sys.executable, path.join(get_dye_root(), 'dye', 'tasks.py'),
+                 '-d', self.deploy_dir] + list(args),
+                env=tasks_env, stdout=devnull, stderr=subprocess.STDOUT)
+        finally:
+            devnull.close()
+
+    # the benchmarks - each is (name, setup, run)
+
+    def get_task_benchmarks(self):
+        env = tasklib.env
+        private_settings = path.join(self.base_env['django_settings_dir'],
+                                     'private_settings.py')
+        local_settings = path.join(self.base_env['django_settings_dir'],
+                                   'local_settings.py')
+
+        def setup_paths():
+            tasklib._setup_paths(self.load_project_settings(), None)
+
+        def remove_private_settings():
+            self.reset_env()
+            self._remove(private_settings)
+
+        def remove_local_settings():
+            self.reset_env()
+            self._remove(local_settings)
+
+        return [
+            ('tasks_py_help', None, lambda: self._run_tasks_py('--help')),
+            ('tasks_py_noop', None,
+             lambda: self._run_tasks_py('-n', '-q', 'create_private_settings')),
+            ('setup_paths', self.clear_env, setup_paths),
+            ('create_private_settings', remove_private_settings,
+             lambda: scheduler.run_task(tasklib.create_private_settings)),
+            ('create_private_settings_noop', self.reset_env,
+             lambda: scheduler.run_task(tasklib.create_private_settings)),
+            ('link_local_settings', remove_local_settings,
+             lambda: scheduler.run_task(tasklib.link_local_settings, 'dev')),
+            ('link_local_settings_noop', self.reset_env,
+             lambda: scheduler.run_task(tasklib.link_local_settings, 'dev')),
+            ('update_git_submodules', self.reset_env, tasklib.update_git_submodules),
+        ]
+
+    def get_django_benchmarks(self):
+        db_file = path.join(self.base_env['django_dir'], 'benchproj.sqlite')
+
+        def remove_db():
+            self.reset_env()
+            self._remove(db_file)
+
+        def deploy_dev():
+            tasklib.deploy('dev')
+        return [
+            ('update_db', remove_db, tasklib.update_db),
+            ('update_db_noop', self.reset_env, tasklib.update_db),
+            ('deploy_dev_noop', self.reset_env, deploy_dev),
+        ]
+
+    def get_sqlite_benchmarks(self):
+        db = self.sqlite_db
+        dump_file = path.join(self.work_dir, 'sqlite_dump.sql')
+        benchmarks = [
+            ('sqlite_test_connection', None, db.test_sql_user_password),
+            ('sqlite_migration_state', None, db.get_migration_state),
+            ('sqlite_create_snapshot', None, lambda: db.create_snapshot('bench')),
+            ('sqlite_restore_snapshot', None, lambda: db.restore_snapshot('bench')),
+        ]
+        if find_executable('sqlite3'):
+            benchmarks.append(('sqlite_dump', None, lambda: db.dump_db(dump_file)))
+        return benchmarks
+
+    def get_mysql_benchmarks(self):
+        db = self.mysql_db
+        dump_file = path.join(self.work_dir, 'mysql_dump.sql')
+        scratch_db = database.MySQLManager(
+            'benchscratch', db.user, db.password, host=db.host, port=db.port,
+            root_password=db.root_password)
+
+        def drop_scratch_db():
+            database.close_db_connections()
+            scratch_db.drop_db()
+        benchmarks = [
+            ('mysql_ensure_db', drop_scratch_db, scratch_db.ensure_user_and_db_exist),
+            ('mysql_ensure_db_noop', database.close_db_connections,
+             scratch_db.ensure_user_and_db_exist),
+            ('mysql_migration_state', database.close_db_connections,
+             db.get_migration_state),
+            ('mysql_create_snapshot', database.close_db_connections,
+             lambda: db.create_snapshot('bench')),
+            ('mysql_restore_snapshot', database.close_db_connections,
+             lambda: db.restore_snapshot('bench')),
+        ]
+        if find_executable('mysqldump'):
+            benchmarks.append(('mysql_dump', None, lambda: db.dump_db(dump_file)))
+        return benchmarks
+
+    def get_benchmarks(self):
+        benchmarks = self.get_task_benchmarks()
+        if self._has_django():
+            benchmarks += self.get_django_benchmarks()
+        else:
+            print "### Django is not installed - skipping the update_db benchmarks"
+        benchmarks += self.get_sqlite_benchmarks()
+        if self.mysql_db is not None:
+            benchmarks += self.get_mysql_benchmarks()
+        elif self.use_mysql:
+            print "### mysqld or MySQLdb is not installed - skipping the MySQL benchmarks"
+        return benchmarks
+
+    def run(self, patterns, iterations):
+        timings = {}
+        for name, setup, run in self.get_benchmarks():
+            if patterns and not [p for p in patterns if fnmatch.fnmatch(name, p)]:
+                continue
+            print "### Running %s" % name
+            timings[name] = time_benchmark(setup, run, iterations)
+        return timings
+
+
+BENCHMARK_NAMES = (
+    'tasks_py_help', 'tasks_py_noop', 'setup_paths', 'create_private_settings',
+    'create_private_settings_noop', 'link_local_settings',
+    'link_local_settings_noop', 'update_git_submodules', 'update_db',
+    'update_db_noop', 'deploy_dev_noop', 'sqlite_test_connection',
+    'sqlite_migration_state', 'sqlite_create_snapshot', 'sqlite_restore_snapshot',
+    'sqlite_dump', 'mysql_ensure_db', 'mysql_ensure_db_noop',
+    'mysql_migration_state', 'mysql_create_snapshot', 'mysql_restore_snapshot',
+    'mysql_dump',
+)
+
+
+def main(argv=None):
+    import docopt
+    options = docopt.docopt(__doc__, argv)
+    if options['--compare']:
+        print_timings_comparison(load_results(options['<old>']),
+                                 load_results(options['<new>']))
+        return 0
+    if options['--list']:
+        for name in BENCHMARK_NAMES:
+            print name
+        return 0
+
+    work_dir = options['--work-dir']
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='dye-bench-')
+    else:
+        work_dir = path.abspath(work_dir)
+        if path.exists(work_dir):
+            shutil.rmtree(work_dir)
+        os.makedirs(work_dir)
+    bench = TasklibBench(work_dir, options)
+    try:
+        bench.set_up()
+        timings = bench.run(options['<benchmark>'], int(options['--iterations']))
+    finally:
+        bench.tear_down()
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results(options['--output'], {'timings': timings})
+    print_timings(timings)
+    print "### Results written to %s" % options['--output']
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -81,3 +81,82 @@ def staging_test():
 localfab = None
 if os.path.isfile(os.path.join(localfabdir, 'localfab.py')):
     from localfab import *
+    import localfab
+# so that fablib can find the deploy_hook() in localfab
+env.localfab = localfab
+
+
+def _wrap_commands(wrapper):
+    """Replace fablib's run, sudo and local with wrapper(name, function)"""
+    for name in ('run', 'sudo', 'local'):
+        setattr(fablib, name, wrapper(name, getattr(fablib, name)))
+
+
+def _start_tracing(trace_file):
+    """For fab.py --trace - write each command that fablib runs to
+    trace_file, as tasks.py --trace does"""
+    import functools
+    from dye.tasklib.trace import Tracer
+    tracer = Tracer(trace_file, get_secrets=lambda: [env.get('svnpass')])
+
+    def traced_command(name, fn):
+        @functools.wraps(fn)
+        def traced(command, *args, **kwargs):
+            if name == 'local':
+                # local() only captures the output when asked to
+                captured = args[0] if args else kwargs.get('capture', False)
+                trace = tracer.trace_command(command, env.get('lcwd'), 'fablib.local')
+            else:
+                captured = True
+                trace = tracer.trace_command(command, env.get('cwd'), 'fablib.' + name,
+                                             'remote', env.host_string)
+            with trace as record:
+                result = fn(command, *args, **kwargs)
+                record['exit_code'] = getattr(result, 'return_code', None)
+                if captured:
+                    record['output_bytes'] = len(result)
+            return result
+        return traced
+    _wrap_commands(traced_command)
+
+
+def _start_profiling(profile_file):
+    """For fab.py --profile - run each task under cProfile, and time the
+    commands that fablib runs.  The profile is written when fab exits."""
+    import atexit
+    import functools
+    import inspect
+    from dye.tasklib.profiling import Profiler
+    profiler = Profiler(profile_file, get_secrets=lambda: [env.get('svnpass')])
+
+    def timed_command(name, fn):
+        @functools.wraps(fn)
+        def timed(command, *args, **kwargs):
+            with profiler.record_command(command):
+                return fn(command, *args, **kwargs)
+        return timed
+    _wrap_commands(timed_command)
+
+    def profiled_task(name, fn):
+        @functools.wraps(fn)
+        def profiled(*args, **kwargs):
+            return profiler.run_task(name, fn, *args, **kwargs)
+        return profiled
+    # fabric doesn't treat its own functions as tasks, so leave them alone
+    namespace = globals()
+    for name, fn in namespace.items():
+        if inspect.isfunction(fn) and not name.startswith('_') and \
+                not fn.__module__.startswith('fabric'):
+            namespace[name] = profiled_task(name, fn)
+
+    def write_profile():
+        summary_file = profiler.write()
+        print "### Profile written to %s and %s" % (profile_file, summary_file)
+    atexit.register(write_profile)
+
+
+# set by fab.py --trace and --profile
+if os.environ.get('DYE_TRACE'):
+    _start_tracing(os.environ['DYE_TRACE'])
+if os.environ.get('DYE_PROFILE'):
+    _start_profiling(os.environ['DYE_PROFILE'])
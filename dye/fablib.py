@@ -3,6 +3,12 @@ from os import path
 from datetime import datetime
 import getpass
 import re
+import time
+from StringIO import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 from fabric.context_managers import cd, hide, settings
 from fabric.operations import require, prompt, get, run, sudo, local, put
@@ -10,6 +16,18 @@ from fabric.state import env
 from fabric.contrib import files
 from fabric import utils
 
+from dye.tasklib import hooks
+from dye.tasklib.celery_config import (get_node_queues as _get_node_queues,
+        get_queue_stalls as _get_queue_stalls)
+from dye.tasklib.app_server_config import (get_unit_name as _get_unit_name,
+        RELOAD_COMMANDS as _APP_SERVER_RELOAD_COMMANDS)
+from dye.tasklib.webserver_config import get_generated_conf_path as _get_generated_conf_path
+
+# seconds between the pings while waiting for a celery node to start
+CELERY_PING_INTERVAL = 2
+# seconds to wait for the new nginx master in webserver_upgrade
+NGINX_UPGRADE_TIMEOUT = 10
+
 
 def _setup_paths(project_settings):
     env.project = project_settings
@@ -39,7 +57,8 @@ def _setup_paths(project_settings):
 
     # then do optional settings
     for setting in ['cvs_project', 'cvs_rsh', 'svnuser', 'svnpass', 'test_cmd',
-                    'port', 'user', 'host']:
+                    'port', 'user', 'host', 'metrics_statsd', 'metrics_prefix',
+                    'metrics_textfile', 'webserver_conf_template', 'app_server']:
         copy_setting(setting)
 
     # now do settings with defaults
@@ -54,6 +73,8 @@ def _setup_paths(project_settings):
     copy_setting('versions_to_keep', 5)
     copy_setting('dump_dir', path.join(env.server_project_home, 'dbdumps'))
     copy_setting('relative_deploy_dir', 'deploy')
+    copy_setting('celery_health_check_timeout', 60)
+    copy_setting('nginx_pid_file', '/run/nginx.pid')
     copy_setting('deploy_dir', path.join(env.vcs_root_dir, env.relative_deploy_dir))
     copy_setting('settings', '%(project_name)s.settings' % env)
     copy_setting('relative_webserver_dir', env.webserver)
@@ -119,11 +140,64 @@ def _get_tasks_bin():
     return env.tasks_bin
 
 
-def _tasks(tasks_args, verbose=False):
+# the start of the line that tasks.py --json-results prints
+TASKS_RESULTS_PREFIX = 'tasks.py results: '
+
+
+def _parse_tasks_results(output):
+    for line in reversed(output.splitlines()):
+        line = line.strip()
+        if line.startswith(TASKS_RESULTS_PREFIX):
+            try:
+                return json.loads(line[len(TASKS_RESULTS_PREFIX):])
+            except ValueError:
+                break
+    return None
+
+
+def _run_tasks_batch(tasks_args_list, verbose=False):
+    """Run all the tasks in one tasks.py process on the server.  The result
+    has the result of each task, as a list of dicts, in task_results - or
+    None if tasks.py failed before it could report them."""
     tasks_cmd = _get_tasks_bin()
     if env.verbose or verbose:
         tasks_cmd += ' -v'
-    return sudo_or_run(tasks_cmd + ' ' + tasks_args)
+    tasks_cmd += ' --json-results'
+    with settings(warn_only=True):
+        result = sudo_or_run(tasks_cmd + ' ' + ' '.join(tasks_args_list))
+    result.task_results = _parse_tasks_results(result)
+    if result.failed and not env.warn_only:
+        failed = [r for r in (result.task_results or []) if r['status'] == 'failed']
+        if failed:
+            utils.abort('tasks.py failed in %s: %s' %
+                        (failed[0]['task'], failed[0]['error']))
+        utils.abort('tasks.py failed with exit code %s running: %s' %
+                    (result.return_code, ' '.join(tasks_args_list)))
+    return result
+
+
+def _queue_tasks(tasks_args):
+    """Queue tasks to be run by the next call of _tasks() or
+    _run_queued_tasks(), so that they share one tasks.py process (and one
+    sudo) on the server."""
+    if 'queued_tasks' not in env:
+        env.queued_tasks = []
+    env.queued_tasks.append(tasks_args)
+
+
+def _run_queued_tasks(verbose=False):
+    queued_tasks = env.get('queued_tasks')
+    if not queued_tasks:
+        return None
+    env.queued_tasks = []
+    return _run_tasks_batch(queued_tasks, verbose)
+
+
+def _tasks(tasks_args, verbose=False):
+    """Run tasks.py on the server, along with any queued tasks, which are
+    run first"""
+    _queue_tasks(tasks_args)
+    return _run_queued_tasks(verbose)
 
 
 def _get_svn_user_and_pass():
@@ -185,62 +259,115 @@ def deploy(revision=None, keep=None, full_rebuild=True):
     * full_rebuild is whether to do a full rebuild of the virtualenv
     """
     require('project_type', 'server_project_home', provided_by=env.valid_envs)
+    deploy_hooks = _get_deploy_hooks('deploy')
+    with deploy_hooks.phase('deploy', revision=revision):
+        with deploy_hooks.phase('prepare'):
+            # this really needs to be first - other things assume the directory exists
+            _create_dir_if_not_exists(env.server_project_home)
+
+            # if the <server_project_home>/previous/ directory doesn't exist, this does
+            # nothing
+            _migrate_directory_structure()
+            _set_vcs_root_dir_timestamp()
+
+            check_for_local_changes(revision)
+        # TODO: check for deploy-in-progress.json file
+        # also check if there are any directories newer than current ???
+        # might just mean we did a rollback, so maybe don't bother as the
+        # deploy-in-progress should be enough
+        # _check_for_deploy_in_progress()
+
+        # TODO: create deploy-in-progress.json file
+        # _set_deploy_in_progress()
+        with deploy_hooks.phase('checkout'):
+            create_copy_for_next()
+            checkout_or_update(in_next=True, revision=revision)
+            # remove any old pyc files - essential if the .py file is removed by VCS
+            if env.project_type == "django":
+                rm_pyc_files(path.join(env.next_dir, env.relative_django_dir))
+        # create the deploy virtualenv if we use it
+        with deploy_hooks.phase('virtualenv'):
+            create_deploy_virtualenv(in_next=True, full_rebuild=full_rebuild)
+
+        # we only have to disable this site after creating the rollback copy
+        # (do this so that apache carries on serving other sites on this server
+        # and the maintenance page for this vhost)
+        with deploy_hooks.phase('downtime'):
+            downtime_start = datetime.now()
+            with deploy_hooks.phase('maintenance'):
+                # the config test aborts before the reload if the maintenance
+                # conf is broken, so the webserver keeps the conf it has
+                link_webserver_conf(maintenance=True)
+                with settings(warn_only=True):
+                    webserver_cmd('reload')
+                # TODO: do a database dump in the old directory
+                point_current_to_next()
+
+            # Use tasks.py deploy:env to actually do the deployment, including
+            # creating the virtualenv if it thinks it necessary, ignoring
+            # env.use_virtualenv as tasks.py knows nothing about it.
+            with deploy_hooks.phase('tasks'):
+                _queue_tasks('deploy:' + env.environment)
+                if env.environment == 'production':
+                    # this is quick, so do it in the same tasks.py run
+                    require('dump_dir', provided_by=env.valid_envs)
+                    _queue_tasks('setup_db_dumps:' + env.dump_dir)
+                if env.get('webserver_conf_template') and env.webserver:
+                    # render the conf for this server, for link_webserver_conf
+                    _queue_tasks('generate_webserver_conf:' + env.environment)
+                _run_queued_tasks()
+
+            # bring this vhost back in, reload the webserver and touch the WSGI
+            # handler (which reloads the wsgi app)
+            with deploy_hooks.phase('webserver_reload'):
+                link_webserver_conf(generate=False)
+                webserver_cmd('reload')
+            downtime_end = datetime.now()
+        if env.get('app_server'):
+            with deploy_hooks.phase('app_server_reload'):
+                set_up_app_server(reload=True)
+        else:
+            with deploy_hooks.phase('touch_wsgi'):
+                touch_wsgi()
 
-    # this really needs to be first - other things assume the directory exists
-    _create_dir_if_not_exists(env.server_project_home)
+        with deploy_hooks.phase('delete_old_rollback_versions'):
+            delete_old_rollback_versions(keep)
 
-    # if the <server_project_home>/previous/ directory doesn't exist, this does
-    # nothing
-    _migrate_directory_structure()
-    _set_vcs_root_dir_timestamp()
+        # TODO: _remove_deploy_in_progress()
+        # move the deploy-in-progress.json file into the old directory as
+        # deploy-details.json
+        _report_downtime(downtime_start, downtime_end)
 
-    check_for_local_changes(revision)
-    # TODO: check for deploy-in-progress.json file
-    # also check if there are any directories newer than current ???
-    # might just mean we did a rollback, so maybe don't bother as the
-    # deploy-in-progress should be enough
-    # _check_for_deploy_in_progress()
-
-    # TODO: create deploy-in-progress.json file
-    # _set_deploy_in_progress()
-    create_copy_for_next()
-    checkout_or_update(in_next=True, revision=revision)
-    # remove any old pyc files - essential if the .py file is removed by VCS
-    if env.project_type == "django":
-        rm_pyc_files(path.join(env.next_dir, env.relative_django_dir))
-    # create the deploy virtualenv if we use it
-    create_deploy_virtualenv(in_next=True, full_rebuild=full_rebuild)
-
-    # we only have to disable this site after creating the rollback copy
-    # (do this so that apache carries on serving other sites on this server
-    # and the maintenance page for this vhost)
-    downtime_start = datetime.now()
-    link_webserver_conf(maintenance=True)
-    with settings(warn_only=True):
-        webserver_cmd('reload')
-    # TODO: do a database dump in the old directory
-    point_current_to_next()
-
-    # Use tasks.py deploy:env to actually do the deployment, including
-    # creating the virtualenv if it thinks it necessary, ignoring
-    # env.use_virtualenv as tasks.py knows nothing about it.
-    _tasks('deploy:' + env.environment)
-
-    # bring this vhost back in, reload the webserver and touch the WSGI
-    # handler (which reloads the wsgi app)
-    link_webserver_conf()
-    webserver_cmd('reload')
-    downtime_end = datetime.now()
-    touch_wsgi()
 
-    delete_old_rollback_versions(keep)
-    if env.environment == 'production':
-        setup_db_dumps()
+class _RemoteTextfileEmitter(hooks.PrometheusTextfileEmitter):
+    """Keeps metrics_textfile on the server, where node_exporter reads it,
+    rather than on the machine fab is run on"""
+
+    def __repr__(self):
+        return '_RemoteTextfileEmitter(%r)' % self.textfile
+
+    def read_samples(self):
+        with settings(hide('stdout'), warn_only=True):
+            contents = sudo_or_run('cat %s' % self.textfile)
+        if contents.failed:
+            return {}
+        return hooks.parse_textfile(contents.splitlines())
 
-    # TODO: _remove_deploy_in_progress()
-    # move the deploy-in-progress.json file into the old directory as
-    # deploy-details.json
-    _report_downtime(downtime_start, downtime_end)
+    def write_samples(self, samples):
+        # moved into place, so the textfile collector never sees half a file
+        temp_file = self.textfile + '.tmp'
+        put(StringIO(hooks.format_textfile(samples)), temp_file,
+            use_sudo=env.use_sudo)
+        sudo_or_run('mv %s %s' % (temp_file, self.textfile))
+
+
+def _get_deploy_hooks(command):
+    """The hooks for command (deploy or rollback) - see dye.tasklib.hooks"""
+    return hooks.DeployHooks(
+        hooks.get_hooks(env, env.get('localfab'), _RemoteTextfileEmitter),
+        runner='fablib',
+        command=command, project=env.project_name,
+        environment=env.get('environment'), host=env.host_string)
 
 
 def _total_seconds(td):
@@ -258,25 +385,164 @@ def _report_downtime(downtime_start, downtime_end):
                (downtime_start, downtime_end))
 
 
+def _graceful_webserver():
+    """Whether the webserver can carry on serving through a rollback -
+    nginx reloads its conf gracefully and the app server behind it keeps its
+    socket, where Apache is stopped and started"""
+    return env.webserver == 'nginx'
+
+
+def _copy_if_changed(source, destination):
+    """Copy source to destination on the server, unless destination is the
+    same already.  Returns True if it was copied."""
+    with settings(warn_only=True):
+        unchanged = sudo_or_run('cmp -s %s %s' % (source, destination)).succeeded
+    if not unchanged:
+        sudo_or_run('cp %s %s' % (source, destination))
+    return not unchanged
+
+
+def _get_celery_nodes(celery_configuration):
+    """The nodes in CELERYD_NODES - either the node names, or the number of
+    nodes, which celeryd-multi calls celery1, celery2 ..."""
+    output = sudo_or_run('. %s && echo $CELERYD_NODES' % celery_configuration)
+    lines = output.strip().splitlines()
+    nodes = lines[-1].split() if lines else []
+    if len(nodes) == 1 and nodes[0].isdigit():
+        nodes = ['celery%d' % number for number in range(1, int(nodes[0]) + 1)]
+    # the default in the init script
+    return nodes or ['celery']
+
+
+def _get_celery_node_queues(celery_configuration, nodes):
+    """The queues each node takes tasks from, from the -Q options in
+    CELERYD_OPTS"""
+    output = sudo_or_run('. %s && echo "$CELERYD_OPTS"' % celery_configuration)
+    lines = output.strip().splitlines()
+    return _get_node_queues(lines[-1] if lines else '', nodes)
+
+
+def _wait_for_celery_node(celery_run_script, node):
+    """Wait until node answers a ping, or abort after
+    env.celery_health_check_timeout seconds"""
+    # celery 3.0 calls the node <node>.<host> and 3.1 <node>@<host>
+    node_re = re.compile(r'(?:^|\s)%s[.@]' % re.escape(node), re.MULTILINE)
+    deadline = time.time() + env.celery_health_check_timeout
+    while True:
+        with settings(warn_only=True):
+            pings = sudo_or_run('%s ping' % celery_run_script)
+        if pings.succeeded and node_re.search(pings):
+            return
+        if time.time() > deadline:
+            utils.abort('celery node %s did not answer a ping within %d seconds' %
+                        (node, env.celery_health_check_timeout))
+        time.sleep(CELERY_PING_INTERVAL)
+
+
+def _rolling_restart_celeryd(celery_run_script, celery_configuration, deploy_hooks):
+    """Restart the celeryd nodes one at a time.  Each node gets a warm
+    shutdown - it stops taking tasks and finishes the ones it has - and is
+    started on the new release, and the next node is only restarted once it
+    answers a ping.  Returns how long each queue had no node taking tasks
+    from it, as {queue: seconds}."""
+    nodes = _get_celery_nodes(celery_configuration)
+    node_queues = _get_celery_node_queues(celery_configuration, nodes)
+    down_times = {}
+    with deploy_hooks.phase('restart_celeryd') as restart_event:
+        for node in nodes:
+            with deploy_hooks.phase('restart_celeryd_' + node):
+                stopped = time.time()
+                sudo_or_run('%s stopwait-node %s' % (celery_run_script, node))
+                sudo_or_run('%s start-node %s' % (celery_run_script, node))
+                _wait_for_celery_node(celery_run_script, node)
+                down_times[node] = (stopped, time.time())
+            utils.puts("celery node %s was out of service for %.1f seconds" %
+                       (node, down_times[node][1] - down_times[node][0]))
+        # only one node is down at a time, so a queue only stalls if it has
+        # just the one node
+        queue_stalls = _get_queue_stalls(node_queues, down_times)
+        restart_event['queue_stall_seconds'] = max(queue_stalls.values() or [0.0])
+        for queue, stall in queue_stalls.items():
+            restart_event['queue_stall_seconds_' + queue] = stall
+    for queue in sorted(queue_stalls):
+        utils.puts("The celery queue %s stalled for %.1f seconds" %
+                   (queue, queue_stalls[queue]))
+    return queue_stalls
+
+
+def _celeryd_has_node_commands(celery_run_script):
+    """Whether the installed init script has stopwait-node and start-node -
+    those copied from older projects don't"""
+    with settings(warn_only=True):
+        return sudo_or_run('grep -q stopwait-node %s' % celery_run_script).succeeded
+
+
+def _restart_celeryd(celery_run_script, celery_configuration_location,
+                     celery_configuration_destination, deploy_hooks):
+    """Install the celeryd configuration and restart the nodes on the new
+    release.  Nodes the new configuration drops are stopped first, while the
+    configuration that started them is still installed."""
+    if files.exists(celery_configuration_destination, use_sudo=True):
+        old_nodes = _get_celery_nodes(celery_configuration_destination)
+    else:
+        old_nodes = []
+    new_nodes = _get_celery_nodes(celery_configuration_location)
+    removed_nodes = [node for node in old_nodes if node not in new_nodes]
+    if not _celeryd_has_node_commands(celery_run_script):
+        utils.warn("%s has no stopwait-node command, so the celeryd nodes are "
+                   "restarted all at once - copy celery/init/celeryd from the "
+                   "cookiecutter project to restart them one at a time" %
+                   celery_run_script)
+        if removed_nodes:
+            sudo_or_run('%s stop' % celery_run_script)
+        _copy_if_changed(celery_configuration_location,
+                         celery_configuration_destination)
+        with deploy_hooks.phase('restart_celeryd'):
+            sudo_or_run('%s restart' % celery_run_script)
+        return None
+    for node in removed_nodes:
+        with deploy_hooks.phase('stop_celeryd_' + node):
+            sudo_or_run('%s stopwait-node %s' % (celery_run_script, node))
+    _copy_if_changed(celery_configuration_location,
+                     celery_configuration_destination)
+    return _rolling_restart_celeryd(celery_run_script,
+                                    celery_configuration_destination,
+                                    deploy_hooks)
+
+
 def set_up_celery_daemon():
+    """Install the celery init scripts and configuration where they have
+    changed, restart celerybeat and do a rolling restart of the celeryd
+    nodes.  If project_settings has celery_queues the configuration is
+    generated on the server by tasks.py generate_celery_config, otherwise it
+    is copied from celery/config/"""
     require('vcs_root_dir', 'project_name', provided_by=env)
+    deploy_hooks = _get_deploy_hooks('set_up_celery_daemon')
+    if hasattr(env.project, 'celery_queues'):
+        # generated on the server, to fit the machine
+        _tasks('generate_celery_config')
+        celery_configuration_dir = path.join(env['vcs_root_dir'], 'celery', 'generated')
+    else:
+        celery_configuration_dir = path.join(env['vcs_root_dir'], 'celery', 'config')
     for command in ('celerybeat', 'celeryd'):
         command_project = command + '_' + env.project_name
         celery_run_script_location = path.join(env['vcs_root_dir'],
                                                'celery', 'init', command)
         celery_run_script = path.join('/etc', 'init.d', command_project)
-        celery_configuration_location = path.join(env['vcs_root_dir'],
-                                                  'celery', 'config', command)
+        celery_configuration_location = path.join(celery_configuration_dir, command)
         celery_configuration_destination = path.join('/etc', 'default',
                                                      command_project)
 
-        sudo_or_run(" ".join(['cp', celery_run_script_location,
-                    celery_run_script]))
-        sudo_or_run(" ".join(['chmod', '+x', celery_run_script]))
-
-        sudo_or_run(" ".join(['cp', celery_configuration_location,
-                    celery_configuration_destination]))
-        sudo_or_run('/etc/init.d/%s restart' % command_project)
+        if _copy_if_changed(celery_run_script_location, celery_run_script):
+            sudo_or_run(" ".join(['chmod', '+x', celery_run_script]))
+        if command == 'celeryd':
+            _restart_celeryd(celery_run_script, celery_configuration_location,
+                             celery_configuration_destination, deploy_hooks)
+        else:
+            _copy_if_changed(celery_configuration_location,
+                             celery_configuration_destination)
+            with deploy_hooks.phase('restart_' + command):
+                sudo_or_run('%s restart' % celery_run_script)
 
 
 def clean_old_celery():
@@ -443,8 +709,15 @@ def _dump_db_in_directory(dump_dir):
                 # and compress the dump (provided it worked)
                 dump_file = 'db_dump.sql'
                 dump_file_compressed = dump_file + '.gz'
-                sudo_or_run('gzip -c %s > %s' % (dump_file, dump_file_compressed))
+                # get the size for the deploy hooks while we're at it
+                dump_size = sudo_or_run('gzip -c %s > %s && wc -c < %s' % (
+                    dump_file, dump_file_compressed, dump_file_compressed))
                 sudo_or_run('rm %s' % dump_file)
+                try:
+                    return int(dump_size.strip().splitlines()[-1])
+                except (ValueError, IndexError):
+                    return None
+    return None
 
 
 def _get_list_of_versions():
@@ -523,23 +796,40 @@ def rollback(version='last', migrate=False, restore_db=False):
         utils.abort("Cannot rollback to version %s, it does not exist, use"
                     "list_versions to see versions available" % version)
 
-    webserver_cmd("stop")
-    # first make a db dump of the current state
-    _dump_db_in_directory(env.vcs_root_dir)
-    if migrate:
-        # run the south migrations back to the old version
-        # but how to work out what the old version is??
-        pass
-    if restore_db:
-        # feed the dump file into mysql command
-        with cd(rollback_dir):
-            _tasks('load_dbdump')
-    # change current link
-    if files.exists(env.current_link):
-        sudo_or_run('rm %s' % env.current_link)
-    with cd(env.server_project_home):
-        sudo_or_run('ln -s %s current' % version)
-    webserver_cmd("start")
+    deploy_hooks = _get_deploy_hooks('rollback')
+    with deploy_hooks.phase('rollback', version=version):
+        with deploy_hooks.phase('downtime'):
+            # nothing must write to the database while it is being restored
+            graceful = _graceful_webserver() and not restore_db
+            if not graceful:
+                webserver_cmd("stop")
+            # first make a db dump of the current state
+            with deploy_hooks.phase('dump_db') as event:
+                dump_bytes = _dump_db_in_directory(env.vcs_root_dir)
+                if dump_bytes is not None:
+                    event['dump_bytes'] = dump_bytes
+            if migrate:
+                # run the south migrations back to the old version
+                # but how to work out what the old version is??
+                pass
+            if restore_db:
+                # feed the dump file into mysql command
+                with deploy_hooks.phase('restore_db'):
+                    with cd(rollback_dir):
+                        _tasks('load_dbdump')
+            # change current link
+            if files.exists(env.current_link):
+                sudo_or_run('rm %s' % env.current_link)
+            with cd(env.server_project_home):
+                sudo_or_run('ln -s %s current' % version)
+            if graceful:
+                # the conf is linked through current/, so the old release's
+                # conf is picked up by the reload
+                webserver_cmd('reload')
+                if env.get('app_server'):
+                    app_server_reload()
+            else:
+                webserver_cmd("start")
 
 
 def local_test():
@@ -899,8 +1189,12 @@ def _link_files(source_file, target_path):
         sudo_or_run('ln -s %s %s' % (source_file, target_path))
 
 
-def link_webserver_conf(maintenance=False):
-    """link the webserver conf file"""
+def link_webserver_conf(maintenance=False, generate=True):
+    """link the webserver conf file, and run the webserver's config test
+
+    If webserver_conf_template is set in project_settings the live conf is
+    rendered from it on the server by tasks.py generate_webserver_conf -
+    generate=False links the one rendered already."""
     require('webserver', 'vcs_root_dir', provided_by=env.valid_envs)
     if env.webserver is None:
         return
@@ -909,6 +1203,11 @@ def link_webserver_conf(maintenance=False):
                                 env.environment)
     vcs_config_live = vcs_config_stub + '.conf'
     vcs_config_maintenance = vcs_config_stub + '-maintenance.conf'
+    if env.get('webserver_conf_template') and not maintenance:
+        if generate:
+            _tasks('generate_webserver_conf:' + env.environment)
+        vcs_config_live = _get_generated_conf_path(
+            env.vcs_root_dir, env.webserver_conf_template, env.environment)
     webserver_conf = _webserver_conf_path()
 
     if maintenance:
@@ -935,6 +1234,8 @@ def _webserver_conf_path():
     webserver_conf_dir = {
         'apache_redhat': '/etc/httpd/conf.d',
         'apache_debian': '/etc/apache2/sites-available',
+        'nginx_redhat': '/etc/nginx/conf.d',
+        'nginx_debian': '/etc/nginx/sites-available',
     }
     key = env.webserver + '_' + _linux_type()
     if key in webserver_conf_dir:
@@ -951,6 +1252,8 @@ def webserver_configtest():
     tests = {
         'apache_redhat': '/usr/sbin/httpd -S',
         'apache_debian': '/usr/sbin/apache2ctl -S',
+        'nginx_redhat': '/usr/sbin/nginx -t',
+        'nginx_debian': '/usr/sbin/nginx -t',
     }
     if env.webserver:
         key = env.webserver + '_' + _linux_type()
@@ -971,12 +1274,24 @@ def webserver_restart():
     webserver_cmd('restart')
 
 
+def _webserver_uses_systemd():
+    """nginx with an app server is run by systemd, like the app server - the
+    nginx packages for systemd have no init script"""
+    return env.webserver == 'nginx' and bool(env.get('app_server'))
+
+
 def webserver_cmd(cmd):
-    """ run cmd against webserver init.d script """
+    """ run cmd against webserver init.d script (or systemctl for nginx
+    with an app server) """
     require('webserver', provided_by=env.valid_envs)
+    if _webserver_uses_systemd():
+        sudo('systemctl %s nginx' % cmd)
+        return
     cmd_strings = {
         'apache_redhat': '/etc/init.d/httpd',
         'apache_debian': '/etc/init.d/apache2',
+        'nginx_redhat': '/etc/init.d/nginx',
+        'nginx_debian': '/etc/init.d/nginx',
     }
     if env.webserver:
         key = env.webserver + '_' + _linux_type()
@@ -984,3 +1299,76 @@ def webserver_cmd(cmd):
             sudo(cmd_strings[key] + ' ' + cmd)
         else:
             utils.abort('webserver %s is not supported' % env.webserver)
+
+
+def webserver_upgrade():
+    """ upgrade to a new nginx binary without dropping connections
+
+    The old master starts the new binary (USR2), which takes over the
+    listening sockets, and is then told to quit (QUIT) - for after the nginx
+    package has been upgraded."""
+    require('webserver', provided_by=env.valid_envs)
+    if env.webserver != 'nginx':
+        utils.abort('webserver %s does not do binary upgrades' % env.webserver)
+    if not _webserver_uses_systemd():
+        webserver_cmd('upgrade')
+        return
+    # systemctl has no upgrade, so send the signals ourselves - systemd
+    # follows the master through the pid file
+    old_pid_file = env.nginx_pid_file + '.oldbin'
+    sudo('kill -USR2 $(cat %s)' % env.nginx_pid_file)
+    deadline = time.time() + NGINX_UPGRADE_TIMEOUT
+    while not (files.exists(old_pid_file, use_sudo=True) and
+               files.exists(env.nginx_pid_file, use_sudo=True)):
+        if time.time() > deadline:
+            utils.abort('the new nginx master did not start within %d seconds' %
+                        NGINX_UPGRADE_TIMEOUT)
+        time.sleep(1)
+    sudo('kill -QUIT $(cat %s)' % old_pid_file)
+
+
+def set_up_app_server(reload=False):
+    """Install the systemd socket and service units for the gunicorn or uWSGI
+    app_server, as rendered on the server by tasks.py generate_webserver_conf,
+    and start the socket.  With reload=True the app server is moved on to
+    the current release (see app_server_reload)."""
+    require('vcs_root_dir', 'project_name', provided_by=env.valid_envs)
+    if not env.get('app_server') or not env.get('webserver_conf_template'):
+        utils.abort('set_up_app_server needs app_server and webserver_conf_template '
+                    'in project_settings.py')
+    unit = _get_unit_name(env.project_name, env.app_server)
+    generated_dir = path.dirname(_get_generated_conf_path(
+        env.vcs_root_dir, env.webserver_conf_template, env.environment))
+    changed = False
+    for unit_file in (unit + '.socket', unit + '.service'):
+        if _copy_if_changed(path.join(generated_dir, unit_file),
+                            path.join('/etc', 'systemd', 'system', unit_file)):
+            changed = True
+    if changed:
+        sudo_or_run('systemctl daemon-reload')
+        sudo_or_run('systemctl enable %s.socket %s.service' % (unit, unit))
+    # nothing happens if it is listening already - so a change to the socket
+    # unit only takes effect once it is restarted by hand
+    sudo_or_run('systemctl start %s.socket' % unit)
+    if reload:
+        app_server_reload()
+
+
+def app_server_reload():
+    """ move the app server on to the current release without refusing
+    connections
+
+    uWSGI gets a HUP, and re-executes itself gracefully.  gunicorn is
+    restarted, as a HUP would keep the virtualenv of the old release - the
+    socket unit keeps accepting connections until the new one is up."""
+    require('app_server', provided_by=env.valid_envs)
+    if env.app_server not in _APP_SERVER_RELOAD_COMMANDS:
+        utils.abort('app_server %s is not supported' % env.app_server)
+    app_server_cmd(_APP_SERVER_RELOAD_COMMANDS[env.app_server])
+
+
+def app_server_cmd(cmd):
+    """ run systemctl cmd against the app server service """
+    require('project_name', 'app_server', provided_by=env.valid_envs)
+    sudo_or_run('systemctl %s %s.service' %
+                (cmd, _get_unit_name(env.project_name, env.app_server)))
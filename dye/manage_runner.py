@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""Run a batch of Django management commands in a single process.
+
+tasklib starts this with the virtualenv python and the django directory as
+the working directory (see _manage_py_batch() in tasklib/django.py) so that
+Django is only set up once for the whole batch.  It reads a JSON request
+from stdin like:
+
+    {"commands": [["syncdb", "--noinput"], ["migrate", "--noinput"]],
+     "sys_path": ["/path/to/deploy"],
+     "result_file": "/tmp/tmpXYZ.json"}
+
+Each command is run in turn, with its own captured stdout and stderr,
+stopping after the first command that fails.  A JSON list with the args,
+exit_code, stdout, stderr and duration of each command run is written to
+result_file.
+
+The request can also have "log_files", a list with a file for each command.
+The stdout and stderr of each command are then written to its file, rather
+than kept in memory, and the results have "log_file" in place of stdout and
+stderr.
+
+The request can also have "model_tables_file".  The tables of the managed
+models of each app, including the tables of many to many fields, are then
+written to it as JSON, like {"app_label": ["app_label_model", ...]}, before
+any command is run.
+
+If Django cannot be set up then nothing is written to result_file and we
+exit with BOOT_FAILED, so tasklib can fall back to running manage.py once
+for each command.
+"""
+import os
+from os import path
+import sys
+import time
+import traceback
+from StringIO import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BOOT_FAILED = 3
+
+
+def _exit_code_from_system_exit(e, stderr):
+    # sys.exit() can be called with None, a number or a message
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    stderr.write('%s\n' % e.code)
+    return 1
+
+
+# the buffer for a log file, so the output is written in large chunks
+LOG_BUFFER_SIZE = 64 * 1024
+
+
+def run_command(utility_class, args, log_file=None):
+    if log_file is None:
+        stdout, stderr = StringIO(), StringIO()
+    else:
+        stdout = stderr = open(log_file, 'w', LOG_BUFFER_SIZE)
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr
+    start = time.time()
+    exit_code = 0
+    try:
+        try:
+            utility_class(['manage.py'] + args).execute()
+        except SystemExit, e:
+            exit_code = _exit_code_from_system_exit(e, stderr)
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+    result = {
+        'args': args,
+        'exit_code': exit_code,
+        'duration': time.time() - start,
+    }
+    if log_file is None:
+        result['stdout'] = stdout.getvalue()
+        result['stderr'] = stderr.getvalue()
+    else:
+        stdout.close()
+        result['log_file'] = log_file
+    return result
+
+
+def get_model_tables():
+    """The tables syncdb creates for each app - those of the models Django
+    manages, which are not proxies or swapped out"""
+    try:
+        from django.apps import apps
+    except ImportError:
+        # before Django 1.7
+        from django.db import models
+        app_models = [(app.__name__.split('.')[-2],
+                       models.get_models(app, include_auto_created=True))
+                      for app in models.get_apps()]
+    else:
+        app_models = [(config.label, config.get_models(include_auto_created=True))
+                      for config in apps.get_app_configs()]
+    model_tables = {}
+    for app_label, models in app_models:
+        model_tables[app_label] = sorted(set(
+            model._meta.db_table for model in models
+            if model._meta.managed and not model._meta.proxy and
+            not getattr(model._meta, 'swapped', None)))
+    return model_tables
+
+
+def write_json(file_path, value):
+    json_file = open(file_path, 'w')
+    try:
+        json.dump(value, json_file)
+    finally:
+        json_file.close()
+
+
+def main():
+    request = json.load(sys.stdin)
+
+    # we are run as a script, so our own directory is at the start of
+    # sys.path - but we want the project modules, not the dye ones
+    own_dir = path.dirname(path.abspath(__file__))
+    sys.path = [p for p in sys.path if path.abspath(p or os.curdir) != own_dir]
+    sys.path.insert(0, os.getcwd())
+    sys.path.extend(request.get('sys_path', []))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+    try:
+        import django
+        if hasattr(django, 'setup'):
+            django.setup()
+        from django.conf import settings
+        from django.core.management import ManagementUtility
+        # make the settings load now, so errors in them are reported before
+        # we run any commands
+        settings.INSTALLED_APPS
+    except Exception:
+        traceback.print_exc()
+        return BOOT_FAILED
+
+    if request.get('model_tables_file'):
+        try:
+            model_tables = get_model_tables()
+        except Exception:
+            traceback.print_exc()
+            return BOOT_FAILED
+        write_json(request['model_tables_file'], model_tables)
+
+    results = []
+    log_files = request.get('log_files') or [None] * len(request['commands'])
+    for args, log_file in zip(request['commands'], log_files):
+        result = run_command(ManagementUtility, args, log_file)
+        results.append(result)
+        if result['exit_code'] != 0:
+            break
+
+    write_json(request['result_file'], results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
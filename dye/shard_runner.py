@@ -0,0 +1,316 @@
+"""Run one shard of a project's tests.
+
+tasklib's run_tests:jobs=N (see _manage_py_tests() in tasklib/django.py)
+starts N copies of manage.py test (one without jobs), each with
+DYE_TEST_SHARD set to "n/N" and DJANGO_SETTINGS_MODULE set to a generated
+settings module like:
+
+    from settings import *
+    from dye.shard_runner import configure_shard_settings
+    configure_shard_settings(globals(), {'default': 'test_myproject_2'})
+
+which gives the shard its own test databases, and makes TEST_RUNNER the
+ShardedTestRunner below.  With pytest this module is loaded as a plugin
+(-p dye.shard_runner) instead.  Either way each shard collects the whole
+suite, then keeps only its own share of it.  The tests of a TestCase class
+(or a pytest module or class) are kept together, so that class and module
+fixtures are only set up in one shard.
+
+If DYE_TEST_HISTORY is set it is the path of a JSON file with the duration
+of each test and the tests that failed last time (see tasklib/test_times.py).
+The shards are then balanced by duration rather than number of tests, and
+the classes with tests that failed last time are run first.  If
+DYE_TEST_RESULTS is set we write the result and duration of each test to it.
+"""
+import os
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+SHARD_ENV_VAR = 'DYE_TEST_SHARD'
+HISTORY_ENV_VAR = 'DYE_TEST_HISTORY'
+RESULTS_ENV_VAR = 'DYE_TEST_RESULTS'
+
+
+def get_shard():
+    """Returns (index, count) from DYE_TEST_SHARD, with index counting from 0,
+    or None if we are not running as a shard"""
+    shard = os.environ.get(SHARD_ENV_VAR)
+    if not shard:
+        return None
+    number, count = shard.split('/')
+    return int(number) - 1, int(count)
+
+
+def get_history():
+    """Returns the durations dict and the set of failed test ids from the
+    DYE_TEST_HISTORY file, or ({}, set()) if there is no history"""
+    history_file = os.environ.get(HISTORY_ENV_VAR)
+    if not history_file:
+        return {}, set()
+    try:
+        f = open(history_file)
+        try:
+            history = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}, set()
+    return history['durations'], set(history['failed'])
+
+
+def get_weights(test_ids, durations):
+    """The weight of each test for assign_shards() - its duration last time,
+    or for new tests the average duration of the others"""
+    if durations:
+        default = sum(durations.values()) / len(durations)
+    else:
+        default = 1.0
+    return [durations.get(test_id, default) for test_id in test_ids]
+
+
+def assign_shards(group_keys, count, weights=None):
+    """Take the group key of each test, and return a dict of group key to
+    shard index.  The biggest groups are given out first, each to the shard
+    with the least so far, so the shards get about the same number of tests
+    or, if weights gives the duration of each test, the same amount of work.
+    The result only depends on the keys and weights, so every shard works
+    out the same assignment."""
+    if weights is None:
+        weights = [1] * len(group_keys)
+    sizes = {}
+    for key, weight in zip(group_keys, weights):
+        sizes[key] = sizes.get(key, 0) + weight
+    loads = [0] * count
+    assignment = {}
+    for key in sorted(sizes, key=lambda k: (-sizes[k], k)):
+        shard = loads.index(min(loads))
+        assignment[key] = shard
+        loads[shard] += sizes[key]
+    return assignment
+
+
+def failed_first(group_keys, failed_keys, bins=None):
+    """Returns the order (a list of indexes into group_keys) in which to run
+    the tests so that the groups in failed_keys come first.  Otherwise the
+    order is kept, and tests are never moved out of their bin."""
+    if bins is None:
+        bins = [0] * len(group_keys)
+    order = range(len(group_keys))
+    order.sort(key=lambda i: (bins[i], group_keys[i] not in failed_keys))
+    return order
+
+
+class ResultRecorder(object):
+    """Records the result and duration of each test, by wrapping the methods
+    of a unittest TestResult"""
+
+    OUTCOMES = (
+        ('addSuccess', 'passed'),
+        ('addFailure', 'failed'),
+        ('addError', 'error'),
+        ('addSkip', 'skipped'),
+        ('addExpectedFailure', 'passed'),
+        ('addUnexpectedSuccess', 'failed'),
+    )
+
+    def __init__(self):
+        self.results = []
+        self._started = {}
+        self._outcomes = {}
+
+    def watch(self, result):
+        for method_name, outcome in self.OUTCOMES:
+            method = getattr(result, method_name, None)
+            if method is not None:
+                setattr(result, method_name, self._wrap_outcome(method, outcome))
+        start_test, stop_test = result.startTest, result.stopTest
+
+        def startTest(test):
+            self._started[test.id()] = time.time()
+            return start_test(test)
+
+        def stopTest(test):
+            test_id = test.id()
+            if test_id in self._started:
+                self.results.append((test_id, self._outcomes.get(test_id, 'passed'),
+                                     time.time() - self._started.pop(test_id)))
+            return stop_test(test)
+        result.startTest, result.stopTest = startTest, stopTest
+
+    def _wrap_outcome(self, method, outcome):
+        def record(test, *args, **kwargs):
+            self._outcomes[test.id()] = outcome
+            return method(test, *args, **kwargs)
+        return record
+
+    def save(self):
+        results_file = os.environ.get(RESULTS_ENV_VAR)
+        if not results_file:
+            return
+        f = open(results_file, 'w')
+        try:
+            json.dump(self.results, f)
+        finally:
+            f.close()
+
+
+class RecordingSuite(object):
+    """Wraps a test suite so that the results of its tests are recorded"""
+
+    def __init__(self, suite):
+        self.suite = suite
+
+    def __iter__(self):
+        return iter(self.suite)
+
+    def countTestCases(self):
+        return self.suite.countTestCases()
+
+    def __call__(self, result):
+        return self.run(result)
+
+    def run(self, result):
+        recorder = ResultRecorder()
+        recorder.watch(result)
+        try:
+            return self.suite.run(result)
+        finally:
+            recorder.save()
+
+
+def configure_shard_settings(settings, test_names):
+    """Called from the generated settings module with its globals() and a
+    dict of database alias to the test database name for this shard"""
+    import django
+    from django.conf import global_settings
+    settings['DYE_ORIGINAL_TEST_RUNNER'] = settings.get(
+        'TEST_RUNNER', global_settings.TEST_RUNNER)
+    settings['TEST_RUNNER'] = 'dye.shard_runner.ShardedTestRunner'
+    databases = settings.get('DATABASES')
+    if databases is None:
+        # the old DATABASE_NAME = 'x' style of settings
+        if 'default' in test_names:
+            settings['TEST_DATABASE_NAME'] = test_names['default']
+        return
+    for alias, test_name in test_names.items():
+        if django.VERSION >= (1, 7):
+            databases[alias].setdefault('TEST', {})['NAME'] = test_name
+        else:
+            databases[alias]['TEST_NAME'] = test_name
+
+
+def _flatten_suite(suite):
+    tests = []
+    for test in suite:
+        if hasattr(test, '__iter__'):
+            tests.extend(_flatten_suite(test))
+        else:
+            tests.append(test)
+    return tests
+
+
+def _test_case_key(test):
+    return '%s.%s' % (test.__class__.__module__, test.__class__.__name__)
+
+
+def _get_bin(test, reorder_by):
+    # Django runs the tests in bins by type, eg TestCase before
+    # TransactionTestCase, as the latter don't leave the database clean
+    for i, test_type in enumerate(reorder_by):
+        if isinstance(test, test_type):
+            return i
+    return len(reorder_by)
+
+
+def shard_suite(suite, index, count, reorder_by=()):
+    """Returns a suite of the same type with only the tests for this shard,
+    with the classes that failed last time first"""
+    durations, failed = get_history()
+    tests = _flatten_suite(suite)
+    keys = [_test_case_key(test) for test in tests]
+    weights = get_weights([test.id() for test in tests], durations)
+    assignment = assign_shards(keys, count, weights)
+    failed_keys = set(key for key, test in zip(keys, tests) if test.id() in failed)
+    bins = [_get_bin(test, reorder_by) for test in tests]
+    order = failed_first(keys, failed_keys, bins)
+    return suite.__class__([tests[i] for i in order
+                            if assignment[keys[i]] == index])
+
+
+class ShardedTestRunner(object):
+    """Used as TEST_RUNNER by the generated settings.  Creating one gives the
+    project's own test runner, but with build_suite() cut down to this shard
+    and the results of the tests recorded.  It is a class rather than a
+    function, as Django before 1.4 takes a function to be an old style
+    runner that returns the number of failures."""
+
+    def __new__(cls, *args, **kwargs):
+        from django.conf import settings
+        from django.test import TestCase
+        from django.test.utils import get_runner
+        original_runner = get_runner(settings, settings.DYE_ORIGINAL_TEST_RUNNER)
+
+        class Runner(original_runner):
+            def build_suite(self, *args, **kwargs):
+                suite = original_runner.build_suite(self, *args, **kwargs)
+                index, count = get_shard() or (0, 1)
+                reorder_by = getattr(self, 'reorder_by', (TestCase,))
+                return RecordingSuite(shard_suite(suite, index, count, reorder_by))
+
+        return Runner(*args, **kwargs)
+
+
+def _pytest_item_key(item):
+    # the file, and the class if there is one
+    key = item.nodeid.split('::')[0]
+    if getattr(item, 'cls', None) is not None:
+        key = '%s::%s' % (key, item.cls.__name__)
+    return key
+
+
+def pytest_collection_modifyitems(session, config, items):
+    """pytest hook to deselect the tests for the other shards, and put the
+    tests that failed last time first"""
+    index, count = get_shard() or (0, 1)
+    durations, failed = get_history()
+    keys = [_pytest_item_key(item) for item in items]
+    weights = get_weights([item.nodeid for item in items], durations)
+    assignment = assign_shards(keys, count, weights)
+    failed_keys = set(key for key, item in zip(keys, items) if item.nodeid in failed)
+    selected = []
+    deselected = []
+    for i in failed_first(keys, failed_keys):
+        if assignment[keys[i]] == index:
+            selected.append(items[i])
+        else:
+            deselected.append(items[i])
+    items[:] = selected
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+
+
+_pytest_recorder = ResultRecorder()
+# setup, call and teardown each have a report
+_pytest_durations = {}
+_pytest_outcomes = {}
+
+
+def pytest_runtest_logreport(report):
+    """pytest hook to record the result and duration of each test"""
+    test_id = report.nodeid
+    _pytest_durations[test_id] = _pytest_durations.get(test_id, 0) + report.duration
+    if report.failed:
+        _pytest_outcomes[test_id] = 'failed' if report.when == 'call' else 'error'
+    elif report.skipped:
+        _pytest_outcomes.setdefault(test_id, 'skipped')
+    if report.when == 'teardown':
+        _pytest_recorder.results.append(
+            (test_id, _pytest_outcomes.pop(test_id, 'passed'),
+             _pytest_durations.pop(test_id)))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    _pytest_recorder.save()
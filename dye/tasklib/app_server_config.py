@@ -0,0 +1,227 @@
+"""Render the configuration of a gunicorn or uWSGI app server behind nginx,
+and the systemd units that run it.
+
+Set app_server ('gunicorn' or 'uwsgi') in project_settings.py along with
+webserver = 'nginx' and a webserver_conf_template.  The processes, threads
+and the rest come from the same values as the nginx conf (see
+webserver_config.py), so webserver_conf_settings tunes both.  The nginx
+template can use
+
+* app_socket - the unix socket the app server listens on
+* app_upstream - a name for the upstream block with app_socket in it
+* app_pass - the directives to pass a request on to app_upstream, for a
+  location block
+* request_timeout - how long a request can take, default 60 seconds
+
+The socket belongs to a systemd socket unit rather than the app server, so
+it keeps accepting connections - queued, up to listen_backlog - while the
+app server restarts.  That makes a restart on to a new release safe, which
+gunicorn needs as the virtualenv is in the release directory.  uWSGI
+re-executes itself on a HUP, so it just gets a graceful reload.
+"""
+import os
+from os import path
+
+APP_SERVERS = ('gunicorn', 'uwsgi')
+# nginx's user on Debian - on Red Hat it is nginx
+DEFAULT_USER = 'www-data'
+SOCKET_DIR = '/run'
+# seconds a request can take before the worker is killed
+DEFAULT_REQUEST_TIMEOUT = 60
+# the systemctl command to have the app server pick up a new release
+RELOAD_COMMANDS = {
+    'gunicorn': 'restart',
+    'uwsgi': 'reload-or-restart',
+}
+
+CONFIG_HEADER = """\
+# Generated by dye's generate_webserver_conf for %(host)s, which has
+# %(cpu_count)s CPUs and %(memory_mb)s MB of memory.  It is written again on
+# every deploy, so change project_settings.py rather than this file.
+"""
+
+GUNICORN_CONF = CONFIG_HEADER + """
+# the socket comes from the systemd socket unit when there is one
+bind = 'unix:%(app_socket)s'
+backlog = %(listen_backlog)d
+chdir = '%(wsgi_dir)s'
+workers = %(processes)d
+threads = %(threads)d
+worker_class = '%(worker_class)s'
+max_requests = %(maximum_requests)d
+max_requests_jitter = %(maximum_requests_jitter)d
+timeout = %(request_timeout)d
+graceful_timeout = %(graceful_timeout)d
+keepalive = 5
+"""
+
+UWSGI_INI = CONFIG_HEADER + """
+[uwsgi]
+master = true
+# uWSGI takes this socket over from the systemd socket unit
+socket = %(app_socket)s
+listen = %(listen_backlog)d
+chdir = %(wsgi_dir)s
+wsgi-file = %(wsgi_dir)s/wsgi_handler.py
+home = %(ve_dir)s
+need-app = true
+processes = %(processes)d
+threads = %(threads)d
+enable-threads = true
+max-requests = %(maximum_requests)d
+harakiri = %(request_timeout)d
+reload-mercy = %(graceful_timeout)d
+worker-reload-mercy = %(graceful_timeout)d
+"""
+
+SOCKET_UNIT = CONFIG_HEADER + """
+[Unit]
+Description=%(app_server)s socket for %(project_name)s (%(environment)s)
+
+[Socket]
+ListenStream=%(app_socket)s
+SocketUser=%(user)s
+SocketGroup=%(socket_group)s
+SocketMode=0660
+Backlog=%(listen_backlog)d
+
+[Install]
+WantedBy=sockets.target
+"""
+
+SERVICE_UNIT = CONFIG_HEADER + """
+[Unit]
+Description=%(app_server)s for %(project_name)s (%(environment)s)
+Requires=%(unit)s.socket
+After=network.target
+
+[Service]
+User=%(user)s
+Group=%(group)s
+WorkingDirectory=%(wsgi_dir)s
+ExecStart=%(exec_start)s
+ExecReload=/bin/kill -s HUP $MAINPID
+%(service_options)s
+TimeoutStopSec=%(stop_timeout)d
+PrivateTmp=true
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+SERVICE_OPTIONS = {
+    # TERM is gunicorn's graceful shutdown
+    'gunicorn': 'Type=simple\nKillMode=mixed',
+    # as the uWSGI docs suggest, as TERM makes it reload
+    'uwsgi': 'Type=notify\nNotifyAccess=all\nKillSignal=SIGQUIT',
+}
+
+APP_PASS = {
+    'gunicorn': [
+        'proxy_pass http://%(upstream)s;',
+        'proxy_set_header Host $http_host;',
+        'proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;',
+        'proxy_set_header X-Forwarded-Proto $scheme;',
+        'proxy_redirect off;',
+        'proxy_read_timeout %(request_timeout)ds;',
+    ],
+    'uwsgi': [
+        'include uwsgi_params;',
+        'uwsgi_pass %(upstream)s;',
+        'uwsgi_read_timeout %(request_timeout)ds;',
+    ],
+}
+
+
+def check_app_server(app_server):
+    if app_server not in APP_SERVERS:
+        raise ValueError('app_server must be one of %s, not %s' %
+                         (', '.join(APP_SERVERS), app_server))
+
+
+def get_unit_name(project_name, app_server):
+    """The name of the systemd socket and service units - fablib uses this
+    too, to install them"""
+    return '%s-%s' % (project_name, app_server)
+
+
+def get_conf_name(app_server):
+    return 'gunicorn.conf.py' if app_server == 'gunicorn' else 'uwsgi.ini'
+
+
+def get_app_socket(project_name, app_server):
+    return path.join(SOCKET_DIR, get_unit_name(project_name, app_server) + '.sock')
+
+
+def get_app_pass(app_server, upstream, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+    """The nginx directives that pass a request on to the app server, one
+    per line, indented to go in a location block"""
+    check_app_server(app_server)
+    lines = [line % {'upstream': upstream, 'request_timeout': request_timeout}
+             for line in APP_PASS[app_server]]
+    return '\n        '.join(lines)
+
+
+def add_template_values(values, app_server):
+    """Add the values for the nginx template to values (the tuning and
+    webserver_conf_settings, which can set these too)"""
+    check_app_server(app_server)
+    values['app_server'] = app_server
+    values.setdefault('app_socket', get_app_socket(values['project_name'], app_server))
+    values.setdefault('app_upstream', values['project_name'] + '_app')
+    values.setdefault('request_timeout', DEFAULT_REQUEST_TIMEOUT)
+    values.setdefault('app_pass', get_app_pass(
+        app_server, values['app_upstream'], values['request_timeout']))
+    return values
+
+
+def render_configs(app_server, values, facts, conf_dir, ve_dir,
+                   user=DEFAULT_USER, group=None, socket_group=None):
+    """Returns {file name: contents} for the app server configuration and
+    its systemd units.  values are those for the nginx template, after
+    add_template_values(), and conf_dir is where the files will be on the
+    server."""
+    check_app_server(app_server)
+    unit = get_unit_name(values['project_name'], app_server)
+    conf_file = path.join(conf_dir, get_conf_name(app_server))
+    config_values = dict(values)
+    config_values.update({
+        'host': facts['host'],
+        'cpu_count': facts['cpu_count'],
+        'memory_mb': facts['memory_mb'] or 'unknown',
+        'app_server': app_server,
+        'unit': unit,
+        've_dir': ve_dir,
+        'user': user,
+        'group': group or user,
+        'socket_group': socket_group or group or user,
+        'worker_class': 'gthread' if values['threads'] > 1 else 'sync',
+        'maximum_requests_jitter': values['maximum_requests'] // 10,
+        'service_options': SERVICE_OPTIONS[app_server],
+        'stop_timeout': values['graceful_timeout'] + 5,
+    })
+    if app_server == 'gunicorn':
+        config_values['exec_start'] = '%s --config %s wsgi_handler:application' % (
+            path.join(ve_dir, 'bin', 'gunicorn'), conf_file)
+        conf = GUNICORN_CONF % config_values
+    else:
+        config_values['exec_start'] = '%s --ini %s' % (
+            path.join(ve_dir, 'bin', 'uwsgi'), conf_file)
+        conf = UWSGI_INI % config_values
+    return {
+        get_conf_name(app_server): conf,
+        unit + '.socket': SOCKET_UNIT % config_values,
+        unit + '.service': SERVICE_UNIT % config_values,
+    }
+
+
+def write_configs(output_dir, configs):
+    """Write each of configs, as from render_configs(), to output_dir"""
+    if not path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for name, contents in configs.items():
+        f = open(path.join(output_dir, name), 'w')
+        try:
+            f.write(contents)
+        finally:
+            f.close()
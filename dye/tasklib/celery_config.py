@@ -0,0 +1,243 @@
+"""Generate the celeryd and celerybeat configurations for the init scripts
+from the celery_queues in project_settings.py and the machine they will run
+on, rather than hard coding the nodes and concurrency.
+
+celery_queues maps each queue to its options, eg
+
+    celery_queues = {
+        'celery': {'nodes': 2},
+        'email': {'concurrency': 2, 'max_tasks_per_child': 50},
+    }
+
+Each queue gets its own nodes, called <queue>1, <queue>2 ...  A queue without
+a concurrency gets a share (by its weight) of the worker processes the
+machine can run - one per CPU, fewer if celery_worker_memory_mb for each of
+them would use more than celery_memory_fraction of the memory - divided
+between its nodes.
+
+Celery only takes the prefetch multiplier for all the nodes at once, so the
+smallest one asked for is used.
+"""
+import os
+from os import path
+
+DEFAULT_QUEUES = {'celery': {}}
+QUEUE_DEFAULTS = {
+    'nodes': 1,
+    # None to work it out from the machine
+    'concurrency': None,
+    # the share of the machine, for working out the concurrency
+    'weight': 1,
+    'prefetch_multiplier': 1,
+    'max_tasks_per_child': 100,
+    'time_limit': 600,
+}
+DEFAULT_WORKER_MEMORY_MB = 150
+DEFAULT_MEMORY_FRACTION = 0.5
+DEFAULT_BEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
+DEFAULT_USER = 'apache'
+
+CONFIG_HEADER = """\
+# Generated by dye's generate_celery_config from project_settings.py for
+# %(host)s, which has %(cpu_count)s CPUs and %(memory_mb)s MB of memory.
+# It is written again on every deploy, so change project_settings.py rather
+# than this file.
+"""
+
+CELERYD_CONFIG = CONFIG_HEADER + """
+# Names of nodes to start
+%(queue_comments)s
+CELERYD_NODES="%(nodes)s"
+
+# Where to chdir at start.
+CELERYD_CHDIR="%(chdir)s"
+
+# Python interpreter from environment.
+ENV_PYTHON="%(python)s"
+
+# How to call "manage.py celeryd_multi"
+CELERYD_MULTI="$ENV_PYTHON $CELERYD_CHDIR/manage.py celeryd_multi"
+
+# How to call "manage.py celeryctl"
+CELERYCTL="$ENV_PYTHON $CELERYD_CHDIR/manage.py celeryctl"
+
+# Extra arguments to celeryd
+CELERYD_OPTS="%(options)s"
+
+# Name of the celery config module.
+CELERY_CONFIG_MODULE="celeryconfig"
+
+# Workers should run as an unprivileged user.
+CELERYD_USER="%(user)s"
+CELERYD_GROUP="%(group)s"
+
+# Name of the projects settings module.
+export DJANGO_SETTINGS_MODULE="settings"
+"""
+
+CELERYBEAT_CONFIG = CONFIG_HEADER + """
+# Where the Django project is.
+CELERYBEAT_CHDIR="%(chdir)s"
+
+# Name of the projects settings module.
+export DJANGO_SETTINGS_MODULE="settings"
+
+# Path to celerybeat
+CELERYBEAT="%(python)s %(chdir)s/manage.py celerybeat -S %(scheduler)s"
+
+# Details for user running Celery
+CELERYBEAT_USER="%(user)s"
+CELERYBEAT_GROUP="%(group)s"
+"""
+
+
+def get_queue_options(celery_queues):
+    """A list of (queue, options) with the defaults filled in, sorted by
+    queue name"""
+    queues = []
+    for queue in sorted(celery_queues):
+        options = dict(QUEUE_DEFAULTS)
+        options.update(celery_queues[queue] or {})
+        if options['nodes'] < 1:
+            raise ValueError('celery queue %s must have at least one node' % queue)
+        queues.append((queue, options))
+    return queues
+
+
+def get_worker_processes(facts, worker_memory_mb=DEFAULT_WORKER_MEMORY_MB,
+                         memory_fraction=DEFAULT_MEMORY_FRACTION):
+    """How many worker processes the machine can run - one per CPU, unless
+    that would use too much memory"""
+    processes = facts['cpu_count']
+    if facts['memory_mb'] and worker_memory_mb:
+        processes = min(processes,
+                        int(facts['memory_mb'] * memory_fraction // worker_memory_mb))
+    return max(processes, 1)
+
+
+def get_concurrency(queues, worker_processes):
+    """The concurrency of each node of each queue, as {queue: concurrency}.
+    The queues without one share out worker_processes by weight."""
+    auto_queues = [(queue, options) for queue, options in queues
+                   if not options['concurrency']]
+    total_weight = sum(options['weight'] for queue, options in auto_queues)
+    concurrency = {}
+    for queue, options in queues:
+        if options['concurrency']:
+            concurrency[queue] = options['concurrency']
+        else:
+            share = worker_processes * options['weight'] / float(total_weight)
+            concurrency[queue] = max(int(share // options['nodes']), 1)
+    return concurrency
+
+
+def get_nodes(queue, options):
+    return ['%s%d' % (queue, number) for number in range(1, options['nodes'] + 1)]
+
+
+def get_celeryd_options(queues, concurrency):
+    """The celeryd_multi options, set for each node with -<option>:<node>"""
+    options = []
+    prefetch_multipliers = []
+    for queue, queue_options in queues:
+        node_list = ','.join(get_nodes(queue, queue_options))
+        options += [
+            '-Q:%s %s' % (node_list, queue),
+            '-c:%s %d' % (node_list, concurrency[queue]),
+            '--maxtasksperchild:%s=%d' % (node_list, queue_options['max_tasks_per_child']),
+            '--time-limit:%s=%d' % (node_list, queue_options['time_limit']),
+        ]
+        prefetch_multipliers.append(queue_options['prefetch_multiplier'])
+    # passed through to every node as a setting
+    options.append('-- celeryd.prefetch_multiplier=%d' % min(prefetch_multipliers))
+    return ' '.join(options)
+
+
+def _get_spec_nodes(spec, nodes):
+    """The nodes a celeryd_multi -Q:<spec> option is for - node names, or
+    numbers or ranges (counting from 1), separated by commas"""
+    spec_nodes = []
+    for part in spec.split(','):
+        if part in nodes:
+            spec_nodes.append(part)
+        elif '-' in part and part.replace('-', '').isdigit():
+            start, end = part.split('-', 1)
+            spec_nodes += nodes[int(start) - 1:int(end)]
+        elif part.isdigit() and 0 < int(part) <= len(nodes):
+            spec_nodes.append(nodes[int(part) - 1])
+    return spec_nodes
+
+
+def get_node_queues(options, nodes):
+    """Which queues each node takes tasks from, as {node: [queue, ...]},
+    from the -Q and -Q:<nodes> options in CELERYD_OPTS.  Without either a
+    node takes from the default queue, celery."""
+    default_queues = ['celery']
+    node_queues = {}
+    args = options.split()
+    for i, arg in enumerate(args[:-1]):
+        if arg in ('-Q', '--queues'):
+            default_queues = args[i + 1].split(',')
+        elif arg.startswith('-Q:'):
+            for node in _get_spec_nodes(arg[len('-Q:'):], nodes):
+                node_queues[node] = args[i + 1].split(',')
+    return dict((node, node_queues.get(node, default_queues)) for node in nodes)
+
+
+def get_queue_stalls(node_queues, down_times):
+    """How long each queue had none of its nodes up, as {queue: seconds},
+    from get_node_queues() and the (stopped, up again) times of each node"""
+    queue_nodes = {}
+    for node, queues in node_queues.items():
+        for queue in queues:
+            queue_nodes.setdefault(queue, []).append(node)
+    stalls = {}
+    for queue, nodes in queue_nodes.items():
+        # each node is down once, so the queue is stalled while they all are
+        stalled_from = max(down_times[node][0] for node in nodes)
+        stalled_until = min(down_times[node][1] for node in nodes)
+        stalls[queue] = max(stalled_until - stalled_from, 0.0)
+    return stalls
+
+
+def render_configs(celery_queues, facts, chdir, python, user=DEFAULT_USER,
+                   group=None, worker_memory_mb=DEFAULT_WORKER_MEMORY_MB,
+                   memory_fraction=DEFAULT_MEMORY_FRACTION,
+                   beat_scheduler=DEFAULT_BEAT_SCHEDULER):
+    """Returns the contents of the celeryd and celerybeat configurations"""
+    queues = get_queue_options(celery_queues)
+    worker_processes = get_worker_processes(facts, worker_memory_mb, memory_fraction)
+    concurrency = get_concurrency(queues, worker_processes)
+    nodes = []
+    queue_comments = []
+    for queue, options in queues:
+        nodes += get_nodes(queue, options)
+        queue_comments.append('# %s: %d nodes of %d processes' % (
+            queue, options['nodes'], concurrency[queue]))
+    values = {
+        'host': facts['host'],
+        'cpu_count': facts['cpu_count'],
+        'memory_mb': facts['memory_mb'] or 'unknown',
+        'queue_comments': '\n'.join(queue_comments),
+        'nodes': ' '.join(nodes),
+        'chdir': chdir,
+        'python': python,
+        'options': get_celeryd_options(queues, concurrency),
+        'user': user,
+        'group': group or user,
+        'scheduler': beat_scheduler,
+    }
+    return CELERYD_CONFIG % values, CELERYBEAT_CONFIG % values
+
+
+def write_configs(output_dir, celeryd_config, celerybeat_config):
+    """Write the configurations as celeryd and celerybeat in output_dir"""
+    if not path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for name, contents in (('celeryd', celeryd_config),
+                           ('celerybeat', celerybeat_config)):
+        f = open(path.join(output_dir, name), 'w')
+        try:
+            f.write(contents)
+        finally:
+            f.close()
@@ -1,7 +1,9 @@
 import os
 from os import path
-import sqlite3
-import MySQLdb
+import glob
+import shutil
+import re
+import threading
 
 from .exceptions import (InvalidArgumentError, InvalidProjectError,
                          InvalidPasswordError)
@@ -12,6 +14,26 @@ from .util import (_check_call_wrapper, _capture_command,
 # this is a global dictionary
 from .environment import env
 
+# The database libraries are only imported when a manager that needs them is
+# created, so tasks.py --help and tasks that don't touch the database don't
+# pay for them, and a SQLite project doesn't need MySQLdb installed at all.
+sqlite3 = None
+MySQLdb = None
+CLIENT = None
+
+
+def _import_sqlite3():
+    global sqlite3
+    if sqlite3 is None:
+        import sqlite3
+
+
+def _import_mysqldb():
+    global MySQLdb, CLIENT
+    if MySQLdb is None:
+        import MySQLdb
+        from MySQLdb.constants import CLIENT
+
 
 # the methods in this class are those used externally
 class DBManager(object):
@@ -26,6 +48,25 @@ class DBManager(object):
     def test_db_table_exists(self, table):
         raise NotImplementedError()
 
+    def get_identifier(self):
+        raise NotImplementedError()
+
+    # the value for the test database NAME in the Django settings
+    def get_test_settings_name(self):
+        raise NotImplementedError()
+
+    def get_migration_state(self):
+        """Returns the set of table names, and a dictionary of app label to
+        the set of applied South migrations (or None if there is no
+        south_migrationhistory table)"""
+        raise NotImplementedError()
+
+    def _group_migrations(self, history_rows):
+        applied_migrations = {}
+        for app_name, migration in history_rows:
+            applied_migrations.setdefault(app_name, set()).add(migration)
+        return applied_migrations
+
     # this is used directly for the test database
     def grant_all_privileges_for_database(self):
         raise NotImplementedError()
@@ -44,6 +85,17 @@ class DBManager(object):
     def setup_db_dumps(self, dump_dir):
         raise NotImplementedError()
 
+    # these three are used to keep a copy of a freshly migrated database so
+    # that test runs can restore it rather than running syncdb and migrate
+    def snapshot_exists(self, snapshot_name):
+        raise NotImplementedError()
+
+    def create_snapshot(self, snapshot_name):
+        raise NotImplementedError()
+
+    def restore_snapshot(self, snapshot_name):
+        raise NotImplementedError()
+
     def create_dbdump_cron_file(self, cron_file, dump_file_stub):
         # write something like:
         # #!/bin/sh
@@ -92,17 +144,33 @@ class SqliteManager(DBManager):
 
     ENGINE = 'Sqlite'
 
-    def __init__(self, name, root_dir):
+    def __init__(self, name, root_dir, test_name=None):
+        _import_sqlite3()
         if path.isabs(name):
             self.file_path = name
         else:
             self.file_path = path.abspath(path.join(root_dir, name))
-
-    def get_test_database(self):
-        test_db_filename = path.join(path.dirname(self.file_path),
-            'test_%s' % path.basename(self.file_path))
+        if test_name and not path.isabs(test_name):
+            test_name = path.abspath(path.join(root_dir, test_name))
+        self.test_name = test_name
+
+    def get_test_database(self, shard=None):
+        """The test database is the test NAME from the settings, or
+        test_<name> next to the database, with _<shard> added for the one
+        used by a test shard when running tests in parallel"""
+        if self.test_name:
+            test_db_filename = self.test_name
+        else:
+            test_db_filename = path.join(path.dirname(self.file_path),
+                'test_' + path.basename(self.file_path))
+        if shard is not None:
+            base, ext = path.splitext(test_db_filename)
+            test_db_filename = '%s_%s%s' % (base, shard, ext)
         return SqliteManager(name=test_db_filename, root_dir=None)
 
+    def get_test_settings_name(self):
+        return self.file_path
+
     def drop_db(self):
         if path.exists(self.file_path):
             os.remove(self.file_path)
@@ -130,6 +198,24 @@ class SqliteManager(DBManager):
         finally:
             conn.close()
 
+    def get_identifier(self):
+        return 'sqlite:%s' % self.file_path
+
+    def get_migration_state(self):
+        conn = sqlite3.connect(self.file_path)
+        try:
+            result = conn.execute(
+                "select name from sqlite_master where type = 'table'")
+            tables = set(row[0] for row in result.fetchall())
+            applied_migrations = None
+            if 'south_migrationhistory' in tables:
+                result = conn.execute(
+                    "select app_name, migration from south_migrationhistory")
+                applied_migrations = self._group_migrations(result.fetchall())
+            return tables, applied_migrations
+        finally:
+            conn.close()
+
     # There is no security on SQLite databases
     def test_grants(self):
         return True
@@ -150,6 +236,104 @@ class SqliteManager(DBManager):
             _call_command(dump_cmd, stdout=dump_file, shell=True)
         dump_file.close()
 
+    def get_snapshot_path(self, snapshot_name):
+        return path.join(path.dirname(self.file_path), '.%s.snapshot-%s' %
+                         (path.basename(self.file_path), snapshot_name))
+
+    def snapshot_exists(self, snapshot_name):
+        return path.isfile(self.get_snapshot_path(snapshot_name))
+
+    def create_snapshot(self, snapshot_name):
+        """Save a copy of the database file, replacing any older snapshots"""
+        snapshot_path = self.get_snapshot_path(snapshot_name)
+        for old_snapshot in glob.glob(self.get_snapshot_path('*')):
+            os.remove(old_snapshot)
+        # copy then rename, so an interrupted copy is never used
+        shutil.copy2(self.file_path, snapshot_path + '.tmp')
+        os.rename(snapshot_path + '.tmp', snapshot_path)
+
+    def restore_snapshot(self, snapshot_name):
+        snapshot_path = self.get_snapshot_path(snapshot_name)
+        shutil.copy2(snapshot_path, self.file_path + '.tmp')
+        os.rename(self.file_path + '.tmp', self.file_path)
+
+
+class ConnectionPool(threading.local):
+    """MySQL connections shared by all the MySQLManager instances in a run,
+    keyed by (host, port, user).  MySQLdb connections can't be shared between
+    threads, so each thread has its own pool.  The main and test databases normally use
+    the same user, and every database on a server uses the same root user,
+    so this saves a connection (several round trips over a VPN) each time.
+
+    The connections allow multiple statements, so a batch of statements can
+    be sent in one round trip.  Each entry also caches the databases the
+    user can see and has been granted all privileges on - see
+    MySQLManager.get_user_state()
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def get_connection(self, db_manager, user, password):
+        """Return a pooled connection, connecting if we don't have one for
+        this user and password.  Raises MySQLdb.OperationalError if the
+        connection fails."""
+        key = (db_manager.host, db_manager.port, user)
+        entry = self.entries.get(key)
+        if entry is not None and entry['password'] == password:
+            return entry['conn']
+        conn = db_manager.create_db_connection(
+            user=user, passwd=password, client_flag=CLIENT.MULTI_STATEMENTS)
+        # we don't want a long lived connection to see an old snapshot of
+        # tables that manage.py changes in another process
+        conn.autocommit(True)
+        self.close(key)
+        self.entries[key] = {
+            'conn': conn, 'password': password, 'db': None, 'state': None}
+        return conn
+
+    def get_entry(self, db_manager, user):
+        return self.entries[(db_manager.host, db_manager.port, user)]
+
+    def clear_state(self):
+        """Forget the cached user state - called whenever root changes
+        users, databases or privileges"""
+        for entry in self.entries.values():
+            entry['state'] = None
+
+    def close(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry['conn'].close()
+
+    def close_all(self):
+        for key in self.entries.keys():
+            self.close(key)
+
+
+_connection_pool = ConnectionPool()
+
+# root passwords that work, keyed by (host, port), so that the databases
+# on one server only need to look for the root password once
+_root_passwords = {}
+_root_password_lock = threading.Lock()
+
+
+def close_db_connections():
+    """Close the pooled connections of the current thread"""
+    _connection_pool.close_all()
+
+
+def _execute_batch(cursor, sql_cmd_list):
+    """Send all the statements in one round trip, and return a list with the
+    rows returned by each statement"""
+    cursor.execute(';\n'.join(sql_cmd_list))
+    results = [cursor.fetchall()]
+    # this also raises the error for any statement after the first
+    while cursor.nextset():
+        results.append(cursor.fetchall())
+    return results
+
 
 class MySQLManager(DBManager):
 
@@ -158,7 +342,8 @@ class MySQLManager(DBManager):
     root_pw_file_needs_sudo = True
 
     def __init__(self, name, user, password, port=None, host=None,
-                 root_password=None, grant_enabled=True):
+                 root_password=None, grant_enabled=True, test_name=None):
+        _import_mysqldb()
         self.name = name
         self.user = user
         self.password = password
@@ -169,13 +354,16 @@ class MySQLManager(DBManager):
             self.host = host
         self.root_password = root_password
         self.grant_enabled = grant_enabled
-        # connections to the database for the normal user and the root
-        # user
-        self.user_db_conn = None
-        self.root_db_conn = None
-
-    def get_test_database(self):
-        return MySQLManager(name='test_%s' % self.name, user=self.user,
+        self.test_name = test_name
+
+    def get_test_database(self, shard=None):
+        """The test database is the test NAME from the settings, or
+        test_<name>, with _<shard> added for the one used by a test shard
+        when running tests in parallel"""
+        test_name = self.test_name or 'test_%s' % self.name
+        if shard is not None:
+            test_name = '%s_%s' % (test_name, shard)
+        return MySQLManager(name=test_name, user=self.user,
             password=self.password, port=self.port, host=self.host,
             root_password=self.root_password, grant_enabled=self.grant_enabled)
 
@@ -184,64 +372,91 @@ class MySQLManager(DBManager):
         # first try to read the root password from a file
         # otherwise ask the user
         if self.root_password is None:
-            root_pw = _get_file_contents(self.root_pw_file, sudo=self.root_pw_file_needs_sudo)
-            # maybe it is wrong (on developer machine) - check it
-            if root_pw is not None and not self.test_root_password(root_pw):
-                if env['verbose']:
-                    print "mysql root password in %s doesn't work" % self.root_pw_file
-                root_pw = None
-
-            # still haven't got it, ask the user
-            if root_pw is None:
-                if not env['noinput']:
-                    root_pw = _ask_for_password("Please enter the MySQL root password:",
-                                                test_fn=self.test_root_password)
-                else:
-                    raise InvalidPasswordError('Could not discover MySQL root password')
-
-            # now we have root password that works
-            self.root_password = root_pw
+            # only one thread should be asking the user at a time, and
+            # another database on this server may have found it already
+            _root_password_lock.acquire()
+            try:
+                server = (self.host, self.port)
+                if server not in _root_passwords:
+                    _root_passwords[server] = self._find_root_password()
+                self.root_password = _root_passwords[server]
+            finally:
+                _root_password_lock.release()
 
         return self.root_password
 
+    def _find_root_password(self):
+        root_pw = _get_file_contents(self.root_pw_file, sudo=self.root_pw_file_needs_sudo)
+        # maybe it is wrong (on developer machine) - check it
+        if root_pw is not None and not self.test_root_password(root_pw):
+            if env['verbose']:
+                print "mysql root password in %s doesn't work" % self.root_pw_file
+            root_pw = None
+
+        # still haven't got it, ask the user
+        if root_pw is None:
+            if not env['noinput']:
+                root_pw = _ask_for_password("Please enter the MySQL root password:",
+                                            test_fn=self.test_root_password)
+            else:
+                raise InvalidPasswordError('Could not discover MySQL root password')
+
+        # now we have root password that works
+        return root_pw
+
     def test_sql_user_password(self, user=None, password=None):
-        # try to connect
-        kwargs = {
-            'user': user if user else self.user,
-            'passwd': password if password else self.password,
-        }
+        # try to connect - a connection that works is kept in the pool, so
+        # it will be used for the queries that follow
         try:
-            db_conn = self.create_db_connection(**kwargs)
+            _connection_pool.get_connection(self, user if user else self.user,
+                                            password if password else self.password)
         except MySQLdb.OperationalError as e:
             if e.args[0] == 1045:  # access denied for user/password
                 return False
             else:
                 raise e
-        db_conn.close()
         return True
 
     def test_root_password(self, password):
         """Try a no-op with the root password"""
         return self.test_sql_user_password(user='root', password=password)
 
+    def get_user_state(self):
+        """Returns the set of databases the user can see and the set of
+        databases the user has been granted all privileges on.  This covers
+        the test database too, and is fetched in one round trip then cached
+        until root changes something.  Raises MySQLdb.OperationalError if the
+        user cannot connect."""
+        _connection_pool.get_connection(self, self.user, self.password)
+        entry = _connection_pool.get_entry(self, self.user)
+        if entry['state'] is None:
+            cursor = entry['conn'].cursor()
+            try:
+                schema_rows, grant_rows = _execute_batch(cursor, [
+                    "SELECT schema_name FROM information_schema.schemata",
+                    "SHOW GRANTS FOR CURRENT_USER",
+                ])
+            finally:
+                cursor.close()
+            visible_dbs = set(row[0] for row in schema_rows)
+            granted_dbs = set()
+            # look for GRANT ALL PRIVILEGES ON `dbname`.* TO 'user'@ ...
+            grant_re = re.compile(r"^grant all privileges on `(.+)`\.\* to ['`]%s['`]@" %
+                                  re.escape(self.user.lower()))
+            for row in grant_rows:
+                match = grant_re.match(row[0].lower())
+                if match:
+                    # mysql may escape the wildcard characters in the name
+                    granted_dbs.add(match.group(1).replace('\\_', '_'))
+            entry['state'] = (visible_dbs, granted_dbs)
+        return entry['state']
+
     def test_grants(self):
         try:
-            cursor = self.get_user_db_cursor()
-        except:
+            visible_dbs, granted_dbs = self.get_user_state()
+        except MySQLdb.OperationalError:
             return False
-        # do "SHOW GRANTS FOR CURRENT USER"
-        try:
-            cursor.execute("SHOW GRANTS FOR CURRENT_USER")
-            # check for GRANT ALL PRIVILEGES ON `dbname`.* TO `user ...
-            grant_list = [row[0] for row in cursor.fetchall()]
-            for grant in grant_list:
-                if grant.lower().startswith(
-                        "grant all privileges on `%s`.* to '%s'@" %
-                        (self.name, self.user)):
-                    return True
-        finally:
-            cursor.close()
-        return False
+        return self.name in granted_dbs
 
     def create_db_connection(self, **kwargs):
         if self.host:
@@ -251,33 +466,25 @@ class MySQLManager(DBManager):
         return MySQLdb.connect(**kwargs)
 
     def get_user_db_cursor(self, **cursor_kwargs):
-        if self.user_db_conn is None:
-            self.user_db_conn = self.create_db_connection(
-                user=self.user,
-                passwd=self.password,
-                db=self.name
-            )
-        return self.user_db_conn.cursor(**cursor_kwargs)
+        conn = _connection_pool.get_connection(self, self.user, self.password)
+        # the connection may be shared with the test database
+        entry = _connection_pool.get_entry(self, self.user)
+        if entry['db'] != self.name:
+            conn.select_db(self.name)
+            entry['db'] = self.name
+        return conn.cursor(**cursor_kwargs)
 
     def close_user_db_connection(self):
-        if self.user_db_conn is not None:
-            self.user_db_conn.close()
-            self.user_db_conn = None
+        _connection_pool.close((self.host, self.port, self.user))
 
     def get_root_db_cursor(self, **cursor_kwargs):
-        if self.root_db_conn is None:
-            self.root_db_conn = self.create_db_connection(
-                user='root',
-                passwd=self.get_root_password()
-            )
-        return self.root_db_conn.cursor(**cursor_kwargs)
+        conn = _connection_pool.get_connection(self, 'root', self.get_root_password())
+        return conn.cursor(**cursor_kwargs)
 
     def close_root_db_connection(self):
-        if self.root_db_conn is not None:
-            self.root_db_conn.close()
-            self.root_db_conn = None
+        _connection_pool.close((self.host, self.port, 'root'))
 
-    def create_cmdline_args(self):
+    def create_cmdline_args(self, db_name=None):
         cmdline_args = [
             '-u', self.user,
             '-p%s' % self.password,
@@ -286,14 +493,19 @@ class MySQLManager(DBManager):
             cmdline_args.append('--host=%s' % self.host)
         if self.port:
             cmdline_args.append('--port=%s' % self.port)
-        cmdline_args.append(self.name)
+        cmdline_args.append(db_name if db_name else self.name)
         return cmdline_args
 
     def sql_exec(self, sql_cmd, db_name=None, capture_output=False):
-        """execute a SQL statement using the mysql command line client.
+        """execute SQL using the mysql command line client.
         We do this rather than using the python libraries so this script can
         be run without the python libraries being installed.  (Also this was
-        orginally written for fabric, so the code was already proven there)."""
+        orginally written for fabric, so the code was already proven there).
+
+        sql_cmd can be a list of statements, which are all sent to one mysql
+        process."""
+        if not isinstance(sql_cmd, basestring):
+            sql_cmd = ';\n'.join(sql_cmd)
         cmdline_call = ['mysql'] + self.create_cmdline_args(db_name)
         cmdline_call += ['-e', sql_cmd]
 
@@ -303,13 +515,15 @@ class MySQLManager(DBManager):
             _check_call_wrapper(cmdline_call)
 
     def exec_as_root(self, *sql_cmd_list):
-        """ execute a SQL statement using MySQL as the root MySQL user"""
+        """ execute SQL statements using MySQL as the root MySQL user - they
+        are all sent in one round trip"""
         cursor = self.get_root_db_cursor()
         try:
-            for cmd in sql_cmd_list:
-                cursor.execute(cmd)
+            _execute_batch(cursor, sql_cmd_list)
         finally:
             cursor.close()
+            # root may have changed what the user can see
+            _connection_pool.clear_state()
 
     def test_sql_user_exists(self, user=None):
         # check user in mysql table
@@ -324,6 +538,12 @@ class MySQLManager(DBManager):
         return rows != 0
 
     def db_exists(self):
+        # if the user can see it, we don't need to ask root
+        try:
+            if self.name in self.get_user_state()[0]:
+                return True
+        except MySQLdb.OperationalError:
+            pass
         cursor = self.get_root_db_cursor()
         try:
             cursor.execute("SHOW DATABASES")
@@ -340,35 +560,69 @@ class MySQLManager(DBManager):
             cursor.close()
         return rows != 0
 
+    def get_identifier(self):
+        return 'mysql:%s:%s/%s' % (self.host, self.port, self.name)
+
+    def get_test_settings_name(self):
+        return self.name
+
+    def get_migration_state(self):
+        cursor = self.get_user_db_cursor()
+        try:
+            cursor.execute("SHOW TABLES")
+            tables = set(row[0] for row in cursor.fetchall())
+            applied_migrations = None
+            if 'south_migrationhistory' in tables:
+                cursor.execute(
+                    "SELECT app_name, migration FROM south_migrationhistory")
+                applied_migrations = self._group_migrations(cursor.fetchall())
+            return tables, applied_migrations
+        finally:
+            cursor.close()
+
+    def get_create_user_sql(self):
+        return "CREATE USER '%s'@'%s' IDENTIFIED BY '%s'" % \
+            (self.user, self.host, self.password)
+
+    def get_set_password_sql(self):
+        return "SET PASSWORD FOR '%s'@'%s' = PASSWORD('%s')" % \
+            (self.user, self.host, self.password)
+
+    def get_grant_sql(self):
+        return [
+            "GRANT ALL PRIVILEGES ON %s.* TO '%s'@'%s'" % (self.name, self.user, self.host),
+            "FLUSH PRIVILEGES",
+        ]
+
     def create_user_if_not_exists(self):
         if not self.grant_enabled:
             return
         if not self.test_sql_user_exists(self.user):
-            self.exec_as_root(
-                "CREATE USER '%s'@'%s' IDENTIFIED BY '%s'" %
-                (self.user, self.host, self.password))
+            self.exec_as_root(self.get_create_user_sql())
 
     def set_user_password(self):
         if not self.grant_enabled:
             return
-        self.exec_as_root(
-            "SET PASSWORD FOR '%s'@'%s' = PASSWORD('%s')" %
-            (self.user, self.host, self.password))
+        self.exec_as_root(self.get_set_password_sql())
+        # a pooled connection would hide a password that no longer works
+        self.close_user_db_connection()
 
     def grant_all_privileges_for_database(self):
         if not self.grant_enabled:
             return
-        self.exec_as_root(
-            "GRANT ALL PRIVILEGES ON %s.* TO '%s'@'%s'" % (self.name, self.user, self.host),
-            "FLUSH PRIVILEGES",
-        )
+        self.exec_as_root(*self.get_grant_sql())
 
     def create_db_if_not_exists(self):
         if not self.db_exists():
             try:
-                cursor = self.create_db_connection(user=self.user, passwd=self.password)
-                cursor.execute('CREATE DATABASE %s CHARACTER SET utf8' % self.name)
-            except:
+                cursor = _connection_pool.get_connection(
+                    self, self.user, self.password).cursor()
+                try:
+                    cursor.execute('CREATE DATABASE %s CHARACTER SET utf8' % self.name)
+                finally:
+                    cursor.close()
+                _connection_pool.clear_state()
+            except MySQLdb.Error:
                 self.exec_as_root('CREATE DATABASE %s CHARACTER SET utf8' % self.name)
 
     def ensure_user_and_db_exist(self):
@@ -377,22 +631,94 @@ class MySQLManager(DBManager):
         # they would like to do.
 
         try:
-            self.get_user_db_cursor()
-            # the user and database obviously exist already
-            if self.test_grants():
+            visible_dbs, granted_dbs = self.get_user_state()
+        except MySQLdb.OperationalError:
+            # the user doesn't exist or has the wrong password - send all
+            # the root statements in one go
+            if not self.grant_enabled:
+                self.create_db_if_not_exists()
                 return
-        except:
-            # this except block is only to skip the return if
-            # get_user_db_cursor fails
-            self.create_user_if_not_exists()
-            self.set_user_password()
-            self.create_db_if_not_exists()
-        # if we get here we've skipped the return and need to grant privileges
+            cursor = self.get_root_db_cursor()
+            try:
+                user_rows, db_rows = _execute_batch(cursor, [
+                    "SELECT 1 FROM mysql.user WHERE user = '%s'" % self.user,
+                    "SHOW DATABASES LIKE '%s'" % self.name.replace('_', '\\_'),
+                ])
+            finally:
+                cursor.close()
+            sql_cmd_list = []
+            if not user_rows:
+                sql_cmd_list.append(self.get_create_user_sql())
+            sql_cmd_list.append(self.get_set_password_sql())
+            if not db_rows:
+                sql_cmd_list.append('CREATE DATABASE %s CHARACTER SET utf8' % self.name)
+            self.exec_as_root(*(sql_cmd_list + self.get_grant_sql()))
+            self.close_user_db_connection()
+            return
+
+        # the user and database obviously exist already
+        if self.name in visible_dbs and self.name in granted_dbs:
+            return
+        self.create_db_if_not_exists()
         self.grant_all_privileges_for_database()
 
     def drop_db(self):
         self.exec_as_root('DROP DATABASE IF EXISTS %s' % self.name)
 
+    def get_snapshot_db_name(self, snapshot_name):
+        # mysql database names are limited to 64 characters
+        return '%s_snap_%s' % (self.name[:45], snapshot_name[:12])
+
+    def list_snapshot_dbs(self):
+        cursor = self.get_root_db_cursor()
+        try:
+            cursor.execute("SHOW DATABASES LIKE '%s\\_snap\\_%%'" %
+                           self.name[:45].replace('_', '\\_'))
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def snapshot_exists(self, snapshot_name):
+        return self.get_snapshot_db_name(snapshot_name) in self.list_snapshot_dbs()
+
+    def clone_db(self, source_db, target_db):
+        """Copy the schema and data of source_db into a new target_db.  We use
+        SHOW CREATE TABLE rather than CREATE TABLE ... LIKE so that the
+        foreign keys are copied too."""
+        cursor = self.get_root_db_cursor()
+        try:
+            cursor.execute('DROP DATABASE IF EXISTS %s' % target_db)
+            cursor.execute('CREATE DATABASE %s CHARACTER SET utf8' % target_db)
+            cursor.execute("SHOW FULL TABLES FROM %s WHERE Table_type = 'BASE TABLE'"
+                           % source_db)
+            tables = [row[0] for row in cursor.fetchall()]
+            cursor.execute('USE %s' % target_db)
+            cursor.execute('SET FOREIGN_KEY_CHECKS = 0')
+            try:
+                for table in tables:
+                    cursor.execute('SHOW CREATE TABLE %s.`%s`' % (source_db, table))
+                    cursor.execute(cursor.fetchone()[1])
+                    cursor.execute('INSERT INTO %s.`%s` SELECT * FROM %s.`%s`' %
+                                   (target_db, table, source_db, table))
+            finally:
+                cursor.execute('SET FOREIGN_KEY_CHECKS = 1')
+        finally:
+            cursor.close()
+
+    def create_snapshot(self, snapshot_name):
+        """Clone the database into a snapshot database, replacing any older
+        snapshots of this database"""
+        snapshot_db = self.get_snapshot_db_name(snapshot_name)
+        for old_snapshot_db in self.list_snapshot_dbs():
+            if old_snapshot_db != snapshot_db:
+                self.exec_as_root('DROP DATABASE %s' % old_snapshot_db)
+        self.clone_db(self.name, snapshot_db)
+
+    def restore_snapshot(self, snapshot_name):
+        # the user connection may have the old database selected
+        self.close_user_db_connection()
+        self.clone_db(self.get_snapshot_db_name(snapshot_name), self.name)
+
     def dump_db(self, dump_filename='db_dump.sql', for_rsync=False):
         """Dump the database in the current working directory"""
         dump_cmd = ['mysqldump'] + self.create_cmdline_args()
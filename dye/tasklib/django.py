@@ -1,28 +1,92 @@
 import os
 from os import path
 import sys
+import glob
+import imp
 import random
+import re
+import shutil
+import signal
 import subprocess
-
+import tempfile
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from . import scheduler
+from . import test_times
+from . import mysqld
+from . import lint
 from .exceptions import TasksError
-from .database import get_db_manager
+from .database import get_db_manager, close_db_connections
+from .introspection import (get_settings, get_database_settings, get_django_version,
+                            get_model_tables)
 from .exceptions import InvalidProjectError, ShellCommandError
-from .util import _check_call_wrapper, _create_dir_if_not_exists, _linux_type
+from .util import (_check_call_wrapper, _call_wrapper, _create_dir_if_not_exists,
+                   _linux_type, _get_file_contents, _record_command)
 # global dictionary for state
 from .environment import env
 
 
-def _manage_py(args, cwd=None):
-    # for manage.py, always use the system python
-    # otherwise the update_ve will fail badly, as it deletes
-    # the virtualenv part way through the process ...
-    manage_cmd = [env['python_bin'], env['manage_py']]
+# the output of each manage.py command is written to a log in this directory
+# in django_dir, unless manage_py_log_dir is set in project_settings.py
+MANAGE_PY_LOG_DIRNAME = '.dye_manage_py_logs'
+# how many of the last lines of output to show when a command fails, unless
+# manage_py_error_lines is set in project_settings.py
+MANAGE_PY_ERROR_LINES = 100
+# the most we read from the end of a log to find those lines
+MANAGE_PY_LOG_TAIL_BYTES = 256 * 1024
+
+
+def _get_manage_py_log_file(args):
+    """The log for a manage.py command, eg migrate-1a2b3c4d.log.  Running the
+    same command again overwrites it."""
+    log_dir = env.get('manage_py_log_dir',
+                      path.join(env['django_dir'], MANAGE_PY_LOG_DIRNAME))
+    if not path.isdir(log_dir):
+        os.makedirs(log_dir)
+    commands = [arg for arg in args if not arg.startswith('-')] or ['manage']
+    name = re.sub(r'[^\w-]', '_', commands[0])
+    return path.join(log_dir, '%s-%s.log' % (name, md5(' '.join(args)).hexdigest()[:8]))
+
+
+def _read_last_lines(file_path, count):
+    """The last count lines of a file, without reading all of a big file"""
+    f = open(file_path, 'rb')
+    try:
+        f.seek(0, os.SEEK_END)
+        start = max(0, f.tell() - MANAGE_PY_LOG_TAIL_BYTES)
+        f.seek(start)
+        if start > 0:
+            # skip the partial line
+            f.readline()
+        return list(deque(f, maxlen=count))
+    finally:
+        f.close()
+
+
+def _manage_py(args, cwd=None, python_args=(), capture_output=False):
+    """Run manage.py with args.  The output goes to a log file (see
+    _get_manage_py_log_file()), rather than being kept in memory.  Returns the
+    last lines of output, or all of it if capture_output is True."""
+    if isinstance(args, str):
+        args = [args]
+    # use the virtualenv python and set VIRTUAL_ENV, so that manage.py goes
+    # straight to running django rather than checking the virtualenv and
+    # starting another python
+    manage_cmd = [_get_manage_runner_python()] + list(python_args) + [env['manage_py']]
     if env['quiet']:
         manage_cmd.append('--verbosity=0')
-    if isinstance(args, str):
-        manage_cmd.append(args)
-    else:
-        manage_cmd.extend(args)
+    manage_cmd.extend(args)
 
     # Allow manual specification of settings file
     if 'manage_py_settings' in env:
@@ -33,24 +97,296 @@ def _manage_py(args, cwd=None):
 
     if env['verbose']:
         print 'Executing manage command: %s' % ' '.join(manage_cmd)
-    output_lines = []
+    error_lines = env.get('manage_py_error_lines', MANAGE_PY_ERROR_LINES)
+    last_lines = deque(maxlen=error_lines)
+    log_file = _get_manage_py_log_file(args)
+    manage_env = os.environ.copy()
+    manage_env['VIRTUAL_ENV'] = env['ve_dir']
+    log = open(log_file, 'wb')
     try:
-        # TODO: make compatible with python 2.3
-        popen = subprocess.Popen(manage_cmd, cwd=cwd, stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-    except OSError, e:
-        print "Failed to execute command: %s: %s" % (manage_cmd, e)
-        raise e
-    for line in iter(popen.stdout.readline, ""):
-        if env['verbose']:
-            print line,
-        output_lines.append(line)
-    returncode = popen.wait()
+        with _record_command(manage_cmd, cwd, '_manage_py') as record:
+            try:
+                if env['verbose']:
+                    # TODO: make compatible with python 2.3
+                    popen = subprocess.Popen(manage_cmd, cwd=cwd, env=manage_env,
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                else:
+                    # manage.py writes straight to the log, in large chunks
+                    # as its output is not a terminal
+                    popen = subprocess.Popen(manage_cmd, cwd=cwd, env=manage_env,
+                        stdout=log, stderr=subprocess.STDOUT)
+            except OSError, e:
+                print "Failed to execute command: %s: %s" % (manage_cmd, e)
+                raise e
+            if env['verbose']:
+                for line in iter(popen.stdout.readline, ""):
+                    print line,
+                    log.write(line)
+                    last_lines.append(line)
+            returncode = popen.wait()
+            log.flush()
+            record['exit_code'] = returncode
+            record['output_bytes'] = os.fstat(log.fileno()).st_size
+    finally:
+        log.close()
+    if not env['verbose']:
+        last_lines.extend(_read_last_lines(log_file, error_lines))
     if returncode != 0:
-        error_msg = "Failed to execute command: %s: returned %s\n%s" % \
-            (manage_cmd, returncode, "\n".join(output_lines))
-        raise ShellCommandError(error_msg, popen.returncode)
-    return output_lines
+        error_msg = "Failed to execute command: %s: returned %s\n" \
+            "The last %d lines of output follow - all of it is in %s\n%s" % \
+            (manage_cmd, returncode, len(last_lines), log_file, ''.join(last_lines))
+        raise ShellCommandError(error_msg, returncode)
+    if capture_output:
+        with open(log_file) as log:
+            return log.readlines()
+    return list(last_lines)
+
+
+def _get_manage_runner_python():
+    ve_python = path.join(env['ve_dir'], 'bin', 'python')
+    if path.exists(ve_python):
+        return ve_python
+    return env['python_bin']
+
+
+def _run_manage_runner(commands, cwd, log_files=None, model_tables_file=None):
+    """Run the commands using dye/manage_runner.py, with the output of each
+    going to its file in log_files if given, and the tables of the models
+    written to model_tables_file if given.  Returns the list of results, or
+    None if the runner could not set up Django."""
+    runner = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                       'manage_runner.py')
+    runner_env = os.environ.copy()
+    runner_env['VIRTUAL_ENV'] = env['ve_dir']
+    if 'manage_py_settings' in env:
+        runner_env['DJANGO_SETTINGS_MODULE'] = env['manage_py_settings']
+    result_fd, result_file = tempfile.mkstemp(suffix='.json')
+    os.close(result_fd)
+    request = {
+        'commands': commands,
+        'sys_path': [env['django_settings_dir'], env['deploy_dir']],
+        'result_file': result_file,
+    }
+    if log_files is not None:
+        request['log_files'] = log_files
+    if model_tables_file is not None:
+        request['model_tables_file'] = model_tables_file
+    try:
+        runner_label = 'manage_runner.py: ' + '; '.join(' '.join(args) for args in commands)
+        with _record_command(runner_label, cwd, '_run_manage_runner') as record:
+            try:
+                popen = subprocess.Popen([_get_manage_runner_python(), runner],
+                    cwd=cwd, env=runner_env, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            except OSError, e:
+                if env['verbose']:
+                    print "Failed to start manage runner: %s" % e
+                return None
+            boot_output = popen.communicate(json.dumps(request))[0]
+            record['exit_code'] = popen.returncode
+            record['output_bytes'] = len(boot_output)
+        if popen.returncode != 0 or os.path.getsize(result_file) == 0:
+            if env['verbose']:
+                print "Manage runner could not set up Django:\n%s" % boot_output
+            return None
+        return json.load(open(result_file))
+    finally:
+        os.remove(result_file)
+
+
+def _manage_py_batch(commands, cwd=None):
+    """Run several manage.py commands, in order, in one Django process so that
+    Django and the INSTALLED_APPS are only set up once.  If that process cannot
+    set up Django then we fall back to calling _manage_py() for each command.
+
+    The output of each command goes to a log file, as for _manage_py().
+    Returns a list with the last lines of output of each command."""
+    if cwd is None:
+        cwd = env['django_dir']
+    runner_commands = []
+    for args in commands:
+        if env['quiet']:
+            args = args + ['--verbosity=0']
+        runner_commands.append(args)
+    if env['verbose']:
+        print 'Executing manage commands in one process: %s' % \
+            '; '.join(' '.join(args) for args in runner_commands)
+
+    log_files = [_get_manage_py_log_file(args) for args in runner_commands]
+    results = _run_manage_runner(runner_commands, cwd, log_files)
+    if results is None:
+        return [_manage_py(args, cwd=cwd) for args in commands]
+
+    error_lines = env.get('manage_py_error_lines', MANAGE_PY_ERROR_LINES)
+    outputs = []
+    for result in results:
+        if env['verbose']:
+            with open(result['log_file']) as log:
+                shutil.copyfileobj(log, sys.stdout)
+        output_lines = _read_last_lines(result['log_file'], error_lines)
+        if result['exit_code'] != 0:
+            error_msg = "Failed to execute manage command: %s: returned %s\n" \
+                "The last %d lines of output follow - all of it is in %s\n%s" % \
+                (' '.join(result['args']), result['exit_code'], len(output_lines),
+                 result['log_file'], ''.join(output_lines))
+            raise ShellCommandError(error_msg, result['exit_code'])
+        outputs.append(output_lines)
+    return outputs
+
+
+# the settings module each test shard uses - see dye/shard_runner.py
+SHARD_SETTINGS_MODULE = 'dye_test_shard_%d'
+SHARD_SETTINGS_TEMPLATE = """# written by tasks.py run_tests:jobs=N - it is removed after the run
+from %(settings_module)s import *
+from dye.shard_runner import configure_shard_settings
+configure_shard_settings(globals(), %(test_names)r)
+"""
+
+
+def _uses_pytest():
+    """The cookiecutter manage.py hands the tests to pytest when the project
+    was created with use_pytest.  Set use_pytest in project_settings.py if
+    we guess wrong."""
+    if 'use_pytest' in env:
+        return env['use_pytest']
+    return 'pytest.main(' in (_get_file_contents(env['manage_py']) or '')
+
+
+def _get_shard_test_names(shard):
+    """Returns a dict of database alias to the name of the test database for
+    one shard, and makes sure the database user can use those databases."""
+    test_names = {}
+    for alias in _get_database_aliases('all'):
+        db = _get_db_managers(alias)[0]
+        if db.ENGINE == 'Sqlite':
+            db_settings = get_database_settings(alias)
+            if not (db_settings.get('TEST_NAME') or
+                    db_settings.get('TEST', {}).get('NAME')):
+                # Django gives each process its own in memory database
+                continue
+        shard_db = db.get_test_database(shard=shard)
+        if db.ENGINE != 'Sqlite' and (not shard_db.test_sql_user_password() or
+                                      not shard_db.test_grants()):
+            shard_db.grant_all_privileges_for_database()
+        test_names[alias] = shard_db.get_test_settings_name()
+    return test_names
+
+
+def _write_shard_settings(shard, test_names):
+    settings_file = path.join(env['django_settings_dir'],
+                              SHARD_SETTINGS_MODULE % shard + '.py')
+    f = open(settings_file, 'w')
+    try:
+        f.write(SHARD_SETTINGS_TEMPLATE % {
+            'settings_module': env.get('manage_py_settings', 'settings'),
+            'test_names': test_names,
+        })
+    finally:
+        f.close()
+    return settings_file
+
+
+def _count_tests_run(output):
+    """Find how many tests a shard ran from the summary line of the Django
+    test runner ("Ran 12 tests in 1.234s") or pytest ("3 passed, 1 failed")"""
+    match = re.search(r'^Ran (\d+) tests? in', output, re.MULTILINE)
+    if match:
+        return int(match.group(1))
+    match = re.search(r'^=+ (.*) in [\d.]+ ?s(econds)? =+$', output, re.MULTILINE)
+    if match:
+        return sum(int(count) for count in re.findall(
+            r'(\d+) (?:passed|failed|errors?|xfailed|xpassed)', match.group(1)))
+    return None
+
+
+def _manage_py_tests(test_labels, jobs=1):
+    """Run the tests, split across jobs manage.py processes.  With more than
+    one job each process has its own test databases (test_<name>_<n>).  The
+    output of each process is printed when they have all finished (only if
+    it failed, unless verbose) and TasksError is raised if any of them failed.
+
+    The result and duration of each test is added to the record kept by
+    test_times, which is used to balance the processes, to run the tests
+    that failed last time first, and to print the slowest tests."""
+    use_pytest = _uses_pytest()
+    if use_pytest:
+        args = ['test', '-p', 'dye.shard_runner'] + list(test_labels)
+    else:
+        args = ['test', '--noinput', '-v0'] + list(test_labels)
+    manage_cmd = [_get_manage_runner_python(), env['manage_py']] + args
+    if env['verbose']:
+        print 'Executing manage command in %d process(es): %s' % (
+            jobs, ' '.join(manage_cmd))
+
+    timing_db = test_times.get_timing_database()
+    work_dir = tempfile.mkdtemp()
+    history_file = path.join(work_dir, 'history.json')
+    test_times.write_history_file(timing_db, history_file)
+    settings_files = []
+    shards = []
+    try:
+        for shard in range(1, jobs + 1):
+            if jobs > 1:
+                test_names = _get_shard_test_names(shard)
+            else:
+                test_names = {}
+            settings_files.append(_write_shard_settings(shard, test_names))
+            results_file = path.join(work_dir, 'results-%d.json' % shard)
+            shard_env = os.environ.copy()
+            shard_env['VIRTUAL_ENV'] = env['ve_dir']
+            shard_env['DJANGO_SETTINGS_MODULE'] = SHARD_SETTINGS_MODULE % shard
+            shard_env['DYE_TEST_SHARD'] = '%d/%d' % (shard, jobs)
+            shard_env['DYE_TEST_HISTORY'] = history_file
+            shard_env['DYE_TEST_RESULTS'] = results_file
+            shard_env['PYTHONPATH'] = os.pathsep.join(
+                [env['django_settings_dir']] +
+                [p for p in [os.environ.get('PYTHONPATH')] if p])
+            # a file rather than a pipe, so we can wait for them all at once
+            output_file = tempfile.TemporaryFile()
+            try:
+                popen = subprocess.Popen(manage_cmd, cwd=env['django_dir'],
+                    env=shard_env, stdout=output_file, stderr=subprocess.STDOUT)
+            except OSError, e:
+                print "Failed to execute command: %s: %s" % (manage_cmd, e)
+                raise e
+            shards.append((shard, popen, output_file, results_file))
+        failures = []
+        tests_run = 0
+        results = []
+        for shard, popen, output_file, results_file in shards:
+            returncode = popen.wait()
+            output_file.seek(0)
+            output = output_file.read()
+            tests_run += _count_tests_run(output) or 0
+            results += test_times.read_results_file(results_file)
+            if returncode != 0:
+                failures.append((shard, returncode))
+            if returncode != 0 or env['verbose']:
+                if jobs > 1:
+                    print "### Test shard %d/%d: %s" % (
+                        shard, jobs, 'FAILED' if returncode else 'passed')
+                print output
+        timing_db.record(results)
+    finally:
+        for shard, popen, output_file, results_file in shards:
+            if popen.poll() is None:
+                popen.kill()
+                popen.wait()
+            output_file.close()
+        for settings_file in settings_files:
+            for old_file in (settings_file, settings_file + 'c'):
+                if path.exists(old_file):
+                    os.remove(old_file)
+        shutil.rmtree(work_dir)
+        timing_db.close()
+    if not env['quiet']:
+        print "### Ran %d tests in %d process(es)" % (tests_run, jobs)
+        test_times.print_slowest_tests(results, env.get('slowest_tests', 10))
+    if failures:
+        if jobs == 1:
+            raise TasksError("Tests failed", failures[0][1])
+        raise TasksError("Tests failed in shard(s): %s" % ', '.join(
+            '%d/%d' % (shard, jobs) for shard, _ in failures), failures[0][1])
 
 
 def _infer_environment():
@@ -61,32 +397,33 @@ def _infer_environment():
         raise TasksError('no environment set, or pre-existing')
 
 
-def _create_db_objects(database='default'):
-    """
+def _get_db_managers(database='default'):
+    """Returns the DBManager for a database and the one for its test database.
+    They are created once per run and kept in env['db_managers'].
+
         Args:
             database (string): The database key to use in the 'DATABASES'
-                configuration. Override from the default to use a different
-                database.
+                configuration.
     """
-    if 'db' in env:
-        return
+    db_managers = env.setdefault('db_managers', {})
+    if database not in db_managers:
+        db = _create_db_manager(database)
+        db_managers[database] = (db, db.get_test_database())
+    return db_managers[database]
+
+
+def _create_db_manager(database):
     # work out what the environment is if necessary
     if 'environment' not in env:
         env['environment'] = _infer_environment()
 
-    # import local_settings from the django dir. Here we are adding the django
-    # project directory to the path. Note that env['django_dir'] may be more than
-    # one directory (eg. 'django/project') which is why we use django_module
-    sys.path.append(env['django_settings_dir'])
-    import local_settings
-
     default_host = '127.0.0.1'
     db_details = {}
-    # there are two ways of having the settings:
-    # either as DATABASE_NAME = 'x', DATABASE_USER ...
-    # or as DATABASES = { 'default': { 'NAME': 'xyz' ... } }
+    # the settings can either be DATABASE_NAME = 'x', DATABASE_USER ...
+    # or DATABASES = { 'default': { 'NAME': 'xyz' ... } } but
+    # get_database_settings() gives us the second form either way
+    db = get_database_settings(database)
     try:
-        db = local_settings.DATABASES[database]
         db_details['engine'] = db['ENGINE']
         db_details['name'] = db['NAME']
         if db_details['engine'].endswith('sqlite3'):
@@ -96,56 +433,270 @@ def _create_db_objects(database='default'):
             db_details['password'] = db['PASSWORD']
             db_details['port'] = db.get('PORT', None)
             db_details['host'] = db.get('HOST', default_host)
-
-    except (AttributeError, KeyError):
-        try:
-            db_details['engine'] = local_settings.DATABASE_ENGINE
-            db_details['name'] = local_settings.DATABASE_NAME
-            if db_details['engine'].endswith('sqlite3'):
-                db_details['root_dir'] = env['django_dir']
-            else:
-                db_details['user'] = local_settings.DATABASE_USER
-                db_details['password'] = local_settings.DATABASE_PASSWORD
-                db_details['port'] = getattr(local_settings, 'DATABASE_PORT', None)
-                db_details['host'] = getattr(local_settings, 'DATABASE_HOST', default_host)
-        except AttributeError:
-            # we've failed to find the details we need - give up
-            raise InvalidProjectError("Failed to find database settings")
+            if 'ROOT_PASSWORD' in db:
+                db_details['root_password'] = db['ROOT_PASSWORD']
+        # TEST_NAME before Django 1.7
+        test_name = db.get('TEST', {}).get('NAME') or db.get('TEST_NAME')
+        if test_name:
+            db_details['test_name'] = test_name
+    except KeyError:
+        # we've failed to find the details we need - give up
+        raise InvalidProjectError("Failed to find database settings")
     # sort out the engine part - discard everything before the last .
     db_details['engine'] = db_details['engine'].split('.')[-1]
-    if env['environment'] == 'dev_fasttests':
+    if env['environment'] == 'dev_fasttests' and 'temp_mysqld' not in env:
+        # scripts/mysqld-ram.sh runs mysqld with --skip-grant-tables
         db_details['grant_enabled'] = False
-    # and create the objects that hold the db details
-    env['db'] = get_db_manager(**db_details)
-    # and the test db object
-    env['test_db'] = env['db'].get_test_database()
+    # and create the object that holds the db details
+    return get_db_manager(**db_details)
+
+
+def _create_db_objects(database='default'):
+    """Set env['db'] and env['test_db'] to the managers for one database.
+
+        Args:
+            database (string): The database key to use in the 'DATABASES'
+                configuration. Override from the default to use a different
+                database.
+    """
+    env['db'], env['test_db'] = _get_db_managers(database)
+
+
+def _get_database_aliases(database):
+    """database can be a key in DATABASES, or 'all' for all of them"""
+    if database != 'all':
+        return [database]
+    aliases = sorted(get_settings()['DATABASES'].keys())
+    # do the default database first when running them one at a time
+    if 'default' in aliases:
+        aliases.remove('default')
+        aliases.insert(0, 'default')
+    return aliases
+
+
+def _run_for_each_database(task_name, database, db_fn, *args):
+    """Call db_fn(alias, *args) for each database.  For database=all the
+    databases are done concurrently, and the result for each database is
+    reported once they have all finished."""
+    aliases = _get_database_aliases(database)
+    if len(aliases) == 1:
+        db_fn(aliases[0], *args)
+        return
+    # create these in this thread before the workers all want them
+    for alias in aliases:
+        _get_db_managers(alias)
+
+    print_lock = threading.Lock()
+
+    def run_one(alias):
+        try:
+            try:
+                db_fn(alias, *args)
+                error = None
+            except Exception, e:
+                error = e
+                if env['verbose']:
+                    print_lock.acquire()
+                    try:
+                        traceback.print_exc()
+                    finally:
+                        print_lock.release()
+        finally:
+            # MySQL connections belong to the thread that made them
+            close_db_connections()
+        return alias, error
+
+    # multiprocessing is slow to import, so only do it when needed
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(len(aliases), env.get('db_workers', 4)))
+    try:
+        results = pool.map(run_one, aliases)
+    finally:
+        pool.close()
+        pool.join()
+
+    failures = []
+    for alias, error in results:
+        if error is None:
+            if not env['quiet']:
+                print "### %s: %s done" % (task_name, alias)
+        else:
+            message = getattr(error, 'msg', None) or str(error)
+            print "### %s: %s FAILED: %s" % (task_name, alias, message)
+            failures.append((alias, error))
+    if failures:
+        exit_code = getattr(failures[0][1], 'exit_code', 1)
+        raise TasksError("%s failed for database(s): %s" % (
+            task_name, ', '.join(alias for alias, _ in failures)), exit_code)
+
+
+def _clean_one_db(database):
+    db, test_db = _get_db_managers(database)
+    db.drop_db()
+    test_db.drop_db()
 
 
 def clean_db(database='default'):
-    """Delete the database for a clean start"""
-    _create_db_objects(database=database)
-    env['db'].drop_db()
-    env['test_db'].drop_db()
+    """Delete the database for a clean start.  Use database=all to delete all
+    the databases in DATABASES"""
+    _run_for_each_database('clean_db', database, _clean_one_db)
 
 
 def _get_cache_table():
-    # import settings from the django dir
-    sys.path.append(env['django_settings_dir'])
-    import settings
-    if not hasattr(settings, 'CACHES'):
+    caches = get_settings()['CACHES']
+    if 'default' not in caches:
         return None
-    if not settings.CACHES['default']['BACKEND'].endswith('DatabaseCache'):
+    if not caches['default']['BACKEND'].endswith('DatabaseCache'):
         return None
-    return settings.CACHES['default']['LOCATION']
+    return caches['default']['LOCATION']
 
 
-def _get_django_version():
-    version_string = _manage_py(['--version'])[0].strip().split('.')
+def _get_django_version_from_manage_py():
+    version_string = _manage_py(['--version'], capture_output=True)[0].strip().split('.')
 
     return [int(x) for x in version_string]
 
 
-def update_db(syncdb=True, drop_test_db=True, force_use_migrations=True, database='default'):
+def _get_django_version():
+    return get_django_version(fallback_fn=_get_django_version_from_manage_py)
+
+
+def _get_installed_apps():
+    return get_settings()['INSTALLED_APPS']
+
+
+def _find_app_dir(app):
+    """Find the directory of an app package without importing it"""
+    if env['django_dir'] not in sys.path:
+        sys.path.append(env['django_dir'])
+    search_path = None
+    for part in app.split('.'):
+        try:
+            module_file, module_path, _ = imp.find_module(part, search_path)
+        except ImportError:
+            return None
+        if module_file is not None:
+            module_file.close()
+        search_path = [module_path]
+    if not path.isdir(module_path):
+        return None
+    return module_path
+
+
+def _get_app_migrations(app_dir):
+    """Returns the names of the South migrations for an app, or None if the
+    app does not use migrations"""
+    migrations_dir = path.join(app_dir, 'migrations')
+    if not path.isfile(path.join(migrations_dir, '__init__.py')):
+        return None
+    return set(f[:-3] for f in os.listdir(migrations_dir)
+               if f.endswith('.py') and not f.startswith('_'))
+
+
+def _get_models_fingerprint(installed_apps, unmigrated_app_dirs):
+    """syncdb only creates tables for apps without migrations, so it only has
+    work to do when INSTALLED_APPS or the models of those apps change"""
+    fingerprint = md5()
+    fingerprint.update(' '.join(installed_apps))
+    for app_dir in unmigrated_app_dirs:
+        for model_file in _get_model_files(app_dir):
+            fingerprint.update(open(model_file, 'rb').read())
+    return fingerprint.hexdigest()
+
+
+def _get_syncdb_fingerprint(db, installed_apps, unmigrated_app_dirs):
+    return md5(db.get_identifier() +
+               _get_models_fingerprint(installed_apps, unmigrated_app_dirs)).hexdigest()
+
+
+def _get_model_files(app_dir):
+    model_files = [path.join(app_dir, 'models.py')]
+    for dir_path, dir_names, file_names in os.walk(path.join(app_dir, 'models')):
+        dir_names.sort()
+        model_files += [path.join(dir_path, f) for f in sorted(file_names)
+                        if f.endswith('.py')]
+    return [f for f in model_files if path.isfile(f)]
+
+
+def _read_model_tables():
+    """Ask Django for the tables of the models of each app.  Returns None if
+    manage_runner.py could not set up Django."""
+    tables_fd, tables_file = tempfile.mkstemp(suffix='.json')
+    os.close(tables_fd)
+    try:
+        if _run_manage_runner([], env['django_dir'], model_tables_file=tables_file) is None:
+            return None
+        model_tables = json.load(open(tables_file))
+    finally:
+        os.remove(tables_file)
+    return dict((str(app_label), [str(table) for table in tables])
+                for app_label, tables in model_tables.items())
+
+
+def _get_syncdb_stamp_path(database='default'):
+    if database == 'default':
+        return path.join(env['django_dir'], '.syncdb_fingerprint')
+    return path.join(env['django_dir'], '.syncdb_fingerprint-%s' % database)
+
+
+def _get_pending_db_work(db, database, tables, applied_migrations):
+    """Work out what update_db needs to do by comparing the tables and the
+    South migration history with the apps and migration files on disk.
+
+    syncdb is needed if the apps or their models have changed since the
+    stamp was written, or if a table of an app without migrations is
+    missing - the stamp file goes with the release directory, not the
+    database, so it can't tell us about a database that has been restored
+    from an older dump.  Django gives us the tables of the models (see
+    get_model_tables() in introspection.py), and if it can't then we run
+    syncdb to be safe.
+
+    Returns whether syncdb is needed, the labels of the apps with migrations
+    that have not been applied, and the fingerprint to save once syncdb has
+    been done.
+    """
+    installed_apps = _get_installed_apps()
+    unmigrated_app_dirs = []
+    unmigrated_app_labels = []
+    pending_apps = []
+    for app in installed_apps:
+        app_dir = _find_app_dir(app)
+        if app_dir is None:
+            continue
+        migrations = _get_app_migrations(app_dir)
+        app_label = app.split('.')[-1]
+        if migrations is None:
+            unmigrated_app_dirs.append(app_dir)
+            unmigrated_app_labels.append(app_label)
+            continue
+        if applied_migrations is None or \
+                migrations - applied_migrations.get(app_label, set()):
+            pending_apps.append(app_label)
+
+    models_fingerprint = _get_models_fingerprint(installed_apps, unmigrated_app_dirs)
+    syncdb_fingerprint = md5(db.get_identifier() + models_fingerprint).hexdigest()
+    if not tables:
+        needs_syncdb = True
+    elif 'south' in installed_apps and 'south_migrationhistory' not in tables:
+        needs_syncdb = True
+    elif _get_file_contents(_get_syncdb_stamp_path(database)) != syncdb_fingerprint:
+        needs_syncdb = True
+    else:
+        model_tables = get_model_tables(models_fingerprint, _read_model_tables)
+        if model_tables is None:
+            needs_syncdb = True
+        else:
+            expected_tables = set()
+            for app_label in unmigrated_app_labels:
+                expected_tables.update(model_tables.get(app_label, []))
+            # MySQL can be set up to give the table names in lower case
+            needs_syncdb = bool(set(t.lower() for t in expected_tables) -
+                                set(t.lower() for t in tables))
+    return needs_syncdb, pending_apps, syncdb_fingerprint
+
+
+def update_db(syncdb=True, drop_test_db=True, force_use_migrations=True,
+              database='default', check_pending=True):
     """ create the database, and do syncdb and migrations
     Note that if syncdb is true, then migrations will always be done if one of
     the Django apps has a directory called 'migrations/'
@@ -153,49 +704,256 @@ def update_db(syncdb=True, drop_test_db=True, force_use_migrations=True, databas
         syncdb (bool): whether to run syncdb (aswell as creating database)
         drop_test_db (bool): whether to drop the test database after creation
         force_use_migrations (bool): always True now
-        database (string): The database value passed to _get_django_db_settings.
+        database (string): The key in DATABASES to update, or 'all' to
+            update all of them concurrently.
+        check_pending (bool): whether to check the database for missing tables
+            and unapplied migrations first, and only run syncdb and migrate
+            if there is something for them to do
     """
     if not env['quiet']:
         print "### Creating and updating the databases"
 
-    _create_db_objects(database=database)
+    if database == 'all' and env['project_type'] == "django" and syncdb:
+        # look this up now rather than in each of the worker threads
+        _get_django_version()
+    _run_for_each_database('update_db', database, _update_one_db,
+                           syncdb, drop_test_db, check_pending)
+
+
+def _update_one_db(database, syncdb, drop_test_db, check_pending):
+    db, test_db = _get_db_managers(database)
 
     # then see if the database exists
 
-    env['db'].ensure_user_and_db_exist()
+    db.ensure_user_and_db_exist()
 
+    # the test database needs the user the line above may have created
     if not drop_test_db:
-        env['test_db'].create_db_if_not_exists()
+        test_db.create_db_if_not_exists()
 
-    if not env['test_db'].test_sql_user_password() or \
-            not env['test_db'].test_grants():
-        env['test_db'].grant_all_privileges_for_database()
+    if not test_db.test_sql_user_password() or \
+            not test_db.test_grants():
+        test_db.grant_all_privileges_for_database()
 
     if env['project_type'] == "django" and syncdb:
+        tables, applied_migrations = db.get_migration_state()
+        needs_syncdb, pending_apps, syncdb_fingerprint = \
+            _get_pending_db_work(db, database, tables, applied_migrations)
+
         # if we are using the database cache we need to create the table
         # and we need to do it before syncdb
+        commands = []
         cache_table = _get_cache_table()
-        if cache_table and not env['db'].test_db_table_exists(cache_table):
-            _manage_py(['createcachetable', cache_table])
+        if cache_table and cache_table not in tables:
+            commands.append(['createcachetable', cache_table])
+
+        if check_pending and not needs_syncdb and not pending_apps:
+            if commands:
+                _manage_py_batch(_add_database_option(commands, database))
+            elif not env['quiet']:
+                print "### No missing tables or unapplied migrations found"
+            return
+
+        if check_pending and not needs_syncdb:
+            if env['verbose']:
+                print "Unapplied migrations found for: %s" % ', '.join(pending_apps)
+            # first without initial data:
+            commands.append(['migrate', '--noinput', '--no-initial-data'])
+            # then with initial data, AFTER tables have been created:
+            commands.append(['migrate', '--noinput'])
+            _manage_py_batch(_add_database_option(commands, database))
+            return
 
         django_version = _get_django_version()
 
         if django_version[0] >= 1 and django_version[1] >= 5:
             # syncdb with --no-initial-data appears in Django 1.5
-            _manage_py(['syncdb', '--noinput', '--no-initial-data'])
+            commands.append(['syncdb', '--noinput', '--no-initial-data'])
             # always call migrate - shouldn't fail (I think)
             # first without initial data:
-            _manage_py(['migrate', '--noinput', '--no-initial-data'])
+            commands.append(['migrate', '--noinput', '--no-initial-data'])
             # then with initial data, AFTER tables have been created:
-            _manage_py(['syncdb', '--noinput'])
-            _manage_py(['migrate', '--noinput'])
+            commands.append(['syncdb', '--noinput'])
+            commands.append(['migrate', '--noinput'])
         else:
-            _manage_py(['syncdb', '--noinput'])
+            commands.append(['syncdb', '--noinput'])
             # always call migrate - shouldn't fail (I think)
             # first without initial data:
-            _manage_py(['migrate', '--noinput', '--no-initial-data'])
+            commands.append(['migrate', '--noinput', '--no-initial-data'])
             # then with initial data, AFTER tables have been created:
-            _manage_py(['migrate', '--noinput'])
+            commands.append(['migrate', '--noinput'])
+        _manage_py_batch(_add_database_option(commands, database))
+
+        # so next time we know syncdb has nothing to do
+        stamp_file = open(_get_syncdb_stamp_path(database), 'w')
+        try:
+            stamp_file.write(syncdb_fingerprint)
+        finally:
+            stamp_file.close()
+
+
+def _add_database_option(commands, database):
+    """createcachetable, syncdb and migrate all use the default database
+    unless told otherwise"""
+    if database == 'default':
+        return commands
+    return [command + ['--database=%s' % database] for command in commands]
+
+
+def _get_db_fingerprint():
+    """Hash the migrations, fixtures and models of the project apps, so we can
+    tell whether a snapshot of a migrated database is still valid."""
+    fingerprint = md5()
+    fingerprint.update(env['environment'])
+    for app in sorted(env['django_apps']):
+        app_dir = path.join(env['django_dir'], *app.split('.'))
+        app_files = [path.join(app_dir, 'models.py')]
+        for sub_dir in ('migrations', 'fixtures'):
+            for dir_path, dir_names, file_names in os.walk(path.join(app_dir, sub_dir)):
+                dir_names.sort()
+                app_files += [path.join(dir_path, f) for f in sorted(file_names)
+                              if not f.endswith('.pyc')]
+        for app_file in app_files:
+            if path.isfile(app_file):
+                fingerprint.update(path.relpath(app_file, env['django_dir']))
+                fingerprint.update(open(app_file, 'rb').read())
+    return fingerprint.hexdigest()
+
+
+def _update_db_from_snapshot(database='default'):
+    """Restore the database from a snapshot taken after an earlier update_db,
+    provided the migrations and fixtures have not changed since.  Otherwise
+    do the full update_db and save a snapshot for next time.
+
+    Note that the snapshot is taken of the whole database, so this should only
+    be used where the database holds nothing but what update_db puts in it,
+    such as for tests.
+    """
+    if not env.get('use_db_snapshots', True):
+        update_db(database=database)
+        return
+    if 'temp_mysqld' in env:
+        _update_db_from_seed(database)
+        return
+    _create_db_objects(database=database)
+    snapshot_name = _get_db_fingerprint()
+    env['db'].ensure_user_and_db_exist()
+    if env['db'].snapshot_exists(snapshot_name):
+        if not env['quiet']:
+            print "### Restoring database snapshot %s" % snapshot_name
+        env['db'].restore_snapshot(snapshot_name)
+        return
+    update_db(database=database)
+    if not env['quiet']:
+        print "### Saving database snapshot %s" % snapshot_name
+    env['db'].create_snapshot(snapshot_name)
+
+
+TEMP_MYSQLD_SETTINGS_MODULE = 'dye_temp_mysqld_settings'
+TEMP_MYSQLD_SETTINGS_TEMPLATE = """# written by tasks.py while it runs a temporary mysqld - it is removed afterwards
+from %(settings_module)s import *
+
+for _alias, _overrides in %(overrides)r.items():
+    DATABASES[_alias].update(_overrides)
+"""
+
+
+def _write_settings_module(module_name, template, values):
+    """Write a settings module next to settings.py that imports the current
+    settings, and have manage.py use it.  template is filled in from values
+    and settings_module."""
+    values = dict(values,
+                  settings_module=env.get('manage_py_settings', 'settings'))
+    f = open(path.join(env['django_settings_dir'], module_name + '.py'), 'w')
+    try:
+        f.write(template % values)
+    finally:
+        f.close()
+    env['manage_py_settings'] = module_name
+
+
+def _remove_settings_module(module_name, old_manage_py_settings):
+    """Undo _write_settings_module()"""
+    if old_manage_py_settings is None:
+        env.pop('manage_py_settings', None)
+    else:
+        env['manage_py_settings'] = old_manage_py_settings
+    settings_file = path.join(env['django_settings_dir'], module_name + '.py')
+    for old_file in (settings_file, settings_file + 'c'):
+        if path.exists(old_file):
+            os.remove(old_file)
+
+
+def _get_mysql_aliases():
+    return [alias for alias in _get_database_aliases('all')
+            if get_database_settings(alias)['ENGINE'].endswith('mysql')]
+
+
+@contextmanager
+def _temp_mysqld():
+    """Run a temporary mysqld (see mysqld.py) for the MySQL databases in
+    DATABASES, and point tasklib and manage.py at it until we are done.
+    Yields None, and leaves things as they are, if there are no MySQL
+    databases, we can't find mysqld, or use_temp_mysqld is False in
+    project_settings.py."""
+    if not env.get('use_temp_mysqld', True) or not _get_mysql_aliases() or \
+            not (env.get('mysqld_bin') or mysqld.find_program('mysqld')):
+        yield None
+        return
+    server = mysqld.TempMysqld()
+    old_manage_py_settings = env.get('manage_py_settings')
+    # the finally clause below won't run if we are killed by SIGTERM
+    old_sigterm_handler = None
+    if threading.current_thread().name == 'MainThread':
+        old_sigterm_handler = signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    try:
+        server.start()
+        overrides = dict((alias, {'HOST': '127.0.0.1', 'PORT': str(server.port)})
+                         for alias in _get_mysql_aliases())
+        _write_settings_module(TEMP_MYSQLD_SETTINGS_MODULE,
+                               TEMP_MYSQLD_SETTINGS_TEMPLATE,
+                               {'overrides': overrides})
+        for alias in overrides:
+            overrides[alias]['ROOT_PASSWORD'] = server.root_password
+        env['database_overrides'] = overrides
+        env['temp_mysqld'] = server
+        # the managers have to be made again with the new host and port
+        env.pop('db_managers', None)
+        yield server
+    finally:
+        close_db_connections()
+        env.pop('db_managers', None)
+        env.pop('database_overrides', None)
+        env.pop('temp_mysqld', None)
+        _remove_settings_module(TEMP_MYSQLD_SETTINGS_MODULE, old_manage_py_settings)
+        server.stop()
+        if old_sigterm_handler is not None:
+            signal.signal(signal.SIGTERM, old_sigterm_handler)
+
+
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _update_db_from_seed(database='default'):
+    """The temporary mysqld starts empty each time, so rather than keeping a
+    snapshot database we keep a dump of the database after update_db, and
+    load that while the migrations and fixtures are unchanged."""
+    _create_db_objects(database=database)
+    seed_stub = path.join(env['django_dir'], '.dye_mysqld_seed-%s' % database)
+    seed_file = '%s-%s.sql' % (seed_stub, _get_db_fingerprint())
+    env['db'].ensure_user_and_db_exist()
+    if path.isfile(seed_file):
+        if not env['quiet']:
+            print "### Loading the database from %s" % seed_file
+        env['db'].restore_db(seed_file)
+        return
+    update_db(database=database)
+    for old_seed_file in glob.glob(seed_stub + '-*.sql'):
+        os.remove(old_seed_file)
+    if not env['quiet']:
+        print "### Saving the database to %s" % seed_file
+    env['db'].dump_db(seed_file)
 
 
 def create_test_db(drop_after_create=True, database='default'):
@@ -203,14 +961,40 @@ def create_test_db(drop_after_create=True, database='default'):
     env['test_db'].create_db_if_not_exists(drop_after_create=drop_after_create)
 
 
+def _get_dump_filename(dump_filename, database):
+    """With database=all each database needs its own dump file, so add the
+    database key to the name for everything except the default database"""
+    if database == 'default':
+        return dump_filename
+    base, ext = path.splitext(dump_filename)
+    return '%s-%s%s' % (base, database, ext)
+
+
+def _dump_one_db(database, dump_filename, for_rsync, multiple):
+    if multiple:
+        dump_filename = _get_dump_filename(dump_filename, database)
+    _get_db_managers(database)[0].dump_db(dump_filename, for_rsync)
+
+
 def dump_db(dump_filename='db_dump.sql', for_rsync=False, database='default'):
-    _create_db_objects(database=database)
-    env['db'].dump_db(dump_filename, for_rsync)
+    """Dump the database.  With database=all every database in DATABASES is
+    dumped, to dump_filename for the default database and dump_filename with
+    the database key added (eg db_dump-other.sql) for the rest"""
+    _run_for_each_database('dump_db', database, _dump_one_db,
+                           dump_filename, for_rsync, database == 'all')
+
+
+def _restore_one_db(database, dump_filename, multiple):
+    if multiple:
+        dump_filename = _get_dump_filename(dump_filename, database)
+    _get_db_managers(database)[0].restore_db(dump_filename)
 
 
 def restore_db(dump_filename='db_dump.sql', database='default'):
-    _create_db_objects(database=database)
-    env['db'].restore_db(dump_filename)
+    """Restore a database dump.  With database=all the dump files are named
+    as for dump_db"""
+    _run_for_each_database('restore_db', database, _restore_one_db,
+                           dump_filename, database == 'all')
 
 
 def create_dbdump_cron_file(cron_file, dump_file_stub, database='default'):
@@ -223,6 +1007,22 @@ def setup_db_dumps(dump_dir, database='default'):
     env['db'].setup_db_dumps(dump_dir)
 
 
+def _get_local_settings_sources(environment):
+    return [path.join(env['django_settings_dir'], 'settings.py'),
+            path.join(env['django_settings_dir'], 'local_settings.py.%s' % environment)]
+
+
+def _get_local_settings_link(environment):
+    return [path.join(env['django_settings_dir'], 'local_settings.py')]
+
+
+def _set_environment(environment):
+    # later tasks read this, so it is set even when the link is up to date
+    env['environment'] = environment
+
+
+@scheduler.task(file_dep=_get_local_settings_sources, targets=_get_local_settings_link,
+                setup=_set_environment)
 def link_local_settings(environment):
     """ link local_settings.py.environment as local_settings.py """
     if not env['quiet']:
@@ -268,9 +1068,14 @@ def link_local_settings(environment):
     else:
         import shutil
         shutil.copy2(source, target)
-    env['environment'] = environment
+    _set_environment(environment)
+
 
+def _get_private_settings_file():
+    return [path.join(env['django_settings_dir'], 'private_settings.py')]
 
+
+@scheduler.task(targets=_get_private_settings_file)
 def create_private_settings():
     """ create private settings file
     - contains generated DB password and secret key"""
@@ -316,15 +1121,37 @@ def get_webserver_user_group(environment=None):
         return None
 
 
+def _get_static_sources(environment):
+    """The files collectstatic and webassets read: the static directories
+    and assets.py of the apps, STATICFILES_DIRS and the settings"""
+    settings = get_settings()
+    sources = [path.join(env['django_settings_dir'], 'settings.py'),
+               path.join(env['django_settings_dir'], 'local_settings.py')]
+    sources += settings['STATICFILES_DIRS']
+    for app in settings['INSTALLED_APPS']:
+        app_dir = _find_app_dir(app)
+        if app_dir is not None:
+            sources += [path.join(app_dir, 'static'), path.join(app_dir, 'assets.py')]
+    return sources
+
+
+def _get_static_root(environment):
+    static_root = get_settings()['STATIC_ROOT']
+    return [static_root] if static_root else []
+
+
+@scheduler.task(deps=['create_private_settings'], file_dep=_get_static_sources,
+                targets=_get_static_root)
 def collect_static(environment):
     print '### Collecting static files and building webassets'
-    _manage_py(["collectstatic", "--noinput"])
-
-    sys.path.append(env['django_settings_dir'])
-    import settings
-    if 'django_assets' in settings.INSTALLED_APPS:
-        _manage_py(['assets', 'clean'])
-        _manage_py(['assets', 'build'])
+    commands = [["collectstatic", "--noinput"]]
+    use_assets = 'django_assets' in _get_installed_apps()
+    if use_assets:
+        commands.append(['assets', 'clean'])
+        commands.append(['assets', 'build'])
+    _manage_py_batch(commands)
+
+    if use_assets:
         # and ensure the webserver can read the cached files
         owner = get_webserver_user_group(environment)
         if owner:
@@ -332,32 +1159,159 @@ def collect_static(environment):
             _check_call_wrapper(['chown', '-R', owner, cache_path])
 
 
+# the packages run_jenkins needs, and the setting in project_settings.py
+# that pins the version of each
+JENKINS_PACKAGES = (
+    ('django-jenkins', 'django_jenkins_version'),
+    ('pylint', 'pylint_version'),
+    ('coverage', 'coverage_version'),
+)
+
+
+def _get_installed_packages():
+    """Returns a dict of the lower case name of each package installed in
+    the virtualenv to its version"""
+    pip_bin = path.join(env['ve_dir'], 'bin', 'pip')
+    popen = subprocess.Popen([pip_bin, 'freeze'], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+    output = popen.communicate()[0]
+    if popen.returncode != 0:
+        return {}
+    installed = {}
+    for line in output.splitlines():
+        if '==' in line:
+            name, version = line.strip().split('==', 1)
+            installed[name.lower().replace('_', '-')] = version
+    return installed
+
+
+def _get_missing_jenkins_packages(installed):
+    """Returns the requirements for the packages that are not installed, or
+    not at the version pinned in project_settings.py"""
+    missing = []
+    for name, version_setting in JENKINS_PACKAGES:
+        version = env.get(version_setting)
+        if name not in installed or (version and installed[name] != version):
+            missing.append('%s==%s' % (name, version) if version else name)
+    return missing
+
+
 def _install_django_jenkins():
     """ ensure that pip has installed the django-jenkins thing """
+    packages = _get_missing_jenkins_packages(_get_installed_packages())
+    if not packages:
+        return
     if not env['quiet']:
-        print "### Installing Jenkins packages"
-    if 'django_jenkins_version' in env:
-        packages = ['django-jenkins==%s' % env['django_jenkins_version']]
-    else:
-        packages = ['django-jenkins']
-    packages += ['pylint', 'coverage']
-
+        print "### Installing Jenkins packages: %s" % ' '.join(packages)
     pip_bin = path.join(env['ve_dir'], 'bin', 'pip')
-    for package in packages:
-        _check_call_wrapper([pip_bin, 'install', package])
+    _check_call_wrapper([pip_bin, 'install'] + packages)
+
+
+# the settings module django-jenkins runs with - we do the linting and
+# coverage ourselves, so that they can be incremental and in parallel mode
+JENKINS_SETTINGS_MODULE = 'dye_jenkins_settings'
+JENKINS_SETTINGS_TEMPLATE = """# written by tasks.py run_jenkins - it is removed after the run
+from %(settings_module)s import *
+
+if 'JENKINS_TASKS' in globals():
+    _tasks = JENKINS_TASKS
+else:
+    # django-jenkins' own default, less the tasks it has - django_tests
+    # went in 0.14 - found without importing django_jenkins
+    import imp as _imp
+    from os import path as _path
+    _tasks_dir = _path.join(_imp.find_module('django_jenkins')[1], 'tasks')
+    _tasks = [_task for _task in %(default_tasks)r if _path.exists(
+        _path.join(_tasks_dir, _task.split('.')[-1] + '.py'))]
+JENKINS_TASKS = tuple(_task for _task in _tasks if _task not in %(skipped_tasks)r)
+"""
+# the JENKINS_TASKS django-jenkins uses when the settings have none
+DEFAULT_JENKINS_TASKS = (
+    'django_jenkins.tasks.run_pylint',
+    'django_jenkins.tasks.with_coverage',
+    'django_jenkins.tasks.django_tests',
+)
+SKIPPED_JENKINS_TASKS = (
+    'django_jenkins.tasks.run_pylint',
+    'django_jenkins.tasks.with_coverage',
+)
+
+
+def _get_app_dirs():
+    app_dirs = []
+    for app in env['django_apps']:
+        app_dir = _find_app_dir(app)
+        if app_dir is not None:
+            app_dirs.append(app_dir)
+    return app_dirs
+
+
+def _get_coverage_args():
+    """The arguments to run manage.py under coverage in parallel mode, so
+    that each process writes its own data file for _combine_coverage()"""
+    for old_file in glob.glob(path.join(env['vcs_root_dir'], '.coverage.*')):
+        os.remove(old_file)
+    args = ['-m', 'coverage', 'run', '--parallel-mode']
+    coveragerc_filepath = path.join(env['vcs_root_dir'], 'jenkins', 'coverage.rc')
+    if path.exists(coveragerc_filepath):
+        args.append('--rcfile=%s' % coveragerc_filepath)
+    elif _get_app_dirs():
+        args.append('--source=%s' % ','.join(_get_app_dirs()))
+    return args
 
 
-def _manage_py_jenkins():
-    """ run the jenkins command """
-    args = ['jenkins', ]
-    args += ['--pylint-rcfile', path.join(env['vcs_root_dir'], 'jenkins', 'pylint.rc')]
+def _combine_coverage(reports_dir):
+    """Combine the data files of the processes and write coverage.xml for
+    Jenkins.  This runs whether or not the tests passed, so it only warns
+    if it fails."""
+    if not glob.glob(path.join(env['vcs_root_dir'], '.coverage.*')):
+        return
+    coverage_bin = path.join(env['ve_dir'], 'bin', 'coverage')
     coveragerc_filepath = path.join(env['vcs_root_dir'], 'jenkins', 'coverage.rc')
+    rc_args = []
     if path.exists(coveragerc_filepath):
-        args += ['--coverage-rcfile', coveragerc_filepath]
-    args += env['django_apps']
+        rc_args.append('--rcfile=%s' % coveragerc_filepath)
+    for args in (['combine'], ['xml', '-o', path.join(reports_dir, 'coverage.xml')]):
+        if _call_wrapper([coverage_bin] + args + rc_args,
+                         cwd=env['vcs_root_dir']) != 0:
+            print "### Failed to run coverage %s" % args[0]
+            return
+
+
+def _manage_py_jenkins():
+    """ lint the apps, and run the tests with coverage using django-jenkins """
+    reports_dir = path.join(env['vcs_root_dir'], 'reports')
+    _create_dir_if_not_exists(reports_dir)
+    lint.lint_apps(_get_app_dirs(),
+                   path.join(env['vcs_root_dir'], 'jenkins', 'pylint.rc'),
+                   path.join(reports_dir, 'pylint.report'))
+
+    args = ['jenkins', ] + env['django_apps']
     if not env['quiet']:
         print "### Running django-jenkins, with args; %s" % args
-    _manage_py(args, cwd=env['vcs_root_dir'])
+    junit_file = path.join(reports_dir, 'junit.xml')
+    if path.exists(junit_file):
+        os.remove(junit_file)
+    old_manage_py_settings = env.get('manage_py_settings')
+    _write_settings_module(JENKINS_SETTINGS_MODULE, JENKINS_SETTINGS_TEMPLATE,
+                           {'skipped_tasks': SKIPPED_JENKINS_TASKS,
+                            'default_tasks': DEFAULT_JENKINS_TASKS})
+    try:
+        _manage_py(args, cwd=env['vcs_root_dir'],
+                   python_args=_get_coverage_args())
+    finally:
+        _remove_settings_module(JENKINS_SETTINGS_MODULE, old_manage_py_settings)
+        _combine_coverage(reports_dir)
+        # add the test durations to the record kept for run_tests
+        if path.exists(junit_file):
+            results = test_times.read_junit_results(junit_file)
+            timing_db = test_times.get_timing_database()
+            try:
+                timing_db.record(results)
+            finally:
+                timing_db.close()
+            if not env['quiet']:
+                test_times.print_slowest_tests(results, env.get('slowest_tests', 10))
 
 
 def create_uploads_dir(environment=None):
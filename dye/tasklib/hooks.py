@@ -0,0 +1,247 @@
+"""Hooks called at the start and end of each phase of fablib's deploy and
+rollback and of tasklib's deploy, and emitters that send how long each phase
+took to statsd or write it to a Prometheus textfile.
+
+A hook is any callable.  It is called with a dict like:
+
+    {"event": "end", "runner": "fablib", "command": "deploy",
+     "phase": "downtime", "project": "myproject", "environment": "staging",
+     "host": "server.example.com", "start": 1476802215.25,
+     "duration": 12.3, "error": None}
+
+once with "event" set to "start" and once with it set to "end".  duration and
+error are only in the "end" event, and error is None unless the phase failed.
+The "deploy" and "rollback" phases cover the whole command.  A phase can add
+numbers of its own, such as dump_bytes for "dump_db", and the emitters send
+these as well.
+
+The hooks are set up from the project settings - metrics_statsd = 'host:port'
+and metrics_textfile = '/path/to/file.prom' turn on the emitters - along with
+a deploy_hook(event) function in localtasks.py or localfab.py.  A hook that
+fails only gets a warning, so it can't stop a deploy.
+"""
+import os
+import re
+import socket
+import sys
+import time
+from contextlib import contextmanager
+
+DEFAULT_PREFIX = 'dye'
+DEFAULT_STATSD_PORT = 8125
+PROMETHEUS_PREFIX = 'dye_deploy_phase_'
+# the keys every event has - any other numbers in an event are metrics
+EVENT_KEYS = ('event', 'runner', 'command', 'phase', 'project', 'environment',
+              'host', 'start', 'duration', 'error')
+# the labels of the Prometheus metrics, in this order
+PROMETHEUS_LABELS = ('project', 'environment', 'host', 'runner', 'command', 'phase')
+STATSD_NAME_PARTS = ('project', 'environment', 'runner', 'command', 'phase')
+NAME_CLEAN_RE = re.compile(r'[^\w-]+')
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{.*\})?\s+(\S+)\s*$')
+
+
+def get_numbers(event):
+    """The numbers a phase added to event, such as dump_bytes"""
+    numbers = {}
+    for key, value in event.items():
+        if key not in EVENT_KEYS and isinstance(value, (int, long, float)) \
+                and not isinstance(value, bool):
+            numbers[key] = value
+    return numbers
+
+
+class DeployHooks(object):
+
+    def __init__(self, hooks, **context):
+        """context is added to every event, and should have the runner,
+        command, project, environment and host"""
+        self.hooks = hooks
+        self.context = context
+
+    def call_hooks(self, event):
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception, e:
+                print >>sys.stderr, "### Warning: deploy hook %r failed: %s" % (hook, e)
+
+    @contextmanager
+    def phase(self, name, **context):
+        """Call the hooks at the start and end of the with block.  Numbers
+        added to the dict yielded are passed to the hooks at the end."""
+        event = dict(self.context)
+        event.update(context)
+        event['phase'] = name
+        event['start'] = time.time()
+        self.call_hooks(dict(event, event='start'))
+        event['error'] = None
+        try:
+            try:
+                yield event
+            except:
+                # a bare except, to include the SystemExit of fabric's abort()
+                error = sys.exc_info()[1]
+                event['error'] = str(error) or error.__class__.__name__
+                raise
+        finally:
+            event['duration'] = time.time() - event['start']
+            self.call_hooks(dict(event, event='end'))
+
+
+def _clean_name(name):
+    return NAME_CLEAN_RE.sub('_', str(name))
+
+
+def _parse_address(address):
+    """'host:port' or 'host' to (host, port)"""
+    host, _, port = address.rpartition(':')
+    if not host:
+        return port, DEFAULT_STATSD_PORT
+    return host, int(port)
+
+
+class StatsdEmitter(object):
+    """At the end of each phase, send its duration to statsd as a timer,
+    count it as failed if it was, and send its numbers as gauges"""
+
+    def __init__(self, address, prefix=DEFAULT_PREFIX):
+        self.host, self.port = _parse_address(address)
+        self.prefix = prefix
+
+    def __repr__(self):
+        return 'StatsdEmitter(%r)' % ('%s:%s' % (self.host, self.port))
+
+    def get_name(self, event, metric):
+        parts = [self.prefix] + [_clean_name(event[key]) for key in STATSD_NAME_PARTS
+                                 if event.get(key)]
+        return '.'.join(parts + [metric])
+
+    def get_lines(self, event):
+        lines = ['%s:%d|ms' % (self.get_name(event, 'duration'),
+                               int(round(event['duration'] * 1000)))]
+        if event['error'] is not None:
+            lines.append('%s:1|c' % self.get_name(event, 'failed'))
+        numbers = get_numbers(event)
+        for key in sorted(numbers):
+            lines.append('%s:%s|g' % (self.get_name(event, _clean_name(key)), numbers[key]))
+        return lines
+
+    def __call__(self, event):
+        if event['event'] != 'end':
+            return
+        family, socktype, proto, _, address = socket.getaddrinfo(
+            self.host, self.port, 0, socket.SOCK_DGRAM)[0]
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.sendto('\n'.join(self.get_lines(event)), address)
+        finally:
+            sock.close()
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def parse_textfile(lines):
+    """The samples in the lines of a Prometheus textfile, as
+    {(name, labels): value} where labels is the text between the braces"""
+    samples = {}
+    for line in lines:
+        match = SAMPLE_RE.match(line)
+        if match and not line.startswith('#'):
+            labels = (match.group(2) or '{}')[1:-1]
+            samples[(match.group(1), labels)] = match.group(3)
+    return samples
+
+
+def format_textfile(samples):
+    """The contents of a textfile with samples, as from parse_textfile()"""
+    lines = []
+    last_name = None
+    for name, labels in sorted(samples):
+        if name != last_name:
+            lines.append('# TYPE %s gauge' % name)
+            last_name = name
+        lines.append('%s{%s} %s' % (name, labels, samples[(name, labels)]))
+    return '\n'.join(lines) + '\n'
+
+
+def read_textfile(textfile):
+    if not os.path.exists(textfile):
+        return {}
+    f = open(textfile)
+    try:
+        return parse_textfile(f)
+    finally:
+        f.close()
+
+
+def write_textfile(textfile, samples):
+    """Write samples so that the textfile collector never sees half a file"""
+    # the textfile collector only reads files ending in .prom
+    temp_file = textfile + '.tmp'
+    f = open(temp_file, 'w')
+    try:
+        f.write(format_textfile(samples))
+    finally:
+        f.close()
+    os.rename(temp_file, textfile)
+
+
+class PrometheusTextfileEmitter(object):
+    """At the end of each phase, update its duration, whether it failed,
+    when it finished and its numbers in a textfile for node_exporter's
+    textfile collector.  The other samples in the file are kept, so one
+    file can hold every project and phase.  fablib uses a subclass that
+    writes the file on the server."""
+
+    def __init__(self, textfile):
+        self.textfile = textfile
+
+    def __repr__(self):
+        return 'PrometheusTextfileEmitter(%r)' % self.textfile
+
+    def get_samples(self, event):
+        labels = ','.join('%s="%s"' % (key, _escape_label_value(event.get(key) or ''))
+                          for key in PROMETHEUS_LABELS)
+        values = {
+            'duration_seconds': '%f' % event['duration'],
+            'failed': '1' if event['error'] is not None else '0',
+            'end_time_seconds': '%f' % (event['start'] + event['duration']),
+        }
+        numbers = get_numbers(event)
+        for key in numbers:
+            values[_clean_name(key).replace('-', '_')] = str(numbers[key])
+        samples = {}
+        for metric, value in values.items():
+            samples[(PROMETHEUS_PREFIX + metric, labels)] = value
+        return samples
+
+    def read_samples(self):
+        return read_textfile(self.textfile)
+
+    def write_samples(self, samples):
+        write_textfile(self.textfile, samples)
+
+    def __call__(self, event):
+        if event['event'] != 'end':
+            return
+        samples = self.read_samples()
+        samples.update(self.get_samples(event))
+        self.write_samples(samples)
+
+
+def get_hooks(settings, local_module=None, textfile_emitter=PrometheusTextfileEmitter):
+    """The hooks turned on by settings - the project settings, as a dict -
+    and the deploy_hook() function of local_module, if it has one.
+    textfile_emitter is the class for metrics_textfile."""
+    hooks = []
+    if settings.get('metrics_statsd'):
+        hooks.append(StatsdEmitter(settings['metrics_statsd'],
+                                   settings.get('metrics_prefix', DEFAULT_PREFIX)))
+    if settings.get('metrics_textfile'):
+        hooks.append(textfile_emitter(settings['metrics_textfile']))
+    deploy_hook = getattr(local_module, 'deploy_hook', None)
+    if deploy_hook is not None:
+        hooks.append(deploy_hook)
+    return hooks
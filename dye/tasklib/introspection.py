@@ -0,0 +1,232 @@
+"""Cached information about the Django settings and the virtualenv.
+
+Several tasks need to know the Django version, INSTALLED_APPS, CACHES,
+DATABASES or the tables of the models.  Finding out means importing the settings, or even starting
+Django, so we do it once per run and also keep the results on disk in the
+django dir.  The cache is keyed by the modification times of the settings
+files and of the virtualenv, so it is rebuilt when either changes.
+"""
+import os
+from os import path
+import sys
+import re
+import glob
+import tempfile
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .exceptions import InvalidProjectError
+# global dictionary for state
+from .environment import env
+from .util import _file_signature
+
+CACHE_FILENAME = '.dye_settings_cache.json'
+
+# the keys we keep for each database - the OPTIONS etc aren't needed by tasks.
+# TEST has the test NAME from Django 1.7, and ROOT_PASSWORD is our own.
+DATABASE_KEYS = ('ENGINE', 'NAME', 'USER', 'PASSWORD', 'HOST', 'PORT', 'TEST_NAME',
+                 'TEST', 'ROOT_PASSWORD')
+
+# old style settings - DATABASE_NAME = 'x' etc
+OLD_DATABASE_SETTINGS = ('ENGINE', 'NAME', 'USER', 'PASSWORD', 'HOST', 'PORT')
+
+
+def _to_str(value):
+    """json gives us unicode, but the rest of tasklib expects str"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_to_str(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in value.items())
+    return value
+
+
+def _get_settings_fingerprint():
+    """The settings can come from any python file in the settings directory,
+    and local_settings.py is a link we need to follow."""
+    settings_dir = env['django_settings_dir']
+    parts = []
+    for name in sorted(os.listdir(settings_dir)):
+        if name.startswith('dye_'):
+            # the settings modules tasklib writes for a run
+            continue
+        if name.endswith('.py') or name.startswith('local_settings.py'):
+            parts.append('%s=%s' % (name, _file_signature(path.join(settings_dir, name))))
+    local_settings = path.join(settings_dir, 'local_settings.py')
+    if path.islink(local_settings):
+        parts.append('link=%s' % os.readlink(local_settings))
+    return ';'.join(parts)
+
+
+def _get_site_packages_dirs():
+    return glob.glob(path.join(env['ve_dir'], 'lib', 'python*', 'site-packages'))
+
+
+def _get_ve_fingerprint():
+    """pip install changes the site-packages mtime and bootstrap.py touches
+    the timestamp file"""
+    parts = [_file_signature(path.join(env['ve_dir'], 'timestamp'))]
+    parts += [_file_signature(d) for d in _get_site_packages_dirs()]
+    return ';'.join(parts)
+
+
+def _read_cache_file():
+    cache_path = path.join(env['django_dir'], CACHE_FILENAME)
+    if not path.isfile(cache_path):
+        return {}
+    try:
+        cache_file = open(cache_path)
+        try:
+            return _to_str(json.load(cache_file))
+        finally:
+            cache_file.close()
+    except ValueError:
+        # corrupt cache - just rebuild it
+        return {}
+
+
+def _write_cache_file(cache):
+    cache_path = path.join(env['django_dir'], CACHE_FILENAME)
+    # the cache holds the database passwords, so only we should read it -
+    # mkstemp creates the file with mode 0600.  A unique temporary file also
+    # means that threads working on different databases can't collide.
+    fd, tmp_path = tempfile.mkstemp(prefix=CACHE_FILENAME, dir=env['django_dir'])
+    cache_file = os.fdopen(fd, 'w')
+    try:
+        json.dump(cache, cache_file)
+    finally:
+        cache_file.close()
+    os.rename(tmp_path, cache_path)
+
+
+def _get_cached(section, fingerprint, read_fn):
+    """Get a section of the cache, from env if we've already had it this run,
+    otherwise from the cache file, calling read_fn if the fingerprint has
+    changed."""
+    cache = env.setdefault('introspection_cache', {})
+    if section not in cache:
+        cache.update(_read_cache_file())
+    if section in cache and cache[section]['fingerprint'] == fingerprint:
+        return cache[section]['value']
+    value = read_fn()
+    if value is None:
+        # read_fn couldn't find out, so try again next time
+        return None
+    cache[section] = {'fingerprint': fingerprint, 'value': value}
+    _write_cache_file(cache)
+    return value
+
+
+def _import_settings():
+    if env['django_settings_dir'] not in sys.path:
+        sys.path.append(env['django_settings_dir'])
+    # if the settings were imported earlier in this run then local_settings.py
+    # may have been linked to a different file since
+    for module_name in ('private_settings', 'local_settings', 'settings'):
+        if module_name in sys.modules:
+            reload(sys.modules[module_name])
+    import settings
+    return settings
+
+
+def _read_databases(settings):
+    if hasattr(settings, 'DATABASES'):
+        databases = settings.DATABASES
+    elif hasattr(settings, 'DATABASE_ENGINE'):
+        databases = {'default': dict(
+            (key, getattr(settings, 'DATABASE_' + key))
+            for key in OLD_DATABASE_SETTINGS
+            if hasattr(settings, 'DATABASE_' + key))}
+    else:
+        return {}
+    return dict((alias, dict((key, db[key]) for key in DATABASE_KEYS if key in db))
+                for alias, db in databases.items())
+
+
+def _read_settings():
+    settings = _import_settings()
+    caches = {}
+    for alias, cache in getattr(settings, 'CACHES', {}).items():
+        caches[alias] = {
+            'BACKEND': cache.get('BACKEND'),
+            'LOCATION': cache.get('LOCATION'),
+        }
+    # STATICFILES_DIRS entries can be a path or a (prefix, path) tuple
+    staticfiles_dirs = []
+    for static_dir in getattr(settings, 'STATICFILES_DIRS', ()):
+        if isinstance(static_dir, (list, tuple)):
+            static_dir = static_dir[1]
+        staticfiles_dirs.append(static_dir)
+    return _to_str({
+        'INSTALLED_APPS': list(settings.INSTALLED_APPS),
+        'CACHES': caches,
+        'DATABASES': _read_databases(settings),
+        'STATIC_ROOT': getattr(settings, 'STATIC_ROOT', None),
+        'STATICFILES_DIRS': staticfiles_dirs,
+    })
+
+
+def get_settings():
+    """Returns a dictionary with the INSTALLED_APPS, CACHES (BACKEND and
+    LOCATION only), DATABASES (connection details only), STATIC_ROOT and
+    STATICFILES_DIRS (paths only) settings"""
+    return _get_cached('settings', _get_settings_fingerprint(), _read_settings)
+
+
+def get_database_settings(database='default'):
+    """The settings for one database, with any overrides set in
+    env['database_overrides'] (eg by the temporary mysqld) applied"""
+    try:
+        db = get_settings()['DATABASES'][database]
+    except KeyError:
+        raise InvalidProjectError("Failed to find database settings for %s" % database)
+    overrides = env.get('database_overrides', {}).get(database)
+    if overrides:
+        db = dict(db, **overrides)
+    return db
+
+
+def _read_django_version_from_ve():
+    """Read the Django version from the package metadata in the virtualenv,
+    which is much quicker than starting Django to ask it."""
+    for site_packages in _get_site_packages_dirs():
+        for info_dir in glob.glob(path.join(site_packages, 'Django-*-info')):
+            # eg Django-1.6.11-py2.7.egg-info or Django-1.6.11.dist-info
+            version = path.basename(info_dir)[len('Django-'):]
+            version = re.match(r'[0-9.]+[0-9]', version)
+            if version:
+                return [int(x) for x in version.group().split('.')]
+        # an editable install won't have the metadata in site-packages
+        # so look at the package itself
+        django_init = path.join(site_packages, 'django', '__init__.py')
+        if path.isfile(django_init):
+            match = re.search(r'^VERSION\s*=\s*\((\d+),\s*(\d+),\s*(\d+)',
+                              open(django_init).read(), re.MULTILINE)
+            if match:
+                return [int(x) for x in match.groups()]
+    return None
+
+
+def get_django_version(fallback_fn=None):
+    """Returns the Django version as a list of ints, eg [1, 6, 11].  If the
+    version can't be read from the virtualenv then fallback_fn is called to
+    get it."""
+    def read_version():
+        version = _read_django_version_from_ve()
+        if version is None and fallback_fn is not None:
+            version = fallback_fn()
+        return version
+    return _get_cached('django_version', _get_ve_fingerprint(), read_version)
+
+
+def get_model_tables(models_fingerprint, read_fn):
+    """Returns the tables of the models of each app, as {app label: [table,
+    ...]}, or None if read_fn, which asks Django, couldn't find out.  They
+    are kept until the settings, the virtualenv or models_fingerprint (of
+    the model files) change."""
+    fingerprint = ';'.join([_get_settings_fingerprint(), _get_ve_fingerprint(),
+                            models_fingerprint])
+    return _get_cached('model_tables', fingerprint, read_fn)
@@ -0,0 +1,199 @@
+"""Incremental pylint for run_jenkins.
+
+django-jenkins lints every module of the django_apps on every build.  We
+lint them ourselves instead, and keep the messages for each file in
+django_dir/.dye_pylint_cache.json along with the md5 of the file:
+
+    {"signature": "<md5 of the rcfile and pylint --version>",
+     "files": {"django/website/main/views.py":
+                   {"hash": "<md5>", "messages": ["django/website/..."]}}}
+
+so only the files that have changed since the last build are linted again.
+The cache is thrown away when the rcfile or the version of pylint changes.
+Messages about other modules (eg no-member) are only brought up to date
+when the file itself changes - remove the cache to lint everything again.
+
+The messages are written to reports/pylint.report in the parseable format
+the Jenkins violations plugin reads, as django-jenkins did.
+"""
+import os
+from os import path
+import re
+import subprocess
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+from ConfigParser import RawConfigParser, Error as ConfigParserError
+
+from .exceptions import TasksError
+# global dictionary for state
+from .environment import env
+
+PYLINT_CACHE_FILENAME = '.dye_pylint_cache.json'
+MESSAGE_RE = re.compile(r'^(?P<file>[^:\s]+\.py):\d+:')
+# pylint's exit status is a bit mask - 32 is a usage error
+PYLINT_USAGE_ERROR = 32
+
+
+def get_file_hash(file_path):
+    f = open(file_path, 'rb')
+    try:
+        return md5(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
+def get_ignored_names(rcfile):
+    """The file and directory names in the ignore= option of the rcfile,
+    which pylint skips when walking a package"""
+    parser = RawConfigParser()
+    try:
+        parser.read([rcfile])
+    except ConfigParserError:
+        return set(['CVS'])
+    for section in parser.sections():
+        if parser.has_option(section, 'ignore'):
+            return set(name.strip() for name in
+                       parser.get(section, 'ignore').split(',') if name.strip())
+    return set(['CVS'])
+
+
+def find_python_files(dirs, ignored_names, cwd):
+    """Returns the .py files under dirs, relative to cwd"""
+    files = []
+    for top_dir in dirs:
+        for dir_path, dir_names, file_names in os.walk(top_dir):
+            dir_names[:] = sorted(name for name in dir_names
+                                  if name not in ignored_names and
+                                  path.exists(path.join(dir_path, name, '__init__.py')))
+            for name in sorted(file_names):
+                if name.endswith('.py') and name not in ignored_names:
+                    files.append(path.relpath(path.join(dir_path, name), cwd))
+    return files
+
+
+def parse_pylint_output(output_lines, cwd):
+    """Returns a dict of file (relative to cwd) to its messages, from the
+    parseable output of pylint"""
+    messages = {}
+    for line in output_lines:
+        match = MESSAGE_RE.match(line)
+        if not match:
+            continue
+        file_path = match.group('file')
+        if path.isabs(file_path):
+            file_path = path.relpath(file_path, cwd)
+        file_path = path.normpath(file_path)
+        messages.setdefault(file_path, []).append(
+            file_path + line[len(match.group('file')):].rstrip('\n'))
+    return messages
+
+
+class PylintCache(object):
+
+    def __init__(self, cache_file, signature):
+        self.cache_file = cache_file
+        self.signature = signature
+        self.files = {}
+        try:
+            f = open(cache_file)
+            try:
+                cache = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return
+        if cache.get('signature') == signature:
+            self.files = cache['files']
+
+    def get_changed(self, hashes):
+        """Returns the files whose hash is not the one we linted"""
+        return [file_path for file_path in sorted(hashes)
+                if self.files.get(file_path, {}).get('hash') != hashes[file_path]]
+
+    def update(self, hashes, linted, messages):
+        """Store the messages for the files we linted, and forget the files
+        that have gone"""
+        for file_path in linted:
+            self.files[file_path] = {'hash': hashes[file_path],
+                                     'messages': messages.get(file_path, [])}
+        for file_path in list(self.files):
+            if file_path not in hashes:
+                del self.files[file_path]
+
+    def get_messages(self):
+        lines = []
+        for file_path in sorted(self.files):
+            lines.extend(self.files[file_path]['messages'])
+        return lines
+
+    def save(self):
+        f = open(self.cache_file, 'w')
+        try:
+            json.dump({'signature': self.signature, 'files': self.files}, f)
+        finally:
+            f.close()
+
+
+def _get_pylint_bin():
+    return path.join(env['ve_dir'], 'bin', 'pylint')
+
+
+def _get_pylint_env():
+    pylint_env = os.environ.copy()
+    pylint_env['VIRTUAL_ENV'] = env['ve_dir']
+    pylint_env['PYTHONPATH'] = os.pathsep.join(
+        [env['django_dir']] + [p for p in [pylint_env.get('PYTHONPATH')] if p])
+    pylint_env['DJANGO_SETTINGS_MODULE'] = env.get('manage_py_settings', 'settings')
+    return pylint_env
+
+
+def _get_signature(rcfile):
+    popen = subprocess.Popen([_get_pylint_bin(), '--version'],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    version = popen.communicate()[0]
+    return md5(version + (open(rcfile).read() if path.exists(rcfile) else '')).hexdigest()
+
+
+def _run_pylint(rcfile, files, cwd):
+    command = [_get_pylint_bin(), '--rcfile=%s' % rcfile,
+               '--output-format=parseable', '--reports=n'] + files
+    if env['verbose']:
+        print "Executing command: %s" % ' '.join(command)
+    popen = subprocess.Popen(command, cwd=cwd, env=_get_pylint_env(),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = popen.communicate()[0]
+    if popen.returncode & PYLINT_USAGE_ERROR:
+        raise TasksError("Failed to execute command: %s: returned %s\n%s" %
+                         (' '.join(command), popen.returncode, output))
+    return output.splitlines()
+
+
+def lint_apps(app_dirs, rcfile, report_file):
+    """Lint the files of the apps that have changed since last time, and
+    write the messages for all of them to report_file"""
+    cwd = env['vcs_root_dir']
+    files = find_python_files(app_dirs, get_ignored_names(rcfile), cwd)
+    hashes = dict((file_path, get_file_hash(path.join(cwd, file_path)))
+                  for file_path in files)
+    cache = PylintCache(path.join(env['django_dir'], PYLINT_CACHE_FILENAME),
+                        _get_signature(rcfile))
+    changed = cache.get_changed(hashes)
+    if not env['quiet']:
+        print "### Running pylint on %d of %d files" % (len(changed), len(files))
+    messages = {}
+    if changed:
+        messages = parse_pylint_output(_run_pylint(rcfile, changed, cwd), cwd)
+    cache.update(hashes, changed, messages)
+    cache.save()
+    f = open(report_file, 'w')
+    try:
+        for line in cache.get_messages():
+            f.write(line + '\n')
+    finally:
+        f.close()
@@ -0,0 +1,291 @@
+"""A throwaway MySQL server for running the tests.
+
+quick_test and run_jenkins start one of these rather than relying on a
+mysqld someone has set up on port 3307.  It runs as the current user, keeps
+its data on tmpfs (/dev/shm) with the durability features turned off, and
+only listens on 127.0.0.1 on a free port and on a socket in its own private
+directory.  The root password is random, so other users of the machine
+can't use it.
+
+The server is stopped and its directory removed when we are done with it.
+It is also told to stop if we die without doing that, and the directories
+left by servers that are no longer running are removed the next time one
+is started.
+"""
+import os
+from os import path
+import errno
+import glob
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+
+from .exceptions import TasksError
+from .database import _import_mysqldb
+# global dictionary for state
+from .environment import env
+
+DIR_PREFIX = 'dye-mysqld-'
+# where to look for mysqld as well as the PATH - it is often in an sbin
+SEARCH_DIRS = ['/usr/sbin', '/usr/local/sbin', '/usr/local/mysql/bin',
+               '/usr/local/mysql/scripts']
+START_TIMEOUT = 60
+STOP_TIMEOUT = 30
+# PR_SET_PDEATHSIG from linux/prctl.h
+PR_SET_PDEATHSIG = 1
+
+
+def find_program(name):
+    dirs = os.environ.get('PATH', '').split(os.pathsep) + SEARCH_DIRS
+    for dir_name in dirs:
+        program = path.join(dir_name, name)
+        if path.isfile(program) and os.access(program, os.X_OK):
+            return program
+    return None
+
+
+def parse_version(version_output):
+    """Returns (is_mariadb, version tuple) from the output of mysqld --version
+    eg "mysqld  Ver 8.0.36 for Linux on x86_64 (MySQL Community Server - GPL)"
+    """
+    match = re.search(r'Ver (\d+)\.(\d+)\.(\d+)', version_output)
+    if not match:
+        raise TasksError("Could not find the mysqld version in: %s" % version_output)
+    return 'MariaDB' in version_output, tuple(int(x) for x in match.groups())
+
+
+def get_tmpfs_dir():
+    if path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def remove_stale_dirs(base_dir):
+    """Remove the directories of servers that are no longer running"""
+    for server_dir in glob.glob(path.join(base_dir, DIR_PREFIX + '*')):
+        try:
+            if os.stat(server_dir).st_uid != os.getuid():
+                continue
+            pid = int(open(path.join(server_dir, 'mysqld.pid')).read().strip())
+        except (OSError, IOError, ValueError):
+            # not started yet, or it failed to start - give it an hour
+            try:
+                if os.stat(server_dir).st_mtime > time.time() - 3600:
+                    continue
+            except OSError:
+                continue
+            pid = None
+        if pid is None or not _process_exists(pid):
+            shutil.rmtree(server_dir, ignore_errors=True)
+
+
+def _get_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def _die_with_parent():
+    """Run in the mysqld process before it starts, so that linux sends it
+    SIGTERM if we are killed before we can stop it"""
+    try:
+        import ctypes
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except Exception:
+        pass
+
+
+class TempMysqld(object):
+
+    def __init__(self, mysqld=None, base_dir=None):
+        self.mysqld = mysqld or env.get('mysqld_bin') or find_program('mysqld')
+        if self.mysqld is None:
+            raise TasksError("Could not find mysqld")
+        self.base_dir = base_dir or get_tmpfs_dir()
+        self.server_dir = None
+        self.port = None
+        self.root_password = ''.join(
+            random.choice('abcdefghijklmnopqrstuvwxyz0123456789') for i in range(16))
+        self.process = None
+        self._version = None
+
+    def get_version(self):
+        if self._version is None:
+            output = subprocess.Popen([self.mysqld, '--version'],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT).communicate()[0]
+            self._version = parse_version(output)
+        return self._version
+
+    def _get_path(self, name):
+        return path.join(self.server_dir, name)
+
+    def get_socket(self):
+        return self._get_path('mysqld.sock')
+
+    def _get_user_args(self):
+        # mysqld refuses to run as root unless told to
+        if os.getuid() == 0:
+            return ['--user=root']
+        return []
+
+    def _get_auth_args(self):
+        is_mariadb, version = self.get_version()
+        if not is_mariadb and (8, 0) <= version < (8, 4):
+            # older MySQLdb can't log in with caching_sha2_password
+            return ['--default-authentication-plugin=mysql_native_password']
+        return []
+
+    def get_install_command(self):
+        is_mariadb, version = self.get_version()
+        data_dir = '--datadir=%s' % self._get_path('data')
+        if not is_mariadb and version >= (5, 7):
+            return [self.mysqld, '--no-defaults', '--initialize-insecure',
+                    data_dir] + self._get_user_args() + self._get_auth_args()
+        install_db = find_program('mysql_install_db')
+        if install_db is None:
+            raise TasksError("Could not find mysql_install_db")
+        command = [install_db, '--no-defaults', data_dir] + self._get_user_args()
+        if is_mariadb and version >= (10, 4):
+            # otherwise root can only log in through the unix_socket plugin
+            command.append('--auth-root-authentication-method=normal')
+        return command
+
+    def get_server_command(self):
+        is_mariadb, version = self.get_version()
+        command = [
+            self.mysqld, '--no-defaults',
+            '--datadir=%s' % self._get_path('data'),
+            '--tmpdir=%s' % self.server_dir,
+            '--socket=%s' % self.get_socket(),
+            '--pid-file=%s' % self._get_path('mysqld.pid'),
+            '--log-error=%s' % self._get_path('error.log'),
+            '--bind-address=127.0.0.1',
+            '--port=%d' % self.port,
+            # it is all thrown away afterwards, so don't pay for durability
+            '--innodb-flush-log-at-trx-commit=0',
+            '--innodb-doublewrite=OFF',
+            '--sync-binlog=0',
+            '--skip-performance-schema',
+            '--character-set-server=utf8',
+        ] + self._get_user_args() + self._get_auth_args()
+        if not is_mariadb and version >= (8, 0):
+            # the binary log is on by default from MySQL 8, and the X plugin
+            # would try to use port 33060 and /tmp/mysqlx.sock
+            command += ['--skip-log-bin', '--mysqlx=OFF']
+        return command
+
+    def get_root_sql(self):
+        """The statements that give root a password, and let it log in over
+        TCP, which is how tasklib and Django connect"""
+        is_mariadb, version = self.get_version()
+        password = self.root_password
+        if (is_mariadb and version >= (10, 2)) or (not is_mariadb and version >= (5, 7)):
+            return [
+                "DROP USER IF EXISTS ''@'localhost'",
+                "CREATE USER IF NOT EXISTS 'root'@'127.0.0.1'",
+                "ALTER USER 'root'@'localhost' IDENTIFIED BY '%s'" % password,
+                "ALTER USER 'root'@'127.0.0.1' IDENTIFIED BY '%s'" % password,
+                "GRANT ALL PRIVILEGES ON *.* TO 'root'@'127.0.0.1' WITH GRANT OPTION",
+                "FLUSH PRIVILEGES",
+            ]
+        # mysql_install_db has already created root@127.0.0.1
+        return [
+            "DELETE FROM mysql.user WHERE user = ''",
+            "SET PASSWORD FOR 'root'@'localhost' = PASSWORD('%s')" % password,
+            "SET PASSWORD FOR 'root'@'127.0.0.1' = PASSWORD('%s')" % password,
+            "FLUSH PRIVILEGES",
+        ]
+
+    def _run(self, command):
+        if env['verbose']:
+            print "Executing command: %s" % ' '.join(command)
+        popen = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        output = popen.communicate()[0]
+        if popen.returncode != 0:
+            raise TasksError("Failed to execute command: %s: returned %s\n%s" %
+                             (' '.join(command), popen.returncode, output))
+
+    def _read_error_log(self):
+        try:
+            return open(self._get_path('error.log')).read()
+        except IOError:
+            return ''
+
+    def _connect_as_root(self, password):
+        _import_mysqldb()
+        from .database import MySQLdb
+        return MySQLdb.connect(unix_socket=self.get_socket(), user='root',
+                               passwd=password)
+
+    def _wait_until_ready(self):
+        _import_mysqldb()
+        from .database import MySQLdb
+        deadline = time.time() + START_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise TasksError("mysqld failed to start:\n%s" % self._read_error_log())
+            try:
+                return self._connect_as_root('')
+            except MySQLdb.OperationalError:
+                if time.time() > deadline:
+                    raise TasksError("mysqld did not start within %d seconds:\n%s" %
+                                     (START_TIMEOUT, self._read_error_log()))
+                time.sleep(0.1)
+
+    def start(self):
+        remove_stale_dirs(self.base_dir)
+        # mkdtemp makes the directory only readable by us, which keeps the
+        # socket private
+        self.server_dir = tempfile.mkdtemp(prefix=DIR_PREFIX, dir=self.base_dir)
+        self.port = _get_free_port()
+        if not env['quiet']:
+            print "### Starting mysqld in %s on port %d" % (self.server_dir, self.port)
+        try:
+            self._run(self.get_install_command())
+            self.process = subprocess.Popen(self.get_server_command(),
+                stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT,
+                preexec_fn=_die_with_parent)
+            conn = self._wait_until_ready()
+            try:
+                cursor = conn.cursor()
+                for sql in self.get_root_sql():
+                    cursor.execute(sql)
+                cursor.close()
+            finally:
+                conn.close()
+        except:
+            self.stop()
+            raise
+
+    def stop(self):
+        """Stop the server and remove its directory.  This is safe to call
+        more than once."""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            deadline = time.time() + STOP_TIMEOUT
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        if self.server_dir is not None:
+            shutil.rmtree(self.server_dir, ignore_errors=True)
+            self.server_dir = None
@@ -0,0 +1,166 @@
+"""Profiling for tasks.py --profile and fab.py --profile.
+
+Each task is run under cProfile, and the wall time and the user and system
+time of each command it runs are recorded.  At the end the profiles of all the
+tasks are combined and written to the profile file, which can be read with
+pstats or a viewer such as snakeviz, and a summary is written next to it with
+".txt" added.  For each task the summary has the time spent in commands, the
+slowest commands and the functions with the most cumulative time.
+
+The CPU time of a command comes from getrusage(RUSAGE_CHILDREN), which only
+counts children once they have been waited for.  With tasks.py --jobs the
+commands of tasks running at the same time can be counted against each other.
+The commands fab runs on the server over ssh only have their wall time.
+"""
+import time
+import threading
+from StringIO import StringIO
+from contextlib import contextmanager
+
+from .util import _get_child_times, _format_command
+from .trace import mask_secrets
+
+SUMMARY_SUFFIX = '.txt'
+DEFAULT_TOP_N = 20
+# how many of the slowest commands to list for each task
+TOP_COMMANDS = 10
+NO_TASK = '(outside any task)'
+
+
+def _new_task(name):
+    return {'name': name, 'wall_time': 0.0, 'profile': None, 'commands': []}
+
+
+class Profiler(object):
+
+    def __init__(self, profile_file, top_n=DEFAULT_TOP_N, get_secrets=None):
+        """get_secrets is as for trace.Tracer - the commands are masked in the
+        same way, as they are written to the summary"""
+        self.profile_file = profile_file
+        self.top_n = top_n
+        self.get_secrets = get_secrets
+        # in the order they were started
+        self.tasks = []
+        self.no_task = _new_task(NO_TASK)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_current_task(self):
+        return getattr(self._local, 'task', None)
+
+    def run_task(self, name, fn, *args, **kwargs):
+        """Call fn under cProfile, as the task called name.  A task run from
+        inside another one is counted as part of the outer one."""
+        if self._get_current_task() is not None:
+            return fn(*args, **kwargs)
+        # cProfile and pstats are only imported when we are profiling, so
+        # that they don't slow down every tasks.py
+        import cProfile
+        task = _new_task(name)
+        task['profile'] = cProfile.Profile()
+        self._lock.acquire()
+        try:
+            self.tasks.append(task)
+        finally:
+            self._lock.release()
+        self._local.task = task
+        start = time.time()
+        try:
+            return task['profile'].runcall(fn, *args, **kwargs)
+        finally:
+            task['wall_time'] = time.time() - start
+            self._local.task = None
+
+    def mask(self, command):
+        secrets = self.get_secrets() if self.get_secrets is not None else ()
+        return mask_secrets(_format_command(command), secrets)
+
+    @contextmanager
+    def record_command(self, command):
+        """Time the command run inside the with block"""
+        task = self._get_current_task() or self.no_task
+        start_user, start_system = _get_child_times()
+        start = time.time()
+        try:
+            yield
+        finally:
+            wall_time = time.time() - start
+            end_user, end_system = _get_child_times()
+            self._lock.acquire()
+            try:
+                task['commands'].append({
+                    'command': self.mask(command),
+                    'wall_time': wall_time,
+                    'user_time': end_user - start_user,
+                    'system_time': end_system - start_system,
+                })
+            finally:
+                self._lock.release()
+
+    def get_stats(self):
+        """The profiles of all the tasks as one pstats.Stats, or None if no
+        task was run"""
+        import pstats
+        stats = None
+        for task in self.tasks:
+            if stats is None:
+                stats = pstats.Stats(task['profile'])
+            else:
+                stats.add(task['profile'])
+        return stats
+
+    def _format_task(self, task):
+        commands = task['commands']
+        command_time = sum(command['wall_time'] for command in commands)
+        lines = [
+            "### %s: %.2fs, of which %.2fs in %d commands (user %.2fs, system %.2fs)" % (
+                task['name'], task['wall_time'], command_time, len(commands),
+                sum(command['user_time'] for command in commands),
+                sum(command['system_time'] for command in commands)),
+            '']
+        if commands:
+            lines.append("Slowest commands:     wall     user   system")
+            slowest = sorted(commands, key=lambda command: command['wall_time'],
+                             reverse=True)
+            for command in slowest[:TOP_COMMANDS]:
+                lines.append("                  %7.2fs %7.2fs %7.2fs  %s" % (
+                    command['wall_time'], command['user_time'],
+                    command['system_time'], command['command']))
+            lines.append('')
+        if task['profile'] is not None:
+            import pstats
+            stream = StringIO()
+            stats = pstats.Stats(task['profile'], stream=stream)
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+            lines.append(stream.getvalue())
+        return '\n'.join(lines)
+
+    def format_summary(self):
+        tasks = list(self.tasks)
+        if self.no_task['commands']:
+            tasks.append(self.no_task)
+        return '\n'.join(self._format_task(task) for task in tasks)
+
+    def write(self):
+        """Write the combined profile and the summary.  Returns the name of
+        the summary file."""
+        stats = self.get_stats()
+        if stats is not None:
+            stats.dump_stats(self.profile_file)
+        summary_file = self.profile_file + SUMMARY_SUFFIX
+        f = open(summary_file, 'w')
+        try:
+            f.write(self.format_summary())
+        finally:
+            f.close()
+        return summary_file
+
+
+@contextmanager
+def record_command(profiler, command):
+    """Time command with profiler, unless profiler is None"""
+    if profiler is None:
+        yield
+    else:
+        with profiler.record_command(command):
+            yield
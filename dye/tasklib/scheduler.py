@@ -0,0 +1,318 @@
+"""Dependencies and up-to-date checks for tasks, in the style of python-doit.
+
+A task can declare the names of tasks it depends on, the files it reads
+(file_dep) and the files it creates (targets):
+
+    @scheduler.task(deps=['create_private_settings'],
+                    file_dep=_get_static_sources,
+                    targets=_get_static_root)
+    def collect_static(environment):
+        ...
+
+file_dep and targets can be lists of paths, or functions that are called
+with the same arguments as the task and return a list of paths (as most
+paths are only known once env has been set up).  A directory in file_dep
+stands for all the files below it.
+
+A task that declares file_dep or targets is skipped when it has run
+successfully before with the same arguments, none of its file_dep have
+changed since and its targets are as it left them.  A task that declares
+neither always runs.  The state is kept in django_dir/.dye_task_state.json
+
+A task that sets something in env that later tasks read can give a setup
+function, which is called with the task's arguments whether or not the
+task is skipped.
+"""
+import os
+from os import path
+import time
+import threading
+import Queue
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from .exceptions import TasksError
+# global dictionary for state
+from .environment import env
+from .util import _file_signature
+
+STATE_FILENAME = '.dye_task_state.json'
+
+_state_lock = threading.Lock()
+
+
+def task(deps=(), file_dep=None, targets=None, setup=None):
+    """Decorator to declare the dependencies, inputs and outputs of a task,
+    and its setup.  The function itself is returned unchanged."""
+    def decorator(fn):
+        fn.task_deps = list(deps)
+        fn.task_file_dep = file_dep
+        fn.task_targets = targets
+        fn.task_setup = setup
+        return fn
+    return decorator
+
+
+def _resolve_paths(paths, args, kwargs):
+    if paths is None:
+        return []
+    if callable(paths):
+        paths = paths(*args, **kwargs)
+    return list(paths)
+
+
+def _get_file_dep_signature(file_dep):
+    """Hash the modification time and size of every file in file_dep, which
+    is much quicker than hashing the contents"""
+    signature = md5()
+    for dep in sorted(file_dep):
+        if path.isdir(dep):
+            for dir_path, dir_names, file_names in os.walk(dep):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    file_path = path.join(dir_path, file_name)
+                    signature.update('%s=%s\n' % (file_path, _file_signature(file_path)))
+        else:
+            signature.update('%s=%s\n' % (dep, _file_signature(dep)))
+    return signature.hexdigest()
+
+
+def _get_targets_signature(targets):
+    """A target must still exist, and a link must still point where the task
+    left it"""
+    parts = []
+    for target in targets:
+        if path.islink(target):
+            parts.append('%s->%s' % (target, os.readlink(target)))
+        elif path.exists(target):
+            parts.append(target)
+        else:
+            return None
+    return ';'.join(parts)
+
+
+def _get_state_path():
+    return path.join(env['django_dir'], STATE_FILENAME)
+
+
+def _read_state():
+    if 'task_state' not in env:
+        env['task_state'] = {}
+        state_path = _get_state_path()
+        if path.isfile(state_path):
+            state_file = open(state_path)
+            try:
+                try:
+                    env['task_state'] = json.load(state_file)
+                except ValueError:
+                    # corrupt state - just run everything
+                    pass
+            finally:
+                state_file.close()
+    return env['task_state']
+
+
+def _write_state(state):
+    state_path = _get_state_path()
+    state_file = open(state_path + '.tmp', 'w')
+    try:
+        json.dump(state, state_file, indent=1, sort_keys=True)
+    finally:
+        state_file.close()
+    os.rename(state_path + '.tmp', state_path)
+
+
+def _get_task_key(name, args, kwargs):
+    return '%s:%s' % (name, json.dumps([list(args), kwargs], sort_keys=True))
+
+
+def _has_up_to_date_check(fn):
+    return getattr(fn, 'task_file_dep', None) is not None or \
+        getattr(fn, 'task_targets', None) is not None
+
+
+def _get_signature(fn, args, kwargs):
+    file_dep = _resolve_paths(fn.task_file_dep, args, kwargs)
+    targets = _resolve_paths(fn.task_targets, args, kwargs)
+    return {
+        'file_dep': _get_file_dep_signature(file_dep),
+        'targets': _get_targets_signature(targets),
+    }
+
+
+def is_up_to_date(fn, *args, **kwargs):
+    if env.get('always_run', False) or not _has_up_to_date_check(fn):
+        return False
+    key = _get_task_key(fn.__name__, args, kwargs)
+    _state_lock.acquire()
+    try:
+        saved_signature = _read_state().get(key)
+    finally:
+        _state_lock.release()
+    if saved_signature is None:
+        return False
+    signature = _get_signature(fn, args, kwargs)
+    return signature['targets'] is not None and signature == saved_signature
+
+
+def run_task(fn, *args, **kwargs):
+    """Call fn unless it is up to date, and record its state if it succeeds.
+    Returns True if fn was run."""
+    setup = getattr(fn, 'task_setup', None)
+    if setup is not None:
+        setup(*args, **kwargs)
+    if is_up_to_date(fn, *args, **kwargs):
+        if env['verbose']:
+            print "### %s is up to date" % fn.__name__
+        return False
+    fn(*args, **kwargs)
+    if _has_up_to_date_check(fn):
+        signature = _get_signature(fn, args, kwargs)
+        _state_lock.acquire()
+        try:
+            state = _read_state()
+            state[_get_task_key(fn.__name__, args, kwargs)] = signature
+            _write_state(state)
+        finally:
+            _state_lock.release()
+    return True
+
+
+class TaskRunner(object):
+    """Run tasks and their dependencies, in dependency order.  With jobs > 1
+    tasks that don't depend on each other are run at the same time.
+
+    find_task is called with a task name and should return the function.
+    """
+
+    def __init__(self, find_task, jobs=1):
+        self.find_task = find_task
+        self.jobs = jobs
+        # the keys in the order they were added - deps always come first
+        self.order = []
+        # key -> (fn, args, kwargs, keys of deps)
+        self.nodes = {}
+        # key -> (name, status, error, exit_code, seconds) - see get_results()
+        self.results = {}
+        self.results_lock = threading.Lock()
+
+    def add(self, name, args=(), kwargs=None, _adding=()):
+        """Add a task (and the tasks it depends on) to be run, and return its
+        key.  A dependency is only run once, however many tasks need it."""
+        kwargs = kwargs or {}
+        key = _get_task_key(name, args, kwargs)
+        if key in _adding:
+            raise TasksError("Circular dependency for task %s" % name)
+        if key in self.nodes:
+            if _adding:
+                return key
+            # a task given twice is still run twice
+            key = '%s#%d' % (key, len(self.order))
+        fn = self.find_task(name)
+        if fn is None:
+            raise TasksError("%s is not a valid task" % name, 2)
+        dep_keys = [self.add(dep, _adding=_adding + (key,))
+                    for dep in getattr(fn, 'task_deps', [])]
+        self.nodes[key] = (fn, tuple(args), kwargs, dep_keys)
+        self.order.append(key)
+        self.results[key] = (name, 'not run', None, None, None)
+        return key
+
+    def _run_node(self, key):
+        fn, args, kwargs, dep_keys = self.nodes[key]
+        name = self.results[key][0]
+        profiler = env.get('profiler')
+        start = time.time()
+        try:
+            if profiler is None:
+                ran = run_task(fn, *args, **kwargs)
+            else:
+                ran = profiler.run_task(name, run_task, fn, *args, **kwargs)
+        except Exception, e:
+            if isinstance(e, TasksError):
+                result = (name, 'failed', e.msg, e.exit_code, time.time() - start)
+            else:
+                result = (name, 'failed', str(e), 1, time.time() - start)
+            self._set_result(key, result)
+            raise
+        if ran:
+            status = 'ok'
+        else:
+            status = 'up to date'
+        self._set_result(key, (name, status, None, 0, time.time() - start))
+
+    def _set_result(self, key, result):
+        self.results_lock.acquire()
+        try:
+            self.results[key] = result
+        finally:
+            self.results_lock.release()
+
+    def get_results(self):
+        """Returns a list with a dict for each task, in the order they were
+        added.  status is one of 'ok', 'up to date', 'failed' or 'not run'
+        (because an earlier task failed)."""
+        results = []
+        for key in self.order:
+            fn, args, kwargs, dep_keys = self.nodes[key]
+            name, status, error, exit_code, seconds = self.results[key]
+            results.append({
+                'task': name,
+                'args': list(args),
+                'kwargs': kwargs,
+                'status': status,
+                'error': error,
+                'exit_code': exit_code,
+                'seconds': seconds,
+            })
+        return results
+
+    def run(self):
+        if self.jobs <= 1:
+            for key in self.order:
+                self._run_node(key)
+        else:
+            self._run_parallel()
+
+    def _run_parallel(self):
+        done = set()
+        started = set()
+        finished = Queue.Queue()
+        errors = []
+
+        def run_node(key):
+            try:
+                self._run_node(key)
+                finished.put((key, None))
+            except Exception, e:
+                finished.put((key, e))
+
+        # multiprocessing is slow to import, so only do it when needed
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.jobs)
+        try:
+            while len(done) < len(self.order):
+                if not errors:
+                    for key in self.order:
+                        if key not in started and \
+                                set(self.nodes[key][3]).issubset(done):
+                            started.add(key)
+                            pool.apply_async(run_node, (key,))
+                if len(started) == len(done):
+                    # an error means nothing more will be started
+                    break
+                key, error = finished.get()
+                done.add(key)
+                if error is not None:
+                    errors.append(error)
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            raise errors[0]
@@ -20,14 +20,23 @@
 
 import os
 from os import path
+import platform
 import sys
 from types import ModuleType
 
 from .django import (collect_static, create_private_settings,
         _install_django_jenkins, link_local_settings, _manage_py,
         _manage_py_jenkins, clean_db, update_db, _infer_environment,
-        create_uploads_dir)
-from .util import _check_call_wrapper, _call_wrapper, _rm_all_pyc
+        create_uploads_dir, _update_db_from_snapshot, _manage_py_tests,
+        _temp_mysqld)
+from . import app_server_config
+from . import celery_config
+from . import webserver_config
+from .exceptions import InvalidArgumentError, InvalidProjectError
+from .hooks import DeployHooks as _DeployHooks, get_hooks as _get_hooks
+from .scheduler import run_task as _run_task
+from .util import (_check_call_wrapper, _call_wrapper, _rm_orphan_pyc,
+        _get_host_facts, _linux_type)
 # this is a global dictionary
 from .environment import env
 
@@ -95,7 +104,7 @@ def update_git_submodules():
         _check_call_wrapper(git_submodule_cmd, cwd=env['vcs_root_dir'], shell=True)
 
 
-def run_tests(*extra_args):
+def run_tests(*extra_args, **kwargs):
     """Run the django tests.
 
     With no arguments it will run all the tests for you apps (as listed in
@@ -104,27 +113,44 @@ def run_tests(*extra_args):
 
     ./tasks.py run_tests:myapp
     ./tasks.py run_tests:myapp.ModelTests,myapp.ViewTests.my_view_test
+
+    Add jobs=N to split the tests between N processes run at the same time,
+    each with its own test database:
+
+    ./tasks.py run_tests:jobs=4
+
+    With jobs (or record_test_times = True in project_settings.py) the tests
+    that failed last time are run first, and the slowest tests are listed at
+    the end (set slowest_tests in project_settings.py to list more or fewer,
+    or 0 for none).
     """
+    jobs = kwargs.pop('jobs', 1)
+    if kwargs:
+        raise InvalidArgumentError("Unknown arguments for run_tests: %s" %
+                                   ', '.join(kwargs))
     if not env['quiet']:
         print "### Running tests"
 
-    args = ['test', '--noinput', '-v0']
-
     if extra_args:
-        args += extra_args
+        test_labels = list(extra_args)
     else:
         # default to running all tests
-        args += env['django_apps']
+        test_labels = env['django_apps']
 
-    _manage_py(args)
+    if jobs > 1 or env.get('record_test_times'):
+        _manage_py_tests(test_labels, jobs)
+    else:
+        _manage_py(['test', '--noinput', '-v0'] + test_labels)
 
 
-def quick_test(*extra_args):
+def quick_test(*extra_args, **kwargs):
     """Run the django tests with local_settings.py.dev_fasttests
 
-    local_settings.py.dev_fasttests (should) use port 3307 so it will work
-    with a mysqld running with a ramdisk, which should be a lot faster. The
-    original environment will be reset afterwards.
+    If mysqld is installed the tests use a temporary mysqld, with its data
+    on a ramdisk, which is a lot faster.  It is stopped again afterwards.
+    Otherwise local_settings.py.dev_fasttests (should) use port 3307 so it
+    will work with scripts/mysqld-ram.sh.  The original environment will be
+    reset afterwards.
 
     With no arguments it will run all the tests for you apps (as listed in
     project_settings.py), but you can also pass in multiple arguments to run
@@ -132,32 +158,43 @@ def quick_test(*extra_args):
 
     ./tasks.py quick_test:myapp
     ./tasks.py quick_test:myapp.ModelTests,myapp.ViewTests.my_view_test
+
+    As for run_tests, add jobs=N to run the tests in N processes.
+
+    The migrated database is restored from a snapshot when the migrations
+    and fixtures have not changed since the snapshot was taken.
     """
     original_environment = _infer_environment()
 
     try:
         link_local_settings('dev_fasttests')
-        update_db()
-        run_tests(*extra_args)
+        with _temp_mysqld():
+            _update_db_from_snapshot()
+            run_tests(*extra_args, **kwargs)
     finally:
         link_local_settings(original_environment)
 
 
 def run_jenkins():
-    """ make sure the local settings is correct and the database exists """
+    """ make sure the local settings is correct and the database exists
+
+    As for quick_test, the tests use a temporary mysqld if mysqld is
+    installed."""
     env['verbose'] = True
     # don't want any stray pyc files causing trouble
-    _rm_all_pyc()
+    _rm_orphan_pyc()
     _install_django_jenkins()
     create_private_settings()
     link_local_settings('jenkins')
-    clean_db()
-    update_db()
-    _manage_py_jenkins()
+    with _temp_mysqld():
+        clean_db()
+        _update_db_from_snapshot()
+        _manage_py_jenkins()
 
 
 def deploy(environment=None):
-    """Do all the required steps in order"""
+    """Do all the required steps in order.  Steps whose inputs have not
+    changed since the last deploy are skipped."""
     if environment:
         env['environment'] = environment
     else:
@@ -165,21 +202,132 @@ def deploy(environment=None):
         if env['verbose']:
             print "Inferred environment as %s" % env['environment']
 
-    create_private_settings()
-    link_local_settings(env['environment'])
-    update_git_submodules()
-    update_db()
+    hooks = _DeployHooks(
+        _get_hooks(env, env['localtasks']), runner='tasklib', command='deploy',
+        project=env['project_name'], environment=env['environment'],
+        host=platform.node())
+    with hooks.phase('deploy'):
+        with hooks.phase('create_private_settings'):
+            _run_task(create_private_settings)
+        with hooks.phase('link_local_settings'):
+            _run_task(link_local_settings, env['environment'])
+        with hooks.phase('update_git_submodules'):
+            update_git_submodules()
+        with hooks.phase('update_db'):
+            update_db()
+
+        with hooks.phase('collect_static'):
+            _run_task(collect_static, environment)
+
+        if env['project_type'] in ["django", "cms"]:
+            with hooks.phase('create_uploads_dir'):
+                create_uploads_dir()
+
+        if hasattr(env['localtasks'], 'post_deploy'):
+            with hooks.phase('post_deploy'):
+                env['localtasks'].post_deploy(env['environment'])
 
-    collect_static(environment)
+    print "\n*** Finished deploying %s for %s." % (
+            env['project_name'], env['environment'])
 
-    if env['project_type'] in ["django", "cms"]:
-        create_uploads_dir()
 
-    if hasattr(env['localtasks'], 'post_deploy'):
-        env['localtasks'].post_deploy(env['environment'])
+def generate_celery_config(output_dir=None):
+    """Write the celeryd and celerybeat configurations for this machine, from
+    celery_queues in project_settings.py, to celery/generated/ (or output_dir)
+    for fab set_up_celery_daemon to install"""
+    if output_dir is None:
+        output_dir = path.join(env['vcs_root_dir'], 'celery', 'generated')
+    # the workers should always run the deployed release
+    if 'current_link' in env:
+        current_dir = env['current_link']
+    elif 'server_project_home' in env:
+        current_dir = path.join(env['server_project_home'], 'current')
+    else:
+        current_dir = env['vcs_root_dir']
+    facts = _get_host_facts()
+    celeryd_config, celerybeat_config = celery_config.render_configs(
+        env.get('celery_queues', celery_config.DEFAULT_QUEUES), facts,
+        chdir=path.join(current_dir, env['relative_django_dir']),
+        python=path.join(current_dir, env['relative_ve_dir'], 'bin', 'python'),
+        user=env.get('celery_user', celery_config.DEFAULT_USER),
+        group=env.get('celery_group'),
+        worker_memory_mb=env.get('celery_worker_memory_mb',
+                                 celery_config.DEFAULT_WORKER_MEMORY_MB),
+        memory_fraction=env.get('celery_memory_fraction',
+                                celery_config.DEFAULT_MEMORY_FRACTION),
+        beat_scheduler=env.get('celerybeat_scheduler',
+                               celery_config.DEFAULT_BEAT_SCHEDULER))
+    celery_config.write_configs(output_dir, celeryd_config, celerybeat_config)
+    if not env['quiet']:
+        print "### Wrote the celery configuration for %d CPUs and %s MB to %s" % (
+            facts['cpu_count'], facts['memory_mb'] or 'unknown', output_dir)
 
-    print "\n*** Finished deploying %s for %s." % (
-            env['project_name'], env['environment'])
+
+def _get_nginx_user():
+    """The user (and group) nginx runs as - the app server runs as it too by
+    default, and its group needs to get at the app server socket"""
+    try:
+        linux_type = _linux_type()
+    except Exception:
+        linux_type = None
+    return 'nginx' if linux_type == 'redhat' else app_server_config.DEFAULT_USER
+
+
+def generate_webserver_conf(environment=None):
+    """Render the webserver_conf_template in project_settings.py for this
+    machine and environment, to generated/<environment>.conf next to the
+    template, for fab link_webserver_conf to link to.  If app_server is set
+    the gunicorn or uWSGI configuration and its systemd units are written
+    there too, for fab set_up_app_server to install."""
+    if 'webserver_conf_template' not in env:
+        raise InvalidProjectError(
+            'webserver_conf_template is not set in project_settings.py')
+    app_server = env.get('app_server')
+    if app_server and app_server not in app_server_config.APP_SERVERS:
+        raise InvalidProjectError(
+            'app_server in project_settings.py must be one of %s, not %s' %
+            (', '.join(app_server_config.APP_SERVERS), app_server))
+    if environment is None:
+        environment = env.get('environment') or _infer_environment()
+    if 'current_link' in env:
+        current_dir = env['current_link']
+    elif 'server_project_home' in env:
+        current_dir = path.join(env['server_project_home'], 'current')
+    else:
+        current_dir = env['vcs_root_dir']
+    paths = {
+        'project_name': env['project_name'],
+        'vcs_root_dir': current_dir,
+        'django_dir': path.join(current_dir, env['relative_django_dir']),
+        'wsgi_dir': path.join(current_dir, env.get('relative_wsgi_dir', 'wsgi')),
+    }
+    facts = _get_host_facts()
+    facts['somaxconn'] = webserver_config.get_somaxconn()
+    values = webserver_config.get_conf_values(
+        environment, facts, paths, env.get('webserver_conf_settings'),
+        env.get('wsgi_process_memory_mb', webserver_config.DEFAULT_PROCESS_MEMORY_MB),
+        env.get('apache_memory_fraction', webserver_config.DEFAULT_MEMORY_FRACTION))
+    if app_server:
+        app_server_config.add_template_values(values, app_server)
+    output_file = webserver_config.get_generated_conf_path(
+        env['vcs_root_dir'], env['webserver_conf_template'], environment)
+    webserver_config.write_conf(
+        path.join(env['vcs_root_dir'], env['webserver_conf_template']),
+        output_file, values, facts)
+    if app_server:
+        # the units refer to the files under current/, like the conf does
+        conf_dir = path.dirname(webserver_config.get_generated_conf_path(
+            current_dir, env['webserver_conf_template'], environment))
+        configs = app_server_config.render_configs(
+            app_server, values, facts, conf_dir,
+            ve_dir=path.join(current_dir, env['relative_ve_dir']),
+            user=env.get('app_server_user', _get_nginx_user()),
+            group=env.get('app_server_group'),
+            socket_group=env.get('app_server_socket_group', _get_nginx_user()))
+        app_server_config.write_configs(path.dirname(output_file), configs)
+    if not env['quiet']:
+        print "### Wrote %s with %d processes of %d threads" % (
+            output_file, values['processes'], values['threads'])
 
 
 def patch_south():
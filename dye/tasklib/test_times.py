@@ -0,0 +1,128 @@
+"""A record of how long each test took and how it went last time it ran.
+
+The record is kept in a sqlite database at django_dir/.dye_test_times.sqlite
+with one row per test id (eg myapp.tests.ModelTests.test_save for the Django
+runner, or myapp/tests.py::ModelTests::test_save for pytest).
+
+Before the tests are run the record is written to a JSON file like:
+
+    {"durations": {"myapp.tests.ModelTests.test_save": 0.52},
+     "failed": ["myapp.tests.ViewTests.test_edit"]}
+
+and dye/shard_runner.py reads that to balance the shards by duration and to
+run the tests that failed last time first.  Each shard writes a JSON list of
+[test id, result, duration] which is added to the record afterwards.
+"""
+from os import path
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# global dictionary for state
+from .environment import env
+
+TEST_TIMES_FILENAME = '.dye_test_times.sqlite'
+FAILED_RESULTS = ('failed', 'error')
+
+
+class TimingDatabase(object):
+
+    def __init__(self, db_path):
+        # only imported when needed, so that tasks.py starts quickly
+        import sqlite3
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS test_times ('
+            'test_id TEXT PRIMARY KEY, duration REAL, last_result TEXT, '
+            'last_run REAL)')
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, results):
+        """results is a list of (test id, result, duration)"""
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO test_times VALUES (?, ?, ?, ?)',
+            [(test_id, duration, result, now) for test_id, result, duration in results])
+        self.conn.commit()
+
+    def get_history(self):
+        durations = {}
+        failed = []
+        for test_id, duration, last_result in self.conn.execute(
+                'SELECT test_id, duration, last_result FROM test_times'):
+            durations[test_id] = duration
+            if last_result in FAILED_RESULTS:
+                failed.append(test_id)
+        return {'durations': durations, 'failed': sorted(failed)}
+
+
+def get_timing_database():
+    return TimingDatabase(path.join(env['django_dir'], TEST_TIMES_FILENAME))
+
+
+def write_history_file(timing_db, history_file):
+    f = open(history_file, 'w')
+    try:
+        json.dump(timing_db.get_history(), f)
+    finally:
+        f.close()
+
+
+def read_results_file(results_file):
+    """Returns the list of (test id, result, duration) written by a shard, or
+    an empty list if the shard did not get as far as writing it"""
+    try:
+        f = open(results_file)
+        try:
+            return [tuple(result) for result in json.load(f)]
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return []
+
+
+def read_junit_results(junit_file):
+    """Returns the list of (test id, result, duration) from the junit.xml
+    written by django-jenkins"""
+    from xml.etree import ElementTree
+    results = []
+    for testcase in ElementTree.parse(junit_file).findall('.//testcase'):
+        test_id = '%s.%s' % (testcase.get('classname'), testcase.get('name'))
+        if testcase.find('failure') is not None:
+            result = 'failed'
+        elif testcase.find('error') is not None:
+            result = 'error'
+        elif testcase.find('skipped') is not None:
+            result = 'skipped'
+        else:
+            result = 'passed'
+        results.append((test_id, result, float(testcase.get('time') or 0)))
+    return results
+
+
+def _get_test_class(test_id):
+    if '::' in test_id:
+        return test_id.rsplit('::', 1)[0]
+    return test_id.rsplit('.', 1)[0]
+
+
+def print_slowest_tests(results, count=10):
+    """Print the slowest tests, and the slowest test classes, of a run"""
+    if not results or count <= 0:
+        return
+    slowest = sorted(results, key=lambda result: -result[2])[:count]
+    print "### Slowest tests:"
+    for test_id, result, duration in slowest:
+        print "%8.2fs %s" % (duration, test_id)
+    class_durations = {}
+    for test_id, result, duration in results:
+        test_class = _get_test_class(test_id)
+        class_durations[test_class] = class_durations.get(test_class, 0) + duration
+    slowest_classes = sorted(class_durations.items(), key=lambda item: -item[1])
+    print "### Slowest test classes:"
+    for test_class, duration in slowest_classes[:count]:
+        print "%8.2fs %s" % (duration, test_class)
@@ -1,10 +1,18 @@
 import os
 from os import path
 from getpass import getpass
+import socket
+from contextlib import contextmanager
 
 from .environment import env
 from .exceptions import InvalidPasswordError
 
+try:
+    import resource
+except ImportError:
+    # not on windows
+    resource = None
+
 # make sure WindowsError is available
 import __builtin__
 if not hasattr(__builtin__, 'WindowsError'):
@@ -18,7 +26,12 @@ try:
     from subprocess import call as _call_command
 
     def _capture_command(argv):
-        return subprocess.Popen(argv, stdout=subprocess.PIPE).communicate()[0]
+        with _record_command(argv, source='_capture_command') as record:
+            popen = subprocess.Popen(argv, stdout=subprocess.PIPE)
+            output = popen.communicate()[0]
+            record['exit_code'] = popen.returncode
+            record['output_bytes'] = len(output)
+        return output
 
 except ImportError:
     # this section is for python older than 2.4 - basically for CentOS 4
@@ -64,6 +77,47 @@ except ImportError:
                 (self.cmd, self.returncode)
 
 
+def _format_command(command):
+    if isinstance(command, basestring):
+        return command
+    return ' '.join(command)
+
+
+def _get_child_usage():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _get_child_times():
+    """The user and system time of the children that have finished"""
+    usage = _get_child_usage()
+    if usage is None:
+        return 0.0, 0.0
+    return usage.ru_utime, usage.ru_stime
+
+
+def _file_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return '-'
+    return '%s:%s' % (stat.st_mtime, stat.st_size)
+
+
+@contextmanager
+def _record_command(argv, cwd=None, source=None):
+    """Time argv for tasks.py --profile, and write it to the trace for
+    tasks.py --trace.  The dict yielded can be given the exit_code and
+    output_bytes of the command."""
+    # not at the top, as profiling and trace use the helpers above
+    from .profiling import record_command
+    from .trace import trace_command
+    with record_command(env.get('profiler'), argv):
+        with trace_command(env.get('tracer'), argv, cwd, source) as record:
+            yield record
+
+
 def _call_wrapper(argv, **kwargs):
     if env['verbose']:
         if hasattr(argv, '__iter__'):
@@ -71,7 +125,10 @@ def _call_wrapper(argv, **kwargs):
         else:
             command = argv
         print "Executing command: %s" % command
-    return _call_command(argv, **kwargs)
+    with _record_command(argv, kwargs.get('cwd'), '_call_wrapper') as record:
+        returncode = _call_command(argv, **kwargs)
+        record['exit_code'] = returncode
+    return returncode
 
 
 def _check_call_wrapper(argv, accepted_returncode_list=[0], **kwargs):
@@ -93,10 +150,19 @@ def _create_dir_if_not_exists(dir_path, world_writeable=False, owner=None):
         _check_call_wrapper(['chown', '-R', owner, dir_path])
 
 
-def _rm_all_pyc():
-    """Remove all pyc files, to be sure"""
-    _call_wrapper('find . -type f -name \*.pyc -exec rm {} \\;', shell=True,
-                  cwd=env['vcs_root_dir'])
+def _rm_orphan_pyc():
+    """Remove the pyc files that have no py file any more, which python would
+    still import.  The others are rewritten by python when they are out of
+    date, so keeping them saves compiling everything again.  The virtualenv
+    is left to pip."""
+    skip_dirs = set([path.join(env['vcs_root_dir'], '.git'), env.get('ve_dir')])
+    for dir_path, dir_names, file_names in os.walk(env['vcs_root_dir']):
+        dir_names[:] = [name for name in dir_names
+                        if path.join(dir_path, name) not in skip_dirs]
+        names = set(file_names)
+        for name in file_names:
+            if name.endswith('.pyc') and name[:-1] not in names:
+                os.remove(path.join(dir_path, name))
 
 
 def _ask_for_password(prompt, test_fn=None, max_attempts=3):
@@ -149,3 +215,27 @@ def _linux_type():
     else:
         # TODO: should we print a warning here?
         raise Exception("could not determine linux type of machine")
+
+
+def _get_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        # not available on this platform
+        return None
+
+
+def _get_host_facts():
+    """The host name, number of CPUs and memory (in MB, or None if we can't
+    tell) of this machine, for generating configuration to suit it"""
+    # not imported at the top, as it is slow and every tasks.py imports us
+    import multiprocessing
+    try:
+        cpu_count = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpu_count = 1
+    return {
+        'host': socket.getfqdn(),
+        'cpu_count': cpu_count,
+        'memory_mb': _get_memory_mb(),
+    }
@@ -0,0 +1,154 @@
+"""Render the webserver (Apache and mod_wsgi) configuration from a template,
+with the mod_wsgi daemon processes tuned to the machine.
+
+The template is the file named by webserver_conf_template in
+project_settings.py, relative to the VCS root, and uses string.Template
+$name (or ${name}) substitution - so it can keep Apache's %{GROUP} and the
+like, but a literal $ must be written $$.  It can use:
+
+* project_name, environment, vcs_root_dir, django_dir and wsgi_dir - the
+  directories are under current/, so they follow the deployed release
+* processes, threads, maximum_requests, listen_backlog, inactivity_timeout,
+  graceful_timeout and static_expiry_seconds - worked out from the machine
+* anything in webserver_conf_settings, which overrides all of the above:
+
+    webserver_conf_settings = {
+        'default': {'inactivity_timeout': 600},
+        'production': {'server_name': 'www.example.org', 'processes': 4},
+        'staging': {'server_name': 'example.stage.example.org'},
+    }
+
+The processes are one per CPU, but no more than fit in apache_memory_fraction
+(default 0.5) of the memory at wsgi_process_memory_mb (default 250) each.
+Each one gets fewer threads the more processes there are, as the threads of a
+process share the GIL.  When memory limits the processes they are also
+recycled sooner.
+"""
+import os
+from os import path
+from string import Template
+
+from .exceptions import TasksError
+
+DEFAULT_PROCESS_MEMORY_MB = 250
+DEFAULT_MEMORY_FRACTION = 0.5
+# threads per process, shared out between the processes
+TOTAL_THREADS = 30
+MIN_THREADS = 5
+MAX_THREADS = 15
+MAXIMUM_REQUESTS = 1000
+MAXIMUM_REQUESTS_LOW_MEMORY = 500
+MIN_LISTEN_BACKLOG = 100
+INACTIVITY_TIMEOUT = 300
+GRACEFUL_TIMEOUT = 15
+# static files can be cached for longer on production, where they change
+# only when we deploy
+STATIC_EXPIRY_SECONDS = {'production': 7 * 24 * 3600}
+DEFAULT_STATIC_EXPIRY_SECONDS = 300
+SOMAXCONN_FILE = '/proc/sys/net/core/somaxconn'
+GENERATED_DIRNAME = 'generated'
+
+CONF_HEADER = """\
+# Generated by dye's generate_webserver_conf from %(template)s for %(host)s,
+# which has %(cpu_count)s CPUs and %(memory_mb)s MB of memory.  It is written
+# again on every deploy, so change the template or project_settings.py.
+
+"""
+
+
+def get_somaxconn():
+    """The most connections the kernel will queue for a socket, which caps
+    the listen backlog, or None if we can't tell"""
+    try:
+        f = open(SOMAXCONN_FILE)
+        try:
+            return int(f.read().strip())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+
+def get_generated_conf_path(vcs_root_dir, template, environment):
+    """Where the configuration for environment rendered from template goes -
+    fablib uses this too, to link to it"""
+    return path.join(vcs_root_dir, path.dirname(template), GENERATED_DIRNAME,
+                     environment + '.conf')
+
+
+def get_wsgi_tuning(facts, environment, process_memory_mb=DEFAULT_PROCESS_MEMORY_MB,
+                    memory_fraction=DEFAULT_MEMORY_FRACTION):
+    """The mod_wsgi daemon settings to suit the machine described by facts,
+    as from _get_host_facts() with somaxconn added"""
+    processes = facts['cpu_count']
+    memory_limited = False
+    if facts.get('memory_mb') and process_memory_mb:
+        memory_processes = int(facts['memory_mb'] * memory_fraction // process_memory_mb)
+        if memory_processes < processes:
+            processes = memory_processes
+            memory_limited = True
+    processes = max(processes, 1)
+    threads = max(MIN_THREADS, min(MAX_THREADS, TOTAL_THREADS // processes))
+    listen_backlog = max(MIN_LISTEN_BACKLOG, processes * threads * 2)
+    if facts.get('somaxconn'):
+        listen_backlog = min(listen_backlog, facts['somaxconn'])
+    return {
+        'processes': processes,
+        'threads': threads,
+        'maximum_requests': (MAXIMUM_REQUESTS_LOW_MEMORY if memory_limited
+                             else MAXIMUM_REQUESTS),
+        'listen_backlog': listen_backlog,
+        'inactivity_timeout': INACTIVITY_TIMEOUT,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'static_expiry_seconds': STATIC_EXPIRY_SECONDS.get(
+            environment, DEFAULT_STATIC_EXPIRY_SECONDS),
+    }
+
+
+def get_conf_values(environment, facts, paths, conf_settings=None,
+                    process_memory_mb=DEFAULT_PROCESS_MEMORY_MB,
+                    memory_fraction=DEFAULT_MEMORY_FRACTION):
+    """The values for the template - paths, then the tuning, then the
+    'default' and environment entries of conf_settings"""
+    conf_settings = conf_settings or {}
+    values = dict(paths)
+    values['environment'] = environment
+    values.update(get_wsgi_tuning(facts, environment, process_memory_mb, memory_fraction))
+    values.update(conf_settings.get('default', {}))
+    values.update(conf_settings.get(environment, {}))
+    return values
+
+
+def render_conf(template_text, values):
+    try:
+        return Template(template_text).substitute(values)
+    except KeyError, e:
+        raise TasksError(
+            'The webserver conf template uses $%s, which is not set - add it to '
+            'webserver_conf_settings in project_settings.py' % e.args[0])
+    except ValueError, e:
+        raise TasksError('Could not render the webserver conf template: %s' % e)
+
+
+def write_conf(template_file, output_file, values, facts):
+    """Render template_file with values and write it to output_file"""
+    f = open(template_file)
+    try:
+        template_text = f.read()
+    finally:
+        f.close()
+    conf = render_conf(template_text, values)
+    header = CONF_HEADER % {
+        'template': path.basename(template_file),
+        'host': facts['host'],
+        'cpu_count': facts['cpu_count'],
+        'memory_mb': facts['memory_mb'] or 'unknown',
+    }
+    output_dir = path.dirname(output_file)
+    if not path.isdir(output_dir):
+        os.makedirs(output_dir)
+    f = open(output_file, 'w')
+    try:
+        f.write(header + conf)
+    finally:
+        f.close()
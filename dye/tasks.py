@@ -7,6 +7,7 @@
 
 Usage:
     tasks.py [-d DEPLOYDIR] [options] <tasks>...
+    tasks.py [-d DEPLOYDIR] [options] (--serve | --stop-server)
     tasks.py [-d DEPLOYDIR] -h | --help
 
 Options:
@@ -16,9 +17,27 @@ Options:
     -d, --deploydir DEPLOYDIR  Set the deploy dir (where to find project_settings.py
                                and, optionally, localtasks.py)  Defaults to the
                                directory that contains tasks.py
+    -j, --jobs JOBS            Run up to JOBS tasks at once, where the tasks don't
+                               depend on each other [default: 1]
+    -a, --always-run           Run tasks even when they are up to date
+    --json-results             Finish by printing a line with the result of each
+                               task as JSON (used by fablib)
+    --profile=PROFILE          Run each task under cProfile and time the commands
+                               it runs.  The profile is written to PROFILE, and a
+                               summary of each task to PROFILE.txt.  PROFILE can
+                               be left out, to use dye_tasks.prof
+    --profile-top=N            The number of functions to list for each task in
+                               the summary [default: 20]
+    --trace=TRACE              Write each command run to TRACE as a line of JSON,
+                               with its time, exit code and CPU time.  TRACE can
+                               be left out, to use dye_tasks_trace.jsonl.  Run
+                               python -m dye.tasklib.trace TRACE to summarise it
     -n, --noinput              Never ask for input from the user (for scripts)
     -q, --quiet                Print less output while executing (note: not none)
     -v, --verbose              Print extra output while executing
+    --serve                    Start a server that keeps tasks.py loaded, so that
+                               later calls of deploy/tasks.py start quicker
+    --stop-server              Stop the server started by --serve
     -h, --help                 Print this help text
 
 You can pass arguments to the tasks listed below, by adding the argument after a
@@ -33,18 +52,43 @@ $ ./tasks.py deploy:environment=staging
 Multiple arguments are separated by commas:
 
 $ ./tasks.py deploy:environment=staging,arg2=somevalue
+
+Tasks can depend on other tasks, which are run first.  A task that declares
+the files it reads and creates is skipped if it has run before with the same
+arguments and none of those files have changed since.  The tasks given are
+run in order unless you use --jobs.
+
+While a server started with --serve is running, deploy/tasks.py passes the
+tasks to it to run.  Set DYE_NO_TASKS_SERVER to run them directly instead,
+for example for a task that needs to ask you something.
 """
 
 import os
 import sys
-import docopt
 import inspect
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 from dye import tasklib
 from dye.tasklib.exceptions import TasksError
+from dye.tasklib.profiling import Profiler
+from dye.tasklib.trace import Tracer
+from dye.tasklib.scheduler import TaskRunner
 
 localtasks = None
 
+# task name -> 'localtasks' or 'tasklib' - see get_task_registry()
+_task_registry = None
+REGISTRY_CACHE_FILENAME = '.tasks_registry.json'
+
+# the start of the line printed by --json-results - fablib looks for this
+JSON_RESULTS_PREFIX = 'tasks.py results: '
+# the files for --profile and --trace without a file name
+DEFAULT_PROFILE_FILENAME = 'dye_tasks.prof'
+DEFAULT_TRACE_FILENAME = 'dye_tasks_trace.jsonl'
+
 
 def invalid_command(cmd):
     print "Tasks.py:"
@@ -64,16 +108,103 @@ def get_public_callables(mod):
     return callables
 
 
+def _get_tasklib_modules():
+    # the modules whose functions tasklib/__init__.py makes into tasks - the
+    # functions they import from elsewhere in tasklib are not tasks
+    return (tasklib.django.__name__, tasklib.tasklib.__name__)
+
+
+def _build_task_registry():
+    registry = {}
+    tasklib_modules = _get_tasklib_modules()
+    for name in get_public_callables(tasklib):
+        if getattr(tasklib, name).__module__ in tasklib_modules:
+            registry[name] = 'tasklib'
+    # localtasks have priority
+    for name in get_public_callables(localtasks):
+        registry[name] = 'localtasks'
+    return registry
+
+
+def _get_registry_source_files():
+    tasklib_dir = os.path.dirname(os.path.abspath(tasklib.__file__))
+    source_files = [os.path.join(tasklib_dir, f) for f in sorted(os.listdir(tasklib_dir))
+                    if f.endswith('.py')]
+    if localtasks is not None:
+        source_files.append(os.path.join(tasklib.env['deploy_dir'], 'localtasks.py'))
+    return source_files
+
+
+def _get_registry_signature():
+    parts = []
+    for source_file in _get_registry_source_files():
+        try:
+            stat = os.stat(source_file)
+            parts.append('%s:%s:%s' % (source_file, stat.st_mtime, stat.st_size))
+        except OSError:
+            parts.append('%s:-' % source_file)
+    return ';'.join(parts)
+
+
+def _get_registry_cache_path():
+    return os.path.join(tasklib.env['deploy_dir'], REGISTRY_CACHE_FILENAME)
+
+
+def _read_registry_cache(signature):
+    try:
+        cache_file = open(_get_registry_cache_path())
+        try:
+            cache = json.load(cache_file)
+        finally:
+            cache_file.close()
+    except (IOError, ValueError):
+        return None
+    if cache.get('signature') != signature:
+        return None
+    return dict((str(name), str(source)) for name, source in cache['tasks'].items())
+
+
+def _write_registry_cache(signature, registry):
+    cache_path = _get_registry_cache_path()
+    try:
+        cache_file = open(cache_path + '.tmp', 'w')
+        try:
+            json.dump({'signature': signature, 'tasks': registry}, cache_file)
+        finally:
+            cache_file.close()
+        os.rename(cache_path + '.tmp', cache_path)
+    except (IOError, OSError):
+        # the deploy dir may not be writable - we just won't have a cache
+        pass
+
+
+def get_task_registry():
+    """Returns a dict of task name to where the task comes from, 'localtasks'
+    or 'tasklib'.  This is built once per process, and cached on disk until
+    tasklib or localtasks.py change, so that looking up tasks doesn't scan
+    the modules each time."""
+    global _task_registry
+    if _task_registry is None:
+        signature = _get_registry_signature()
+        _task_registry = _read_registry_cache(signature)
+        if _task_registry is None:
+            _task_registry = _build_task_registry()
+            _write_registry_cache(signature, _task_registry)
+    return _task_registry
+
+
 def tasklib_list():
-    return get_public_callables(tasklib)
+    return [name for name, source in get_task_registry().items()
+            if source == 'tasklib']
 
 
 def localtasks_list():
-    return get_public_callables(localtasks)
+    return [name for name, source in get_task_registry().items()
+            if source == 'localtasks']
 
 
 def tasks_available():
-    tasks = list(set(tasklib_list() + localtasks_list()))
+    tasks = get_task_registry().keys()
     tasks.sort()
     return tasks
 
@@ -96,6 +227,9 @@ def print_description(task_name, task_function):
     else:
         print "No description found for %s" % task_name
     print
+    if getattr(task_function, 'task_deps', None):
+        print "%s depends on: %s" % (task_name, ', '.join(task_function.task_deps))
+        print
     argspec = inspect.getargspec(task_function)
     if len(argspec.args) == 0:
         if argspec.varargs is None:
@@ -116,11 +250,8 @@ def print_description(task_name, task_function):
 def describe_task(args):
     for arg in args:
         task = arg.split(':', 1)[0]
-        if hasattr(localtasks, task):
-            taskf = getattr(localtasks, task)
-            print_description(task, taskf)
-        elif hasattr(tasklib, task):
-            taskf = getattr(tasklib, task)
+        taskf = find_task(task)
+        if taskf is not None:
             print_description(task, taskf)
         else:
             print "%s: no such task found" % task
@@ -166,16 +297,54 @@ def convert_task_bits(task_bits):
     return task, pos_args, kwargs_dict
 
 
+def find_task(fname):
+    """work out which function to call - localtasks have priority"""
+    source = get_task_registry().get(fname)
+    if source == 'localtasks':
+        return getattr(localtasks, fname, None)
+    elif source == 'tasklib':
+        return getattr(tasklib, fname, None)
+    return None
+
+
+def print_json_results(runner):
+    # flush so the results come after any output of the tasks
+    sys.stderr.flush()
+    print JSON_RESULTS_PREFIX + json.dumps(runner.get_results())
+    sys.stdout.flush()
+
+
+def _set_default_files(argv):
+    # docopt can't have an option whose value is optional
+    defaults = {
+        '--profile': '--profile=' + DEFAULT_PROFILE_FILENAME,
+        '--trace': '--trace=' + DEFAULT_TRACE_FILENAME,
+    }
+    return [defaults.get(arg, arg) for arg in argv]
+
+
+def write_profile(profiler):
+    summary_file = profiler.write()
+    print >>sys.stderr, "### Profile written to %s and %s" % (
+        profiler.profile_file, summary_file)
+
+
 def main(argv):
-    global localtasks
+    global localtasks, _task_registry
+    # only imported here, so that importing this module stays quick
+    import docopt
 
-    options = docopt.docopt(__doc__, argv, help=False)
+    options = docopt.docopt(__doc__, _set_default_files(argv), help=False)
 
     # need to set this before doing task-description or help
     if options['--deploydir']:
-        tasklib.env['deploy_dir'] = options['--deploydir']
+        deploy_dir = options['--deploydir']
     else:
-        tasklib.env['deploy_dir'] = os.path.dirname(__file__)
+        deploy_dir = os.path.dirname(__file__)
+    if tasklib.env.get('deploy_dir') != deploy_dir:
+        # the deploy dir, and so localtasks, is different this time
+        _task_registry = None
+    tasklib.env['deploy_dir'] = deploy_dir
     # first we need to find and load the project settings
     sys.path.append(tasklib.env['deploy_dir'])
     # now see if we can find localtasks
@@ -197,6 +366,13 @@ def main(argv):
     tasklib.env['verbose'] = options['--verbose']
     tasklib.env['quiet'] = options['--quiet']
     tasklib.env['noinput'] = options['--noinput']
+    tasklib.env['always_run'] = options['--always-run']
+    try:
+        jobs = int(options['--jobs'])
+        profile_top = int(options['--profile-top'])
+    except ValueError:
+        print "--jobs and --profile-top must be numbers"
+        return 2
 
     try:
         import project_settings
@@ -210,25 +386,43 @@ def main(argv):
             localtasks._setup_paths()
     # now set up the various paths required
     tasklib._setup_paths(project_settings, localtasks)
-    # process arguments - just call the function with that name
-    for arg in options['<tasks>']:
-        fname, pos_args, kwargs = convert_task_bits(arg)
-        # work out which function to call - localtasks have priority
-        f = None
-        if fname in localtasks_list():
-            f = getattr(localtasks, fname)
-        elif fname in tasklib_list():
-            f = getattr(tasklib, fname)
-        else:
-            invalid_command(fname)
-            return 2
-
-        # call the function
-        try:
-            f(*pos_args, **kwargs)
-        except TasksError as e:
-            print >>sys.stderr, e.msg
-            return e.exit_code
+    if options['--serve'] or options['--stop-server']:
+        from dye import tasks_server
+        # requests are run from the directory the client was in
+        tasklib.env['deploy_dir'] = os.path.abspath(tasklib.env['deploy_dir'])
+        if options['--stop-server']:
+            return tasks_server.stop_server(tasklib.env['deploy_dir'])
+        # load everything now, so each request doesn't have to
+        get_task_registry()
+        return tasks_server.serve(tasklib.env['deploy_dir'], main)
+    profiler = None
+    if options['--profile']:
+        profiler = Profiler(os.path.abspath(options['--profile']), profile_top)
+        tasklib.env['profiler'] = profiler
+    if options['--trace']:
+        tasklib.env['tracer'] = Tracer(os.path.abspath(options['--trace']))
+    # process arguments - find the function with that name
+    runner = TaskRunner(find_task, jobs=jobs)
+    try:
+        for arg in options['<tasks>']:
+            fname, pos_args, kwargs = convert_task_bits(arg)
+            if find_task(fname) is None:
+                invalid_command(fname)
+                return 2
+            runner.add(fname, pos_args, kwargs)
+
+        # call the functions
+        runner.run()
+    except TasksError as e:
+        print >>sys.stderr, e.msg
+        return e.exit_code
+    finally:
+        tasklib.env.pop('tracer', None)
+        if profiler is not None:
+            del tasklib.env['profiler']
+            write_profile(profiler)
+        if options['--json-results']:
+            print_json_results(runner)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,302 @@
+"""Keep a warm tasks.py running, so that repeated calls don't pay for starting
+python and importing dye, project_settings and localtasks every time.
+
+`tasks.py --serve` starts a daemon listening on a Unix socket in the deploy
+dir.  When the socket exists deploy/tasks.py sends its arguments there (see
+run_in_tasks_server() in ve_mgr.py) and the daemon forks a child, which
+already has everything imported, to run them.
+
+The client sends one line of JSON, either
+
+    {"argv": [...], "cwd": "/path", "environ": {...}}
+
+or {"command": "stop"}.  The server replies with frames of a one character
+type, a 4 byte big endian length and then the data:
+
+    o - data written to stdout
+    e - data written to stderr
+    x - the exit code, as text
+    r - the server is restarting, so the client should run tasks.py itself
+
+The server restarts itself when project_settings.py, localtasks.py or any
+part of dye changes.  Tasks run by the server can't ask for input, so they
+are always run with --noinput.
+"""
+import os
+from os import path
+import sys
+import errno
+import select
+import socket
+import struct
+import threading
+import traceback
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+SOCKET_FILENAME = '.tasks_server.sock'
+LOG_FILENAME = '.tasks_server.log'
+FRAME_HEADER = '>cI'
+# how often to check for changes when there are no requests
+WATCH_INTERVAL = 2.0
+# set when we re-exec ourselves, so we don't daemonize again
+RESTART_ENV_VAR = 'DYE_TASKS_SERVER_RESTART'
+
+
+def get_socket_path(deploy_dir):
+    return path.join(deploy_dir, SOCKET_FILENAME)
+
+
+def send_frame(conn, frame_type, data):
+    conn.sendall(struct.pack(FRAME_HEADER, frame_type, len(data)) + data)
+
+
+def _recv_exactly(conn, length):
+    data = ''
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _to_str(value):
+    """json gives us unicode, but docopt and os.environ want str"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_to_str(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in value.items())
+    return value
+
+
+def _read_request(conn):
+    data = ''
+    while not data.endswith('\n'):
+        chunk = conn.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+    return _to_str(json.loads(data))
+
+
+def _get_watched_files(deploy_dir):
+    dye_dir = path.dirname(path.abspath(__file__))
+    watched_files = [path.join(deploy_dir, 'project_settings.py'),
+                     path.join(deploy_dir, 'localtasks.py')]
+    for dir_path, dir_names, file_names in os.walk(dye_dir):
+        dir_names.sort()
+        watched_files += [path.join(dir_path, f) for f in sorted(file_names)
+                          if f.endswith('.py')]
+    return watched_files
+
+
+def _get_watched_signature(deploy_dir):
+    parts = []
+    for watched_file in _get_watched_files(deploy_dir):
+        try:
+            stat = os.stat(watched_file)
+            parts.append('%s:%s:%s' % (watched_file, stat.st_mtime, stat.st_size))
+        except OSError:
+            parts.append('%s:-' % watched_file)
+    return ';'.join(parts)
+
+
+def _connect(socket_path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except socket.error:
+        conn.close()
+        return None
+    return conn
+
+
+def _daemonize(deploy_dir):
+    """The usual double fork, with output going to a log file in the deploy
+    dir.  Returns True in the parent, False in the daemon."""
+    pid = os.fork()
+    if pid != 0:
+        # wait for the first child, which exits straight away
+        os.waitpid(pid, 0)
+        return True
+    os.setsid()
+    if os.fork() != 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    log = os.open(path.join(deploy_dir, LOG_FILENAME),
+                  os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0600)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    return False
+
+
+def _reap_children():
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError, e:
+            if e.errno == errno.ECHILD:
+                return
+            raise
+        if pid == 0:
+            return
+
+
+def _run_request(conn, request, tasks_main):
+    """Run in the forked child - run the tasks with stdout and stderr sent
+    back to the client.  The output of any commands the tasks run goes back
+    too, as we redirect the file descriptors rather than sys.stdout."""
+    os.chdir(request['cwd'])
+    virtual_env = os.environ.get('VIRTUAL_ENV')
+    os.environ.clear()
+    os.environ.update(request['environ'])
+    if virtual_env:
+        os.environ['VIRTUAL_ENV'] = virtual_env
+
+    send_lock = threading.Lock()
+
+    def forward(read_fd, frame_type):
+        while True:
+            data = os.read(read_fd, 4096)
+            if not data:
+                break
+            send_lock.acquire()
+            try:
+                send_frame(conn, frame_type, data)
+            finally:
+                send_lock.release()
+        os.close(read_fd)
+
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    threads = []
+    for fd, frame_type in ((1, 'o'), (2, 'e')):
+        read_fd, write_fd = os.pipe()
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+        thread = threading.Thread(target=forward, args=(read_fd, frame_type))
+        thread.start()
+        threads.append(thread)
+    sys.stdout = os.fdopen(1, 'w', 0)
+    sys.stderr = os.fdopen(2, 'w', 0)
+
+    argv = list(request['argv'])
+    if '-n' not in argv and '--noinput' not in argv:
+        argv.insert(0, '--noinput')
+    try:
+        exit_code = tasks_main(argv)
+    except SystemExit, e:
+        exit_code = e.code
+    except:
+        traceback.print_exc()
+        exit_code = 1
+    if exit_code is None:
+        exit_code = 0
+    elif not isinstance(exit_code, int):
+        exit_code = 1
+
+    # closing our end of the pipes lets the forwarding threads finish
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    for thread in threads:
+        # a command left running in the background could keep the pipe
+        # open, so don't wait for ever
+        thread.join(5)
+    send_frame(conn, 'x', str(exit_code))
+
+
+def _restart():
+    os.environ[RESTART_ENV_VAR] = 'true'
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def serve(deploy_dir, tasks_main, daemonize=True):
+    """Listen on the socket in deploy_dir, and run tasks_main(argv) in a
+    forked child for each request."""
+    socket_path = get_socket_path(deploy_dir)
+    existing = _connect(socket_path)
+    if existing is not None:
+        existing.close()
+        print >>sys.stderr, "tasks.py server already running for %s" % deploy_dir
+        return 1
+    if path.exists(socket_path):
+        # left behind by a server that didn't shut down cleanly
+        os.remove(socket_path)
+
+    restarted = os.environ.pop(RESTART_ENV_VAR, None) is not None
+    if daemonize and not restarted:
+        if _daemonize(deploy_dir):
+            print "tasks.py server started, listening on %s" % socket_path
+            return 0
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the server runs whatever it is sent, so only we should be able to
+    # connect to it
+    old_umask = os.umask(0077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(5)
+    signature = _get_watched_signature(deploy_dir)
+
+    try:
+        while True:
+            _reap_children()
+            readable = select.select([listener], [], [], WATCH_INTERVAL)[0]
+            changed = _get_watched_signature(deploy_dir) != signature
+            if not readable:
+                if changed:
+                    break
+                continue
+            conn, _ = listener.accept()
+            try:
+                request = _read_request(conn)
+                if request is None:
+                    continue
+                if request.get('command') == 'stop':
+                    send_frame(conn, 'x', '0')
+                    return 0
+                if changed:
+                    # remove the socket first, so no more clients queue up
+                    # on a server that won't answer them
+                    os.remove(socket_path)
+                    send_frame(conn, 'r', '')
+                    break
+                if os.fork() == 0:
+                    listener.close()
+                    try:
+                        _run_request(conn, request, tasks_main)
+                    finally:
+                        os._exit(0)
+            finally:
+                conn.close()
+    finally:
+        listener.close()
+        if path.exists(socket_path):
+            os.remove(socket_path)
+    # we only get here if something we have imported has changed
+    print "Restarting tasks.py server as files have changed"
+    _restart()
+
+
+def stop_server(deploy_dir):
+    conn = _connect(get_socket_path(deploy_dir))
+    if conn is None:
+        print "No tasks.py server running for %s" % deploy_dir
+        return 0
+    try:
+        conn.sendall(json.dumps({'command': 'stop'}) + '\n')
+        header = _recv_exactly(conn, struct.calcsize(FRAME_HEADER))
+    finally:
+        conn.close()
+    if header is None:
+        return 1
+    print "Stopped tasks.py server for %s" % deploy_dir
+    return 0
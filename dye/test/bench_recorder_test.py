@@ -0,0 +1,95 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import types
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+from bench import recorder
+
+
+def make_fake_fablib(copied_file):
+    fablib = types.ModuleType('fake_fablib')
+    fablib.commands = []
+    fablib.run = lambda command: fablib.commands.append(command)
+    fablib.local = lambda command: fablib.commands.append(command)
+    fablib.put = lambda local_path, remote_path: None
+    fablib.get = lambda remote_path, local_path=None: None
+
+    def checkout():
+        fablib.run('git fetch')
+        fablib.run('git merge')
+
+    def deploy():
+        fablib.checkout()
+        fablib.put(copied_file, '/tmp/x')
+        fablib.local('git rev-parse HEAD')
+    fablib.checkout = checkout
+    fablib.deploy = deploy
+    return fablib
+
+
+class PhaseRecorderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.copied_file = path.join(self.testdir, 'copied')
+        with open(self.copied_file, 'w') as f:
+            f.write('x' * 100)
+        self.fablib = make_fake_fablib(self.copied_file)
+        self.recorder = recorder.PhaseRecorder()
+        self.recorder.watch_commands(self.fablib)
+
+    def tearDown(self):
+        self.recorder.restore()
+        shutil.rmtree(self.testdir)
+
+    def test_commands_counted_against_phase(self):
+        self.recorder.watch_phases(self.fablib, ['checkout'])
+        self.fablib.deploy()
+        phases = self.recorder.get_summary(1.0)['phases']
+        self.assertEqual(2, phases['checkout']['remote_commands'])
+        self.assertEqual(1, phases['other']['local_commands'])
+        self.assertEqual(100, phases['other']['bytes_copied'])
+
+    def test_nested_phases_count_as_outer_phase(self):
+        self.recorder.watch_phases(self.fablib, ['checkout', 'deploy'])
+        self.fablib.deploy()
+        summary = self.recorder.get_summary(0.0)
+        self.assertEqual(['deploy'], summary['phases'].keys())
+        self.assertEqual(2, summary['remote_commands'])
+        self.assertEqual(1, summary['phases']['deploy']['calls'])
+
+    def test_restore_puts_functions_back(self):
+        original_run = self.fablib.run
+        self.recorder.restore()
+        self.assertNotEqual(original_run, self.fablib.run)
+        self.fablib.deploy()
+        self.assertEqual({}, self.recorder.phases)
+
+
+class CompareResultsTests(unittest.TestCase):
+
+    def make_run(self, wall_time, commands):
+        phase = {'wall_time': wall_time, 'calls': 1, 'remote_commands': commands,
+                 'local_commands': 0, 'bytes_copied': 0}
+        return dict(phase, phases={'checkout_or_update': phase})
+
+    def test_medians_compared(self):
+        old = {'scenarios': {'full_deploy': [self.make_run(10.0, 5),
+                                             self.make_run(30.0, 5),
+                                             self.make_run(12.0, 5)]}}
+        new = {'scenarios': {'full_deploy': [self.make_run(8.0, 4)],
+                             'rollback': [self.make_run(1.0, 1)]}}
+        rows = recorder.compare_results(old, new)
+        self.assertIn(('full_deploy', None, 'wall_time', 12.0, 8.0), rows)
+        self.assertIn(('full_deploy', 'checkout_or_update', 'remote_commands', 5, 4),
+                      rows)
+        self.assertEqual(set(['full_deploy']), set(row[0] for row in rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
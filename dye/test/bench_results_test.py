@@ -0,0 +1,40 @@
+import os
+from os import path
+import sys
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+from bench import results
+
+
+class TestStatistics(unittest.TestCase):
+
+    def test_median_of_odd_and_even_lengths(self):
+        self.assertEqual(2, results.median([3, 1, 2]))
+        self.assertEqual(2.5, results.median([4, 1, 3, 2]))
+        self.assertEqual(None, results.median([]))
+
+    def test_percentile_interpolates(self):
+        values = range(1, 11)
+        self.assertEqual(1, results.percentile(values, 0))
+        self.assertEqual(10, results.percentile(values, 100))
+        self.assertAlmostEqual(9.1, results.percentile(values, 90))
+
+    def test_summarise_times(self):
+        summary = results.summarise([0.2, 0.1, 0.4, 0.3])
+        self.assertEqual(4, summary['iterations'])
+        self.assertEqual(0.1, summary['min'])
+        self.assertEqual(0.4, summary['max'])
+        self.assertAlmostEqual(0.25, summary['median'])
+        self.assertAlmostEqual(0.25, summary['mean'])
+
+    def test_format_change(self):
+        self.assertEqual('+50.0%', results.format_change(2.0, 3.0))
+        self.assertEqual('-25.0%', results.format_change(4.0, 3.0))
+        self.assertEqual('', results.format_change(0, 3.0))
+        self.assertEqual('', results.format_change(4.0, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
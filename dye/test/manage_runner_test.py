@@ -0,0 +1,114 @@
+import os
+from os import path
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+runner = path.join(dye_dir, 'manage_runner.py')
+
+# a minimal stand in for django, so we can test the runner without needing
+# a django project
+FAKE_MANAGEMENT = """
+import sys
+
+class ManagementUtility(object):
+    def __init__(self, argv):
+        self.argv = argv
+
+    def execute(self):
+        command = self.argv[1]
+        if command == 'hello':
+            print 'hello', ' '.join(self.argv[2:])
+        elif command == 'warn':
+            sys.stderr.write('warning\\n')
+        elif command == 'fail':
+            sys.exit(2)
+        elif command == 'broken':
+            raise ValueError('broken command')
+"""
+
+FAKE_CONF = """
+class Settings(object):
+    INSTALLED_APPS = ['app']
+
+settings = Settings()
+"""
+
+
+class TestManageRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.result_file = path.join(self.testdir, 'result.json')
+        self.write_module('django/__init__.py', '')
+        self.write_module('django/conf.py', FAKE_CONF)
+        self.write_module('django/core/__init__.py', '')
+        self.write_module('django/core/management/__init__.py', FAKE_MANAGEMENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def write_module(self, relative_path, contents):
+        module_path = path.join(self.testdir, relative_path)
+        if not path.isdir(path.dirname(module_path)):
+            os.makedirs(path.dirname(module_path))
+        with open(module_path, 'w') as f:
+            f.write(contents)
+
+    def run_runner(self, commands, log_files=None):
+        request = {'commands': commands, 'result_file': self.result_file}
+        if log_files is not None:
+            request['log_files'] = log_files
+        popen = subprocess.Popen([sys.executable, runner], cwd=self.testdir,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        popen.communicate(json.dumps(request))
+        return popen.returncode
+
+    def get_results(self):
+        with open(self.result_file) as f:
+            return json.load(f)
+
+    def test_runner_captures_output_of_each_command(self):
+        self.assertEqual(0, self.run_runner([['hello', 'one'], ['hello', 'two']]))
+        results = self.get_results()
+        self.assertEqual(['hello one\n', 'hello two\n'],
+                         [r['stdout'] for r in results])
+
+    def test_runner_captures_stderr_separately(self):
+        self.run_runner([['warn']])
+        result = self.get_results()[0]
+        self.assertEqual('', result['stdout'])
+        self.assertEqual('warning\n', result['stderr'])
+
+    def test_runner_writes_output_to_log_files(self):
+        log_files = [path.join(self.testdir, 'one.log'), path.join(self.testdir, 'two.log')]
+        self.run_runner([['hello', 'one'], ['warn']], log_files)
+        results = self.get_results()
+        self.assertEqual(log_files, [r['log_file'] for r in results])
+        self.assertNotIn('stdout', results[0])
+        self.assertEqual('hello one\n', open(log_files[0]).read())
+        self.assertEqual('warning\n', open(log_files[1]).read())
+
+    def test_runner_stops_after_failed_command(self):
+        self.run_runner([['hello'], ['fail'], ['hello']])
+        results = self.get_results()
+        self.assertEqual([0, 2], [r['exit_code'] for r in results])
+
+    def test_runner_reports_exception_as_failure(self):
+        self.run_runner([['broken']])
+        result = self.get_results()[0]
+        self.assertEqual(1, result['exit_code'])
+        self.assertIn('broken command', result['stderr'])
+
+    def test_runner_exits_with_boot_failed_when_django_missing(self):
+        shutil.rmtree(path.join(self.testdir, 'django'))
+        self.assertEqual(3, self.run_runner([['hello']]))
+        self.assertFalse(path.exists(self.result_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
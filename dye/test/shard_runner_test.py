@@ -0,0 +1,203 @@
+import os
+from os import path
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+
+import shard_runner
+
+PYTEST_TESTS = """
+class TestOne(object):
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        pass
+
+
+class TestTwo(object):
+    def test_c(self):
+        pass
+
+
+def test_d():
+    pass
+"""
+
+
+class ExampleTests(unittest.TestCase):
+    def test_a(self):
+        pass
+
+    def test_b(self):
+        pass
+
+
+class OtherTests(unittest.TestCase):
+    def test_c(self):
+        pass
+
+
+class ShardAssignmentTests(unittest.TestCase):
+
+    def test_groups_spread_over_shards(self):
+        assignment = shard_runner.assign_shards(['a', 'a', 'b', 'c'], 2)
+        self.assertEqual(0, assignment['a'])
+        self.assertEqual(1, assignment['b'])
+        self.assertEqual(1, assignment['c'])
+
+    def test_assignment_does_not_depend_on_order(self):
+        keys = ['x', 'y', 'y', 'z', 'w', 'w', 'w']
+        self.assertEqual(shard_runner.assign_shards(keys, 3),
+                         shard_runner.assign_shards(list(reversed(keys)), 3))
+
+    def test_more_shards_than_groups(self):
+        self.assertEqual({'a': 0}, shard_runner.assign_shards(['a'], 4))
+
+    def test_groups_balanced_by_weight(self):
+        assignment = shard_runner.assign_shards(['a', 'b', 'b', 'c'], 2,
+                                                [10.0, 1.0, 1.0, 1.0])
+        self.assertEqual(0, assignment['a'])
+        self.assertEqual(1, assignment['b'])
+        self.assertEqual(1, assignment['c'])
+
+    def test_new_tests_weighted_by_average_duration(self):
+        self.assertEqual([1.0, 3.0, 2.0], shard_runner.get_weights(
+            ['a', 'b', 'c'], {'a': 1.0, 'b': 3.0}))
+
+    def test_failed_groups_first_within_bin(self):
+        keys = ['a', 'b', 'c', 'c']
+        self.assertEqual([2, 3, 0, 1], shard_runner.failed_first(keys, set(['c'])))
+        keys = ['a', 'c', 'b', 'c']
+        self.assertEqual([1, 0, 3, 2],
+                         shard_runner.failed_first(keys, set(['c']), [0, 0, 1, 1]))
+
+    def test_get_shard_reads_environment(self):
+        os.environ[shard_runner.SHARD_ENV_VAR] = '2/3'
+        try:
+            self.assertEqual((1, 3), shard_runner.get_shard())
+        finally:
+            del os.environ[shard_runner.SHARD_ENV_VAR]
+        self.assertIsNone(shard_runner.get_shard())
+
+
+class ShardSuiteTests(unittest.TestCase):
+
+    def get_suite(self):
+        loader = unittest.TestLoader()
+        return unittest.TestSuite([loader.loadTestsFromTestCase(ExampleTests),
+                                   loader.loadTestsFromTestCase(OtherTests)])
+
+    def get_test_names(self, suite):
+        return sorted(test.id().split('.')[-1] for test in suite)
+
+    def test_shards_split_the_suite_by_class(self):
+        first = shard_runner.shard_suite(self.get_suite(), 0, 2)
+        second = shard_runner.shard_suite(self.get_suite(), 1, 2)
+        self.assertEqual(['test_a', 'test_b'], self.get_test_names(first))
+        self.assertEqual(['test_c'], self.get_test_names(second))
+
+    def test_shard_suite_is_same_type(self):
+        suite = shard_runner.shard_suite(self.get_suite(), 0, 2)
+        self.assertTrue(isinstance(suite, unittest.TestSuite))
+
+
+    def test_results_recorded(self):
+        class RecordedTests(unittest.TestCase):
+            def test_pass(self):
+                pass
+
+            def test_fail(self):
+                self.fail('expected to fail')
+
+        results_file = tempfile.mktemp()
+        os.environ[shard_runner.RESULTS_ENV_VAR] = results_file
+        try:
+            suite = shard_runner.RecordingSuite(
+                unittest.TestLoader().loadTestsFromTestCase(RecordedTests))
+            suite(unittest.TestResult())
+            with open(results_file) as f:
+                results = json.load(f)
+        finally:
+            del os.environ[shard_runner.RESULTS_ENV_VAR]
+            os.remove(results_file)
+        self.assertEqual([('test_fail', 'failed'), ('test_pass', 'passed')],
+                         sorted((test_id.split('.')[-1], result)
+                                for test_id, result, duration in results))
+
+
+class PytestPluginTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        with open(path.join(self.testdir, 'test_example.py'), 'w') as f:
+            f.write(PYTEST_TESTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def run_shard(self, shard, history=None):
+        pytest_env = os.environ.copy()
+        pytest_env[shard_runner.SHARD_ENV_VAR] = shard
+        pytest_env[shard_runner.RESULTS_ENV_VAR] = path.join(self.testdir, 'results.json')
+        if history is not None:
+            history_file = path.join(self.testdir, 'history.json')
+            with open(history_file, 'w') as f:
+                json.dump(history, f)
+            pytest_env[shard_runner.HISTORY_ENV_VAR] = history_file
+        pytest_env['PYTHONPATH'] = path.abspath(path.join(dye_dir, os.pardir))
+        popen = subprocess.Popen(
+            [sys.executable, '-m', 'pytest', '-v', '-p', 'dye.shard_runner',
+             '-p', 'no:cacheprovider', 'test_example.py'],
+            cwd=self.testdir, env=pytest_env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = popen.communicate()[0]
+        self.assertEqual(0, popen.returncode, output)
+        return [line.split()[0] for line in output.splitlines()
+                if line.startswith('test_example.py::')]
+
+    def test_shards_run_every_test_once(self):
+        first = self.run_shard('1/2')
+        second = self.run_shard('2/2')
+        self.assertEqual(['test_example.py::TestOne::test_a',
+                          'test_example.py::TestOne::test_b'], first)
+        self.assertEqual(['test_example.py::TestTwo::test_c',
+                          'test_example.py::test_d'], second)
+
+    def test_failed_tests_run_first(self):
+        history = {'durations': {}, 'failed': ['test_example.py::test_d']}
+        self.assertEqual('test_example.py::test_d', self.run_shard('1/1', history)[0])
+
+    def test_shards_balanced_by_duration(self):
+        history = {'durations': {'test_example.py::TestTwo::test_c': 5.0,
+                                 'test_example.py::TestOne::test_a': 0.1,
+                                 'test_example.py::TestOne::test_b': 0.1,
+                                 'test_example.py::test_d': 0.1},
+                   'failed': []}
+        self.assertEqual(['test_example.py::TestTwo::test_c'],
+                         self.run_shard('1/2', history))
+
+    def test_results_written(self):
+        self.run_shard('1/1')
+        with open(path.join(self.testdir, 'results.json')) as f:
+            results = json.load(f)
+        self.assertEqual(['test_example.py::TestOne::test_a',
+                          'test_example.py::TestOne::test_b',
+                          'test_example.py::TestTwo::test_c',
+                          'test_example.py::test_d'],
+                         [test_id for test_id, result, duration in results])
+        self.assertEqual(set(['passed']),
+                         set(result for test_id, result, duration in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import os
+from os import path
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+from ConfigParser import RawConfigParser
+from StringIO import StringIO
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import app_server_config, webserver_config
+from tasklib.exceptions import TasksError
+
+FACTS = {'host': 'server1', 'cpu_count': 4, 'memory_mb': 8192, 'somaxconn': 128}
+NGINX_TEMPLATE = path.join(dye_dir, os.pardir, '{{cookiecutter.project_name}}',
+                           'nginx', 'vhost.conf.template')
+CONF_DIR = '/var/django/proj/current/nginx/generated'
+VE_DIR = '/var/django/proj/current/django/website/.ve'
+
+
+def find_nginx():
+    for bin_dir in os.environ.get('PATH', '').split(os.pathsep) + ['/usr/sbin']:
+        if path.isfile(path.join(bin_dir, 'nginx')):
+            return path.join(bin_dir, 'nginx')
+    return None
+
+
+def get_values(app_server, **settings):
+    values = webserver_config.get_conf_values('production', FACTS, {
+        'project_name': 'proj',
+        'vcs_root_dir': '/var/django/proj/current',
+        'django_dir': '/var/django/proj/current/django/website',
+        'wsgi_dir': '/var/django/proj/current/wsgi',
+    }, {'default': settings})
+    return app_server_config.add_template_values(values, app_server)
+
+
+def parse_ini(contents):
+    parser = RawConfigParser()
+    parser.optionxform = str
+    parser.readfp(StringIO(contents))
+    return parser
+
+
+class TestTemplateValues(unittest.TestCase):
+
+    def test_gunicorn_proxied_over_http(self):
+        values = get_values('gunicorn')
+        self.assertEqual('/run/proj-gunicorn.sock', values['app_socket'])
+        self.assertTrue(values['app_pass'].startswith('proxy_pass http://proj_app;'))
+        self.assertTrue('proxy_read_timeout 60s;' in values['app_pass'])
+
+    def test_uwsgi_passed_with_uwsgi_protocol(self):
+        values = get_values('uwsgi')
+        self.assertEqual('/run/proj-uwsgi.sock', values['app_socket'])
+        self.assertTrue('uwsgi_pass proj_app;' in values['app_pass'])
+
+    def test_settings_override(self):
+        values = get_values('gunicorn', request_timeout=120, app_socket='/tmp/proj.sock')
+        self.assertEqual('/tmp/proj.sock', values['app_socket'])
+        self.assertTrue('proxy_read_timeout 120s;' in values['app_pass'])
+
+    def test_unknown_app_server(self):
+        self.assertRaises(ValueError, app_server_config.add_template_values,
+                          {'project_name': 'proj'}, 'mod_python')
+
+
+class TestRenderConfigs(unittest.TestCase):
+
+    def test_gunicorn_conf_tuned_to_machine(self):
+        configs = app_server_config.render_configs(
+            'gunicorn', get_values('gunicorn'), FACTS, CONF_DIR, VE_DIR)
+        conf = {}
+        exec configs['gunicorn.conf.py'] in conf
+        self.assertEqual('unix:/run/proj-gunicorn.sock', conf['bind'])
+        self.assertEqual(4, conf['workers'])
+        self.assertEqual(7, conf['threads'])
+        self.assertEqual('gthread', conf['worker_class'])
+        self.assertEqual(100, conf['max_requests_jitter'])
+        self.assertEqual(100, conf['backlog'])
+        self.assertEqual('/var/django/proj/current/wsgi', conf['chdir'])
+
+    def test_gunicorn_units(self):
+        configs = app_server_config.render_configs(
+            'gunicorn', get_values('gunicorn'), FACTS, CONF_DIR, VE_DIR,
+            user='proj', socket_group='nginx')
+        socket_unit = parse_ini(configs['proj-gunicorn.socket'])
+        self.assertEqual('/run/proj-gunicorn.sock',
+                         socket_unit.get('Socket', 'ListenStream'))
+        self.assertEqual('nginx', socket_unit.get('Socket', 'SocketGroup'))
+        service_unit = parse_ini(configs['proj-gunicorn.service'])
+        self.assertEqual('proj-gunicorn.socket', service_unit.get('Unit', 'Requires'))
+        self.assertEqual(VE_DIR + '/bin/gunicorn --config ' + CONF_DIR +
+                         '/gunicorn.conf.py wsgi_handler:application',
+                         service_unit.get('Service', 'ExecStart'))
+        self.assertEqual('proj', service_unit.get('Service', 'Group'))
+        self.assertEqual('/bin/kill -s HUP $MAINPID',
+                         service_unit.get('Service', 'ExecReload'))
+
+    def test_uwsgi_ini(self):
+        configs = app_server_config.render_configs(
+            'uwsgi', get_values('uwsgi', processes=2), FACTS, CONF_DIR, VE_DIR)
+        ini = parse_ini(configs['uwsgi.ini'])
+        self.assertEqual('/run/proj-uwsgi.sock', ini.get('uwsgi', 'socket'))
+        self.assertEqual('2', ini.get('uwsgi', 'processes'))
+        self.assertEqual(VE_DIR, ini.get('uwsgi', 'home'))
+        service_unit = parse_ini(configs['proj-uwsgi.service'])
+        self.assertEqual('notify', service_unit.get('Service', 'Type'))
+        self.assertEqual(VE_DIR + '/bin/uwsgi --ini ' + CONF_DIR + '/uwsgi.ini',
+                         service_unit.get('Service', 'ExecStart'))
+
+
+class TestNginxTemplate(unittest.TestCase):
+
+    def render(self, app_server):
+        values = get_values(app_server, server_name='proj.example.org',
+                            server_alias='www.proj.example.org')
+        return webserver_config.render_conf(open(NGINX_TEMPLATE).read(), values)
+
+    def test_static_served_by_nginx(self):
+        conf = self.render('gunicorn')
+        self.assertTrue('server unix:/run/proj-gunicorn.sock fail_timeout=0;' in conf)
+        self.assertTrue('alias /var/django/proj/current/django/website/static/;' in conf)
+        self.assertTrue('expires 604800s;' in conf)
+        # nginx variables are left for nginx
+        self.assertTrue('proxy_set_header Host $http_host;' in conf)
+
+    @unittest.skipIf(find_nginx() is None, 'nginx is not installed')
+    def test_nginx_accepts_conf(self):
+        testdir = tempfile.mkdtemp()
+        try:
+            vhost = path.join(testdir, 'vhost.conf')
+            f = open(vhost, 'w')
+            f.write(self.render('gunicorn').replace('listen 80;', 'listen 8080;'))
+            f.close()
+            nginx_conf = path.join(testdir, 'nginx.conf')
+            f = open(nginx_conf, 'w')
+            f.write('pid %(dir)s/nginx.pid;\nerror_log %(dir)s/error.log;\n'
+                    'events {}\nhttp {\n    include %(vhost)s;\n}\n' %
+                    {'dir': testdir, 'vhost': vhost})
+            f.close()
+            self.assertEqual(0, subprocess.call(
+                [find_nginx(), '-t', '-q', '-p', testdir, '-c', nginx_conf]))
+        finally:
+            shutil.rmtree(testdir)
+
+
+class TestGenerateWebserverConf(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        os.mkdir(path.join(self.testdir, 'nginx'))
+        shutil.copy(NGINX_TEMPLATE, path.join(self.testdir, 'nginx'))
+        self.old_env = dict(tasklib.env)
+        tasklib.env.update({
+            'quiet': True,
+            'project_name': 'proj',
+            'vcs_root_dir': self.testdir,
+            'server_project_home': '/var/django/proj',
+            'relative_django_dir': path.join('django', 'website'),
+            'relative_ve_dir': path.join('django', 'website', '.ve'),
+            'webserver_conf_template': path.join('nginx', 'vhost.conf.template'),
+            'webserver_conf_settings': {'staging': {'server_name': 'proj.stage.example.org',
+                                                    'server_alias': ''}},
+            'app_server': 'uwsgi',
+            'app_server_socket_group': 'nginx',
+        })
+        tasklib.env.pop('current_link', None)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.old_env)
+        shutil.rmtree(self.testdir)
+
+    def test_app_server_files_written_with_conf(self):
+        tasklib.generate_webserver_conf('staging')
+        generated_dir = path.join(self.testdir, 'nginx', 'generated')
+        conf = open(path.join(generated_dir, 'staging.conf')).read()
+        self.assertTrue('uwsgi_pass proj_app;' in conf)
+        service_unit = parse_ini(open(path.join(generated_dir, 'proj-uwsgi.service')).read())
+        self.assertEqual(
+            '/var/django/proj/current/django/website/.ve/bin/uwsgi --ini '
+            '/var/django/proj/current/nginx/generated/uwsgi.ini',
+            service_unit.get('Service', 'ExecStart'))
+        socket_unit = parse_ini(open(path.join(generated_dir, 'proj-uwsgi.socket')).read())
+        self.assertEqual('nginx', socket_unit.get('Socket', 'SocketGroup'))
+        self.assertTrue(path.exists(path.join(generated_dir, 'uwsgi.ini')))
+
+    def test_user_defaults_to_nginx_user_on_redhat(self):
+        del tasklib.env['app_server_socket_group']
+        old_linux_type = tasklib.tasklib._linux_type
+        tasklib.tasklib._linux_type = lambda: 'redhat'
+        try:
+            tasklib.generate_webserver_conf('staging')
+        finally:
+            tasklib.tasklib._linux_type = old_linux_type
+        generated_dir = path.join(self.testdir, 'nginx', 'generated')
+        service_unit = parse_ini(open(path.join(generated_dir, 'proj-uwsgi.service')).read())
+        self.assertEqual('nginx', service_unit.get('Service', 'User'))
+        socket_unit = parse_ini(open(path.join(generated_dir, 'proj-uwsgi.socket')).read())
+        self.assertEqual('nginx', socket_unit.get('Socket', 'SocketUser'))
+        self.assertEqual('nginx', socket_unit.get('Socket', 'SocketGroup'))
+
+    def test_unknown_app_server(self):
+        tasklib.env['app_server'] = 'mod_python'
+        self.assertRaises(TasksError, tasklib.generate_webserver_conf, 'staging')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import celery_config
+
+FACTS = {'host': 'server1', 'cpu_count': 8, 'memory_mb': 16384}
+
+
+def get_setting(config, name):
+    for line in config.splitlines():
+        if line.startswith(name + '='):
+            return line[len(name) + 1:].strip('"')
+    return None
+
+
+class TestWorkerProcesses(unittest.TestCase):
+
+    def test_one_per_cpu(self):
+        self.assertEqual(8, celery_config.get_worker_processes(FACTS))
+
+    def test_limited_by_memory(self):
+        facts = dict(FACTS, memory_mb=1024)
+        # half of 1024MB at 150MB each
+        self.assertEqual(3, celery_config.get_worker_processes(facts))
+
+    def test_at_least_one(self):
+        facts = dict(FACTS, memory_mb=100)
+        self.assertEqual(1, celery_config.get_worker_processes(facts))
+
+    def test_unknown_memory_ignored(self):
+        facts = dict(FACTS, memory_mb=None)
+        self.assertEqual(8, celery_config.get_worker_processes(facts))
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def test_shared_by_weight_and_nodes(self):
+        queues = celery_config.get_queue_options({
+            'celery': {'nodes': 2, 'weight': 3},
+            'email': {},
+        })
+        self.assertEqual({'celery': 3, 'email': 2},
+                         celery_config.get_concurrency(queues, 8))
+
+    def test_fixed_concurrency_kept(self):
+        queues = celery_config.get_queue_options({
+            'celery': {},
+            'email': {'concurrency': 1},
+        })
+        self.assertEqual({'celery': 8, 'email': 1},
+                         celery_config.get_concurrency(queues, 8))
+
+    def test_queue_needs_a_node(self):
+        self.assertRaises(ValueError, celery_config.get_queue_options,
+                          {'celery': {'nodes': 0}})
+
+
+class TestRenderConfigs(unittest.TestCase):
+
+    def setUp(self):
+        self.celeryd, self.celerybeat = celery_config.render_configs(
+            {'celery': {'nodes': 2}, 'email': {'concurrency': 2, 'prefetch_multiplier': 4,
+                                               'max_tasks_per_child': 50}},
+            FACTS, chdir='/var/django/proj/current/django/website',
+            python='/var/django/proj/current/django/website/.ve/bin/python')
+
+    def test_nodes_for_each_queue(self):
+        self.assertEqual('celery1 celery2 email1', get_setting(self.celeryd, 'CELERYD_NODES'))
+
+    def test_options_per_node(self):
+        options = get_setting(self.celeryd, 'CELERYD_OPTS')
+        self.assertTrue('-Q:celery1,celery2 celery' in options)
+        # the whole machine, as email has a fixed concurrency
+        self.assertTrue('-c:celery1,celery2 4' in options)
+        self.assertTrue('-Q:email1 email' in options)
+        self.assertTrue('-c:email1 2' in options)
+        self.assertTrue('--maxtasksperchild:email1=50' in options)
+        self.assertTrue('--maxtasksperchild:celery1,celery2=100' in options)
+        # the smallest prefetch multiplier, passed through to all nodes
+        self.assertTrue(options.endswith('-- celeryd.prefetch_multiplier=1'))
+
+    def test_paths_use_current(self):
+        self.assertEqual('/var/django/proj/current/django/website',
+                         get_setting(self.celeryd, 'CELERYD_CHDIR'))
+        self.assertEqual('/var/django/proj/current/django/website',
+                         get_setting(self.celerybeat, 'CELERYBEAT_CHDIR'))
+        self.assertTrue(get_setting(self.celerybeat, 'CELERYBEAT').startswith(
+            '/var/django/proj/current/django/website/.ve/bin/python '))
+
+    def test_user_is_group_by_default(self):
+        self.assertEqual('apache', get_setting(self.celeryd, 'CELERYD_GROUP'))
+        self.assertEqual('apache', get_setting(self.celerybeat, 'CELERYBEAT_GROUP'))
+
+
+class TestNodeQueues(unittest.TestCase):
+
+    def test_queues_from_generated_options(self):
+        queues = celery_config.get_queue_options({'celery': {'nodes': 2}, 'email': {}})
+        options = celery_config.get_celeryd_options(queues, {'celery': 2, 'email': 1})
+        self.assertEqual({'celery1': ['celery'], 'celery2': ['celery'], 'email1': ['email']},
+                         celery_config.get_node_queues(options, ['celery1', 'celery2', 'email1']))
+
+    def test_default_and_numbered_nodes(self):
+        self.assertEqual({'celery1': ['a', 'b'], 'celery2': ['c'], 'celery3': ['c']},
+                         celery_config.get_node_queues('-Q c -Q:1 a,b -c 2',
+                                                       ['celery1', 'celery2', 'celery3']))
+        self.assertEqual({'w1': ['celery']}, celery_config.get_node_queues('', ['w1']))
+
+    def test_queue_with_one_node_stalls(self):
+        node_queues = {'celery1': ['celery'], 'email1': ['email']}
+        down_times = {'celery1': (0.0, 3.0), 'email1': (3.0, 5.5)}
+        self.assertEqual({'celery': 3.0, 'email': 2.5},
+                         celery_config.get_queue_stalls(node_queues, down_times))
+
+    def test_queue_with_nodes_up_in_turn_does_not_stall(self):
+        node_queues = {'celery1': ['celery'], 'celery2': ['celery', 'email']}
+        down_times = {'celery1': (0.0, 3.0), 'celery2': (3.0, 5.0)}
+        self.assertEqual({'celery': 0.0, 'email': 2.0},
+                         celery_config.get_queue_stalls(node_queues, down_times))
+
+
+class TestGenerateCeleryConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.old_env = dict(tasklib.env)
+        tasklib.env.update({
+            'quiet': True,
+            'vcs_root_dir': self.testdir,
+            'server_project_home': '/var/django/proj',
+            'relative_django_dir': path.join('django', 'website'),
+            'relative_ve_dir': path.join('django', 'website', '.ve'),
+            'celery_queues': {'email': {}},
+        })
+        tasklib.env.pop('current_link', None)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.old_env)
+        shutil.rmtree(self.testdir)
+
+    def test_configs_written_to_celery_generated(self):
+        tasklib.generate_celery_config()
+        generated_dir = path.join(self.testdir, 'celery', 'generated')
+        celeryd = open(path.join(generated_dir, 'celeryd')).read()
+        self.assertEqual('email1', get_setting(celeryd, 'CELERYD_NODES'))
+        self.assertEqual('/var/django/proj/current/django/website',
+                         get_setting(celeryd, 'CELERYD_CHDIR'))
+        self.assertTrue(path.exists(path.join(generated_dir, 'celerybeat')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -73,6 +73,55 @@ class TestSqliteManager(unittest.TestCase):
         self.create_table()
         self.assertTrue(self.db.test_db_table_exists(self.TEST_TABLE))
 
+    def test_get_migration_state_returns_no_history_without_south(self):
+        self.create_db()
+        self.create_table()
+        tables, applied_migrations = self.db.get_migration_state()
+        self.assertEqual(set([self.TEST_TABLE]), tables)
+        self.assertIsNone(applied_migrations)
+
+    def test_get_migration_state_groups_applied_migrations_by_app(self):
+        self.create_db()
+        conn = sqlite3.connect(self.db.file_path)
+        conn.execute("CREATE TABLE south_migrationhistory "
+                     "(app_name CHAR(30), migration CHAR(30))")
+        conn.executemany("INSERT INTO south_migrationhistory VALUES (?, ?)",
+                         [('app1', '0001_initial'), ('app1', '0002_more'),
+                          ('app2', '0001_initial')])
+        conn.commit()
+        conn.close()
+        tables, applied_migrations = self.db.get_migration_state()
+        self.assertEqual({
+            'app1': set(['0001_initial', '0002_more']),
+            'app2': set(['0001_initial']),
+        }, applied_migrations)
+
+    def test_snapshot_exists_returns_false_when_no_snapshot(self):
+        self.create_db()
+        self.assertFalse(self.db.snapshot_exists('abc123'))
+
+    def test_restore_snapshot_restores_table(self):
+        self.create_db()
+        self.create_table()
+        try:
+            self.db.create_snapshot('abc123')
+            self.db.drop_db()
+            self.assertTrue(self.db.snapshot_exists('abc123'))
+            self.db.restore_snapshot('abc123')
+            self.assertTrue(self.db.test_db_table_exists(self.TEST_TABLE))
+        finally:
+            os.remove(self.db.get_snapshot_path('abc123'))
+
+    def test_create_snapshot_removes_older_snapshots(self):
+        self.create_db()
+        try:
+            self.db.create_snapshot('abc123')
+            self.db.create_snapshot('def456')
+            self.assertFalse(self.db.snapshot_exists('abc123'))
+            self.assertTrue(self.db.snapshot_exists('def456'))
+        finally:
+            os.remove(self.db.get_snapshot_path('def456'))
+
 
 class TestSqlite3Manager(unittest.TestCase):
 
@@ -108,6 +157,11 @@ class MysqlMixin(object):
         )
         super(MysqlMixin, self).setUp()
 
+    def tearDown(self):
+        # don't let pooled connections carry over to the next test
+        database.close_db_connections()
+        super(MysqlMixin, self).tearDown()
+
     def get_mysql_root_password(self):
         """Use the global mysql_root_password as a cache, so we only need to
         don't need to keep asking the user for it.  Bit of a hack, but making it
@@ -225,6 +279,69 @@ class TestCreateMysqlArgs(MysqlMixin, unittest.TestCase):
         expected_args = ['-u', 'dye_user', '-pdye_password', '--host=localhost', 'mydb']
         self.assertSequenceEqual(expected_args, sql_args)
 
+    def test_create_cmdline_args_with_db_name_argument(self):
+        sql_args = self.db.create_cmdline_args('otherdb')
+        expected_args = ['-u', 'dye_user', '-pdye_password', '--host=localhost', 'otherdb']
+        self.assertSequenceEqual(expected_args, sql_args)
+
+
+class FakeConnection(object):
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.closed = False
+
+    def autocommit(self, on):
+        self.autocommit_on = on
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor(object):
+
+    def __init__(self, results):
+        self.results = list(results)
+
+    def execute(self, sql):
+        self.sql = sql
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+    def nextset(self):
+        return 1 if self.results else None
+
+
+class TestConnectionPool(MysqlMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.pool = database.ConnectionPool()
+        self.db.create_db_connection = FakeConnection
+
+    def test_connection_reused_for_same_user_and_password(self):
+        conn = self.pool.get_connection(self.db, 'dye_user', 'dye_password')
+        self.assertIs(conn, self.pool.get_connection(
+            self.db.get_test_database(), 'dye_user', 'dye_password'))
+
+    def test_new_connection_made_when_password_differs(self):
+        conn = self.pool.get_connection(self.db, 'dye_user', 'dye_password')
+        new_conn = self.pool.get_connection(self.db, 'dye_user', 'new_password')
+        self.assertIsNot(conn, new_conn)
+        self.assertTrue(conn.closed)
+
+    def test_connections_allow_multiple_statements(self):
+        conn = self.pool.get_connection(self.db, 'root', 'root_password')
+        self.assertTrue(conn.kwargs['client_flag'] & database.CLIENT.MULTI_STATEMENTS)
+        self.assertTrue(conn.autocommit_on)
+
+    def test_execute_batch_returns_rows_for_each_statement(self):
+        cursor = FakeCursor([(('a',),), (), (('b',), ('c',))])
+        results = database._execute_batch(cursor, ['SELECT 1', 'USE x', 'SELECT 2'])
+        self.assertEqual('SELECT 1;\nUSE x;\nSELECT 2', cursor.sql)
+        self.assertEqual([(('a',),), (), (('b',), ('c',))], results)
+
 
 class TestDatabaseTestFunctions(MysqlMixin, unittest.TestCase):
 
@@ -2,7 +2,9 @@ import os
 from os import path
 import sys
 import shutil
+import subprocess
 import unittest
+from StringIO import StringIO
 
 dye_dir = path.join(path.dirname(__file__), os.pardir)
 sys.path.append(dye_dir)
@@ -100,6 +102,16 @@ class TestLinkLocalSettings(unittest.TestCase):
         linkto = os.readlink(local_settings_path)
         self.assertEqual(linkto, 'local_settings.py.dev')
 
+    def test_link_local_settings_sets_environment_when_up_to_date(self):
+        self.create_settings_py()
+        local_settings_path = path.join(tasklib.env['django_settings_dir'], 'local_settings.py')
+        self.create_local_settings_py_dev(local_settings_path)
+        tasklib.env.pop('task_state', None)
+        tasklib.scheduler.run_task(tasklib.link_local_settings, 'dev')
+        tasklib.env['environment'] = 'staging'
+        self.assertFalse(tasklib.scheduler.run_task(tasklib.link_local_settings, 'dev'))
+        self.assertEqual('dev', tasklib.env['environment'])
+
     def test_link_local_settings_replaces_old_local_settings(self):
         self.create_settings_py()
         local_settings_path = path.join(tasklib.env['django_settings_dir'], 'local_settings.py')
@@ -160,5 +172,542 @@ class TestLinkLocalSettings(unittest.TestCase):
     # patch south
 
 
+class TestAppIntrospection(unittest.TestCase):
+    def setUp(self):
+        self.testdir = path.join(path.dirname(__file__), 'testdir')
+        self.app_dir = path.join(self.testdir, 'testapp')
+        os.makedirs(path.join(self.app_dir, 'migrations'))
+        self.write_file('models.py', '# models')
+        self.write_file(path.join('migrations', '0001_initial.py'), '# initial')
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_dir'] = self.testdir
+        tasklib.env['django_apps'] = ['testapp']
+        tasklib.env['environment'] = 'dev'
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def write_file(self, relative_path, contents):
+        with open(path.join(self.app_dir, relative_path), 'w') as f:
+            f.write(contents)
+
+    def test_fingerprint_is_stable(self):
+        self.assertEqual(tasklib.django._get_db_fingerprint(),
+                         tasklib.django._get_db_fingerprint())
+
+    def test_fingerprint_changes_when_migration_added(self):
+        before = tasklib.django._get_db_fingerprint()
+        self.write_file(path.join('migrations', '0002_more.py'), '# more')
+        self.assertNotEqual(before, tasklib.django._get_db_fingerprint())
+
+    def test_fingerprint_changes_when_fixture_changed(self):
+        os.makedirs(path.join(self.app_dir, 'fixtures'))
+        self.write_file(path.join('fixtures', 'initial_data.json'), '[]')
+        before = tasklib.django._get_db_fingerprint()
+        self.write_file(path.join('fixtures', 'initial_data.json'), '[{}]')
+        self.assertNotEqual(before, tasklib.django._get_db_fingerprint())
+
+    def test_fingerprint_ignores_pyc_files(self):
+        before = tasklib.django._get_db_fingerprint()
+        self.write_file(path.join('migrations', '0001_initial.pyc'), 'bytecode')
+        self.assertEqual(before, tasklib.django._get_db_fingerprint())
+
+    def test_find_app_dir_finds_app_in_django_dir(self):
+        open(path.join(self.app_dir, '__init__.py'), 'w').close()
+        self.assertEqual(self.app_dir, tasklib.django._find_app_dir('testapp'))
+
+    def test_find_app_dir_returns_none_for_missing_app(self):
+        self.assertIsNone(tasklib.django._find_app_dir('no_such_app'))
+
+    def test_get_app_migrations_lists_migrations(self):
+        self.write_file(path.join('migrations', '__init__.py'), '')
+        self.assertEqual(set(['0001_initial']),
+                         tasklib.django._get_app_migrations(self.app_dir))
+
+    def test_get_app_migrations_returns_none_without_migrations_package(self):
+        self.assertIsNone(tasklib.django._get_app_migrations(self.app_dir))
+
+
+UPDATE_DB_SETTINGS = """
+INSTALLED_APPS = ['thingapp', 'migapp']
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'db.sqlite'}}
+"""
+
+THING_MODELS = """
+from django.db import models
+
+
+class Thing(models.Model):
+    tags = models.ManyToManyField('Tag')
+"""
+
+# a minimal stand in for django, with the models manage_runner.py asks for
+FAKE_APPS = """
+class Options(object):
+    def __init__(self, db_table, managed=True, proxy=False):
+        self.db_table = db_table
+        self.managed = managed
+        self.proxy = proxy
+
+
+class Model(object):
+    def __init__(self, db_table, **options):
+        self._meta = Options(db_table, **options)
+
+
+class AppConfig(object):
+    def __init__(self, label, models):
+        self.label = label
+        self.models = models
+
+    def get_models(self, include_auto_created=False):
+        return self.models
+
+
+class Apps(object):
+    def get_app_configs(self):
+        return [
+            AppConfig('thingapp', [
+                Model('thingapp_thing'),
+                Model('thingapp_thing_tags'),
+                Model('special'),
+                Model('thingapp_thing', proxy=True),
+                Model('external', managed=False),
+            ]),
+            AppConfig('migapp', [Model('migapp_mig')]),
+        ]
+
+apps = Apps()
+"""
+# records the commands in the same log as RECORDING_MANAGE_PY
+FAKE_MANAGEMENT = """
+class ManagementUtility(object):
+    def __init__(self, argv):
+        self.argv = argv
+
+    def execute(self):
+        log = open('manage.py.log', 'a')
+        log.write(' '.join(self.argv[1:]) + '\\n')
+        log.close()
+"""
+FAKE_DJANGO = {
+    '__init__.py': '',
+    'apps.py': FAKE_APPS,
+    'conf.py': 'import settings',
+    path.join('core', '__init__.py'): '',
+    path.join('core', 'management', '__init__.py'): FAKE_MANAGEMENT,
+}
+THING_TABLES = ['thingapp_thing', 'thingapp_thing_tags', 'special']
+
+# records the arguments it is called with
+RECORDING_MANAGE_PY = """import sys
+log = open(sys.argv[0] + '.log', 'a')
+log.write(' '.join(sys.argv[1:]) + '\\n')
+log.close()
+"""
+
+
+class TestUpdateDb(unittest.TestCase):
+    def setUp(self):
+        self.testdir = path.join(path.dirname(__file__), 'testdir')
+        os.makedirs(path.join(self.testdir, 'thingapp'))
+        os.makedirs(path.join(self.testdir, 'migapp', 'migrations'))
+        self.write_file('settings.py', UPDATE_DB_SETTINGS)
+        self.write_file('manage.py', RECORDING_MANAGE_PY)
+        self.write_file(path.join('thingapp', '__init__.py'), '')
+        self.write_file(path.join('thingapp', 'models.py'), THING_MODELS)
+        self.write_file(path.join('migapp', '__init__.py'), '')
+        self.write_file(path.join('migapp', 'models.py'), '')
+        self.write_file(path.join('migapp', 'migrations', '__init__.py'), '')
+        self.write_file(path.join('migapp', 'migrations', '0001_initial.py'), '')
+        os.makedirs(path.join(self.testdir, 'django', 'core', 'management'))
+        for file_name, contents in FAKE_DJANGO.items():
+            self.write_file(path.join('django', file_name), contents)
+        self.original_env = tasklib.env.copy()
+        for name in ('django_dir', 'django_settings_dir', 'deploy_dir'):
+            tasklib.env[name] = self.testdir
+        tasklib.env['ve_dir'] = path.join(self.testdir, '.ve')
+        tasklib.env['python_bin'] = sys.executable
+        tasklib.env['manage_py'] = path.join(self.testdir, 'manage.py')
+        tasklib.env['project_type'] = 'django'
+        tasklib.env['environment'] = 'dev'
+        for name in ('introspection_cache', 'db_managers', 'manage_py_settings'):
+            tasklib.env.pop(name, None)
+        sys.modules.pop('settings', None)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        sys.modules.pop('settings', None)
+        shutil.rmtree(self.testdir)
+
+    def write_file(self, relative_path, contents):
+        with open(path.join(self.testdir, relative_path), 'w') as f:
+            f.write(contents)
+
+    def create_tables(self, tables, applied_migrations=()):
+        import sqlite3
+        conn = sqlite3.connect(path.join(self.testdir, 'db.sqlite'))
+        try:
+            for table in tables:
+                conn.execute('create table %s (id integer)' % table)
+            conn.execute('create table south_migrationhistory '
+                         '(app_name text, migration text)')
+            for migration in applied_migrations:
+                conn.execute('insert into south_migrationhistory values (?, ?)',
+                             ('migapp', migration))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def write_stamp(self):
+        db = tasklib.django._get_db_managers()[0]
+        fingerprint = tasklib.django._get_syncdb_fingerprint(
+            db, ['thingapp', 'migapp'], [path.join(self.testdir, 'thingapp')])
+        self.write_file('.syncdb_fingerprint', fingerprint)
+
+    def get_manage_py_calls(self):
+        log_file = tasklib.env['manage_py'] + '.log'
+        if not path.exists(log_file):
+            return []
+        # the command, without the options
+        return [[arg for arg in line.split() if not arg.startswith('-')][0]
+                for line in open(log_file)]
+
+    def get_pending_db_work(self):
+        db = tasklib.django._get_db_managers()[0]
+        tables, applied_migrations = db.get_migration_state()
+        return tasklib.django._get_pending_db_work(db, 'default', tables,
+                                                   applied_migrations)
+
+    def test_test_database_named_in_settings(self):
+        self.write_file('settings.py', UPDATE_DB_SETTINGS +
+                        "DATABASES['default']['TEST'] = {'NAME': 'testing.sqlite'}\n")
+        db, test_db = tasklib.django._get_db_managers()
+        self.assertEqual(path.join(self.testdir, 'testing.sqlite'), test_db.file_path)
+        self.assertEqual(path.join(self.testdir, 'testing_2.sqlite'),
+                         db.get_test_database(shard=2).file_path)
+
+    def test_test_database_named_by_default(self):
+        db, test_db = tasklib.django._get_db_managers()
+        self.assertEqual(path.join(self.testdir, 'test_db.sqlite'), test_db.file_path)
+        self.assertEqual(path.join(self.testdir, 'test_db_2.sqlite'),
+                         db.get_test_database(shard=2).file_path)
+
+    def test_model_tables_from_django(self):
+        self.assertEqual({
+            'thingapp': ['special', 'thingapp_thing', 'thingapp_thing_tags'],
+            'migapp': ['migapp_mig'],
+        }, tasklib.django._read_model_tables())
+
+    def test_nothing_done_when_up_to_date(self):
+        self.create_tables(THING_TABLES, ['0001_initial'])
+        self.write_stamp()
+        tasklib.update_db()
+        self.assertEqual([], self.get_manage_py_calls())
+
+    def test_only_migrate_for_unapplied_migrations(self):
+        self.create_tables(THING_TABLES)
+        self.write_stamp()
+        tasklib.update_db()
+        self.assertEqual(['migrate', 'migrate'], self.get_manage_py_calls())
+
+    def test_syncdb_needed_for_missing_table_despite_stamp(self):
+        # eg the database was restored from an older dump
+        self.create_tables(['thingapp_thing', 'special'], ['0001_initial'])
+        self.write_stamp()
+        needs_syncdb, pending_apps, _ = self.get_pending_db_work()
+        self.assertTrue(needs_syncdb)
+        self.assertEqual([], pending_apps)
+
+    def test_syncdb_needed_when_django_cannot_give_tables(self):
+        self.write_file(path.join('django', 'apps.py'), "raise RuntimeError('broken')")
+        self.create_tables(THING_TABLES, ['0001_initial'])
+        self.write_stamp()
+        needs_syncdb, pending_apps, _ = self.get_pending_db_work()
+        self.assertTrue(needs_syncdb)
+
+    def test_syncdb_needed_without_stamp(self):
+        self.create_tables(THING_TABLES, ['0001_initial'])
+        needs_syncdb, pending_apps, _ = self.get_pending_db_work()
+        self.assertTrue(needs_syncdb)
+
+
+class TestMultipleDatabases(unittest.TestCase):
+    def setUp(self):
+        self.testdir = path.join(path.dirname(__file__), 'testdir')
+        os.makedirs(self.testdir)
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_settings_dir'] = self.testdir
+        tasklib.env['quiet'] = True
+        tasklib.env['verbose'] = False
+        # pretend we have already read the settings
+        databases = {'default': {}, 'other': {}, 'archive': {}}
+        tasklib.env['introspection_cache'] = {'settings': {
+            'fingerprint': tasklib.introspection._get_settings_fingerprint(),
+            'value': {'DATABASES': databases},
+        }}
+        tasklib.env['db_managers'] = dict(
+            (alias, ('db-' + alias, 'test-db-' + alias)) for alias in databases)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def test_all_gives_every_alias_with_default_first(self):
+        self.assertEqual(['default', 'archive', 'other'],
+                         tasklib.django._get_database_aliases('all'))
+
+    def test_single_alias_returned_as_is(self):
+        self.assertEqual(['other'], tasklib.django._get_database_aliases('other'))
+
+    def test_dump_filename_unchanged_for_default_database(self):
+        self.assertEqual('db_dump.sql',
+                         tasklib.django._get_dump_filename('db_dump.sql', 'default'))
+
+    def test_dump_filename_includes_database_key(self):
+        self.assertEqual('/tmp/db_dump-other.sql',
+                         tasklib.django._get_dump_filename('/tmp/db_dump.sql', 'other'))
+
+    def test_database_option_added_for_other_databases(self):
+        self.assertEqual([['migrate', '--noinput', '--database=other']],
+                         tasklib.django._add_database_option([['migrate', '--noinput']], 'other'))
+        self.assertEqual([['migrate', '--noinput']],
+                         tasklib.django._add_database_option([['migrate', '--noinput']], 'default'))
+
+    def test_run_for_each_database_calls_function_for_every_alias(self):
+        done = []
+        tasklib.django._run_for_each_database(
+            'test_task', 'all', lambda alias, arg: done.append((alias, arg)), 'x')
+        self.assertEqual([('archive', 'x'), ('default', 'x'), ('other', 'x')],
+                         sorted(done))
+
+    def test_run_for_each_database_reports_failed_aliases(self):
+        def fail_for_other(alias):
+            if alias == 'other':
+                raise InvalidProjectError('broken')
+        try:
+            tasklib.django._run_for_each_database('test_task', 'all', fail_for_other)
+            self.fail('expected TasksError')
+        except tasklib.exceptions.TasksError as e:
+            self.assertIn('other', e.msg)
+            self.assertNotIn('default', e.msg)
+
+
+class TestTestShards(unittest.TestCase):
+    def setUp(self):
+        self.testdir = path.join(path.dirname(__file__), 'testdir')
+        os.makedirs(self.testdir)
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_settings_dir'] = self.testdir
+        tasklib.env['manage_py'] = path.join(self.testdir, 'manage.py')
+        tasklib.env.pop('manage_py_settings', None)
+        tasklib.env.pop('use_pytest', None)
+        databases = {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                 'NAME': 'db.sqlite', 'TEST_NAME': 'test.sqlite'},
+                     'memory': {'ENGINE': 'django.db.backends.sqlite3',
+                                'NAME': 'memory.sqlite'}}
+        tasklib.env['introspection_cache'] = {'settings': {
+            'fingerprint': tasklib.introspection._get_settings_fingerprint(),
+            'value': {'DATABASES': databases},
+        }}
+        tasklib.env['db_managers'] = dict(
+            (alias, (tasklib.database.SqliteManager(db['NAME'], self.testdir), None))
+            for alias, db in databases.items())
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def test_shard_test_database_name_includes_shard(self):
+        test_names = tasklib.django._get_shard_test_names(3)
+        self.assertEqual({'default': path.join(self.testdir, 'test_db_3.sqlite')},
+                         test_names)
+
+    def test_shard_settings_module_written(self):
+        settings_file = tasklib.django._write_shard_settings(2, {'default': 'test_x_2'})
+        self.assertEqual(path.join(self.testdir, 'dye_test_shard_2.py'), settings_file)
+        contents = open(settings_file).read()
+        self.assertIn('from settings import *', contents)
+        self.assertIn("configure_shard_settings(globals(), {'default': 'test_x_2'})",
+                      contents)
+
+    def test_pytest_detected_from_manage_py(self):
+        with open(tasklib.env['manage_py'], 'w') as f:
+            f.write('import pytest\nsys.exit(pytest.main())\n')
+        self.assertTrue(tasklib.django._uses_pytest())
+
+    def test_django_runner_used_without_pytest(self):
+        with open(tasklib.env['manage_py'], 'w') as f:
+            f.write('execute_from_command_line(sys.argv)\n')
+        self.assertFalse(tasklib.django._uses_pytest())
+
+    def test_tests_run_counted_from_output(self):
+        self.assertEqual(12, tasklib.django._count_tests_run(
+            '.....\n------\nRan 12 tests in 1.234s\n\nOK\n'))
+        self.assertEqual(5, tasklib.django._count_tests_run(
+            '===== 3 passed, 1 failed, 1 error, 2 deselected in 0.52 seconds =====\n'))
+        self.assertEqual(None, tasklib.django._count_tests_run('ImportError: x\n'))
+
+
+class TestJenkins(unittest.TestCase):
+    def setUp(self):
+        self.testdir = path.join(path.dirname(__file__), 'testdir')
+        os.makedirs(self.testdir)
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_settings_dir'] = self.testdir
+        tasklib.env['vcs_root_dir'] = self.testdir
+        tasklib.env['ve_dir'] = path.join(self.testdir, '.ve')
+        tasklib.env.pop('manage_py_settings', None)
+        for name, version_setting in tasklib.django.JENKINS_PACKAGES:
+            tasklib.env.pop(version_setting, None)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def test_only_missing_packages_installed(self):
+        installed = {'django-jenkins': '0.14.0', 'pylint': '1.9.5'}
+        self.assertEqual(['coverage'],
+                         tasklib.django._get_missing_jenkins_packages(installed))
+
+    def test_package_at_wrong_version_installed(self):
+        tasklib.env['django_jenkins_version'] = '0.14.0'
+        installed = {'django-jenkins': '0.16.4', 'pylint': '1.9.5', 'coverage': '4.5'}
+        self.assertEqual(['django-jenkins==0.14.0'],
+                         tasklib.django._get_missing_jenkins_packages(installed))
+
+    def test_jenkins_settings_module_written_and_removed(self):
+        tasklib.env['manage_py_settings'] = 'dye_temp_mysqld_settings'
+        settings_file = path.join(self.testdir, 'dye_jenkins_settings.py')
+        tasklib.django._write_settings_module(
+            tasklib.django.JENKINS_SETTINGS_MODULE,
+            tasklib.django.JENKINS_SETTINGS_TEMPLATE,
+            {'skipped_tasks': tasklib.django.SKIPPED_JENKINS_TASKS,
+             'default_tasks': tasklib.django.DEFAULT_JENKINS_TASKS})
+        self.assertEqual('dye_jenkins_settings', tasklib.env['manage_py_settings'])
+        self.assertIn('from dye_temp_mysqld_settings import *',
+                      open(settings_file).read())
+        tasklib.django._remove_settings_module(
+            tasklib.django.JENKINS_SETTINGS_MODULE, 'dye_temp_mysqld_settings')
+        self.assertEqual('dye_temp_mysqld_settings', tasklib.env['manage_py_settings'])
+        self.assertFalse(path.exists(settings_file))
+
+    def get_jenkins_tasks(self, settings):
+        with open(path.join(self.testdir, 'jenkins_test_settings.py'), 'w') as f:
+            f.write(settings)
+        tasks_dir = path.join(self.testdir, 'django_jenkins', 'tasks')
+        os.makedirs(tasks_dir)
+        for name in ('__init__', 'run_pylint', 'with_coverage', 'django_tests'):
+            open(path.join(tasks_dir, name + '.py'), 'w').close()
+        open(path.join(self.testdir, 'django_jenkins', '__init__.py'), 'w').close()
+        tasklib.env['manage_py_settings'] = 'jenkins_test_settings'
+        tasklib.django._write_settings_module(
+            tasklib.django.JENKINS_SETTINGS_MODULE,
+            tasklib.django.JENKINS_SETTINGS_TEMPLATE,
+            {'skipped_tasks': tasklib.django.SKIPPED_JENKINS_TASKS,
+             'default_tasks': tasklib.django.DEFAULT_JENKINS_TASKS})
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import dye_jenkins_settings; print dye_jenkins_settings.JENKINS_TASKS'],
+            cwd=self.testdir)
+        return eval(output)
+
+    def test_jenkins_tasks_default_to_django_jenkins_defaults(self):
+        # on older django-jenkins the tests are run by the django_tests task
+        self.assertEqual(('django_jenkins.tasks.django_tests',),
+                         self.get_jenkins_tasks('# no JENKINS_TASKS\n'))
+
+    def test_jenkins_tasks_from_settings_less_skipped(self):
+        self.assertEqual(('myapp.tasks.extra',), self.get_jenkins_tasks(
+            "JENKINS_TASKS = ('django_jenkins.tasks.run_pylint', 'myapp.tasks.extra')\n"))
+
+    def test_only_orphan_pyc_files_removed(self):
+        for name in ('kept.py', 'kept.pyc', 'orphan.pyc'):
+            open(path.join(self.testdir, name), 'w').close()
+        os.makedirs(tasklib.env['ve_dir'])
+        open(path.join(tasklib.env['ve_dir'], 'site.pyc'), 'w').close()
+        tasklib.util._rm_orphan_pyc()
+        self.assertEqual(['.ve', 'kept.py', 'kept.pyc'], sorted(os.listdir(self.testdir)))
+        self.assertEqual(['site.pyc'], os.listdir(tasklib.env['ve_dir']))
+
+
+
+# a stand in for manage.py, which prints "line N" for N in 1 to the first
+# argument, and exits with the second
+FAKE_MANAGE_PY = """import sys
+for i in range(int(sys.argv[1])):
+    print 'line %d' % (i + 1)
+sys.exit(int(sys.argv[2]))
+"""
+
+
+class TestManagePyOutput(unittest.TestCase):
+    def setUp(self):
+        self.testdir = path.join(path.dirname(__file__), 'testdir')
+        os.makedirs(self.testdir)
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_dir'] = self.testdir
+        tasklib.env['ve_dir'] = path.join(self.testdir, '.ve')
+        tasklib.env['python_bin'] = sys.executable
+        tasklib.env['manage_py'] = path.join(self.testdir, 'manage.py')
+        tasklib.env['manage_py_error_lines'] = 5
+        tasklib.env['quiet'] = False
+        tasklib.env.pop('manage_py_settings', None)
+        with open(tasklib.env['manage_py'], 'w') as f:
+            f.write(FAKE_MANAGE_PY)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def get_log(self, args):
+        with open(tasklib.django._get_manage_py_log_file(args)) as f:
+            return f.read()
+
+    def test_output_written_to_log_and_last_lines_returned(self):
+        lines = tasklib.django._manage_py(['1000', '0'])
+        self.assertEqual(['line %d\n' % i for i in range(996, 1001)], lines)
+        self.assertEqual(1000, len(self.get_log(['1000', '0']).splitlines()))
+
+    def test_all_output_returned_when_captured(self):
+        lines = tasklib.django._manage_py(['20', '0'], capture_output=True)
+        self.assertEqual(20, len(lines))
+
+    def test_failure_reports_last_lines_and_log_file(self):
+        try:
+            tasklib.django._manage_py(['100', '3'])
+            self.fail('ShellCommandError not raised')
+        except tasklib.exceptions.ShellCommandError as e:
+            self.assertIn('line 96\nline 97\nline 98\nline 99\nline 100', e.msg)
+            self.assertNotIn('line 95', e.msg)
+            self.assertIn(tasklib.django._get_manage_py_log_file(['100', '3']), e.msg)
+
+    def test_verbose_output_also_logged(self):
+        tasklib.env['verbose'] = True
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            lines = tasklib.django._manage_py(['10', '0'])
+        finally:
+            sys.stdout = old_stdout
+        self.assertEqual('line 10\n', lines[-1])
+        self.assertEqual(10, len(self.get_log(['10', '0']).splitlines()))
+
+    def test_last_lines_read_from_end_of_big_file(self):
+        big_file = path.join(self.testdir, 'big.log')
+        with open(big_file, 'w') as f:
+            for i in range(100000):
+                f.write('line %d\n' % i)
+        self.assertEqual(['line 99998\n', 'line 99999\n'],
+                         tasklib.django._read_last_lines(big_file, 2))
+
+
 if __name__ == '__main__':
     unittest.main()
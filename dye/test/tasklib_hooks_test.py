@@ -0,0 +1,192 @@
+import os
+from os import path
+import sys
+import shutil
+import socket
+import tempfile
+import types
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+from tasklib import hooks
+
+
+def make_event(phase='update_db', duration=2.5, error=None, **extra):
+    event = {
+        'event': 'end', 'runner': 'tasklib', 'command': 'deploy',
+        'phase': phase, 'project': 'testproj', 'environment': 'staging',
+        'host': 'server1', 'start': 1000.0, 'duration': duration,
+        'error': error,
+    }
+    event.update(extra)
+    return event
+
+
+class TestDeployHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.deploy_hooks = hooks.DeployHooks(
+            [self.events.append], runner='tasklib', command='deploy',
+            project='testproj', environment='staging', host='server1')
+
+    def test_start_and_end_events_have_context(self):
+        with self.deploy_hooks.phase('update_db'):
+            pass
+        self.assertEqual(['start', 'end'], [event['event'] for event in self.events])
+        for event in self.events:
+            self.assertEqual('update_db', event['phase'])
+            self.assertEqual('testproj', event['project'])
+            self.assertEqual('staging', event['environment'])
+        self.assertNotIn('duration', self.events[0])
+        self.assertTrue(self.events[1]['duration'] >= 0)
+        self.assertEqual(None, self.events[1]['error'])
+
+    def test_numbers_added_in_block_are_in_end_event(self):
+        with self.deploy_hooks.phase('dump_db') as event:
+            event['dump_bytes'] = 1234
+        self.assertEqual({'dump_bytes': 1234}, hooks.get_numbers(self.events[1]))
+
+    def test_error_recorded_and_raised(self):
+        def failing_phase():
+            with self.deploy_hooks.phase('tasks'):
+                raise SystemExit('tasks.py failed')
+        self.assertRaises(SystemExit, failing_phase)
+        self.assertEqual('tasks.py failed', self.events[1]['error'])
+
+    def test_failing_hook_does_not_stop_deploy(self):
+        def bad_hook(event):
+            raise ValueError('broken hook')
+        self.deploy_hooks.hooks.insert(0, bad_hook)
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            with self.deploy_hooks.phase('update_db'):
+                pass
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(2, len(self.events))
+
+
+class TestStatsdEmitter(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.emitter = hooks.StatsdEmitter('127.0.0.1:%d' % self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_duration_sent_as_timer(self):
+        self.emitter(make_event())
+        self.assertEqual('dye.testproj.staging.tasklib.deploy.update_db.duration:2500|ms',
+                         self.server.recv(4096))
+
+    def test_failure_and_numbers_sent(self):
+        self.emitter(make_event('dump_db', error='failed', dump_bytes=1234))
+        lines = self.server.recv(4096).split('\n')
+        self.assertEqual([
+            'dye.testproj.staging.tasklib.deploy.dump_db.duration:2500|ms',
+            'dye.testproj.staging.tasklib.deploy.dump_db.failed:1|c',
+            'dye.testproj.staging.tasklib.deploy.dump_db.dump_bytes:1234|g',
+        ], lines)
+
+    def test_start_event_not_sent(self):
+        self.emitter(dict(make_event(), event='start'))
+        self.server.settimeout(0.1)
+        self.assertRaises(socket.timeout, self.server.recv, 4096)
+
+    def test_address_without_port_uses_default(self):
+        self.assertEqual(hooks.DEFAULT_STATSD_PORT,
+                         hooks.StatsdEmitter('localhost').port)
+
+
+class TestPrometheusTextfileEmitter(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.textfile = path.join(self.testdir, 'dye.prom')
+        self.emitter = hooks.PrometheusTextfileEmitter(self.textfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def get_value(self, metric, phase):
+        for (name, labels), value in hooks.read_textfile(self.textfile).items():
+            if name == metric and 'phase="%s"' % phase in labels:
+                return value
+        return None
+
+    def test_phase_written(self):
+        self.emitter(make_event(dump_bytes=1234))
+        self.assertEqual('2.500000', self.get_value(
+            'dye_deploy_phase_duration_seconds', 'update_db'))
+        self.assertEqual('0', self.get_value('dye_deploy_phase_failed', 'update_db'))
+        self.assertEqual('1234', self.get_value('dye_deploy_phase_dump_bytes', 'update_db'))
+        self.assertFalse(path.exists(self.textfile + '.tmp'))
+
+    def test_other_phases_kept_and_same_phase_replaced(self):
+        self.emitter(make_event('update_db'))
+        self.emitter(make_event('collect_static', duration=1.0))
+        self.emitter(make_event('update_db', duration=4.0, error='failed'))
+        self.assertEqual('4.000000', self.get_value(
+            'dye_deploy_phase_duration_seconds', 'update_db'))
+        self.assertEqual('1', self.get_value('dye_deploy_phase_failed', 'update_db'))
+        self.assertEqual('1.000000', self.get_value(
+            'dye_deploy_phase_duration_seconds', 'collect_static'))
+
+    def test_each_metric_has_one_type_line(self):
+        self.emitter(make_event('update_db'))
+        self.emitter(make_event('collect_static'))
+        contents = open(self.textfile).read()
+        self.assertEqual(1, contents.count('# TYPE dye_deploy_phase_duration_seconds gauge'))
+
+    def test_label_values_escaped(self):
+        self.emitter(make_event(host='a"b'))
+        self.assertTrue('host="a\\"b"' in open(self.textfile).read())
+
+
+class MemoryTextfileEmitter(hooks.PrometheusTextfileEmitter):
+    """Keeps the textfile in memory, as fablib's keeps it on the server"""
+    contents = ''
+
+    def read_samples(self):
+        return hooks.parse_textfile(self.contents.splitlines())
+
+    def write_samples(self, samples):
+        self.contents = hooks.format_textfile(samples)
+
+
+class TestGetHooks(unittest.TestCase):
+
+    def test_no_settings_no_hooks(self):
+        self.assertEqual([], hooks.get_hooks({}))
+
+    def test_emitters_and_local_hook(self):
+        localtasks = types.ModuleType('localtasks')
+        localtasks.deploy_hook = lambda event: None
+        deploy_hooks = hooks.get_hooks(
+            {'metrics_statsd': 'localhost:9125', 'metrics_prefix': 'deploys',
+             'metrics_textfile': '/tmp/dye.prom'}, localtasks)
+        self.assertEqual(3, len(deploy_hooks))
+        self.assertEqual(('localhost', 9125, 'deploys'), (
+            deploy_hooks[0].host, deploy_hooks[0].port, deploy_hooks[0].prefix))
+        self.assertEqual('/tmp/dye.prom', deploy_hooks[1].textfile)
+        self.assertIs(localtasks.deploy_hook, deploy_hooks[2])
+
+    def test_textfile_emitter_can_keep_file_elsewhere(self):
+        emitter = hooks.get_hooks({'metrics_textfile': '/no/such/dir/dye.prom'},
+                                  textfile_emitter=MemoryTextfileEmitter)[0]
+        emitter(make_event('update_db'))
+        emitter(make_event('collect_static'))
+        samples = hooks.parse_textfile(emitter.contents.splitlines())
+        self.assertEqual(2, len([name for name, labels in samples
+                                 if name == 'dye_deploy_phase_duration_seconds']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import introspection
+
+tasklib.env['verbose'] = False
+tasklib.env['quiet'] = True
+tasklib.env['noinput'] = True
+
+SETTINGS = """
+from local_settings import *
+INSTALLED_APPS = ['django.contrib.auth', 'myapp']
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache_table',
+        'OPTIONS': {'MAX_ENTRIES': 100},
+    }
+}
+"""
+
+LOCAL_SETTINGS = """
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.mysql',
+        'NAME': '%s',
+        'USER': 'user',
+        'PASSWORD': 'secret',
+        'OPTIONS': {'init_command': 'SET storage_engine=INNODB'},
+        'TEST': {'NAME': 'test_%s_custom'},
+    }
+}
+"""
+
+
+class IntrospectionTestMixin(object):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_dir'] = self.testdir
+        tasklib.env['django_settings_dir'] = self.testdir
+        tasklib.env['ve_dir'] = path.join(self.testdir, '.ve')
+        tasklib.env.pop('introspection_cache', None)
+        self.site_packages = path.join(
+            tasklib.env['ve_dir'], 'lib', 'python2.7', 'site-packages')
+        os.makedirs(self.site_packages)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def write_file(self, file_path, contents):
+        if not path.isdir(path.dirname(file_path)):
+            os.makedirs(path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(contents)
+
+
+class TestGetDjangoVersion(IntrospectionTestMixin, unittest.TestCase):
+
+    def test_version_read_from_egg_info(self):
+        os.mkdir(path.join(self.site_packages, 'Django-1.6.11-py2.7.egg-info'))
+        self.assertEqual([1, 6, 11], introspection.get_django_version())
+
+    def test_version_read_from_dist_info(self):
+        os.mkdir(path.join(self.site_packages, 'Django-1.5.2.dist-info'))
+        self.assertEqual([1, 5, 2], introspection.get_django_version())
+
+    def test_version_read_from_package_when_no_metadata(self):
+        self.write_file(path.join(self.site_packages, 'django', '__init__.py'),
+                        "VERSION = (1, 4, 3, 'final', 0)\n")
+        self.assertEqual([1, 4, 3], introspection.get_django_version())
+
+    def test_fallback_used_when_version_not_found(self):
+        self.assertEqual([1, 2, 3], introspection.get_django_version(
+            fallback_fn=lambda: [1, 2, 3]))
+
+    def test_version_cached_on_disk(self):
+        calls = []
+
+        def fallback():
+            calls.append(1)
+            return [1, 2, 3]
+        introspection.get_django_version(fallback_fn=fallback)
+        # forget the in-memory copy, so only the cache file is left
+        tasklib.env.pop('introspection_cache')
+        self.assertEqual([1, 2, 3], introspection.get_django_version(
+            fallback_fn=fallback))
+        self.assertEqual(1, len(calls))
+
+
+class TestGetSettings(IntrospectionTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestGetSettings, self).setUp()
+        self.write_file(path.join(self.testdir, 'settings.py'), SETTINGS)
+        self.write_file(path.join(self.testdir, 'local_settings.py.dev'),
+                        LOCAL_SETTINGS % ('devdb', 'devdb'))
+        self.write_file(path.join(self.testdir, 'local_settings.py.jenkins'),
+                        LOCAL_SETTINGS % ('jenkinsdb', 'jenkinsdb'))
+        self.link_local_settings('dev')
+
+    def tearDown(self):
+        for module_name in ('settings', 'local_settings'):
+            sys.modules.pop(module_name, None)
+        if self.testdir in sys.path:
+            sys.path.remove(self.testdir)
+        super(TestGetSettings, self).tearDown()
+
+    def link_local_settings(self, environment):
+        local_settings = path.join(self.testdir, 'local_settings.py')
+        if path.lexists(local_settings):
+            os.remove(local_settings)
+        for pyc in ('local_settings.pyc', 'settings.pyc'):
+            if path.exists(path.join(self.testdir, pyc)):
+                os.remove(path.join(self.testdir, pyc))
+        os.symlink('local_settings.py.' + environment, local_settings)
+
+    def test_installed_apps_read(self):
+        self.assertEqual(['django.contrib.auth', 'myapp'],
+                         introspection.get_settings()['INSTALLED_APPS'])
+
+    def test_caches_only_keeps_backend_and_location(self):
+        self.assertEqual({
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_table',
+        }, introspection.get_settings()['CACHES']['default'])
+
+    def test_database_settings_only_keep_connection_details(self):
+        db = introspection.get_database_settings('default')
+        self.assertEqual('devdb', db['NAME'])
+        self.assertNotIn('OPTIONS', db)
+
+    def test_database_test_name_kept(self):
+        db = introspection.get_database_settings('default')
+        self.assertEqual({'NAME': 'test_devdb_custom'}, db['TEST'])
+
+    def test_cache_file_is_private(self):
+        introspection.get_settings()
+        cache_file = path.join(self.testdir, introspection.CACHE_FILENAME)
+        self.assertEqual(0600, os.stat(cache_file).st_mode & 0777)
+
+    def test_settings_reread_when_local_settings_relinked(self):
+        introspection.get_database_settings('default')
+        # make sure the mtime would be different, even on coarse filesystems
+        time.sleep(0.01)
+        self.link_local_settings('jenkins')
+        self.assertEqual('jenkinsdb',
+                         introspection.get_database_settings('default')['NAME'])
+
+    def test_settings_not_reimported_when_cached(self):
+        introspection.get_settings()
+        tasklib.env.pop('introspection_cache')
+        sys.modules.pop('settings')
+        introspection.get_settings()
+        self.assertNotIn('settings', sys.modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+from tasklib import lint
+
+PYLINT_OUTPUT = """************* Module main.views
+main/views.py:1: [C0111(missing-docstring), ] Missing module docstring
+main/views.py:12: [W0612(unused-variable), edit] Unused variable 'x'
+************* Module main.models
+%(cwd)s/main/models.py:3: [E1101(no-member), Thing.save] Instance of 'Thing' has no 'x' member
+"""
+
+
+class PylintCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.cache_file = path.join(self.testdir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def test_messages_parsed_by_file(self):
+        output = (PYLINT_OUTPUT % {'cwd': self.testdir}).splitlines()
+        messages = lint.parse_pylint_output(output, self.testdir)
+        self.assertEqual(['main/models.py', 'main/views.py'], sorted(messages))
+        self.assertEqual(2, len(messages['main/views.py']))
+        self.assertTrue(messages['main/models.py'][0].startswith('main/models.py:3: [E1101'))
+
+    def test_only_changed_files_linted_again(self):
+        cache = lint.PylintCache(self.cache_file, 'sig')
+        hashes = {'a.py': '1', 'b.py': '2'}
+        self.assertEqual(['a.py', 'b.py'], cache.get_changed(hashes))
+        cache.update(hashes, ['a.py', 'b.py'], {'a.py': ['a.py:1: oops']})
+        cache.save()
+
+        cache = lint.PylintCache(self.cache_file, 'sig')
+        hashes = {'a.py': '1', 'b.py': '3'}
+        self.assertEqual(['b.py'], cache.get_changed(hashes))
+        cache.update(hashes, ['b.py'], {'b.py': ['b.py:2: oops']})
+        self.assertEqual(['a.py:1: oops', 'b.py:2: oops'], cache.get_messages())
+
+    def test_cache_dropped_when_signature_changes(self):
+        cache = lint.PylintCache(self.cache_file, 'sig')
+        cache.update({'a.py': '1'}, ['a.py'], {})
+        cache.save()
+        cache = lint.PylintCache(self.cache_file, 'new-sig')
+        self.assertEqual(['a.py'], cache.get_changed({'a.py': '1'}))
+
+    def test_removed_files_forgotten(self):
+        cache = lint.PylintCache(self.cache_file, 'sig')
+        cache.update({'a.py': '1', 'b.py': '2'}, ['a.py', 'b.py'], {'b.py': ['b.py:1: x']})
+        cache.update({'a.py': '1'}, [], {})
+        self.assertEqual([], cache.get_messages())
+
+    def test_ignored_directories_not_linted(self):
+        with open(path.join(self.testdir, 'pylint.rc'), 'w') as f:
+            f.write('[MASTER]\nignore=migrations\n')
+        app_dir = path.join(self.testdir, 'main')
+        os.makedirs(path.join(app_dir, 'migrations'))
+        for name in ('__init__.py', 'views.py', path.join('migrations', '__init__.py')):
+            open(path.join(app_dir, name), 'w').close()
+        ignored = lint.get_ignored_names(path.join(self.testdir, 'pylint.rc'))
+        self.assertEqual(set(['migrations']), ignored)
+        self.assertEqual(['main/__init__.py', 'main/views.py'],
+                         lint.find_python_files([app_dir], ignored, self.testdir))
+
+
+if __name__ == '__main__':
+    unittest.main()
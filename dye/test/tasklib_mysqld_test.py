@@ -0,0 +1,151 @@
+import os
+from os import path
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import mysqld
+
+tasklib.env['verbose'] = False
+tasklib.env['quiet'] = True
+
+
+class VersionTests(unittest.TestCase):
+
+    def test_mysql_version_parsed(self):
+        self.assertEqual((False, (8, 0, 36)), mysqld.parse_version(
+            'mysqld  Ver 8.0.36 for Linux on x86_64 (MySQL Community Server - GPL)'))
+
+    def test_mariadb_version_parsed(self):
+        self.assertEqual((True, (10, 6, 16)), mysqld.parse_version(
+            '/usr/sbin/mysqld  Ver 10.6.16-MariaDB-0ubuntu0.22.04.1 for debian-linux-gnu'))
+
+    def test_unknown_version_raises_error(self):
+        self.assertRaises(tasklib.exceptions.TasksError, mysqld.parse_version, 'huh')
+
+
+class TempMysqldCommandTests(unittest.TestCase):
+
+    def get_server(self, version):
+        server = mysqld.TempMysqld(mysqld='/usr/sbin/mysqld', base_dir='/dev/shm')
+        server._version = version
+        server.server_dir = '/dev/shm/dye-mysqld-test'
+        server.port = 40001
+        return server
+
+    def test_server_is_private_and_not_durable(self):
+        command = self.get_server((False, (5, 7, 40))).get_server_command()
+        self.assertEqual(['/usr/sbin/mysqld', '--no-defaults'], command[:2])
+        self.assertIn('--socket=/dev/shm/dye-mysqld-test/mysqld.sock', command)
+        self.assertIn('--bind-address=127.0.0.1', command)
+        self.assertIn('--port=40001', command)
+        self.assertIn('--innodb-flush-log-at-trx-commit=0', command)
+        self.assertNotIn('--mysqlx=OFF', command)
+
+    def test_mysql_8_options(self):
+        command = self.get_server((False, (8, 0, 36))).get_server_command()
+        self.assertIn('--skip-log-bin', command)
+        self.assertIn('--mysqlx=OFF', command)
+        self.assertIn('--default-authentication-plugin=mysql_native_password', command)
+
+    def test_mysql_initialised_by_mysqld(self):
+        command = self.get_server((False, (8, 0, 36))).get_install_command()
+        self.assertIn('--initialize-insecure', command)
+        self.assertIn('--datadir=/dev/shm/dye-mysqld-test/data', command)
+
+    def test_root_password_set_with_alter_user(self):
+        server = self.get_server((True, (10, 6, 16)))
+        self.assertIn("ALTER USER 'root'@'127.0.0.1' IDENTIFIED BY '%s'" %
+                      server.root_password, server.get_root_sql())
+
+    def test_root_password_set_with_set_password_for_old_versions(self):
+        server = self.get_server((False, (5, 5, 62)))
+        self.assertIn("SET PASSWORD FOR 'root'@'127.0.0.1' = PASSWORD('%s')" %
+                      server.root_password, server.get_root_sql())
+
+
+class StaleDirTests(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def make_server_dir(self, name, pid=None):
+        server_dir = path.join(self.base_dir, mysqld.DIR_PREFIX + name)
+        os.mkdir(server_dir)
+        if pid is not None:
+            with open(path.join(server_dir, 'mysqld.pid'), 'w') as f:
+                f.write('%d\n' % pid)
+        return server_dir
+
+    def test_dir_of_running_server_kept(self):
+        server_dir = self.make_server_dir('running', os.getpid())
+        mysqld.remove_stale_dirs(self.base_dir)
+        self.assertTrue(path.isdir(server_dir))
+
+    def test_dir_of_dead_server_removed(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        server_dir = self.make_server_dir('dead', process.pid)
+        mysqld.remove_stale_dirs(self.base_dir)
+        self.assertFalse(path.exists(server_dir))
+
+    def test_new_dir_without_pid_kept(self):
+        server_dir = self.make_server_dir('starting')
+        mysqld.remove_stale_dirs(self.base_dir)
+        self.assertTrue(path.isdir(server_dir))
+
+    def test_old_dir_without_pid_removed(self):
+        server_dir = self.make_server_dir('failed')
+        an_hour_ago = time.time() - 3700
+        os.utime(server_dir, (an_hour_ago, an_hour_ago))
+        mysqld.remove_stale_dirs(self.base_dir)
+        self.assertFalse(path.exists(server_dir))
+
+
+class DatabaseOverrideTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_settings_dir'] = self.testdir
+        databases = {'default': {'ENGINE': 'django.db.backends.mysql',
+                                 'NAME': 'proj', 'HOST': '', 'PORT': '3307'}}
+        tasklib.env['introspection_cache'] = {'settings': {
+            'fingerprint': tasklib.introspection._get_settings_fingerprint(),
+            'value': {'DATABASES': databases},
+        }}
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def test_overrides_applied_to_database_settings(self):
+        tasklib.env['database_overrides'] = {
+            'default': {'HOST': '127.0.0.1', 'PORT': '40001'}}
+        db = tasklib.introspection.get_database_settings('default')
+        self.assertEqual(('proj', '127.0.0.1', '40001'),
+                         (db['NAME'], db['HOST'], db['PORT']))
+
+    def test_settings_unchanged_without_overrides(self):
+        db = tasklib.introspection.get_database_settings('default')
+        self.assertEqual('3307', db['PORT'])
+
+    def test_no_temp_mysqld_when_turned_off(self):
+        tasklib.env['use_temp_mysqld'] = False
+        with tasklib.django._temp_mysqld() as server:
+            self.assertIsNone(server)
+            self.assertNotIn('database_overrides', tasklib.env)
+
+
+if __name__ == '__main__':
+    unittest.main()
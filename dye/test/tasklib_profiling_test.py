@@ -0,0 +1,94 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import unittest
+import pstats
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import profiling, scheduler
+from tasklib.util import _call_wrapper
+
+tasklib.env['verbose'] = False
+tasklib.env['quiet'] = True
+
+
+def busy_task():
+    return sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.profiler = profiling.Profiler(path.join(self.testdir, 'test.prof'), 5)
+
+    def tearDown(self):
+        tasklib.env.pop('profiler', None)
+        shutil.rmtree(self.testdir)
+
+    def test_run_task_returns_result_and_records_task(self):
+        self.assertEqual(499500, self.profiler.run_task('busy', busy_task))
+        self.assertEqual(['busy'], [task['name'] for task in self.profiler.tasks])
+
+    def test_task_run_inside_another_task_is_part_of_it(self):
+        self.profiler.run_task(
+            'outer', lambda: self.profiler.run_task('inner', busy_task))
+        self.assertEqual(['outer'], [task['name'] for task in self.profiler.tasks])
+
+    def test_commands_recorded_against_current_task(self):
+        def task():
+            with self.profiler.record_command(['true']):
+                pass
+        self.profiler.run_task('with_command', task)
+        with self.profiler.record_command('echo outside'):
+            pass
+        self.assertEqual(['true'], [command['command'] for command in
+                                    self.profiler.tasks[0]['commands']])
+        self.assertEqual(['echo outside'], [command['command'] for command in
+                                            self.profiler.no_task['commands']])
+
+    def test_call_wrapper_records_command_when_profiling(self):
+        tasklib.env['profiler'] = self.profiler
+        self.assertEqual(0, _call_wrapper(['true']))
+        command = self.profiler.no_task['commands'][0]
+        self.assertEqual('true', command['command'])
+        self.assertTrue(command['wall_time'] >= 0)
+
+    def test_task_runner_profiles_each_task(self):
+        tasklib.env['profiler'] = self.profiler
+        runner = scheduler.TaskRunner(lambda name: busy_task)
+        runner.add('first')
+        runner.add('second')
+        runner.run()
+        self.assertEqual(['first', 'second'],
+                         [task['name'] for task in self.profiler.tasks])
+
+    def test_write_creates_profile_and_summary(self):
+        self.profiler.run_task('busy', busy_task)
+        summary_file = self.profiler.write()
+        stats = pstats.Stats(self.profiler.profile_file)
+        self.assertTrue(stats.total_calls > 0)
+        summary = open(summary_file).read()
+        self.assertTrue(summary.startswith('### busy:'))
+        self.assertTrue('busy_task' in summary)
+
+    def test_passwords_masked_in_summary(self):
+        def task():
+            with self.profiler.record_command(['mysql', '-phunter2', '-e', 'SELECT 1']):
+                pass
+        self.profiler.run_task('sql', task)
+        summary = open(self.profiler.write()).read()
+        self.assertTrue('mysql -p********' in summary)
+        self.assertFalse('hunter2' in summary)
+
+    def test_record_command_does_nothing_without_profiler(self):
+        with profiling.record_command(None, ['true']):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import scheduler
+from tasklib.exceptions import TasksError
+
+tasklib.env['verbose'] = False
+tasklib.env['quiet'] = True
+tasklib.env['noinput'] = True
+
+
+class SchedulerTestMixin(object):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.original_env = tasklib.env.copy()
+        tasklib.env['django_dir'] = self.testdir
+        tasklib.env.pop('task_state', None)
+        tasklib.env.pop('always_run', None)
+        self.source = path.join(self.testdir, 'source.txt')
+        self.target = path.join(self.testdir, 'target.txt')
+        self.write_file(self.source, 'source')
+        self.calls = []
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.original_env)
+        shutil.rmtree(self.testdir)
+
+    def write_file(self, file_path, contents):
+        with open(file_path, 'w') as f:
+            f.write(contents)
+
+    def make_copy_task(self):
+        @scheduler.task(file_dep=[self.source], targets=lambda name: [self.target])
+        def copy_task(name):
+            self.calls.append(name)
+            shutil.copy(self.source, self.target)
+        return copy_task
+
+
+class TestRunTask(SchedulerTestMixin, unittest.TestCase):
+
+    def test_task_decorator_returns_function(self):
+        copy_task = self.make_copy_task()
+        self.assertEqual('copy_task', copy_task.__name__)
+        self.assertEqual([], copy_task.task_deps)
+
+    def test_task_run_first_time(self):
+        self.assertTrue(scheduler.run_task(self.make_copy_task(), 'a'))
+        self.assertEqual(['a'], self.calls)
+
+    def test_task_skipped_when_up_to_date(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        self.assertFalse(scheduler.run_task(copy_task, 'a'))
+        self.assertEqual(['a'], self.calls)
+
+    def test_setup_called_when_up_to_date(self):
+        setups = []
+
+        @scheduler.task(targets=lambda name: [self.target],
+                        setup=lambda name: setups.append(name))
+        def touch_task(name):
+            self.write_file(self.target, name)
+        scheduler.run_task(touch_task, 'a')
+        self.assertFalse(scheduler.run_task(touch_task, 'a'))
+        self.assertEqual(['a', 'a'], setups)
+
+    def test_state_kept_between_runs(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        # forget the in-memory copy, so only the state file is left
+        tasklib.env.pop('task_state')
+        self.assertFalse(scheduler.run_task(copy_task, 'a'))
+
+    def test_task_run_when_arguments_differ(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        self.assertTrue(scheduler.run_task(copy_task, 'b'))
+
+    def test_task_run_when_file_dep_changes(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        self.write_file(self.source, 'a longer source')
+        self.assertTrue(scheduler.run_task(copy_task, 'a'))
+
+    def test_task_run_when_target_removed(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        os.remove(self.target)
+        self.assertTrue(scheduler.run_task(copy_task, 'a'))
+
+    def test_task_run_when_link_target_changes(self):
+        link = path.join(self.testdir, 'link')
+
+        @scheduler.task(targets=[link])
+        def link_task(name):
+            if path.lexists(link):
+                os.remove(link)
+            os.symlink(name, link)
+        scheduler.run_task(link_task, 'a')
+        scheduler.run_task(link_task, 'b')
+        self.assertTrue(scheduler.run_task(link_task, 'a'))
+        self.assertEqual('a', os.readlink(link))
+
+    def test_task_always_run_when_asked(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        tasklib.env['always_run'] = True
+        self.assertTrue(scheduler.run_task(copy_task, 'a'))
+
+    def test_task_without_file_dep_or_targets_always_run(self):
+        def plain_task():
+            self.calls.append('plain')
+        scheduler.run_task(plain_task)
+        scheduler.run_task(plain_task)
+        self.assertEqual(['plain', 'plain'], self.calls)
+
+    def test_failed_task_not_recorded(self):
+        @scheduler.task(targets=[self.target])
+        def failing_task():
+            self.write_file(self.target, 'partial')
+            raise TasksError('failed')
+        self.assertRaises(TasksError, scheduler.run_task, failing_task)
+        self.assertFalse(scheduler.is_up_to_date(failing_task))
+
+
+class TestTaskRunner(SchedulerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestTaskRunner, self).setUp()
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def add_task(self, name, deps=(), delay=0):
+        @scheduler.task(deps=deps)
+        def fn(*args, **kwargs):
+            time.sleep(delay)
+            with self.lock:
+                self.calls.append(name)
+        self.tasks[name] = fn
+
+    def test_dependencies_run_first(self):
+        self.add_task('a')
+        self.add_task('b', deps=['a'])
+        runner = scheduler.TaskRunner(self.tasks.get)
+        runner.add('b')
+        runner.run()
+        self.assertEqual(['a', 'b'], self.calls)
+
+    def test_shared_dependency_run_once(self):
+        self.add_task('a')
+        self.add_task('b', deps=['a'])
+        self.add_task('c', deps=['a'])
+        runner = scheduler.TaskRunner(self.tasks.get)
+        runner.add('b')
+        runner.add('c')
+        runner.run()
+        self.assertEqual(['a', 'b', 'c'], self.calls)
+
+    def test_task_given_twice_run_twice(self):
+        self.add_task('a')
+        runner = scheduler.TaskRunner(self.tasks.get)
+        runner.add('a')
+        runner.add('a')
+        runner.run()
+        self.assertEqual(['a', 'a'], self.calls)
+
+    def test_circular_dependency_raises_error(self):
+        self.add_task('a', deps=['b'])
+        self.add_task('b', deps=['a'])
+        runner = scheduler.TaskRunner(self.tasks.get)
+        self.assertRaises(TasksError, runner.add, 'a')
+
+    def test_unknown_dependency_raises_error(self):
+        self.add_task('a', deps=['missing'])
+        runner = scheduler.TaskRunner(self.tasks.get)
+        self.assertRaises(TasksError, runner.add, 'a')
+
+    def test_independent_tasks_run_in_parallel(self):
+        self.add_task('slow', delay=0.2)
+        self.add_task('fast')
+        self.add_task('last', deps=['slow', 'fast'])
+        runner = scheduler.TaskRunner(self.tasks.get, jobs=2)
+        runner.add('last')
+        runner.run()
+        self.assertEqual(['fast', 'slow', 'last'], self.calls)
+
+    def test_parallel_run_stops_after_failure(self):
+        def failing_task():
+            raise TasksError('failed')
+        self.tasks['fail'] = scheduler.task()(failing_task)
+        self.add_task('after', deps=['fail'])
+        runner = scheduler.TaskRunner(self.tasks.get, jobs=2)
+        runner.add('after')
+        self.assertRaises(TasksError, runner.run)
+        self.assertEqual([], self.calls)
+
+    def test_results_recorded_for_each_task(self):
+        self.add_task('a')
+        self.add_task('b', deps=['a'])
+        runner = scheduler.TaskRunner(self.tasks.get)
+        runner.add('b', ['x'], {'y': 1})
+        runner.run()
+        results = runner.get_results()
+        self.assertEqual(['a', 'b'], [r['task'] for r in results])
+        self.assertEqual(['ok', 'ok'], [r['status'] for r in results])
+        self.assertEqual((['x'], {'y': 1}), (results[1]['args'], results[1]['kwargs']))
+
+    def test_results_show_failed_and_not_run_tasks(self):
+        def failing_task():
+            raise TasksError('it failed', 3)
+        self.tasks['fail'] = scheduler.task()(failing_task)
+        self.add_task('after')
+        runner = scheduler.TaskRunner(self.tasks.get)
+        runner.add('fail')
+        runner.add('after')
+        self.assertRaises(TasksError, runner.run)
+        failed, after = runner.get_results()
+        self.assertEqual(('failed', 'it failed', 3),
+                         (failed['status'], failed['error'], failed['exit_code']))
+        self.assertEqual('not run', after['status'])
+
+    def test_results_show_up_to_date_tasks(self):
+        copy_task = self.make_copy_task()
+        scheduler.run_task(copy_task, 'a')
+        runner = scheduler.TaskRunner({'copy': copy_task}.get)
+        runner.add('copy', ['a'])
+        runner.run()
+        self.assertEqual('up to date', runner.get_results()[0]['status'])
+
+
+if __name__ == '__main__':
+    unittest.main()
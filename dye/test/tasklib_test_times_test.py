@@ -0,0 +1,77 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+from tasklib import test_times
+
+JUNIT_XML = """<?xml version="1.0" encoding="utf-8"?>
+<testsuite errors="1" failures="1" name="djangojenkins" skips="0" tests="3" time="1.5">
+<testcase classname="myapp.tests.ModelTests" name="test_save" time="1.2"></testcase>
+<testcase classname="myapp.tests.ModelTests" name="test_load" time="0.2">
+<failure message="oops" type="AssertionError">Traceback</failure></testcase>
+<testcase classname="myapp.tests.ViewTests" name="test_edit" time="0.1">
+<error message="oops" type="KeyError">Traceback</error></testcase>
+</testsuite>
+"""
+
+
+class TimingDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.timing_db = test_times.TimingDatabase(path.join(self.testdir, 'times.sqlite'))
+
+    def tearDown(self):
+        self.timing_db.close()
+        shutil.rmtree(self.testdir)
+
+    def test_history_has_durations_and_failures(self):
+        self.timing_db.record([('a.A.test_1', 'passed', 0.5),
+                               ('a.A.test_2', 'failed', 1.5),
+                               ('a.B.test_3', 'error', 0.1)])
+        history = self.timing_db.get_history()
+        self.assertEqual({'a.A.test_1': 0.5, 'a.A.test_2': 1.5, 'a.B.test_3': 0.1},
+                         history['durations'])
+        self.assertEqual(['a.A.test_2', 'a.B.test_3'], history['failed'])
+
+    def test_later_run_replaces_result(self):
+        self.timing_db.record([('a.A.test_1', 'failed', 0.5)])
+        self.timing_db.record([('a.A.test_1', 'passed', 0.7)])
+        history = self.timing_db.get_history()
+        self.assertEqual({'a.A.test_1': 0.7}, history['durations'])
+        self.assertEqual([], history['failed'])
+
+    def test_missing_results_file_gives_no_results(self):
+        self.assertEqual([], test_times.read_results_file(
+            path.join(self.testdir, 'missing.json')))
+
+    def test_junit_results_read(self):
+        junit_file = path.join(self.testdir, 'junit.xml')
+        with open(junit_file, 'w') as f:
+            f.write(JUNIT_XML)
+        self.assertEqual([('myapp.tests.ModelTests.test_save', 'passed', 1.2),
+                          ('myapp.tests.ModelTests.test_load', 'failed', 0.2),
+                          ('myapp.tests.ViewTests.test_edit', 'error', 0.1)],
+                         test_times.read_junit_results(junit_file))
+
+    def test_slowest_tests_and_classes_printed(self):
+        old_stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            test_times.print_slowest_tests([('a.A.test_1', 'passed', 0.5),
+                                            ('a.A.test_2', 'passed', 0.4),
+                                            ('a.B.test_3', 'passed', 0.8)], 1)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+        self.assertEqual("### Slowest tests:\n    0.80s a.B.test_3\n"
+                         "### Slowest test classes:\n    0.90s a.A\n", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
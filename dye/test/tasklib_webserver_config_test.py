@@ -0,0 +1,136 @@
+import os
+from os import path
+import sys
+import shutil
+import tempfile
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+import tasklib
+from tasklib import webserver_config
+from tasklib.exceptions import TasksError
+
+FACTS = {'host': 'server1', 'cpu_count': 4, 'memory_mb': 8192, 'somaxconn': 128}
+
+TEMPLATE = """<VirtualHost *:80>
+    ServerName ${server_name}
+    Alias /static "${django_dir}/static/"
+    ExpiresDefault "access plus ${static_expiry_seconds} seconds"
+    WSGIDaemonProcess ${project_name} processes=${processes} threads=${threads} \\
+        maximum-requests=${maximum_requests} listen-backlog=${listen_backlog} \\
+        display-name='%{GROUP}'
+</VirtualHost>
+"""
+
+
+class TestWsgiTuning(unittest.TestCase):
+
+    def test_process_per_cpu(self):
+        tuning = webserver_config.get_wsgi_tuning(FACTS, 'staging')
+        self.assertEqual(4, tuning['processes'])
+        self.assertEqual(7, tuning['threads'])
+        self.assertEqual(webserver_config.MAXIMUM_REQUESTS, tuning['maximum_requests'])
+
+    def test_limited_by_memory(self):
+        facts = dict(FACTS, memory_mb=1024)
+        tuning = webserver_config.get_wsgi_tuning(facts, 'staging')
+        # half of 1024MB at 250MB each
+        self.assertEqual(2, tuning['processes'])
+        self.assertEqual(15, tuning['threads'])
+        self.assertEqual(webserver_config.MAXIMUM_REQUESTS_LOW_MEMORY,
+                         tuning['maximum_requests'])
+
+    def test_at_least_one_process(self):
+        facts = dict(FACTS, memory_mb=200)
+        self.assertEqual(1, webserver_config.get_wsgi_tuning(facts, 'staging')['processes'])
+
+    def test_listen_backlog_capped_by_somaxconn(self):
+        facts = dict(FACTS, cpu_count=16, memory_mb=65536)
+        self.assertEqual(128, webserver_config.get_wsgi_tuning(facts, 'staging')['listen_backlog'])
+        facts['somaxconn'] = None
+        self.assertEqual(160, webserver_config.get_wsgi_tuning(facts, 'staging')['listen_backlog'])
+
+    def test_static_expiry_longer_for_production(self):
+        self.assertTrue(
+            webserver_config.get_wsgi_tuning(FACTS, 'production')['static_expiry_seconds'] >
+            webserver_config.get_wsgi_tuning(FACTS, 'staging')['static_expiry_seconds'])
+
+
+class TestConfValues(unittest.TestCase):
+
+    def test_environment_overrides_default_overrides_tuning(self):
+        values = webserver_config.get_conf_values(
+            'production', FACTS, {'project_name': 'proj'},
+            {'default': {'processes': 2, 'threads': 3},
+             'production': {'processes': 6},
+             'staging': {'processes': 1}})
+        self.assertEqual(6, values['processes'])
+        self.assertEqual(3, values['threads'])
+        self.assertEqual('production', values['environment'])
+        self.assertEqual('proj', values['project_name'])
+
+
+class TestRenderConf(unittest.TestCase):
+
+    def test_values_substituted_and_apache_variables_kept(self):
+        conf = webserver_config.render_conf(TEMPLATE, {
+            'server_name': 'proj.example.org', 'django_dir': '/srv/proj/current/django',
+            'static_expiry_seconds': 300, 'project_name': 'proj', 'processes': 4,
+            'threads': 7, 'maximum_requests': 1000, 'listen_backlog': 100})
+        self.assertTrue('ServerName proj.example.org' in conf)
+        self.assertTrue('processes=4 threads=7' in conf)
+        self.assertTrue("display-name='%{GROUP}'" in conf)
+
+    def test_missing_value_explained(self):
+        try:
+            webserver_config.render_conf(TEMPLATE, {})
+        except TasksError as e:
+            self.assertTrue('webserver_conf_settings' in e.msg)
+        else:
+            self.fail('TasksError not raised')
+
+
+class TestGenerateWebserverConf(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        os.mkdir(path.join(self.testdir, 'apache'))
+        f = open(path.join(self.testdir, 'apache', 'vhost.conf.template'), 'w')
+        f.write(TEMPLATE)
+        f.close()
+        self.old_env = dict(tasklib.env)
+        tasklib.env.update({
+            'quiet': True,
+            'project_name': 'proj',
+            'vcs_root_dir': self.testdir,
+            'server_project_home': '/var/django/proj',
+            'relative_django_dir': path.join('django', 'website'),
+            'webserver_conf_template': path.join('apache', 'vhost.conf.template'),
+            'webserver_conf_settings': {'staging': {'server_name': 'proj.stage.example.org'}},
+        })
+        tasklib.env.pop('current_link', None)
+
+    def tearDown(self):
+        tasklib.env.clear()
+        tasklib.env.update(self.old_env)
+        shutil.rmtree(self.testdir)
+
+    def test_conf_written_to_generated(self):
+        tasklib.generate_webserver_conf('staging')
+        conf_file = path.join(self.testdir, 'apache', 'generated', 'staging.conf')
+        self.assertEqual(conf_file, webserver_config.get_generated_conf_path(
+            self.testdir, tasklib.env['webserver_conf_template'], 'staging'))
+        conf = open(conf_file).read()
+        self.assertTrue(conf.startswith('# Generated by'))
+        self.assertTrue('ServerName proj.stage.example.org' in conf)
+        self.assertTrue('Alias /static "/var/django/proj/current/django/website/static/"'
+                        in conf)
+
+    def test_template_must_be_set(self):
+        del tasklib.env['webserver_conf_template']
+        self.assertRaises(TasksError, tasklib.generate_webserver_conf, 'staging')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+from os import path
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+sys.path.append(dye_dir)
+deploy_template_dir = path.join(dye_dir, os.pardir,
+                                '{{cookiecutter.project_name}}', 'deploy')
+sys.path.append(deploy_template_dir)
+
+import tasks_server
+# the client that deploy/tasks.py uses
+import ve_mgr
+
+SERVER_SCRIPT = """
+import os
+import sys
+sys.path.insert(0, %r)
+from dye import tasks_server
+
+
+def main(argv):
+    print 'args: %%s' %% ' '.join(argv)
+    os.system('echo from a command')
+    sys.stderr.write('to stderr\\n')
+    return int(os.environ.get('TEST_EXIT_CODE', '0'))
+
+sys.exit(tasks_server.serve(sys.argv[1], main, daemonize=False))
+""" % path.abspath(path.join(dye_dir, os.pardir))
+
+
+class TasksServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.deploy_dir = tempfile.mkdtemp()
+        self.project_settings = path.join(self.deploy_dir, 'project_settings.py')
+        self.write_file(self.project_settings, 'project_name = "test"\n')
+        self.script = path.join(self.deploy_dir, 'server.py')
+        self.write_file(self.script, SERVER_SCRIPT)
+        self.socket_path = tasks_server.get_socket_path(self.deploy_dir)
+        self.server = subprocess.Popen(
+            [sys.executable, self.script, self.deploy_dir],
+            stdout=open(os.devnull, 'w'))
+        self.wait_for_socket()
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.capture(tasks_server.stop_server, self.deploy_dir)
+            for i in range(100):
+                if self.server.poll() is not None:
+                    break
+                time.sleep(0.05)
+            else:
+                self.server.kill()
+                self.server.wait()
+        shutil.rmtree(self.deploy_dir)
+
+    def write_file(self, file_path, contents):
+        with open(file_path, 'w') as f:
+            f.write(contents)
+
+    def wait_for_socket(self):
+        for i in range(100):
+            if tasks_server._connect(self.socket_path) is not None:
+                return
+            time.sleep(0.05)
+        self.fail('tasks server did not start')
+
+    def capture(self, fn, *args):
+        """Returns the return value of fn, and what it wrote to stdout and
+        stderr"""
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            result = fn(*args)
+            return result, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+
+    def run_in_server(self, args):
+        return self.capture(ve_mgr.run_in_tasks_server, self.deploy_dir, args)
+
+    def test_output_sent_to_client(self):
+        exit_code, stdout, stderr = self.run_in_server(['deploy:dev'])
+        self.assertEqual(0, exit_code)
+        self.assertIn('args: --noinput --deploydir=%s deploy:dev' % self.deploy_dir,
+                      stdout)
+        self.assertIn('to stderr', stderr)
+
+    def test_output_of_commands_sent_to_client(self):
+        exit_code, stdout, stderr = self.run_in_server(['deploy:dev'])
+        self.assertIn('from a command', stdout)
+
+    def test_exit_code_returned(self):
+        os.environ['TEST_EXIT_CODE'] = '3'
+        try:
+            exit_code, stdout, stderr = self.run_in_server(['deploy:dev'])
+        finally:
+            del os.environ['TEST_EXIT_CODE']
+        self.assertEqual(3, exit_code)
+
+    def test_socket_only_usable_by_owner(self):
+        self.assertEqual(0, os.stat(self.socket_path).st_mode & 0077)
+
+    def test_second_server_refuses_to_start(self):
+        exit_code, stdout, stderr = self.capture(
+            tasks_server.serve, self.deploy_dir, None, False)
+        self.assertEqual(1, exit_code)
+
+    def test_client_not_used_when_asked_not_to(self):
+        os.environ['DYE_NO_TASKS_SERVER'] = 'true'
+        try:
+            exit_code, stdout, stderr = self.run_in_server(['deploy:dev'])
+        finally:
+            del os.environ['DYE_NO_TASKS_SERVER']
+        self.assertIsNone(exit_code)
+        self.assertEqual('', stdout)
+
+    def test_stop_server_removes_socket(self):
+        self.capture(tasks_server.stop_server, self.deploy_dir)
+        self.server.wait()
+        self.assertFalse(path.exists(self.socket_path))
+        self.assertIsNone(self.run_in_server(['deploy:dev'])[0])
+
+    def test_server_restarts_when_project_settings_change(self):
+        self.write_file(self.project_settings, 'project_name = "changed"\n')
+        # the client is told to run the tasks itself while the server restarts
+        exit_code = self.run_in_server(['deploy:dev'])[0]
+        self.assertIsNone(exit_code)
+        for i in range(100):
+            exit_code = self.run_in_server(['deploy:dev'])[0]
+            if exit_code is not None:
+                break
+            time.sleep(0.05)
+        self.assertEqual(0, exit_code)
+        # still the same process, as the server execs itself
+        self.assertIsNone(self.server.poll())
+
+
+class TasksServerNotRunningTests(unittest.TestCase):
+
+    def test_client_returns_none_when_no_server(self):
+        deploy_dir = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(ve_mgr.run_in_tasks_server(deploy_dir, ['deploy']))
+        finally:
+            shutil.rmtree(deploy_dir)
+
+    def test_client_returns_none_for_stale_socket(self):
+        deploy_dir = tempfile.mkdtemp()
+        try:
+            self.write_stale_socket(tasks_server.get_socket_path(deploy_dir))
+            self.assertIsNone(ve_mgr.run_in_tasks_server(deploy_dir, ['deploy']))
+        finally:
+            shutil.rmtree(deploy_dir)
+
+    def write_stale_socket(self, socket_path):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(socket_path)
+        sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
 import os
 from os import path
 import sys
+import shutil
+import subprocess
+import tempfile
 import unittest
+from StringIO import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 # make sure a project_settings is available
 dye_dir = path.join(path.dirname(__file__), os.pardir)
@@ -20,6 +28,40 @@ class TasksMainTests(unittest.TestCase):
         self.assertEqual(0, exit_code)
 
 
+class TasksOptionalFileOptionTests(unittest.TestCase):
+
+    def test_profile_without_file_uses_default(self):
+        self.assertEqual(['--profile=' + tasks.DEFAULT_PROFILE_FILENAME, 'deploy'],
+                         tasks._set_default_files(['--profile', 'deploy']))
+
+    def test_trace_without_file_uses_default(self):
+        self.assertEqual(['--trace=' + tasks.DEFAULT_TRACE_FILENAME, 'deploy'],
+                         tasks._set_default_files(['--trace', 'deploy']))
+
+    def test_options_with_file_are_unchanged(self):
+        argv = ['--profile=x.prof', '--trace=x.jsonl', 'deploy']
+        self.assertEqual(argv, tasks._set_default_files(argv))
+
+
+class TasksJsonResultsTests(unittest.TestCase):
+
+    def test_results_printed_as_one_line_of_json(self):
+        runner = tasks.TaskRunner(lambda name: lambda *args: None)
+        runner.add('a_task', ['arg'])
+        runner.run()
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            tasks.print_json_results(runner)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+        self.assertTrue(output.startswith(tasks.JSON_RESULTS_PREFIX))
+        results = json.loads(output[len(tasks.JSON_RESULTS_PREFIX):])
+        self.assertEqual('a_task', results[0]['task'])
+        self.assertEqual('ok', results[0]['status'])
+
+
 class TasksArgumentConversionTests(unittest.TestCase):
 
     def test_convert_argument_converts_true_to_boolean_true(self):
@@ -119,3 +161,62 @@ class TasksGetPublicCallablesTests(unittest.TestCase):
     def test_get_public_callables_returns_empty_list_when_passed_none(self):
         public_callables = tasks.get_public_callables(None)
         self.assertEqual([], public_callables)
+
+
+class TasksStartupTests(unittest.TestCase):
+
+    def run_help(self):
+        """Run tasks.main(['-h']) in a fresh python, and return the modules
+        it imported that we don't want"""
+        code = """
+import sys
+sys.path[0:0] = [%r, %r]
+import tasks
+tasks.main(['-h'])
+print [m for m in ('MySQLdb', 'sqlite3', 'multiprocessing') if m in sys.modules]
+""" % (dye_dir, path.join(dye_dir, os.pardir))
+        output = subprocess.Popen([sys.executable, '-c', code],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        return eval(output.strip().splitlines()[-1])
+
+    def test_help_does_not_import_database_libraries(self):
+        # this is run for every tasks.py call fabric makes, so should stay
+        # quick - tasklib_bench.py times it
+        self.assertEqual([], self.run_help())
+
+
+class TasksRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.deploy_dir = tempfile.mkdtemp()
+        self.original_deploy_dir = tasks.tasklib.env.get('deploy_dir')
+        tasks.tasklib.env['deploy_dir'] = self.deploy_dir
+        tasks._task_registry = None
+
+    def tearDown(self):
+        tasks._task_registry = None
+        tasks.tasklib.env['deploy_dir'] = self.original_deploy_dir
+        shutil.rmtree(self.deploy_dir)
+
+    def test_registry_contains_tasklib_tasks(self):
+        self.assertEqual('tasklib', tasks.get_task_registry()['deploy'])
+
+    def test_registry_excludes_helpers_imported_into_tasklib(self):
+        self.assertNotIn('get_db_manager', tasks.get_task_registry())
+
+    def test_find_task_returns_function(self):
+        self.assertIs(tasks.tasklib.deploy, tasks.find_task('deploy'))
+        self.assertIsNone(tasks.find_task('no_such_task'))
+
+    def test_registry_cached_on_disk(self):
+        tasks.get_task_registry()
+        self.assertTrue(path.isfile(
+            path.join(self.deploy_dir, tasks.REGISTRY_CACHE_FILENAME)))
+        tasks._task_registry = None
+        # a cached registry should be used without scanning tasklib again
+        real_build = tasks._build_task_registry
+        tasks._build_task_registry = None
+        try:
+            self.assertEqual('tasklib', tasks.get_task_registry()['deploy'])
+        finally:
+            tasks._build_task_registry = real_build
@@ -0,0 +1,95 @@
+import os
+from os import path
+import sys
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+dye_dir = path.join(path.dirname(__file__), os.pardir)
+deploy_template_dir = path.join(dye_dir, os.pardir,
+                                '{{cookiecutter.project_name}}', 'deploy')
+sys.path.append(deploy_template_dir)
+
+import ve_mgr
+
+# stands in for the virtualenv python when asked for its version
+FAKE_PYTHON = """#!/bin/sh
+echo "$@" >> %s
+echo 2 7
+"""
+
+
+class LaunchStampTests(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp()
+        self.ve_dir = path.join(self.testdir, '.ve')
+        os.makedirs(path.join(self.ve_dir, 'bin'))
+        self.python_calls = path.join(self.testdir, 'python_calls')
+        ve_python = path.join(self.ve_dir, 'bin', 'python')
+        with open(ve_python, 'w') as f:
+            f.write(FAKE_PYTHON % self.python_calls)
+        os.chmod(ve_python, stat.S_IRWXU)
+        self.requirements = path.join(self.testdir, 'pip_packages.txt')
+        self.write_requirements('Django==1.6.11\n')
+        self.updater = ve_mgr.UpdateVE(ve_dir=self.ve_dir, requirements=self.requirements)
+        self.updater.python_version = (2, 6)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir)
+
+    def write_requirements(self, contents):
+        with open(self.requirements, 'w') as f:
+            f.write(contents)
+
+    def count_python_calls(self):
+        if not path.exists(self.python_calls):
+            return 0
+        return len(open(self.python_calls).readlines())
+
+    def test_no_stamp_is_not_fresh(self):
+        self.assertFalse(self.updater.launch_stamp_is_fresh())
+
+    def test_stamp_is_fresh_after_update(self):
+        self.updater.update_ve_timestamp()
+        self.assertTrue(self.updater.launch_stamp_is_fresh())
+
+    def test_stamp_is_stale_when_requirements_change(self):
+        self.updater.update_ve_timestamp()
+        self.write_requirements('Django==1.6.11\nSouth==1.0\n')
+        self.assertFalse(self.updater.launch_stamp_is_fresh())
+
+    def test_stamp_is_stale_when_python_version_is_wrong(self):
+        self.updater.update_ve_timestamp()
+        self.updater.python_version = (3, 3)
+        self.assertFalse(self.updater.launch_stamp_is_fresh())
+
+    def test_python_version_read_with_one_python_call(self):
+        self.assertTrue(self.updater.check_virtualenv_python_version())
+        self.assertEqual(1, self.count_python_calls())
+
+    def test_ready_check_writes_stamp(self):
+        # make the virtualenv look newer than the requirements
+        later = time.time() + 10
+        open(self.updater.ve_timestamp, 'w').close()
+        os.utime(self.updater.ve_timestamp, (later, later))
+        os.utime(self.ve_dir, (later, later))
+        self.updater.check_virtualenv_is_ready()
+        self.assertTrue(self.updater.launch_stamp_is_fresh())
+
+    def test_ready_check_starts_no_python_when_stamp_fresh(self):
+        self.updater.update_ve_timestamp()
+        calls = self.count_python_calls()
+        updater = ve_mgr.UpdateVE(ve_dir=self.ve_dir, requirements=self.requirements)
+        updater.python_version = (2, 6)
+        updater.check_virtualenv_is_ready()
+        self.assertEqual(calls, self.count_python_calls())
+
+    def test_ready_check_exits_when_virtualenv_out_of_date(self):
+        self.assertRaises(SystemExit, self.updater.check_virtualenv_is_ready)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,7 @@ setup(
     version='0.2.0',
     author='Hamish Downer',
     author_email='hamish+dye@aptivate.org',
-    packages=['dye', 'dye.test'],
+    packages=['dye', 'dye.bench', 'dye.test'],
     scripts=['dye/tasks.py'],
     url='http://pypi.python.org/pypi/Dye/',
     license='LICENSE.txt',
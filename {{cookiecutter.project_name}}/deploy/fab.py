@@ -5,8 +5,7 @@ from __future__ import unicode_literals, absolute_import
 import os
 from os import path
 import sys
-import subprocess
-from ve_mgr import check_python_version, find_package_dir_in_ve, UpdateVE
+from ve_mgr import check_python_version, exec_command, find_package_dir_in_ve, UpdateVE
 
 # check python version is high enough
 check_python_version(2, 6, __file__)
@@ -24,17 +23,7 @@ if not path.exists(ve_dir):
     sys.exit(1)
 
 updater = UpdateVE(ve_dir=ve_dir)
-if updater.virtualenv_needs_update():
-    print "VirtualEnv needs to be updated"
-    print 'Run deploy/bootstrap.py'
-    sys.exit(1)
-
-# if the virtualenv python version is not correct then the virtualenv
-# needs updating
-if not updater.check_virtualenv_python_version():
-    print "VirtualEnv has wrong python version"
-    print 'Run deploy/bootstrap.py'
-    sys.exit(1)
+updater.check_virtualenv_is_ready()
 
 fab_bin = path.join(ve_dir, 'bin', 'fab')
 
@@ -53,10 +42,21 @@ fab_call = [fab_bin]
 # tell it to use the fabfile from dye
 fab_call += ['-f', fabfile]
 
-# add any arguments passed to this script
-fab_call += sys.argv[1:]
+# add any arguments passed to this script, except --profile[=file] and
+# --trace[=file] which are for dye/fabfile.py rather than fabric
+dye_options = {
+    '--profile': ('DYE_PROFILE', 'dye_fab.prof'),
+    '--trace': ('DYE_TRACE', 'dye_fab_trace.jsonl'),
+}
+for arg in sys.argv[1:]:
+    option, equals, file_name = arg.partition('=')
+    if option in dye_options:
+        env_name, default_file_name = dye_options[option]
+        osenv[env_name] = path.abspath(file_name or default_file_name)
+    else:
+        fab_call.append(arg)
 
 # print "Running fab.py in ve: %s" % ' '.join(fab_call)
 
-# exit with the fabric exit code
-sys.exit(subprocess.call(fab_call, env=osenv))
+# become fabric, so we exit with its exit code
+exec_command(fab_call, env=osenv)
@@ -103,6 +103,34 @@ server_project_home = path.join(server_home, project_name)
 # which web server to use (or None)
 webserver = 'apache'
 
+# to have the webserver conf rendered on the server from a template, with
+# the mod_wsgi processes and threads to suit the machine, uncomment these
+# (see dye/tasklib/webserver_config.py for the values the template can use)
+#webserver_conf_template = path.join('apache', 'vhost.conf.template')
+#webserver_conf_settings = {
+#    'production': {
+#        'server_name': 'lin-' + project_name + '.aptivate.org',
+#        'server_alias': 'www.' + project_name + '.org',
+#    },
+#    'staging': {
+#        'server_name': project_name + '.stage.aptivate.org',
+#        'server_alias': 'fen-vz-' + project_name + '-stage.fen.aptivate.org',
+#    },
+#}
+
+# or for nginx serving the static files with gunicorn (or 'uwsgi') behind it,
+# run by systemd, set these as well (see dye/tasklib/app_server_config.py)
+#webserver = 'nginx'
+#webserver_conf_template = path.join('nginx', 'vhost.conf.template')
+#app_server = 'gunicorn'
+
+# the celery queues - set this to have the celery configuration generated on
+# the server, with the number of worker processes to suit the machine (see
+# dye/tasklib/celery_config.py for the options)
+#celery_queues = {
+#    'email': {'nodes': 1, 'max_tasks_per_child': 100},
+#}
+
 import socket
 
 if socket.getfqdn().endswith('.fen.aptivate.org'):
@@ -5,8 +5,7 @@ from __future__ import unicode_literals, absolute_import
 import os
 from os import path
 import sys
-import subprocess
-from ve_mgr import check_python_version, UpdateVE
+from ve_mgr import check_python_version, exec_command, run_in_tasks_server, UpdateVE
 
 # check python version is high enough
 check_python_version(2, 6, __file__)
@@ -24,17 +23,13 @@ if not os.path.exists(ve_dir):
     sys.exit(1)
 
 updater = UpdateVE(ve_dir=ve_dir)
-if updater.virtualenv_needs_update():
-    print "VirtualEnv needs to be updated"
-    print 'Run deploy/bootstrap.py'
-    sys.exit(1)
+updater.check_virtualenv_is_ready()
 
-# if the virtualenv python version is not correct then the virtualenv
-# needs updating
-if not updater.check_virtualenv_python_version():
-    print "VirtualEnv has wrong python version"
-    print 'Run deploy/bootstrap.py'
-    sys.exit(1)
+# if a server started by `tasks.py --serve` is running, it can run the tasks
+# without us starting the virtualenv python
+exit_code = run_in_tasks_server(path.abspath(path.dirname(__file__)), sys.argv[1:])
+if exit_code is not None:
+    sys.exit(exit_code)
 
 # depending on how you've installed dye, you may need to edit this line
 tasks = path.join(ve_dir, 'bin', 'tasks.py')
@@ -52,5 +47,5 @@ tasks_call += sys.argv[1:]
 if '-v' in sys.argv or '--verbose' in sys.argv:
     print "Running tasks.py in ve: %s" % ' '.join(tasks_call)
 
-# exit with the tasks.py exit code
-sys.exit(subprocess.call(tasks_call))
+# become tasks.py, so we exit with its exit code
+exec_command(tasks_call)
@@ -78,6 +78,94 @@ def in_virtualenv():
     return 'VIRTUAL_ENV' in os.environ or 'IN_VIRTUALENV' in os.environ
 
 
+def exec_command(argv, env=None):
+    """ Replace this process with argv, so there is no python left waiting
+    for it to finish.  Windows has no real exec, so there we call it and exit
+    with its exit code. """
+    if env is None:
+        env = os.environ
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if sys.platform == 'win32':
+        sys.exit(subprocess.call(argv, env=env))
+    try:
+        os.execve(argv[0], argv, env)
+    except OSError, e:
+        print >> sys.stderr, "Failed to run %s: %s" % (argv[0], e)
+        sys.exit(1)
+
+
+# see dye/tasks_server.py for the other end of this
+TASKS_SERVER_SOCKET = '.tasks_server.sock'
+TASKS_SERVER_FRAME_HEADER = b'>cI'
+
+
+def _recv_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def run_in_tasks_server(deploy_dir, args):
+    """ If a `tasks.py --serve` server is running for deploy_dir then get it
+    to run the tasks, and return the exit code.  Returns None if there is no
+    server (or it is restarting) so the caller should run tasks.py itself. """
+    if 'DYE_NO_TASKS_SERVER' in os.environ:
+        return None
+    if '--serve' in args or '--stop-server' in args:
+        return None
+    socket_path = path.join(deploy_dir, TASKS_SERVER_SOCKET)
+    if not path.exists(socket_path):
+        return None
+
+    import json
+    import socket
+    import struct
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            # a server that has died - tasks.py --serve will tidy up
+            return None
+        request = {
+            'argv': ['--deploydir=' + deploy_dir] + args,
+            'cwd': os.getcwd(),
+            'environ': dict(os.environ),
+        }
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        header_size = struct.calcsize(TASKS_SERVER_FRAME_HEADER)
+        started = False
+        while True:
+            header = _recv_exactly(sock, header_size)
+            if header is not None:
+                frame_type, length = struct.unpack(TASKS_SERVER_FRAME_HEADER, header)
+                data = _recv_exactly(sock, length)
+            if header is None or data is None:
+                if not started:
+                    # the server went away before running anything
+                    return None
+                print >> sys.stderr, "Lost connection to tasks.py server"
+                return 1
+            started = True
+            if frame_type == b'o':
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            elif frame_type == b'e':
+                sys.stderr.write(data)
+                sys.stderr.flush()
+            elif frame_type == b'x':
+                return int(data)
+            elif frame_type == b'r':
+                return None
+    finally:
+        sock.close()
+
+
 class UpdateVE(object):
 
     def __init__(self, ve_dir=None, requirements=None):
@@ -104,6 +192,8 @@ class UpdateVE(object):
             self.ve_dir = ve_dir
 
         self.ve_timestamp = path.join(self.ve_dir, 'timestamp')
+        self.launch_stamp = path.join(self.ve_dir, 'launch_stamp.json')
+        self._ve_python_version = None
 
         import project_settings
         self.pypi_cache_url = getattr(project_settings, 'pypi_cache_url', None)
@@ -113,21 +203,82 @@ class UpdateVE(object):
     def update_ve_timestamp(self):
         os.utime(self.ve_dir, None)
         file(self.ve_timestamp, 'w').close()
+        self.write_launch_stamp()
+
+    def get_virtualenv_python_version(self):
+        """ returns the (major, minor) version of the virtualenv python, or
+        None if there is no virtualenv python """
+        if self._ve_python_version is None:
+            ve_python = path.join(self.ve_dir, 'bin', 'python')
+            if not path.exists(ve_python):
+                return None
+            version = capture_command(
+                [ve_python, '-c', 'import sys; print("%d %d" % sys.version_info[:2])'])
+            self._ve_python_version = tuple(int(v) for v in version.split())
+        return self._ve_python_version
+
+    def is_python_version_ok(self, version):
+        """ the major version must be exact, the minor version is a minimum """
+        return (version is not None and
+                version[0] == self.python_version[0] and
+                version[1] >= self.python_version[1])
 
     def check_virtualenv_python_version(self):
         """ returns True if the virtualenv python exists and is new enough """
-        ve_python = path.join(self.ve_dir, 'bin', 'python')
-        if not path.exists(ve_python):
-            return False
-        major_version = capture_command(
-            [ve_python, '-c', 'import sys; print sys.version_info[0]'])
-        if int(major_version) != self.python_version[0]:
+        return self.is_python_version_ok(self.get_virtualenv_python_version())
+
+    def get_requirements_fingerprint(self):
+        stat = os.stat(self.requirements)
+        return '%s:%s' % (stat.st_mtime, stat.st_size)
+
+    def write_launch_stamp(self):
+        """ Record the virtualenv python version and the requirements it was
+        built from, so that launch_stamp_is_fresh() can check the virtualenv
+        without starting another python. """
+        import json
+        version = self.get_virtualenv_python_version()
+        if version is None or not path.exists(self.requirements):
+            return
+        stamp = {
+            'python_version': list(version),
+            'requirements': self.get_requirements_fingerprint(),
+        }
+        with open(self.launch_stamp, 'w') as stamp_file:
+            json.dump(stamp, stamp_file)
+
+    def launch_stamp_is_fresh(self):
+        """ returns True if the launch stamp says the virtualenv is up to date
+        with the requirements and has the right python version.  If this is
+        False then use the slower checks - virtualenv_needs_update() and
+        check_virtualenv_python_version() """
+        import json
+        try:
+            with open(self.launch_stamp) as stamp_file:
+                stamp = json.load(stamp_file)
+            requirements = self.get_requirements_fingerprint()
+        except (IOError, OSError, ValueError):
             return False
-        minor_version = capture_command(
-            [ve_python, '-c', 'import sys; print sys.version_info[1]'])
-        if int(minor_version) < self.python_version[1]:
+        if stamp.get('requirements') != requirements:
             return False
-        return True
+        return self.is_python_version_ok(stamp.get('python_version'))
+
+    def check_virtualenv_is_ready(self):
+        """ Exit with a message if the virtualenv needs updating.  Usually the
+        launch stamp tells us it is fine, otherwise we do the full checks and,
+        if they pass, write a new stamp so next time is quicker. """
+        if self.launch_stamp_is_fresh():
+            return
+        if self.virtualenv_needs_update():
+            print "VirtualEnv needs to be updated"
+            print 'Run deploy/bootstrap.py'
+            sys.exit(1)
+        # if the virtualenv python version is not correct then the virtualenv
+        # needs updating
+        if not self.check_virtualenv_python_version():
+            print "VirtualEnv has wrong python version"
+            print 'Run deploy/bootstrap.py'
+            sys.exit(1)
+        self.write_launch_stamp()
 
     def check_current_python_version(self):
         if sys.version_info[0] != self.python_version[0]:
@@ -216,7 +367,8 @@ class UpdateVE(object):
             print >> sys.stderr, "Could not find requirements: file %s" % self.requirements
             return 1
 
-        update_required = self.virtualenv_needs_update()
+        update_required = (not self.launch_stamp_is_fresh() and
+                           self.virtualenv_needs_update())
         if not update_required and not force_update:
             # Nothing to be done
             print "VirtualEnv does not need to be updated"
@@ -263,6 +415,5 @@ class UpdateVE(object):
         # add environment variable to say we are now in virtualenv
         new_env = os.environ.copy()
         new_env['VIRTUAL_ENV'] = self.ve_dir
-        retcode = subprocess.call([python, file_path] + args, env=new_env)
-        # call the original using the virtualenv and exit
-        sys.exit(retcode)
+        # run the original using the virtualenv in place of this process
+        exec_command([python, file_path] + args, env=new_env)
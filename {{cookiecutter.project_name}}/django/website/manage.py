@@ -28,10 +28,7 @@ if 'IGNORE_DOTVE' not in os.environ and 'VIRTUAL_ENV' not in os.environ:
 
     # if it appears that the virtualenv is out of date then stop here
     updater = ve_mgr.UpdateVE()
-    if updater.virtualenv_needs_update():
-        print "VirtualEnv needs to be updated"
-        print 'Run deploy/bootstrap.py'
-        sys.exit(1)
+    updater.check_virtualenv_is_ready()
 
     # now we should enter the virtualenv. We will only get
     # this far if the virtualenv is up to date.
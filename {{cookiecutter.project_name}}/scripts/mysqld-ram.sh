@@ -7,6 +7,10 @@
 #
 # Written and tested on Ubuntu Karmic.
 #
+# Note that tasks.py quick_test and run_jenkins now start their own
+# temporary mysqld on a ramdisk when mysqld is installed, so you only need
+# this if you set use_temp_mysqld = False in deploy/project_settings.py
+#
 # TODO: Possible things could be even faster; options to consider:
 # * DELAY_KEY_WRITE
 # * Disable logging